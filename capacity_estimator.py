@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import math
+import time
+from typing import Dict, Optional
+
+import psutil
+import requests
+
+from config import Configuration
+from stream_set import stream_set, audio_track_settings
+
+logger = logging.getLogger(__name__)
+
+# Leave room for spikes and the OS when working out free capacity
+CPU_TARGET_PERCENT = 85
+MEMORY_TARGET_PERCENT = 90
+
+# Weight of a new observation when refining a profile cost
+COST_EWMA_ALPHA = 0.1
+
+# Processes younger than this are still settling and are not used to refine costs
+MIN_OBSERVE_UPTIME = 60
+
+# Baseline cost estimates used until a profile has been observed.
+# Video encoder costs are CPU cores for one 1080p rung and scale with pixel count.
+BASE_PROCESS_CORES = {'input': 0.05, 'transcoder': 0.05, 'output': 0.03}
+BASE_PROCESS_RSS = 60 * 1024 * 1024
+VIDEO_ENCODER_CORES = {
+    'x264enc': 1.5,
+    'x265enc': 3.0,
+    'avenc_mpeg2video': 0.8,
+    'mpeg2enc': 0.8,
+    'nvh264enc': 0.1,
+    'nvh265enc': 0.1,
+    'vaapih264enc': 0.2,
+    'vaapih265enc': 0.2,
+    'qsvh264enc': 0.2,
+    'qsvh265enc': 0.2
+}
+DEFAULT_VIDEO_ENCODER_CORES = 1.5
+VIDEO_RUNG_RSS = 150 * 1024 * 1024
+AUDIO_ENCODE_CORES = 0.05
+PIXELS_1080P = 1920 * 1080
+
+CHANNEL_MANAGER_URL = "http://localhost:8001"
+# Per-core figures older than this are not trusted to cap headroom
+PER_CPU_MAX_AGE = 5
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def channel_profile(channel_config: Dict, source_index: int = 0) -> Dict:
+    """Describe what a channel costs to run: input type, streams carried, passthrough/transcode and rungs"""
+    inputs = channel_config.get('inputs', [])
+    input_type = 'unknown'
+    if inputs:
+        input_type = inputs[min(source_index, len(inputs) - 1)].get('type', 'unknown')
+
+    carried = stream_set(channel_config)
+    transcoding = channel_config.get('transcoding', {})
+    video = transcoding.get('video', {})
+    streams = video.get('streams')
+    if not carried['video']:
+        streams = []
+    elif not streams:
+        streams = [{'codec': video.get('codec', 'passthrough'), 'resolution': video.get('resolution')}]
+
+    rungs = []
+    for stream in streams:
+        codec = stream.get('codec', 'passthrough')
+        if codec == 'passthrough':
+            continue
+        resolution = stream.get('resolution') or {}
+        width = int(resolution.get('width', 1920)) if isinstance(resolution, dict) else 1920
+        height = int(resolution.get('height', 1080)) if isinstance(resolution, dict) else 1080
+        rungs.append({'codec': codec, 'width': width, 'height': height})
+
+    audio_codecs = [track.get('codec', 'passthrough') for track in audio_track_settings(channel_config)]
+    audio_encodes = sum(1 for codec in audio_codecs if codec != 'passthrough')
+    audio_codec = next((codec for codec in audio_codecs if codec != 'passthrough'), 'passthrough')
+    mode = 'passthrough' if not rungs and not audio_encodes else 'transcode'
+    outputs = len(channel_config.get('outputs', []))
+
+    key_parts = [input_type, mode]
+    if not carried['video']:
+        key_parts.append("no-video")
+    key_parts += [f"{r['codec']}@{r['width']}x{r['height']}" for r in rungs]
+    if audio_codec != 'passthrough':
+        key_parts.append(f"audio:{audio_codec}")
+    if len(audio_codecs) != 1:
+        key_parts.append(f"audio-tracks:{len(audio_codecs)}")
+    key_parts.append(f"outputs:{outputs}")
+
+    return {
+        'key': '|'.join(key_parts),
+        'input_type': input_type,
+        'mode': mode,
+        'rungs': rungs,
+        'audio_codec': audio_codec,
+        'audio_encodes': audio_encodes,
+        'outputs': outputs
+    }
+
+
+def baseline_cost(profile: Dict) -> Dict:
+    """Cost estimate for a profile that has not been observed yet"""
+    cores = BASE_PROCESS_CORES['input'] + BASE_PROCESS_CORES['output'] * profile['outputs']
+    processes = 1 + profile['outputs']
+    rss = 0
+
+    if profile['mode'] == 'transcode':
+        cores += BASE_PROCESS_CORES['transcoder']
+        processes += 1
+        for rung in profile['rungs']:
+            scale = (rung['width'] * rung['height']) / PIXELS_1080P
+            cores += VIDEO_ENCODER_CORES.get(rung['codec'], DEFAULT_VIDEO_ENCODER_CORES) * scale
+            rss += VIDEO_RUNG_RSS * scale
+        cores += AUDIO_ENCODE_CORES * profile['audio_encodes']
+
+    rss += BASE_PROCESS_RSS * processes
+    return {'cpu_cores': cores, 'rss_bytes': rss, 'samples': 0, 'source': 'baseline'}
+
+
+class CapacityEstimator:
+    """Estimates how many more channels of a given profile the host can run"""
+
+    def __init__(self, redis_client, channel_manager_url: str = CHANNEL_MANAGER_URL):
+        self.redis_client = redis_client
+        self.channel_manager_url = channel_manager_url
+        self.cpu_count = psutil.cpu_count() or 1
+
+    def get_cost(self, profile: Dict) -> Dict:
+        """Observed cost for a profile, falling back to the baseline model"""
+        data = self.redis_client.hgetall(f"capacity:profile:{profile['key']}")
+        if not data:
+            return baseline_cost(profile)
+        data = {_decode(k): _decode(v) for k, v in data.items()}
+        return {
+            'cpu_cores': float(data['cpu_cores']),
+            'rss_bytes': float(data['rss_bytes']),
+            'samples': int(data['samples']),
+            'source': 'observed'
+        }
+
+    def _update_cost(self, profile: Dict, cpu_cores: float, rss_bytes: float):
+        """Fold one observation into the profile's running cost"""
+        current = self.get_cost(profile)
+        if current['source'] == 'baseline':
+            updated_cpu, updated_rss = cpu_cores, rss_bytes
+        else:
+            updated_cpu = current['cpu_cores'] + COST_EWMA_ALPHA * (cpu_cores - current['cpu_cores'])
+            updated_rss = current['rss_bytes'] + COST_EWMA_ALPHA * (rss_bytes - current['rss_bytes'])
+
+        self.redis_client.hset(f"capacity:profile:{profile['key']}", mapping={
+            'cpu_cores': updated_cpu,
+            'rss_bytes': updated_rss,
+            'samples': current['samples'] + 1,
+            'updated': int(time.time())
+        })
+
+    def get_channel_usage(self) -> Dict[str, Dict]:
+        """Current CPU and memory use per running channel from the channel manager's process snapshot"""
+        response = requests.get(f"{self.channel_manager_url}/processes", timeout=2)
+        response.raise_for_status()
+        processes = response.json().get('processes', {})
+
+        usage = {}
+        for key, sample in processes.items():
+            channel_name, process_type, index = key.rsplit(':', 2)
+            if not sample.get('running'):
+                continue
+            channel = usage.setdefault(channel_name, {
+                'cpu_cores': 0.0, 'rss_bytes': 0, 'min_uptime': None, 'source_index': 0
+            })
+            channel['cpu_cores'] += sample['cpu_percent'] / 100
+            channel['rss_bytes'] += sample['rss']
+            uptime = sample['uptime']
+            channel['min_uptime'] = uptime if channel['min_uptime'] is None else min(channel['min_uptime'], uptime)
+            if process_type == 'input':
+                channel['source_index'] = int(index)
+        return usage
+
+    def observe(self):
+        """Refine profile costs from the channels that are currently running"""
+        try:
+            usage = self.get_channel_usage()
+        except Exception as e:
+            logger.error(f"Error getting channel usage for capacity model: {str(e)}")
+            return
+
+        config = Configuration()
+        for channel_name, channel_usage in usage.items():
+            if channel_usage['min_uptime'] is None or channel_usage['min_uptime'] < MIN_OBSERVE_UPTIME:
+                continue
+            try:
+                channel_config = config.get_channel_settings(channel_name)
+            except ValueError:
+                continue
+            profile = channel_profile(channel_config, channel_usage['source_index'])
+            self._update_cost(profile, channel_usage['cpu_cores'], channel_usage['rss_bytes'])
+            logger.debug(
+                f"Observed {channel_name} ({profile['key']}): "
+                f"{channel_usage['cpu_cores']:.2f} cores, {channel_usage['rss_bytes'] / 1048576:.0f} MB"
+            )
+
+    def _latest_percent(self, metric_name: str, window: int = 12) -> Optional[float]:
+        """Average of the last live samples for a host metric"""
+        data = self.redis_client.lrange(f"live:{metric_name}", 0, window - 1)
+        values = [json.loads(_decode(item))['value'] for item in data]
+        return sum(values) / len(values) if values else None
+
+    def get_per_cpu(self) -> Optional[list]:
+        """Per-core CPU from the channel manager's sampler, which measures over a fixed interval"""
+        try:
+            response = requests.get(f"{self.channel_manager_url}/processes", timeout=2)
+            response.raise_for_status()
+            host = response.json().get('host') or {}
+        except Exception as e:
+            logger.debug(f"No per-core CPU from the channel manager: {str(e)}")
+            return None
+        sampled_at = host.get('sampled_at')
+        if not host.get('per_cpu') or sampled_at is None or time.time() - sampled_at > PER_CPU_MAX_AGE:
+            return None
+        return host['per_cpu']
+
+    def get_host_usage(self) -> Dict:
+        """Current host CPU and memory, preferring the metrics collector's recent averages"""
+        cpu_percent = self._latest_percent('cpu')
+        if cpu_percent is None:
+            cpu_percent = psutil.cpu_percent(interval=None)
+        memory = psutil.virtual_memory()
+        memory_percent = self._latest_percent('memory')
+        if memory_percent is None:
+            memory_percent = memory.percent
+
+        return {
+            'cpu_count': self.cpu_count,
+            'cpu_percent': cpu_percent,
+            'per_cpu': self.get_per_cpu(),
+            'memory_total': memory.total,
+            'memory_percent': memory_percent
+        }
+
+    def estimate(self, channel_config: Dict, source_index: int = 0, host: Optional[Dict] = None) -> Dict:
+        """Headroom in "channels of this profile" for a channel configuration"""
+        profile = channel_profile(channel_config, source_index)
+        cost = self.get_cost(profile)
+        host = host or self.get_host_usage()
+
+        free_cores = max(0.0, host['cpu_count'] * (CPU_TARGET_PERCENT - host['cpu_percent']) / 100)
+        if host.get('per_cpu'):
+            # The sampler's one-second per-core view catches load the smoothed average has not caught up with yet.
+            # A core above target gives nothing back, so it is not netted against the idle ones.
+            per_core_free = sum(max(0.0, CPU_TARGET_PERCENT - percent) for percent in host['per_cpu']) / 100
+            free_cores = min(free_cores, per_core_free)
+        free_memory = max(0.0, host['memory_total'] * (MEMORY_TARGET_PERCENT - host['memory_percent']) / 100)
+
+        by_cpu = math.floor(free_cores / cost['cpu_cores']) if cost['cpu_cores'] > 0 else None
+        by_memory = math.floor(free_memory / cost['rss_bytes']) if cost['rss_bytes'] > 0 else None
+        limits = [(v, name) for v, name in ((by_cpu, 'cpu'), (by_memory, 'memory')) if v is not None]
+        headroom, limited_by = min(limits) if limits else (None, None)
+
+        return {
+            'profile': profile,
+            'cost': cost,
+            'free_cores': free_cores,
+            'free_memory': free_memory,
+            'headroom': headroom,
+            'limited_by': limited_by
+        }
+
+    def estimate_all(self) -> Dict:
+        """Headroom for every configured channel's profile plus the host summary"""
+        host = self.get_host_usage()
+        config = Configuration()
+        channels = {}
+        for channel_name, channel_config in config.config.get('channels', {}).items():
+            channels[channel_name] = self.estimate(channel_config, host=host)
+        return {'host': host, 'channels': channels}
@@ -4,16 +4,19 @@ from gi.repository import Gst, GLib
 from config import Configuration
 import logging
 from logging.handlers import RotatingFileHandler
-import subprocess
 import redis
 import json
 import sys
 import os
+import threading
 import time
 from datetime import datetime
 from collections import deque
 from urllib.parse import urlparse, urlencode
 from stats_collector import StatsCollector
+from loop_lag import GLibLagProbe
+from psi_discovery import PSIDiscovery, DISCOVERY_TIMEOUT
+from latency_profile import LatencySizing
 
 def setup_logging(channel_name, log_dir, log_level='INFO'):
     """
@@ -102,9 +105,11 @@ class CariCoder:
         self.logger.info(f"Initializing CariCoder for channel: {channel_name}, source index: {source_index}")
         Gst.init(None)
         self.channel_name = channel_name
+        self.lag_probe = None
         self.source_index = source_index
         self.config = Configuration()
         self.channel_settings = self.config.get_channel_settings(channel_name)
+        self.sizing = LatencySizing(self.channel_settings, 'caricoder', self.logger)
         
         # Retrieve and validate inputs
         self.inputs = self.channel_settings.get('inputs', [])
@@ -194,7 +199,7 @@ class CariCoder:
         return True
 
 
-    def analyze_stream(self):
+    def analyze_stream(self, probe_data):
         def format_pid(pid):
             """
             Format the PID to ensure it always has four digits after the 'x'.
@@ -224,34 +229,7 @@ class CariCoder:
 # Log the initial configuration
         self.logger.info(f"Analyzing stream: URI={uri}, Program={program_number}, Video PID={video_pid}, Audio PID={audio_pid}")
 
-        # Run ffprobe command
-        try:
-            cmd = [
-                "ffprobe",
-                "-v", "quiet",
-                "-print_format", "json",
-                "-show_format",
-                "-show_streams",
-                "-show_programs",
-                "-i", uri
-            ]
-            self.logger.debug(f"Executing ffprobe command: {' '.join(cmd)}")
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=20)
-            
-            if result.returncode != 0:
-                self.logger.error(f"ffprobe command failed: {result.stderr}")
-                sys.exit(1)
-            probe_data = json.loads(result.stdout)
-            self.logger.debug(f"Probe data: {json.dumps(probe_data, indent=2)}")
-        except subprocess.TimeoutExpired:
-            self.logger.error("ffprobe command timed out")
-            sys.exit(1)
-        except json.JSONDecodeError:
-            self.logger.error("Failed to parse ffprobe output")
-            sys.exit(1)
-        except Exception as e:
-            self.logger.error(f"Error during ffprobe execution: {str(e)}")
-            sys.exit(1)
+        self.logger.debug(f"Probe data: {json.dumps(probe_data, indent=2)}")
 
         # Find the matching program
         matching_program = None
@@ -340,12 +318,19 @@ class CariCoder:
         return video_codec, audio_codec, found_video_pid, found_audio_pid, found_program_number
 
     def create_pipeline(self):
+        self.pipeline = Gst.Pipeline.new("caricoder_pipeline")
+        self.logger_extra['pipeline'] = self.pipeline  # Update the pipeline reference
+
+        # The source runs on its own while its PSI is read, then the rest of the pipeline is
+        # built behind it, so the input is only ever connected to once
+        self.elements['source'] = self._create_source(self.selected_input)
+        self.pipeline.add(self.elements['source'])
         self.logger.info("About to check source details")
-        self.video_codec, self.audio_codec, self.video_pid, self.audio_pid, self.program_number = self.analyze_stream()
+        probe_data = self._discover_psi()
+        self.video_codec, self.audio_codec, self.video_pid, self.audio_pid, self.program_number = \
+            self.analyze_stream(probe_data)
  
         self.logger.info("Creating pipeline")
-        self.pipeline = Gst.Pipeline.new("caricoder_pipeline")
-        self.logger_extra['pipeline'] = self.pipeline  # Update the pipeline reference
 
         # Create and add elements
         self._create_elements()
@@ -356,23 +341,39 @@ class CariCoder:
         # Connect pad-added signal for dynamic linking
         self.elements['tsdemux'].connect("pad-added", self.on_pad_added)
 
-    def _create_elements(self):
-        video_codecs = []
-        video_options_list = []
-        video_resolutions = []
-        deinterlace = self.channel_settings['transcoding']['video'].get('deinterlace', False)
-    
-        for stream in self.channel_settings['transcoding']['video']['streams']:
-            video_codecs.append(stream['codec'])
-            video_options_list.append(stream.get('options', {}))
-            video_resolutions.append(stream.get('resolution'))
+        for element in self.elements.values():
+            element.sync_state_with_parent()
+        self._pipeline_linked.set()
+
+    def _discover_psi(self):
+        """Read PAT/PMT off the running source; the buffer that completes them waits for the pipeline behind it"""
+        program_number = self.selected_input.get('demux', {}).get('program-number')
+        self._pipeline_linked = threading.Event()
+        discovery = PSIDiscovery(
+            self.elements['source'].get_static_pad('src'), program_number,
+            on_complete=lambda probe_data: self._pipeline_linked.wait(DISCOVERY_TIMEOUT), logger=self.logger
+        )
+        discovery.start()
+        if self.pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+            self.logger.error("Unable to start the source for PSI discovery")
+            sys.exit(1)
+        if not discovery.done.wait(DISCOVERY_TIMEOUT):
+            self.logger.error(f"No PAT/PMT received within {DISCOVERY_TIMEOUT}s")
+            discovery.stop()
+            self.pipeline.set_state(Gst.State.NULL)
+            sys.exit(1)
+        return discovery.probe_data
 
-        audio_codec = self.channel_settings['transcoding']['audio']['codec']
-        audio_options = self.channel_settings['transcoding']['audio'].get('options', {})
-        self.logger.info("Creating elements")
+    def _apply_encoder_tuning(self, encoder, factory_name):
+        """Encoder tuning for the latency profile; the channel's encoder options go on top"""
+        for key, value in self.sizing.encoder_properties(factory_name).items():
+            try:
+                encoder.set_property(key, value)
+            except Exception as e:
+                self.logger.warning(f"Failed to set encoder tuning {key}={value}: {str(e)}")
 
-        # Source selection
-        input_config = self.selected_input
+    def _create_source(self, input_config, name="source"):
+        """Create the source element for an input configuration"""
         input_type = input_config['type']
         self.logger.info(f"Source Type in config: {input_type}")
         
@@ -380,7 +381,7 @@ class CariCoder:
             case 'srtsrc':
                 self.logger.info("SRT Source Selected")
                 srt_settings = input_config
-                srt = Gst.ElementFactory.make("srtsrc", "source")
+                srt = Gst.ElementFactory.make("srtsrc", name)
                 
                 # Extract base URI and properties
                 base_uri = srt_settings.get('uri', '')
@@ -410,27 +411,43 @@ class CariCoder:
                         prop_value = srt.get_property(prop_name)
                         self.logger.info(f"  {prop_name}: {prop_value}")
 
-                self.elements['source'] = srt
                 actual_latency = srt.get_property('latency')
                 self.logger.info(f"Set SRT latency actual value: {actual_latency}")
-                self.demux_settings = srt_settings.get('demux', {})
+                return srt
            
             case 'udpsrc':
                 self.logger.info("UDP Source Selected") 
                 udp_settings = input_config
-                udp = Gst.ElementFactory.make("udpsrc", "source")
+                udp = Gst.ElementFactory.make("udpsrc", name)
                 self.logger.info(f"Setting source properties: {udp_settings}")
                 for key, value in udp_settings.items():
-                    if key not in ['type', 'demux', 'options']:
+                    if key not in ['type', 'demux', 'options', 'ingest', 'ts_analysis', 'shared', 'pids', 'jitter_buffer']:
                         udp.set_property(key, value)
                         self.logger.info(f"UDP source setting {key} to {value}")
 
-                self.elements['source'] = udp
-                self.demux_settings = udp_settings.get('demux', {})
+                return udp
         
             case _:
                 raise ValueError(f"Unsupported input type: {input_type}")
 
+    def _create_elements(self):
+        video_codecs = []
+        video_options_list = []
+        video_resolutions = []
+        deinterlace = self.channel_settings['transcoding']['video'].get('deinterlace', False)
+    
+        for stream in self.channel_settings['transcoding']['video']['streams']:
+            video_codecs.append(stream['codec'])
+            video_options_list.append(stream.get('options', {}))
+            video_resolutions.append(stream.get('resolution'))
+
+        audio_codec = self.channel_settings['transcoding']['audio']['codec']
+        audio_options = self.channel_settings['transcoding']['audio'].get('options', {})
+        self.logger.info("Creating elements")
+
+        # Source selection
+        input_config = self.selected_input
+
         # Set demux settings
         self.demux_settings = input_config.get('demux', {})
         self.logger.info(f"Demux settings: {self.demux_settings}")
@@ -439,16 +456,14 @@ class CariCoder:
 
         # Queue after source
         self.elements['queue1'] = Gst.ElementFactory.make("queue", "queue1")
-        self.elements['queue1'].set_property("max-size-time", 500000000000)
-        self.elements['queue1'].set_property("max-size-buffers", 1000000)
-        self.elements['queue1'].set_property("leaky", 1)
+        self.sizing.configure_queue(self.elements['queue1'])
 
         self.logger.info("queue1 created")
 
 # TSParse
         self.elements['tsparse1'] = Gst.ElementFactory.make("tsparse", "tsparse1")
         self.elements['tsparse1'].set_property("set-timestamps", 1)
-        self.elements['tsparse1'].set_property("smoothing-latency", 1000)
+        self.sizing.configure_tsparse(self.elements['tsparse1'])
         
         self.logger.info("tsparse1 created")
 
@@ -463,9 +478,7 @@ class CariCoder:
 
         # Video elements
         self.elements['queue_video'] = Gst.ElementFactory.make("queue", "queue_video")
-        self.elements['queue_video'].set_property("max-size-time", 500000000000)
-        self.elements['queue_video'].set_property("max-size-buffers", 1000000)
-        self.elements['queue_video'].set_property("leaky", 1)
+        self.sizing.configure_queue(self.elements['queue_video'])
         self.logger.info("queue_video created")
 
         #check to see which video decoder we will use and witch parser we will use
@@ -541,6 +554,7 @@ class CariCoder:
                     self.logger.info(f"Configuring H264 CPU Encoding for stream {i}")
                     self.elements[f'videoenc{i}'] = Gst.ElementFactory.make("x264enc", f"x264enc{i}")
                     self.logger.info(f"x264enc encoder created for stream {i}")
+                    self._apply_encoder_tuning(self.elements[f'videoenc{i}'], "x264enc")
                     for key, value in video_options.items():
                         self.elements[f'videoenc{i}'].set_property(key, value)
                         self.logger.info(f"Video encoder setting {key} to {value} for stream {i}")
@@ -549,6 +563,7 @@ class CariCoder:
                     self.logger.info(f"Configuring H265 CPU Encoding for stream {i}")
                     self.elements[f'videoenc{i}'] = Gst.ElementFactory.make("x265enc", f"x265enc{i}")
                     self.logger.info(f"x265enc encoder created for stream {i}")
+                    self._apply_encoder_tuning(self.elements[f'videoenc{i}'], "x265enc")
                     for key, value in video_options.items():
                         self.elements[f'videoenc{i}'].set_property(key, value)
                         self.logger.info(f"Video encoder setting {key} to {value} for stream {i}")
@@ -556,6 +571,7 @@ class CariCoder:
                     self.logger.info(f"Configuring Mpeg2 CPU Encoding for stream {i}")
                     self.elements[f'videoenc{i}'] = Gst.ElementFactory.make("avenc_mpeg2video", f"mpeg2enc{i}")
                     self.logger.info(f"avenc_mpeg2video encoder created for stream {i}")
+                    self._apply_encoder_tuning(self.elements[f'videoenc{i}'], "avenc_mpeg2video")
                     for key, value in video_options.items():
                         self.elements[f'videoenc{i}'].set_property(key, value)
                         self.logger.info(f"Video encoder setting {key} to {value} for stream {i}")
@@ -569,16 +585,12 @@ class CariCoder:
             self.logger.info(f"tee_video_out{i} created")
 
             self.elements[f'queue_video_out{i}'] = Gst.ElementFactory.make("queue", f"queue_video_out{i}")
-            self.elements[f'queue_video_out{i}'].set_property("max-size-time", 500000000000)
-            self.elements[f'queue_video_out{i}'].set_property("max-size-buffers", 1000000)
-            self.elements[f'queue_video_out{i}'].set_property("leaky", 1)
+            self.sizing.configure_queue(self.elements[f'queue_video_out{i}'])
             self.logger.info(f"queue_video_out{i} created")
 
         # Audio elements
         self.elements['queue_audio'] = Gst.ElementFactory.make("queue", "queue_audio")
-        self.elements['queue_audio'].set_property("max-size-time", 500000000000)
-        self.elements['queue_audio'].set_property("max-size-buffers", 1000000)
-        self.elements['queue_audio'].set_property("leaky", 1)
+        self.sizing.configure_queue(self.elements['queue_audio'])
         self.logger.info("queue_audio created")
 
         # Add audio element creation based on self.audio_codec
@@ -653,9 +665,7 @@ class CariCoder:
                 raise ValueError(f"Unsupported audio codec: {audio_codec}")
 
         self.elements['queue_audio_out'] = Gst.ElementFactory.make("queue", "queue_audio_out")
-        self.elements['queue_audio_out'].set_property("max-size-time", 500000000000)
-        self.elements['queue_audio_out'].set_property("max-size-buffers", 1000000)
-        self.elements['queue_audio_out'].set_property("leaky", 1)
+        self.sizing.configure_queue(self.elements['queue_audio_out'])
         self.logger.info("queue_audio_out created")
         
         self.elements['tee_audio_out'] = Gst.ElementFactory.make("tee", "tee_audio_out")
@@ -699,7 +709,7 @@ class CariCoder:
     
         # Set other muxer properties
         for key, value in mux_settings.items():
-            if key not in ['video-pid', 'audio-pid', 'program-number', 'type']:
+            if key not in ['video-pid', 'audio-pid', 'program-number', 'type', 'pmt-pid', 'fast-passthrough']:
                 if key == 'bitrate':
                     value = value * 1000
                 self.logger.info(f"Setting mux property: {key} = {value}")
@@ -710,7 +720,7 @@ class CariCoder:
         self.mux_audio_pad = audio_pad
 
         self.elements['tsparse2'] = Gst.ElementFactory.make("tsparse", "tsparse2")
-        self.elements['tsparse2'].set_property("smoothing-latency", 4000)
+        self.sizing.configure_tsparse(self.elements['tsparse2'])
         self.logger.info(f"tsparse2 created")
 
         self.elements['tee'] = Gst.ElementFactory.make("tee", "tee")
@@ -846,6 +856,8 @@ class CariCoder:
 
         # Add all elements to pipeline
         for element in self.elements.values():
+            if element.get_parent() is not None:
+                continue
             self.pipeline.add(element)
             self.logger.info(f"Adding {element} to the pipeline")
 
@@ -1118,6 +1130,13 @@ class CariCoder:
         # Generate DOT file after pipeline is playing
         self.generate_dot_file("pipeline_playing")
 
+        # Measure main loop lag so blocking callbacks show up in stats
+        self.lag_probe = GLibLagProbe(
+            f"{self.channel_name}_caricoder", self.logger,
+            stats_collector=self.stats_collector, stat_type="loop_lag_caricoder"
+        )
+        self.lag_probe.start()
+        
         # Run the main loop
         loop = GLib.MainLoop()
         try:
@@ -1221,6 +1240,9 @@ class CariCoder:
                         self.last_log_time[error_key] = current_time
 
     def cleanup(self):
+        if self.lag_probe:
+            self.lag_probe.stop()
+
         # Stop the SRT stats collection timer
         if hasattr(self, 'srt_stats_timer'):
             GLib.source_remove(self.srt_stats_timer)
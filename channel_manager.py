@@ -18,12 +18,15 @@ from enum import Enum, auto
 import argparse
 from datetime import datetime
 from logging.handlers import RotatingFileHandler
+from process_sampler import ProcessSampler
+from stream_set import stream_set, is_passthrough, all_info_paths, describe as describe_streams
 
 class InputType(Enum):
     SRT = auto()
     UDP = auto()
     RTSP = auto()
     HLS = auto()
+    FILE = auto()
     UNKNOWN = auto()
 
 class TranscoderType(Enum):
@@ -62,14 +65,23 @@ class ChannelProcess:
             return True
         return False
         
-    def get_status(self) -> Dict:
-        return {
+    def get_status(self, sample: Optional[Dict] = None) -> Dict:
+        status = {
             "type": self.process_type,
             "pid": self.process.pid,
-            "running": self.is_running(),
+            "running": sample["running"] if sample else self.is_running(),
             "index": self.index,
             "uptime": int(time.time() - self.start_time)
         }
+        if sample:
+            status.update({
+                "state": sample["state"],
+                "cpu_percent": sample["cpu_percent"],
+                "cpu_per_core": sample["cpu_per_core"],
+                "rss": sample["rss"],
+                "sampled_at": sample["sampled_at"]
+            })
+        return status
 
 class ChannelManager:
     def __init__(self):
@@ -78,6 +90,10 @@ class ChannelManager:
         self.processes: Dict[str, Dict[str, ChannelProcess]] = {}
         self.logger = self._setup_logging()
         self.load_config()
+
+        # Shared process snapshot so status requests don't poll every process
+        self.process_sampler = ProcessSampler(interval=1.0, logger=self.logger)
+        self.process_sampler.start()
         
         # Ensure log directories exist
         log_dirs = [
@@ -166,12 +182,18 @@ class ChannelManager:
             if not inputs:
                 return InputType.UNKNOWN
 
+            # Hot standby, hitless merge, scheduled playout and shared inputs (UDP and/or SRT) run inside the UDP input handler
+            if (channel_config.get('hot_standby') or channel_config.get('hitless_merge')
+                    or channel_config.get('scheduled_playout') or inputs[0].get('shared')):
+                return InputType.UDP
+
             input_type = inputs[0].get('type', '').lower()
             return {
                 'srtsrc': InputType.SRT,
                 'udpsrc': InputType.UDP,
                 'rtspsrc': InputType.RTSP,
-                'hlssrc': InputType.HLS
+                'hlssrc': InputType.HLS,
+                'filesrc': InputType.FILE
             }.get(input_type, InputType.UNKNOWN)
 
         except Exception as e:
@@ -180,20 +202,9 @@ class ChannelManager:
 
     def _detect_transcoder_type(self, channel_config: Dict) -> TranscoderType:
         try:
-            transcoding = channel_config.get('transcoding', {})
             processing = channel_config.get('processing', {})
 
-            video_settings = transcoding.get('video', {})
-            video_streams = video_settings.get('streams', [])
-            
-            if not video_streams:
-                video_passthrough = video_settings.get('codec') == 'passthrough'
-            else:
-                video_passthrough = all(stream.get('codec') == 'passthrough' for stream in video_streams)
-
-            audio_passthrough = transcoding.get('audio', {}).get('codec') == 'passthrough'
-
-            if video_passthrough and audio_passthrough:
+            if is_passthrough(channel_config):
                 return TranscoderType.NONE
 
             transcoder_type = processing.get('type', 'cpu_only').upper()
@@ -272,6 +283,7 @@ class ChannelManager:
             # Store file handles for cleanup
             process._log_files = (stdout_file, stderr_file)
             
+            self.process_sampler.register(f"{channel_name}:{process_type}:{index}", process.pid)
             self.logger.info(f"Started {process_type} process PID: {process.pid}")
             self.logger.info(f"Stdout log: {stdout_path}")
             self.logger.info(f"Stderr log: {stderr_path}")
@@ -293,6 +305,13 @@ class ChannelManager:
                 return {"status": "error", "message": f"Channel {channel_name} is already running"}
 
             channel = self.channels[channel_name]
+            # The SRT and HLS input handlers carry video and at most one audio track
+            streams = stream_set(channel.raw_config)
+            if channel.input_type in (InputType.SRT, InputType.HLS) and streams['audio'] > 1:
+                return {"status": "error",
+                        "message": f"Channel {channel_name} carries {describe_streams(streams)}; "
+                                   f"{channel.input_type.name} inputs carry at most one audio track, "
+                                   f"use a UDP input for more"}
             self.processes[channel_name] = {}
 
             # Start input handler based on type
@@ -318,6 +337,18 @@ class ChannelManager:
                     input_cmd, channel_name, "input", source_index
                 )
 
+            elif channel.input_type == InputType.FILE:
+                # File playout runs in the UDP input handler's appsrc path
+                input_cmd = [
+                    "python3", "udp_input_handler.py",
+                    "--log-dir", "/root/caricoder/logs/file_input",
+                    "--source-index", str(source_index),
+                    channel_name
+                ]
+                self.processes[channel_name]['input'] = self._run_process(
+                    input_cmd, channel_name, "input", source_index
+                )
+
             elif channel.input_type == InputType.HLS:
                 input_cmd = [
                     "python3", "hls_input_handler.py",
@@ -390,10 +421,8 @@ class ChannelManager:
         socket_dir = "/tmp/caricoder"
         files_to_cleanup = [
             f"{socket_dir}/{channel_name}_muxed_shm",
-            f"{socket_dir}/{channel_name}_transcoded_shm",
-            f"{socket_dir}/{channel_name}_video_shm_info",
-            f"{socket_dir}/{channel_name}_audio_shm_info"
-        ]
+            f"{socket_dir}/{channel_name}_transcoded_shm"
+        ] + all_info_paths(channel_name, socket_dir)
     
         for file_path in files_to_cleanup:
             try:
@@ -457,6 +486,8 @@ class ChannelManager:
                 self._cleanup_shared_memory(channel_name)
 
             # Remove from processes dict
+            for process in self.processes[channel_name].values():
+                self.process_sampler.unregister(f"{channel_name}:{process.process_type}:{process.index}")
             del self.processes[channel_name]
             return {"status": "success", "message": f"Channel {channel_name} stopped"}
 
@@ -493,8 +524,10 @@ class ChannelManager:
                         "processes": {}
                     }
                     for proc_type, process in self.processes[chan].items():
-                        if process.is_running():
-                            status[chan]["processes"][proc_type] = process.get_status()
+                        sample = self.process_sampler.get(f"{chan}:{process.process_type}:{process.index}")
+                        proc_status = process.get_status(sample)
+                        if proc_status["running"]:
+                            status[chan]["processes"][proc_type] = proc_status
                         else:
                             status[chan]["running"] = False
                 
@@ -628,6 +661,10 @@ def get_status():
     channel_name = request.args.get('channel')
     return jsonify(channel_manager.get_channel_status(channel_name))
 
+@app.route('/processes', methods=['GET'])
+def get_process_snapshot():
+    return jsonify(channel_manager.process_sampler.snapshot())
+
 @app.route('/list', methods=['GET'])
 def list_channels():
     channels = {}
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+# servers.json is served with the dashboard; fall back to the copy in the repo
+SERVERS_FILES = [
+    "/var/www/html/servers.json",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "web", "html", "servers.json")
+]
+
+STATS_API_PORT = 5000
+CHANNEL_MANAGER_PORT = 8001
+
+# Stat type holding the input stats for each input element
+INPUT_STAT_TYPES = {
+    'srtsrc': 'srt_input',
+    'udpsrc': 'udp_input',
+    'hlssrc': 'hls_input',
+    'filesrc': 'udp_input'
+}
+
+
+def load_servers(path: Optional[str] = None) -> List[Dict]:
+    """Read servers.json; entries are host strings or {"host", "stats_port", "manager_port"} objects"""
+    paths = [path] if path else SERVERS_FILES
+    for candidate in paths:
+        if candidate and os.path.exists(candidate):
+            with open(candidate, 'r') as f:
+                entries = json.load(f).get('servers', [])
+            return [normalize_server(entry) for entry in entries]
+    logger.warning("No servers.json found for federation")
+    return []
+
+
+def normalize_server(entry) -> Dict:
+    if isinstance(entry, str):
+        entry = {'host': entry}
+    host = entry['host']
+    return {
+        'name': entry.get('name', host),
+        'host': host,
+        'stats_port': int(entry.get('stats_port', STATS_API_PORT)),
+        'manager_port': int(entry.get('manager_port', CHANNEL_MANAGER_PORT))
+    }
+
+
+class FederationAggregator:
+    """Fans out to every configured server concurrently and merges the results into one fleet view"""
+
+    def __init__(self, servers: List[Dict], timeout: float = 2.0, cache_ttl: float = 3.0,
+                 max_workers: int = 32):
+        self.servers = servers
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=len(servers) * 2 or 1,
+                                                pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="federation")
+
+        # Only one refresh runs at a time; concurrent callers wait for it and share the result
+        self._refresh_lock = threading.Lock()
+        self._cache = {}
+        self._last_seen: Dict[str, float] = {}
+
+    def _get(self, url: str):
+        start = time.monotonic()
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json(), (time.monotonic() - start) * 1000
+
+    def _fetch_all(self, requests_by_key: Dict) -> Dict:
+        """Run GETs concurrently; each result is (data, latency_ms, error)"""
+        futures = {key: self.executor.submit(self._get, url) for key, url in requests_by_key.items()}
+        results = {}
+        for key, future in futures.items():
+            try:
+                data, latency = future.result()
+                results[key] = (data, latency, None)
+            except Exception as e:
+                results[key] = (None, None, str(e))
+        return results
+
+    def _server_urls(self, server: Dict) -> Dict[str, str]:
+        stats = f"http://{server['host']}:{server['stats_port']}"
+        manager = f"http://{server['host']}:{server['manager_port']}"
+        return {
+            'config': f"{stats}/api/channels",
+            'metrics': f"{stats}/metrics/latest",
+            'list': f"{manager}/list",
+            'status': f"{manager}/status"
+        }
+
+    def _build_view(self, include_stats: bool) -> Dict:
+        now = time.time()
+        requests_by_key = {}
+        for server in self.servers:
+            for endpoint, url in self._server_urls(server).items():
+                requests_by_key[(server['name'], endpoint)] = url
+        results = self._fetch_all(requests_by_key)
+
+        servers_view = {}
+        channels = []
+        for server in self.servers:
+            name = server['name']
+            server_results = {endpoint: results[(name, endpoint)] for endpoint in self._server_urls(server)}
+            errors = {endpoint: error for endpoint, (_, _, error) in server_results.items() if error}
+            reachable = len(errors) < len(server_results)
+            if reachable:
+                self._last_seen[name] = now
+            latencies = [latency for _, latency, _ in server_results.values() if latency is not None]
+
+            servers_view[name] = {
+                'host': server['host'],
+                'reachable': reachable,
+                'errors': errors,
+                'last_seen': self._last_seen.get(name),
+                'latency_ms': max(latencies) if latencies else None,
+                'metrics': server_results['metrics'][0]
+            }
+            if not reachable:
+                logger.warning(f"Federation server {name} unreachable: {errors}")
+                continue
+
+            config = (server_results['config'][0] or {}).get('channels', [])
+            channel_list = (server_results['list'][0] or {}).get('channels', {})
+            channel_status = (server_results['status'][0] or {}).get('channels', {})
+            for channel_config in config:
+                channel_name = channel_config['name']
+                channels.append({
+                    'server': name,
+                    'name': channel_name,
+                    'config': channel_config,
+                    'running': channel_list.get(channel_name, {}).get('running', False),
+                    'processes': channel_status.get(channel_name, {}).get('processes', {})
+                })
+
+        if include_stats:
+            self._attach_input_stats(channels)
+
+        return {
+            'generated_at': now,
+            'servers': servers_view,
+            'channels': channels,
+            'summary': {
+                'servers_total': len(self.servers),
+                'servers_reachable': sum(1 for s in servers_view.values() if s['reachable']),
+                'channels_total': len(channels),
+                'channels_running': sum(1 for c in channels if c['running'])
+            }
+        }
+
+    def _attach_input_stats(self, channels: List[Dict]):
+        """Fetch the latest input stats for every running channel in one concurrent round"""
+        servers = {server['name']: server for server in self.servers}
+        requests_by_key = {}
+        for index, channel in enumerate(channels):
+            if not channel['running']:
+                continue
+            inputs = channel['config'].get('inputs', [])
+            stat_type = INPUT_STAT_TYPES.get(inputs[0].get('type')) if inputs else None
+            if not stat_type:
+                continue
+            server = servers[channel['server']]
+            requests_by_key[index] = (
+                f"http://{server['host']}:{server['stats_port']}/stats/live/{channel['name']}/{stat_type}"
+            )
+
+        for index, (data, _, error) in self._fetch_all(requests_by_key).items():
+            channels[index]['input_stats'] = data[-1] if data else None
+            if error:
+                channels[index]['input_stats_error'] = error
+
+    def get_fleet_view(self, include_stats: bool = False, max_age: Optional[float] = None) -> Dict:
+        """Merged fleet view, served from cache when it is fresh enough"""
+        max_age = self.cache_ttl if max_age is None else max_age
+        cached = self._cache.get(include_stats)
+        if cached and time.time() - cached['generated_at'] < max_age:
+            return dict(cached, cached=True)
+
+        with self._refresh_lock:
+            # Another request may have refreshed the view while we waited
+            cached = self._cache.get(include_stats)
+            if cached and time.time() - cached['generated_at'] < max_age:
+                return dict(cached, cached=True)
+
+            view = self._build_view(include_stats)
+            self._cache[include_stats] = view
+            return dict(view, cached=False)
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from ts_psi import TS_PACKET_SIZE, SYNC_BYTE
+
+RECORDER_DIR = "/dev/shm/caricoder"
+CAPTURE_DIR = "/root/caricoder/captures"
+# bytes written in total, wall clock time of the last write
+HEADER = struct.Struct('<Qd')
+DEFAULT_MINUTES = 1
+DEFAULT_MAX_MBPS = 20        # the ring holds `minutes` of input up to this bitrate
+DEFAULT_KEEP = 10            # captures kept per channel, oldest removed first
+INDEX_INTERVAL = 1.0         # seconds between index entries
+MIN_DUMP_INTERVAL = 30.0     # a failure loop marks events but does not write a capture every time
+MAX_EVENTS = 1000
+
+
+def recorder_path(channel_name: str) -> str:
+    return os.path.join(RECORDER_DIR, f"{channel_name}_flight_recorder")
+
+
+def capture_names(channel_name: str, capture_dir: str = CAPTURE_DIR, suffix: str = ".ts") -> List[str]:
+    """
+    File names of a channel's captures, {channel}_{YYYYmmdd}_{HHMMSS}_{reason}; matched in full
+    so that channel news does not pick up the captures of news_hd
+    """
+    if not os.path.isdir(capture_dir):
+        return []
+    pattern = re.compile(re.escape(channel_name) + r"_\d{8}_\d{6}_[\w-]+" + re.escape(suffix))
+    return sorted(name for name in os.listdir(capture_dir) if pattern.fullmatch(name))
+
+
+def request_dump(channel_name: str, reason: str = 'api'):
+    """Ask a running input handler to write a capture; it picks the request up within a second"""
+    with open(recorder_path(channel_name) + ".dump", 'w') as f:
+        f.write(reason)
+
+
+def create_flight_recorder(input_config: Dict, channel_name: str, stats_collector=None,
+                           logger: Optional[logging.Logger] = None) -> Optional['FlightRecorder']:
+    """Recorder for an input unless it is switched off with `flight_recorder: false`"""
+    settings = input_config.get('flight_recorder', True)
+    if not settings:
+        return None
+    return FlightRecorder(channel_name, settings if isinstance(settings, dict) else {},
+                          stats_collector=stats_collector, logger=logger)
+
+
+class FlightRecorder:
+    """
+    Always-on recording of an input's raw TS into a fixed-size ring file in tmpfs, so
+    a failure comes with the data that led up to it. Buffers are copied into the mapped
+    ring as they arrive; an index of write offsets against wall clock time and a list of
+    error events are kept alongside. dump() freezes the ring, copies it out oldest first
+    and writes it to CAPTURE_DIR from a worker thread with a JSON file holding the index and events, which
+    locate each second and each event in the capture by byte offset.
+    """
+
+    def __init__(self, channel_name: str, settings: Dict, stats_collector=None,
+                 logger: Optional[logging.Logger] = None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.channel_name = channel_name
+        self.stats_collector = stats_collector
+        self.path = recorder_path(channel_name)
+        self.capture_dir = settings.get('capture-dir', CAPTURE_DIR)
+        self.keep = int(settings.get('keep', DEFAULT_KEEP))
+        minutes = float(settings.get('minutes', DEFAULT_MINUTES))
+        max_mbps = float(settings.get('max-mbps', DEFAULT_MAX_MBPS))
+        self.capacity = int(minutes * 60 * max_mbps * 1000000 / 8) // TS_PACKET_SIZE * TS_PACKET_SIZE
+        if self.capacity <= 0:
+            raise ValueError("flight_recorder minutes and max-mbps must be positive")
+
+        os.makedirs(RECORDER_DIR, exist_ok=True)
+        self._fd = os.open(self.path, os.O_CREAT | os.O_TRUNC | os.O_RDWR, 0o644)
+        os.ftruncate(self._fd, HEADER.size + self.capacity)
+        self._map = mmap.mmap(self._fd, HEADER.size + self.capacity)
+
+        self._lock = threading.Lock()
+        self._frozen = False
+        self.written = 0
+        self.dropped = 0
+        self._index = deque(maxlen=int(minutes * 60 / INDEX_INTERVAL) + 2)
+        self._events = deque(maxlen=MAX_EVENTS)
+        self._last_index = 0.0
+        self._last_dump = 0.0
+        self._last_written = 0
+        self.captures = 0
+        self.logger.info(f"Flight recorder at {self.path}, {self.capacity} bytes "
+                         f"({minutes:g} min at {max_mbps:g} Mbps)")
+
+    def probe_buffer(self, pad, info):
+        """Pad probe callback for BUFFER and BUFFER_LIST probes on the input"""
+        buffers = [info.get_buffer()]
+        if info.type & Gst.PadProbeType.BUFFER_LIST:
+            buffer_list = info.get_buffer_list()
+            buffers = [buffer_list.get(i) for i in range(buffer_list.length())]
+        for buffer in buffers:
+            if buffer is None:
+                continue
+            success, map_info = buffer.map(Gst.MapFlags.READ)
+            if success:
+                try:
+                    self.write(map_info.data)
+                finally:
+                    buffer.unmap(map_info)
+        return Gst.PadProbeReturn.OK
+
+    def write(self, data):
+        """Copy a chunk of TS into the ring at the write position"""
+        with self._lock:
+            length = len(data)
+            if self._frozen:
+                self.dropped += length
+                return
+            data = memoryview(data)
+            if length > self.capacity:
+                data = data[length - self.capacity:]
+                self.written += length - self.capacity
+                length = self.capacity
+            now = time.time()
+            if now - self._last_index >= INDEX_INTERVAL:
+                self._index.append((self.written, now))
+                self._last_index = now
+
+            pos = self.written % self.capacity
+            first = min(length, self.capacity - pos)
+            start = HEADER.size + pos
+            self._map[start:start + first] = data[:first]
+            if first < length:
+                self._map[HEADER.size:HEADER.size + length - first] = data[first:]
+            self.written += length
+            HEADER.pack_into(self._map, 0, self.written, now)
+
+    def mark(self, kind: str, message: str = ''):
+        """Note an event against the current write position"""
+        with self._lock:
+            self._events.append((self.written, time.time(), kind, message))
+
+    def dump(self, reason: str, message: str = '', force: bool = False) -> Optional[str]:
+        """
+        Freeze the ring and copy it out, then write a capture with its index on a worker
+        thread; returns the path the capture is being written to
+        """
+        self.mark(reason, message)
+        now = time.monotonic()
+        if not force and now - self._last_dump < MIN_DUMP_INTERVAL:
+            self.logger.info(f"Flight recorder noted {reason}, last capture was {now - self._last_dump:.0f}s ago")
+            return None
+        self._last_dump = now
+
+        with self._lock:
+            self._frozen = True
+            end = self.written
+            start = max(0, end - self.capacity)
+            index = [entry for entry in self._index if entry[0] >= start]
+            events = [event for event in self._events if event[0] >= start]
+        try:
+            pos = start % self.capacity
+            length = end - start
+            first = min(length, self.capacity - pos)
+            # One copy of the ring, oldest first, straight from the map
+            data = bytearray(length)
+            with memoryview(self._map) as ring:
+                data[:first] = ring[HEADER.size + pos:HEADER.size + pos + first]
+                data[first:] = ring[HEADER.size:HEADER.size + length - first]
+        finally:
+            with self._lock:
+                self._frozen = False
+
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        base = os.path.join(self.capture_dir, f"{self.channel_name}_{stamp}_{reason}")
+        # Writing up to the whole ring to disk would stall the thread that asked for it
+        threading.Thread(target=self._write_capture, args=(base, data, start, end, index, events, reason, message),
+                         name="flight_recorder_dump", daemon=True).start()
+        return base + ".ts"
+
+    def _write_capture(self, base: str, data: bytearray, start: int, end: int, index: List, events: List,
+                       reason: str, message: str):
+        # Start on a packet boundary; the oldest bytes may be the tail of an overwritten packet
+        skip = 0
+        while skip < min(len(data), TS_PACKET_SIZE) and not (
+                data[skip] == SYNC_BYTE and (skip + TS_PACKET_SIZE >= len(data)
+                                             or data[skip + TS_PACKET_SIZE] == SYNC_BYTE)):
+            skip += 1
+        start += skip
+
+        try:
+            os.makedirs(self.capture_dir, exist_ok=True)
+            with open(base + ".ts", 'wb') as f:
+                f.write(memoryview(data)[skip:])
+            with open(base + ".json", 'w') as f:
+                json.dump({
+                    'channel': self.channel_name,
+                    'reason': reason,
+                    'message': message,
+                    'created': time.time(),
+                    'bytes': end - start,
+                    'index': [{'offset': max(0, offset - start), 'time': t} for offset, t in index],
+                    'events': [{'offset': max(0, offset - start), 'time': t, 'kind': kind, 'message': text}
+                               for offset, t, kind, text in events]
+                }, f, indent=2)
+            with self._lock:
+                self.captures += 1
+            self._prune()
+            self.logger.warning(f"Flight recorder captured {end - start} bytes of input to {base}.ts ({reason})")
+        except Exception as e:
+            self.logger.error(f"Error writing flight recorder capture: {str(e)}")
+
+    def _prune(self):
+        """Remove this channel's oldest captures beyond `keep`"""
+        captures = sorted(
+            (os.stat(path).st_mtime, path)
+            for path in (os.path.join(self.capture_dir, name)
+                         for name in capture_names(self.channel_name, self.capture_dir))
+        )
+        for _, path in captures[:max(0, len(captures) - self.keep)]:
+            for suffix_path in (path, path[:-3] + ".json"):
+                try:
+                    os.unlink(suffix_path)
+                except FileNotFoundError:
+                    pass
+
+    def poll(self):
+        """Pick up dump requests from the API and publish; runs as a GLib timer"""
+        try:
+            request = self.path + ".dump"
+            if os.path.exists(request):
+                with open(request) as f:
+                    reason = f.read().strip() or 'api'
+                os.unlink(request)
+                self.dump(reason, 'requested', force=True)
+
+            with self._lock:
+                rate = self.written - self._last_written
+                self._last_written = self.written
+                stats = {
+                    'bytes_written': rate,
+                    'capacity_bytes': self.capacity,
+                    'fill_bytes': min(self.written, self.capacity),
+                    'window_s': self.capacity / rate if rate else None,
+                    'dropped_bytes': self.dropped,
+                    'captures': self.captures
+                }
+            if self.stats_collector:
+                self.stats_collector.add_stats("flight_recorder", stats)
+        except Exception as e:
+            self.logger.error(f"Error polling flight recorder: {str(e)}")
+        return True
+
+    def close(self):
+        with self._lock:
+            self._frozen = True
+            self._map.close()
+            os.close(self._fd)
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
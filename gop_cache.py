@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from stream_set import stream_set
+from ts_psi import TS_PACKET_SIZE, SYNC_BYTE, PAT_PID, PSIParser
+
+# tmpfs, so the writer's appends and the readers' snapshots never touch a disk
+CACHE_DIR = "/dev/shm/caricoder"
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+STALE_AFTER = 5.0            # a cache the input has not appended to for this long is not replayed
+REPLAY_PACKETS = 7           # packets per replayed buffer, what a UDP sink sends as one datagram
+# Packets that must line up before the cache is cut where the live data picks up; one is not
+# enough, since an unchanged PAT or PMT repeats exactly every 16 continuity counter cycles
+OVERLAP_MATCH_PACKETS = 4
+
+# NAL unit types that only start a random access point
+H264_KEY_NALS = {5, 7}                           # IDR slice, SPS
+HEVC_KEY_NALS = set(range(16, 22)) | {32, 33}    # IRAP slices, VPS, SPS
+
+
+def gop_cache_path(channel_name: str) -> str:
+    return os.path.join(CACHE_DIR, f"{channel_name}_gop_cache")
+
+
+def gop_cache_settings(channel_settings: Dict) -> Optional[Dict]:
+    """Settings of a channel configured with `gop_cache: true` or a settings dict, if it carries video"""
+    settings = channel_settings.get('gop_cache')
+    # Audio-only channels can be joined at any PES, so there is nothing to cache
+    if not settings or not stream_set(channel_settings)['video']:
+        return None
+    return settings if isinstance(settings, dict) else {}
+
+
+def starts_keyframe(payload, codec: str) -> bool:
+    """Whether the start of a video PES carries a random access point"""
+    if len(payload) < 9 or payload[0] != 0 or payload[1] != 0 or payload[2] != 1:
+        return False
+    es = payload[9 + payload[8]:]
+    pos = es.find(b'\x00\x00\x01')
+    while 0 <= pos < len(es) - 3:
+        header = es[pos + 3]
+        if codec == 'h264' and header & 0x1F in H264_KEY_NALS:
+            return True
+        if codec == 'hevc' and (header >> 1) & 0x3F in HEVC_KEY_NALS:
+            return True
+        if codec in ('mpeg2video', 'mpeg1video') and header == 0xB3:   # sequence header
+            return True
+        pos = es.find(b'\x00\x00\x01', pos + 3)
+    return False
+
+
+class GOPCache:
+    """
+    Keeps the most recent GOP of an input handler's output in a tmpfs file, so a
+    process connecting to the channel's shm mid-stream can start from a keyframe instead
+    of waiting for the next one. Each keyframe on the video PID starts a new file holding
+    the latest PAT and PMT and then every packet from the keyframe on, which replaces the
+    previous one atomically. A GOP that grows past max-bytes drops the cache until the next
+    keyframe. shmsink cannot send to one client alone, so the replay is done by the
+    consumer: see GOPReplay.
+    """
+
+    def __init__(self, channel_name: str, settings: Dict, stats_collector=None,
+                 logger: Optional[logging.Logger] = None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.channel_name = channel_name
+        self.stats_collector = stats_collector
+        self.path = gop_cache_path(channel_name)
+        self.max_bytes = int(settings.get('max-bytes', DEFAULT_MAX_BYTES))
+        os.makedirs(CACHE_DIR, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._psi = PSIParser(settings.get('program-number'))
+        self._psi_packets: Dict[int, List[bytes]] = {}
+        self._psi_pid_set = self._psi_pids()
+        self._video_pid = None
+        self._codec = None
+        self._fd = None
+        self._size = 0
+        self._gop_started = None
+        self.gop_bytes = 0
+        self.gop_ms = None
+        self.keyframes = 0
+        self.oversized = 0
+        self.logger.info(f"GOP cache at {self.path}, up to {self.max_bytes} bytes")
+
+    def probe_buffer(self, pad, info):
+        """Pad probe callback for BUFFER and BUFFER_LIST probes on the input's shmsink"""
+        buffers = [info.get_buffer()]
+        if info.type & Gst.PadProbeType.BUFFER_LIST:
+            buffer_list = info.get_buffer_list()
+            buffers = [buffer_list.get(i) for i in range(buffer_list.length())]
+        for buffer in buffers:
+            if buffer is None:
+                continue
+            success, map_info = buffer.map(Gst.MapFlags.READ)
+            if success:
+                try:
+                    self.feed(map_info.data)
+                finally:
+                    buffer.unmap(map_info)
+        return Gst.PadProbeReturn.OK
+
+    def feed(self, data):
+        """Track PSI and keyframes in a chunk of TS and append it to the current GOP"""
+        with self._lock:
+            data = bytes(data)
+            start = 0
+            for pos in range(0, len(data) - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+                if data[pos] != SYNC_BYTE:
+                    continue
+                pid = ((data[pos + 1] & 0x1F) << 8) | data[pos + 2]
+                if pid in self._psi_pid_set:
+                    self._track_psi(pid, data[pos:pos + TS_PACKET_SIZE])
+                elif pid == self._video_pid and data[pos + 1] & 0x40 and self._is_keyframe(data, pos):
+                    self._append(data[start:pos])
+                    self._start_gop()
+                    start = pos
+            self._append(data[start:])
+
+    def _psi_pids(self):
+        pids = {PAT_PID}
+        if self._psi.pat:
+            pids.update(self._psi.pat['programs'].values())
+        return pids
+
+    def _track_psi(self, pid: int, packet: bytes):
+        """Keep the packets of the latest table on each PSI PID and find the video PID"""
+        if packet[1] & 0x40:
+            self._psi_packets[pid] = [packet]
+        elif pid in self._psi_packets:
+            self._psi_packets[pid].append(packet)
+        self._psi.feed(packet)
+        if pid == PAT_PID:
+            # PMT PIDs only change with the PAT
+            self._psi_pid_set = self._psi_pids()
+
+        program = self._psi.selected_program()
+        pmt = self._psi.pmts.get(program) if program is not None else None
+        if not pmt:
+            return
+        video = next((s for s in pmt['streams'] if s['codec_type'] == 'video'), None)
+        if video and (video['pid'], video['codec_name']) != (self._video_pid, self._codec):
+            self._video_pid = video['pid']
+            self._codec = video['codec_name']
+            self._close_gop()
+            self.logger.info(f"GOP cache following {self._codec} on PID {hex(self._video_pid)}")
+
+    def _is_keyframe(self, data: bytes, pos: int) -> bool:
+        offset = pos + 4
+        if data[pos + 3] & 0x20:
+            length = data[pos + 4]
+            # random_access_indicator
+            if length and data[pos + 5] & 0x40:
+                return True
+            offset += 1 + length
+        if not data[pos + 3] & 0x10 or offset >= pos + TS_PACKET_SIZE:
+            return False
+        return starts_keyframe(data[offset:pos + TS_PACKET_SIZE], self._codec)
+
+    def _start_gop(self):
+        """New file starting with the current PSI, moved over the previous GOP"""
+        now = time.monotonic()
+        if self._gop_started is not None:
+            self.gop_ms = (now - self._gop_started) * 1000
+        self._gop_started = now
+        self.keyframes += 1
+        self._close_gop()
+
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        self._fd = os.open(temp_path, os.O_CREAT | os.O_TRUNC | os.O_WRONLY, 0o644)
+        self._size = 0
+        for pid in sorted(self._psi_packets):
+            self._append(b''.join(self._psi_packets[pid]))
+        os.replace(temp_path, self.path)
+
+    def _append(self, data: bytes):
+        if self._fd is None or not data:
+            return
+        if self._size + len(data) > self.max_bytes:
+            self.oversized += 1
+            self.logger.warning(f"GOP larger than {self.max_bytes} bytes, cache dropped until the next keyframe")
+            self._close_gop()
+            self._remove()
+            return
+        os.write(self._fd, data)
+        self._size += len(data)
+        self.gop_bytes = self._size
+
+    def _close_gop(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _remove(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def publish(self):
+        """Hand the cache state to StatsCollector; runs as a GLib timer"""
+        try:
+            with self._lock:
+                stats = {
+                    'cache_bytes': self._size if self._fd is not None else 0,
+                    'gop_bytes': self.gop_bytes,
+                    'gop_ms': self.gop_ms,
+                    'keyframes': self.keyframes,
+                    'oversized': self.oversized,
+                    'video_pid': hex(self._video_pid) if self._video_pid is not None else None
+                }
+                self.keyframes = self.oversized = 0
+            if self.stats_collector:
+                self.stats_collector.add_stats("gop_cache", stats)
+        except Exception as e:
+            self.logger.error(f"Error publishing GOP cache stats: {str(e)}")
+        return True
+
+    def close(self):
+        with self._lock:
+            self._close_gop()
+            self._remove()
+
+
+class GOPReplay:
+    """
+    Consumer side of GOPCache. A one-shot probe on a shmsrc's src pad reads the cache when
+    the first buffer arrives and pushes it ahead of that buffer, so demuxers, decoders and
+    segmenters downstream see PSI and a keyframe straight away. The cache overlaps the live
+    data by however far the input got since the shm handoff, so it is cut where the first
+    live packets are found in it.
+
+    Only attach it to consumers that do not hold output to the clock by PTS: passthrough
+    UDP stamps buffers on arrival and the HLS segmenter writes as fast as it is fed. A
+    clock-synced consumer (the transcoder) would render the replayed GOP in real time and
+    stay that far behind live for as long as it runs, so it waits for a live keyframe.
+    """
+
+    def __init__(self, channel_name: str, logger: Optional[logging.Logger] = None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.path = gop_cache_path(channel_name)
+        self._replaying = False
+        self.replayed_bytes = 0
+
+    def attach(self, pad):
+        pad.add_probe(Gst.PadProbeType.BUFFER, self._probe)
+
+    def _read_cache(self) -> Optional[bytes]:
+        try:
+            if time.time() - os.stat(self.path).st_mtime > STALE_AFTER:
+                return None
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        # The writer may be part way through appending a packet
+        return data[:len(data) - len(data) % TS_PACKET_SIZE]
+
+    @staticmethod
+    def trim_overlap(cache: bytes, live: bytes) -> bytes:
+        """
+        Cache up to where the live data picks up, searching back from the newest packet.
+        At least two packets have to match; a single packet of overlap is left in, as TS
+        allows one duplicate packet.
+        """
+        live = live[:min(len(live) - len(live) % TS_PACKET_SIZE, OVERLAP_MATCH_PACKETS * TS_PACKET_SIZE)]
+        if len(live) < 2 * TS_PACKET_SIZE:
+            return cache
+        for pos in range(len(cache) - 2 * TS_PACKET_SIZE, -1, -TS_PACKET_SIZE):
+            length = min(len(live), len(cache) - pos)
+            if cache[pos:pos + length] == live[:length]:
+                return cache[:pos]
+        return cache
+
+    def _probe(self, pad, info):
+        if self._replaying:
+            return Gst.PadProbeReturn.OK
+        try:
+            cache = self._read_cache()
+            buffer = info.get_buffer()
+            if cache and buffer:
+                success, map_info = buffer.map(Gst.MapFlags.READ)
+                if success:
+                    try:
+                        cache = self.trim_overlap(cache, bytes(map_info.data))
+                    finally:
+                        buffer.unmap(map_info)
+                self._push(pad, cache)
+        except Exception as e:
+            self.logger.error(f"Error replaying GOP cache: {str(e)}")
+        return Gst.PadProbeReturn.REMOVE
+
+    def _push(self, pad, cache: bytes):
+        self._replaying = True
+        try:
+            size = TS_PACKET_SIZE * REPLAY_PACKETS
+            for pos in range(0, len(cache), size):
+                # No timestamps: only consumers that demux time the replay, from its PTS
+                result = pad.push(Gst.Buffer.new_wrapped(cache[pos:pos + size]))
+                if result != Gst.FlowReturn.OK:
+                    self.logger.warning(f"GOP cache replay stopped after {pos} bytes: {result}")
+                    return
+                self.replayed_bytes += len(cache[pos:pos + size])
+        finally:
+            self._replaying = False
+        self.logger.info(f"Replayed {self.replayed_bytes} bytes of GOP cache ahead of the live stream")
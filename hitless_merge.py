@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from ts_psi import SYNC_BYTE, NULL_PID, TS_PACKET_SIZE
+from latency_profile import DEFAULT_SRT_LATENCY_MS
+from udp_receiver import BatchedUDPReceiver, check_receive_buffer, DEFAULT_BUFFER_SIZE
+
+DEFAULT_MAX_SKEW_MS = 50
+EMIT_INTERVAL = 0.002
+# Weight of each new path delay sample in the running skew estimate
+SKEW_ALPHA = 0.05
+RTP_VERSION = 2
+# How far past a path's last datagram to look for where a datagram only it delivered belongs
+LOOKAHEAD = 16
+
+
+def parse_rtp(datagram: bytes):
+    """(sequence number, payload) of an RTP datagram, or None if it is not RTP"""
+    if len(datagram) < 12 or datagram[0] >> 6 != RTP_VERSION:
+        return None
+    offset = 12 + 4 * (datagram[0] & 0x0F)
+    if datagram[0] & 0x10:
+        if len(datagram) < offset + 4:
+            return None
+        offset += 4 + 4 * int.from_bytes(datagram[offset + 2:offset + 4], 'big')
+    payload = datagram[offset:]
+    if datagram[0] & 0x20 and payload:
+        payload = payload[:-payload[-1]]
+    return int.from_bytes(datagram[2:4], 'big'), payload
+
+
+def _continuity_counters(datagram: bytes, last: bool) -> Dict[int, int]:
+    """First or last continuity counter of each PID carrying payload in a datagram"""
+    counters = {}
+    for pos in range(0, len(datagram) - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+        if datagram[pos] != SYNC_BYTE or not datagram[pos + 3] & 0x10:
+            continue
+        pid = ((datagram[pos + 1] & 0x1F) << 8) | datagram[pos + 2]
+        if pid != NULL_PID and (last or pid not in counters):
+            counters[pid] = datagram[pos + 3] & 0x0F
+    return counters
+
+
+def continues(earlier: bytes, later: bytes) -> bool:
+    """True if later picks up exactly where earlier left off on every PID they share"""
+    last = _continuity_counters(earlier, True)
+    first = _continuity_counters(later, False)
+    shared = last.keys() & first.keys()
+    return bool(shared) and all((last[pid] + 1) & 0x0F == first[pid] for pid in shared)
+
+
+class _Node:
+    """A raw TS datagram in the merged order"""
+    __slots__ = ('datagram', 'time', 'path', 'mask', 'next', 'emitted')
+
+    def __init__(self, datagram: bytes, time: float, path: int):
+        self.datagram = datagram
+        self.time = time
+        self.path = path
+        self.mask = 1 << path
+        self.next = None
+        self.emitted = False
+
+
+class MergeBuffer:
+    """
+    Aligns several copies of one stream and yields each datagram once, from whichever
+    path delivered it first. RTP is aligned by sequence number. Raw TS datagrams are
+    matched by content; one that only a single path delivered is placed after that
+    path's previous datagram, moving past neighbours the path lost when the continuity
+    counters say so. Output is held back by max_skew; anything arriving too late to go
+    out in order is dropped and counted as late.
+    """
+
+    def __init__(self, paths: int, alignment: str = 'auto', max_skew: float = DEFAULT_MAX_SKEW_MS / 1000):
+        self.paths = paths
+        self.alignment = alignment if alignment in ('rtp', 'ts') else None
+        self.max_skew = max_skew
+
+        # Path delay relative to path 0, in seconds
+        self.offsets = [0.0] * paths
+
+        self._pending: Dict = {}
+        self._seen: Dict = {}
+        self._expiry = deque()
+        self._next_seq = None
+        self._highest = None
+        self._last_seq = [None] * paths
+        self._occurrences = [{} for _ in range(paths)]
+        self._head: Optional[_Node] = None
+        self._tail: Optional[_Node] = None
+        self._last_node: List[Optional[_Node]] = [None] * paths
+        # Last continuity counter sent on each PID, to spot datagrams no path delivered
+        self._output_cc: Dict[int, int] = {}
+        self._reset_window()
+
+    def _reset_window(self):
+        self.path_stats = [
+            {'datagrams': 0, 'first': 0, 'duplicates': 0, 'lost': 0, 'late': 0}
+            for _ in range(self.paths)
+        ]
+        self.output_stats = {'datagrams': 0, 'lost': 0}
+
+    def _detect(self, datagram: bytes):
+        if datagram[:1] == bytes([SYNC_BYTE]):
+            self.alignment = 'ts'
+        elif parse_rtp(datagram):
+            self.alignment = 'rtp'
+
+    def _update_skew(self, path: int, first_path: int, delay: float):
+        """delay is how long after first_path this path delivered the same datagram"""
+        error = delay - (self.offsets[path] - self.offsets[first_path])
+        if path != 0:
+            self.offsets[path] += SKEW_ALPHA * error
+        else:
+            self.offsets[first_path] -= SKEW_ALPHA * error
+
+    def skew(self) -> List[float]:
+        """Each path's delay behind the fastest one, in seconds"""
+        fastest = min(self.offsets)
+        return [offset - fastest for offset in self.offsets]
+
+    def push(self, path: int, datagram: bytes, now: float):
+        """Add a datagram received on a path"""
+        if self.alignment is None:
+            self._detect(datagram)
+            if self.alignment is None:
+                return
+        self.path_stats[path]['datagrams'] += 1
+        if self.alignment == 'rtp':
+            self._push_rtp(path, datagram, now)
+        else:
+            self._push_ts(path, datagram, now)
+
+    def _extend(self, seq: int) -> int:
+        """16-bit sequence number to a running count, picking the value closest to the highest seen"""
+        if self._highest is None:
+            self._highest = seq
+            return seq
+        base = self._highest - (self._highest & 0xFFFF) + seq
+        extended = min((base - 0x10000, base, base + 0x10000), key=lambda v: abs(v - self._highest))
+        self._highest = max(self._highest, extended)
+        return extended
+
+    def _push_rtp(self, path: int, datagram: bytes, now: float):
+        parsed = parse_rtp(datagram)
+        if parsed is None:
+            return
+        seq, payload = parsed
+        stats = self.path_stats[path]
+
+        last = self._last_seq[path]
+        if last is None or (seq - last) & 0xFFFF < 0x8000:
+            if last is not None:
+                stats['lost'] += ((seq - last) & 0xFFFF) - 1
+            self._last_seq[path] = seq
+
+        extended = self._extend(seq)
+        if extended in self._seen:
+            first_time, first_path = self._seen[extended]
+            stats['duplicates'] += 1
+            self._update_skew(path, first_path, now - first_time)
+            return
+        if self._next_seq is not None and extended < self._next_seq:
+            stats['late'] += 1
+            return
+
+        self._seen[extended] = (now, path)
+        self._expiry.append((now, extended))
+        self._pending[extended] = payload
+        stats['first'] += 1
+
+    def _push_ts(self, path: int, datagram: bytes, now: float):
+        # Identical datagrams (null stuffing) are told apart by how often each path has sent them
+        fingerprint = hash(datagram)
+        occurrence = self._occurrences[path].get(fingerprint, 0)
+        self._occurrences[path][fingerprint] = occurrence + 1
+        key = (fingerprint, occurrence)
+        stats = self.path_stats[path]
+
+        node = self._seen.get(key)
+        if node is not None:
+            node.mask |= 1 << path
+            stats['duplicates'] += 1
+            self._update_skew(path, node.path, now - node.time)
+            self._last_node[path] = node
+            return
+
+        bit = 1 << path
+        after = self._last_node[path]
+        if after is None:
+            after = self._tail
+        if after is not None:
+            # If this path also lost the datagrams just before this one, they are next in
+            # line without its bit; the new datagram goes after the one it continues from
+            candidate = None if continues(after.datagram or b'', datagram) else after.next
+            for _ in range(LOOKAHEAD):
+                if candidate is None or candidate.mask & bit:
+                    break
+                if candidate.datagram is not None and continues(candidate.datagram, datagram):
+                    after = candidate
+                    break
+                candidate = candidate.next
+            if after.next is not None and after.next.emitted:
+                stats['late'] += 1
+                return
+
+        # Inherit the neighbour's arrival time so the output keeps its pace
+        node = _Node(datagram, after.time if after is not None and after is not self._tail else now, path)
+        if after is None or after is self._tail:
+            if self._tail is not None:
+                self._tail.next = node
+            self._tail = node
+        else:
+            node.next = after.next
+            after.next = node
+        if self._head is None or (after is not None and after.emitted and self._head is node.next):
+            self._head = node
+
+        self._seen[key] = node
+        self._last_node[path] = node
+        self._expiry.append((now, key))
+        stats['first'] += 1
+
+    def pop_ready(self, now: float) -> List[bytes]:
+        """Datagrams that can be sent, in order"""
+        ready = []
+        if self.alignment == 'rtp':
+            while self._pending:
+                if self._next_seq is None:
+                    self._next_seq = min(self._pending)
+                payload = self._pending.pop(self._next_seq, None)
+                if payload is not None:
+                    ready.append(payload)
+                    self._next_seq += 1
+                    continue
+                # Gap: wait up to max_skew from the first datagram after it for the other paths
+                following = min(self._pending)
+                if now - self._seen.get(following, (0.0, 0))[0] < self.max_skew:
+                    break
+                self.output_stats['lost'] += following - self._next_seq
+                self._next_seq = following
+        else:
+            while self._head is not None and self._head.time + self.max_skew <= now:
+                node = self._head
+                node.emitted = True
+                ready.append(node.datagram)
+                self._head = node.next
+                if self._ts_gap(node.datagram):
+                    self.output_stats['lost'] += 1
+
+        self._expire(now)
+        self.output_stats['datagrams'] += len(ready)
+        return ready
+
+    def _ts_gap(self, datagram: bytes) -> bool:
+        """
+        True if a datagram does not continue the output on some PID. Raw TS cannot say how
+        many datagrams went missing, so each gap counts as one lost datagram.
+        """
+        first = _continuity_counters(datagram, False)
+        gap = any(
+            pid in self._output_cc and counter not in (self._output_cc[pid], (self._output_cc[pid] + 1) & 0x0F)
+            for pid, counter in first.items()
+        )
+        self._output_cc.update(_continuity_counters(datagram, True))
+        return gap
+
+    def _expire(self, now: float):
+        """Forget datagrams once every path has had twice max_skew to deliver them"""
+        while self._expiry and now - self._expiry[0][0] > 2 * self.max_skew:
+            _, key = self._expiry.popleft()
+            entry = self._seen.pop(key, None)
+            if self.alignment != 'ts' or entry is None:
+                continue
+            for path in range(self.paths):
+                if not entry.mask & (1 << path):
+                    self.path_stats[path]['lost'] += 1
+                if self._occurrences[path].get(key[0]) == key[1] + 1:
+                    del self._occurrences[path][key[0]]
+                if self._last_node[path] is entry:
+                    # Let the chain behind a silent path be freed
+                    self._last_node[path] = None
+            entry.datagram = None
+
+    def get_stats(self) -> Dict:
+        """Counters since the last call"""
+        skew = self.skew()
+        stats = {
+            'alignment': self.alignment or 'unknown',
+            'output_datagrams': self.output_stats['datagrams'],
+            'output_lost': self.output_stats['lost'],
+            'paths': {}
+        }
+        for path, path_stats in enumerate(self.path_stats):
+            stats['paths'][str(path)] = dict(path_stats, skew_ms=round(skew[path] * 1000, 3))
+        self._reset_window()
+        return stats
+
+
+class HitlessMerge:
+    """
+    Receives redundant copies of one stream over UDP and/or SRT and passes the merged
+    stream to on_output(data, datagrams) from its own thread.
+    """
+
+    def __init__(self, inputs: List[Dict], settings: Dict, on_output: Callable[[bytes, int], None],
+                 stats_collector=None, logger: Optional[logging.Logger] = None,
+                 srt_latency: int = DEFAULT_SRT_LATENCY_MS):
+        self.logger = logger or logging.getLogger(__name__)
+        self.stats_collector = stats_collector
+        self.on_output = on_output
+        # For SRT paths without their own latency option, from the channel's latency_profile
+        self.srt_latency = srt_latency
+
+        indexes = settings.get('inputs', list(range(len(inputs))))
+        if len(indexes) < 2:
+            raise ValueError("Hitless merge needs at least two inputs")
+        for index in indexes:
+            if index < 0 or index >= len(inputs):
+                raise ValueError(f"Invalid hitless merge input index {index}")
+            if inputs[index]['type'] not in ('udpsrc', 'srtsrc'):
+                raise ValueError(f"Hitless merge supports udpsrc and srtsrc inputs, not {inputs[index]['type']}")
+        self.inputs = [inputs[index] for index in indexes]
+        self.indexes = indexes
+
+        max_skew = settings.get('max-skew-ms', DEFAULT_MAX_SKEW_MS) / 1000
+        self.buffer = MergeBuffer(len(indexes), settings.get('alignment', 'auto'), max_skew)
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._receivers = []
+        self._pipelines = []
+
+    def start(self):
+        """Start receiving on every path and the output thread"""
+        self._stop_event.clear()
+        for path, config in enumerate(self.inputs):
+            options = config.get('options') or {}
+            if config['type'] == 'udpsrc':
+                buffer_size = int(options.get('buffer-size', DEFAULT_BUFFER_SIZE))
+                check_receive_buffer(buffer_size, self.logger)
+                receiver = BatchedUDPReceiver(
+                    config['uri'], lambda datagrams, count, path=path: self._receive(path, datagrams),
+                    buffer_size=buffer_size, multicast_iface=options.get('multicast-iface'),
+                    join=False, logger=self.logger
+                )
+                receiver.start()
+                self._receivers.append(receiver)
+            else:
+                self._pipelines.append(self._start_srt(path, config, options))
+            self.logger.info(f"Hitless merge path {path}: input {self.indexes[path]} {config['uri']}")
+
+        self._thread = threading.Thread(target=self._output_loop, name="HitlessMerge", daemon=True)
+        self._thread.start()
+
+    def _start_srt(self, path: int, config: Dict, options: Dict):
+        pipeline = Gst.Pipeline.new(f"hitless_srt_{path}")
+        source = Gst.ElementFactory.make("srtsrc", f"hitless_source_{path}")
+        sink = Gst.ElementFactory.make("appsink", f"hitless_sink_{path}")
+        source.set_property('uri', config['uri'])
+        source.set_property('latency', options.get('latency', self.srt_latency))
+        if 'streamid' in options:
+            source.set_property('streamid', options['streamid'])
+        sink.set_property('emit-signals', True)
+        sink.set_property('sync', False)
+        sink.connect('new-sample', self._on_srt_sample, path)
+        pipeline.add(source)
+        pipeline.add(sink)
+        if not source.link(sink):
+            raise RuntimeError(f"Failed to link SRT path {path}")
+        if pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+            raise RuntimeError(f"Unable to start SRT path {path}")
+        return pipeline
+
+    def _on_srt_sample(self, sink, path):
+        sample = sink.emit('pull-sample')
+        buffer = sample.get_buffer() if sample else None
+        if buffer:
+            success, map_info = buffer.map(Gst.MapFlags.READ)
+            if success:
+                try:
+                    self._receive(path, [bytes(map_info.data)])
+                finally:
+                    buffer.unmap(map_info)
+        return Gst.FlowReturn.OK
+
+    def stop(self):
+        """Stop all paths and the output thread"""
+        self._stop_event.set()
+        for receiver in self._receivers:
+            receiver.stop()
+        for pipeline in self._pipelines:
+            pipeline.set_state(Gst.State.NULL)
+        if self._thread:
+            self._thread.join(timeout=1)
+        self._receivers = []
+        self._pipelines = []
+
+    def _receive(self, path: int, datagrams: List[bytes]):
+        now = time.monotonic()
+        with self._lock:
+            for datagram in datagrams:
+                self.buffer.push(path, datagram, now)
+
+    def _output_loop(self):
+        while not self._stop_event.wait(EMIT_INTERVAL):
+            with self._lock:
+                ready = self.buffer.pop_ready(time.monotonic())
+            if ready:
+                try:
+                    self.on_output(b''.join(ready), len(ready))
+                except Exception as e:
+                    self.logger.error(f"Error passing on merged stream: {str(e)}")
+
+    def get_stats(self) -> Dict:
+        """Per-path and output counters since the last call, keyed by input index"""
+        with self._lock:
+            stats = self.buffer.get_stats()
+        stats['paths'] = {
+            str(self.indexes[int(path)]): dict(path_stats, uri=self.inputs[int(path)]['uri'])
+            for path, path_stats in stats['paths'].items()
+        }
+        return stats
+
+    def publish(self):
+        """Push stats to Redis; returns True so it can run as a GLib timer"""
+        try:
+            stats = self.get_stats()
+            lost = {index: s['lost'] for index, s in stats['paths'].items() if s['lost']}
+            if lost or stats['output_lost']:
+                self.logger.warning(f"Hitless merge path loss {lost}, output loss {stats['output_lost']}")
+            if self.stats_collector:
+                self.stats_collector.add_stats("hitless_merge", stats)
+        except Exception as e:
+            self.logger.error(f"Error publishing hitless merge stats: {str(e)}")
+        return True
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+import fcntl
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+# tmpfs, so the cache lives in RAM and is shared by every handler on the host
+CACHE_DIR = "/dev/shm/caricoder/hls_cache"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Some origins reuse segment names as their window wraps, so entries do not live forever
+DEFAULT_MAX_AGE = 300
+# How often a caller waiting on another's download checks whether it has finished
+LOCK_POLL_INTERVAL = 0.02
+
+
+class SegmentCache:
+    """
+    Host-local cache of HLS segments keyed by URL, shared between processes through a
+    tmpfs directory. A miss takes an flock on the entry so concurrent requests for the
+    same segment, from this process or another, wait for the one download instead of
+    starting their own, for as long as their deadline allows. Entries are evicted least recently used first once the directory
+    grows past max_bytes, and dropped after max_age seconds whatever their use.
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES,
+                 max_age: float = DEFAULT_MAX_AGE, logger: Optional[logging.Logger] = None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._stats_lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self.counters = {'hits': 0, 'misses': 0, 'coalesced': 0, 'evictions': 0, 'bytes_served': 0}
+
+    def _count(self, key: str, value: int = 1):
+        with self._stats_lock:
+            self.counters[key] += value
+
+    def _path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode()).hexdigest() + ".ts")
+
+    def _read(self, path: str) -> Optional[bytes]:
+        """Entry contents if present and fresh; marks it as used for LRU"""
+        try:
+            stat = os.stat(path)
+            if time.time() - stat.st_mtime > self.max_age:
+                return None
+            with open(path, 'rb') as f:
+                data = f.read()
+            # atime tracks last use, mtime stays the time it was stored
+            os.utime(path, (time.time(), stat.st_mtime))
+            return data
+        except FileNotFoundError:
+            return None
+
+    def _wait_for_lock(self, fd: int, url: str, deadline: Optional[float],
+                       cancelled: Optional[threading.Event]):
+        """Take the entry's lock, giving up at the monotonic deadline or when cancelled is set"""
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                pass
+            if cancelled is not None and cancelled.is_set():
+                raise InterruptedError(f"Cancelled waiting for another download of {url}")
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"Timed out waiting for another download of {url}")
+            if cancelled is not None:
+                cancelled.wait(LOCK_POLL_INTERVAL)
+            else:
+                time.sleep(LOCK_POLL_INTERVAL)
+
+    def get(self, url: str, fetch: Callable[[], bytes], deadline: Optional[float] = None,
+            cancelled: Optional[threading.Event] = None) -> bytes:
+        """
+        Segment from the cache, or from fetch() once across all concurrent callers. A caller
+        waiting on someone else's download raises TimeoutError at the monotonic deadline and
+        InterruptedError once cancelled is set, both OSErrors.
+        """
+        path = self._path(url)
+        data = self._read(path)
+        if data is not None:
+            self._count('hits')
+            self._count('bytes_served', len(data))
+            return data
+
+        fd = os.open(path + ".lock", os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Someone else is downloading it; wait for them and use their copy
+                self._wait_for_lock(fd, url, deadline, cancelled)
+                data = self._read(path)
+                if data is not None:
+                    self._count('coalesced')
+                    self._count('bytes_served', len(data))
+                    return data
+
+            data = self._read(path)
+            if data is not None:
+                self._count('hits')
+                self._count('bytes_served', len(data))
+                return data
+
+            self._count('misses')
+            data = fetch()
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+        self._evict()
+        return data
+
+    def _evict(self):
+        """Drop expired entries, then the least recently used until under max_bytes"""
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            now = time.time()
+            entries = []
+            total = 0
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    if entry.name.endswith(".ts"):
+                        if now - stat.st_mtime > self.max_age:
+                            self._remove(entry.path)
+                            continue
+                        entries.append((stat.st_atime, stat.st_size, entry.path))
+                        total += stat.st_size
+                    elif now - stat.st_mtime > self.max_age:
+                        # Lock files of old entries and temp files left by a crashed writer
+                        self._remove(entry.path)
+
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+        finally:
+            self._evict_lock.release()
+
+    def _remove(self, path: str):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return
+        if path.endswith(".ts"):
+            self._count('evictions')
+
+    def get_stats(self) -> Dict:
+        """Counters since the last call"""
+        with self._stats_lock:
+            stats = dict(self.counters)
+            self._reset_counters()
+        return stats
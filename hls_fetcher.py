@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+
+import logging
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urljoin
+
+import requests
+
+from hls_cache import SegmentCache, CACHE_DIR, DEFAULT_MAX_AGE, DEFAULT_MAX_BYTES
+
+DEFAULT_PREFETCH = 3
+DEFAULT_PARALLEL = 2
+DEFAULT_LIVE_EDGE_SEGMENTS = 3       # start this many segments back from the end, as players do
+DEFAULT_SEGMENT_TIMEOUT = 10         # seconds for one download attempt
+DEFAULT_RETRIES = 2
+DEFAULT_TARGET_DURATION = 10         # assumed until the media playlist says otherwise
+# Once a later segment has been ready this many target durations, a slow head segment is skipped
+HEAD_SKIP_AFTER = 0.5
+CHUNK_SIZE = 64 * 1024
+RECENT_SEGMENTS = 10
+
+_ATTRIBUTE_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+
+def parse_attributes(text: str) -> Dict[str, str]:
+    """Attribute list of an EXT-X tag, with quotes stripped"""
+    return {key: value.strip('"') for key, value in _ATTRIBUTE_RE.findall(text)}
+
+
+def parse_playlist(text: str, base_url: str) -> Dict:
+    """Parse a master or media playlist; URIs are made absolute against base_url"""
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines or lines[0] != '#EXTM3U':
+        raise ValueError("Not an M3U8 playlist")
+
+    variants = []
+    segments = []
+    playlist = {'target_duration': 0, 'media_sequence': 0, 'endlist': False}
+    pending = {}
+    sequence = None
+    for line in lines[1:]:
+        if line.startswith('#EXT-X-STREAM-INF:'):
+            attributes = parse_attributes(line.split(':', 1)[1])
+            pending = {'bandwidth': int(attributes.get('BANDWIDTH', 0))}
+            if 'RESOLUTION' in attributes:
+                width, height = attributes['RESOLUTION'].lower().split('x')
+                pending['width'], pending['height'] = int(width), int(height)
+            pending['codecs'] = attributes.get('CODECS', '')
+        elif line.startswith('#EXT-X-TARGETDURATION:'):
+            playlist['target_duration'] = float(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            playlist['media_sequence'] = int(line.split(':', 1)[1])
+        elif line.startswith('#EXTINF:'):
+            pending['duration'] = float(line.split(':', 1)[1].split(',')[0])
+        elif line.startswith('#EXT-X-DISCONTINUITY') and not line.startswith('#EXT-X-DISCONTINUITY-'):
+            pending['discontinuity'] = True
+        elif line.startswith('#EXT-X-ENDLIST'):
+            playlist['endlist'] = True
+        elif line.startswith('#EXT-X-KEY:'):
+            if parse_attributes(line.split(':', 1)[1]).get('METHOD', 'NONE') != 'NONE':
+                raise ValueError("Encrypted HLS is not supported by the prefetch ingest")
+        elif line.startswith(('#EXT-X-MAP:', '#EXT-X-BYTERANGE:')):
+            raise ValueError("Only whole MPEG-TS segments are supported by the prefetch ingest")
+        elif not line.startswith('#'):
+            if 'bandwidth' in pending:
+                variants.append({**pending, 'uri': urljoin(base_url, line)})
+            else:
+                if sequence is None:
+                    sequence = playlist['media_sequence']
+                segments.append({'sequence': sequence, 'uri': urljoin(base_url, line),
+                                 'duration': pending.get('duration', playlist['target_duration']),
+                                 'discontinuity': pending.get('discontinuity', False)})
+                sequence += 1
+            pending = {}
+
+    playlist['variants'] = variants
+    playlist['segments'] = segments
+    return playlist
+
+
+def select_variant(variants: List[Dict], pin: Dict) -> Dict:
+    """
+    Pick a variant by resolution ('1280x720' or a height) or by the bandwidth closest
+    to the one asked for; without a pin the highest bandwidth is used.
+    """
+    if 'resolution' in pin:
+        wanted = str(pin['resolution']).lower()
+        for variant in variants:
+            if 'height' not in variant:
+                continue
+            if wanted == f"{variant['width']}x{variant['height']}" or wanted in (str(variant['height']), f"{variant['height']}p"):
+                return variant
+        raise ValueError(f"No variant with resolution {pin['resolution']}")
+    if 'bandwidth' in pin:
+        return min(variants, key=lambda v: abs(v['bandwidth'] - int(pin['bandwidth'])))
+    return max(variants, key=lambda v: v['bandwidth'])
+
+
+class HLSFetcher:
+    """
+    Follows an HLS media playlist and downloads its segments ahead of time over a pooled
+    keep-alive session. Up to `parallel` segments download at once and up to `prefetch`
+    are kept ahead of the one being delivered; on_segment(data, segment) is called with
+    whole segments in playlist order from the fetcher thread. Each segment has one time
+    budget for all its attempts, a target duration by default; a segment that misses it,
+    or is still downloading while the ones after it are ready, is skipped rather than
+    stalling the stream.
+    Segments are shared with other fetchers on the host through hls_cache.SegmentCache.
+    """
+
+    def __init__(self, uri: str, settings: Dict, on_segment: Callable[[bytes, Dict], None],
+                 logger: Optional[logging.Logger] = None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.uri = uri
+        self.on_segment = on_segment
+        self.prefetch = max(1, int(settings.get('prefetch', DEFAULT_PREFETCH)))
+        self.parallel = max(1, int(settings.get('parallel', DEFAULT_PARALLEL)))
+        self.live_edge_segments = int(settings.get('live-edge-segments', DEFAULT_LIVE_EDGE_SEGMENTS))
+        self.segment_timeout = float(settings.get('segment-timeout', DEFAULT_SEGMENT_TIMEOUT))
+        self.retries = int(settings.get('retries', DEFAULT_RETRIES))
+        # Total time for a segment across its retries; None follows the playlist's target duration
+        deadline = settings.get('segment-deadline')
+        self.segment_deadline = float(deadline) if deadline is not None else None
+        self.variant_pin = settings.get('variant') or {}
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=self.parallel + 1)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=self.parallel, thread_name_prefix="hls_fetch")
+
+        # Segments go through the host-wide cache unless cache: false
+        cache = settings.get('cache', True)
+        self.cache = None
+        if cache:
+            cache = cache if isinstance(cache, dict) else {}
+            self.cache = SegmentCache(
+                cache.get('dir', CACHE_DIR),
+                max_bytes=int(cache.get('max-bytes', DEFAULT_MAX_BYTES)),
+                max_age=float(cache.get('max-age', DEFAULT_MAX_AGE)),
+                logger=self.logger
+            )
+
+        self.media_uri = None
+        self.variant = None
+        self.segments: Dict[int, Dict] = {}
+        self.next_sequence = None
+        self.target_duration = 0
+        self.endlist = False
+
+        self._futures = {}
+        self._cancel: Dict[int, threading.Event] = {}
+        self._ready_at: Dict[int, float] = {}
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._recent = deque(maxlen=RECENT_SEGMENTS)
+        self._reset_counters()
+
+    def _reset_counters(self):
+        self.counters = {'segments': 0, 'bytes': 0, 'failures': 0, 'retries': 0, 'skipped': 0,
+                         'playlist_reloads': 0, 'playlist_errors': 0, 'download_ms_total': 0.0,
+                         'download_ms_max': 0.0}
+
+    def _get(self, uri: str, timeout: float, cancelled: Optional[threading.Event] = None) -> bytes:
+        """GET a whole body, giving up once the timeout has passed in total or when cancelled is set"""
+        deadline = time.monotonic() + timeout
+        with self.session.get(uri, timeout=timeout, stream=True) as response:
+            response.raise_for_status()
+            chunks = []
+            for chunk in response.iter_content(CHUNK_SIZE):
+                chunks.append(chunk)
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Download took longer than {timeout}s")
+                if cancelled is not None and cancelled.is_set():
+                    raise TimeoutError("Download abandoned")
+            return b''.join(chunks)
+
+    def segment_budget(self) -> float:
+        """Seconds a segment may take across all its attempts"""
+        if self.segment_deadline is not None:
+            return self.segment_deadline
+        return self.target_duration or DEFAULT_TARGET_DURATION
+
+    def max_delivery_gap(self) -> float:
+        """
+        Longest a healthy fetcher goes without delivering: a new segment turns up within
+        one and a half target durations of the last, plus its download budget. Watchdogs
+        downstream of the fetcher need to allow at least this long.
+        """
+        return 1.5 * (self.target_duration or DEFAULT_TARGET_DURATION) + self.segment_budget()
+
+    def resolve(self) -> str:
+        """Load the playlist and pin a variant if it is a master playlist; returns the media playlist URI"""
+        playlist = parse_playlist(self._get(self.uri, self.segment_timeout).decode('utf-8'), self.uri)
+        if playlist['variants']:
+            self.variant = select_variant(playlist['variants'], self.variant_pin)
+            self.media_uri = self.variant['uri']
+            resolution = f", {self.variant['width']}x{self.variant['height']}" if 'height' in self.variant else ''
+            self.logger.info(f"Pinned HLS variant {self.media_uri} ({self.variant['bandwidth']} bps{resolution})")
+            # Learn the target duration now, so segment budgets and watchdogs are sized before start
+            playlist = parse_playlist(self._get(self.media_uri, self.segment_timeout).decode('utf-8'),
+                                      self.media_uri)
+        else:
+            self.media_uri = self.uri
+        self.target_duration = playlist['target_duration']
+        return self.media_uri
+
+    def start(self):
+        """Start following the playlist"""
+        if not self.media_uri:
+            self.resolve()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="HLSFetcher", daemon=True)
+        self._thread.start()
+        self.logger.info(f"HLS prefetch ingest: {self.parallel} parallel downloads, "
+                         f"{self.prefetch} segments ahead, starting {self.live_edge_segments} from the live edge")
+
+    def stop(self):
+        """Stop following the playlist and drop downloads in flight"""
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+            self._thread = None
+        for cancelled in self._cancel.values():
+            cancelled.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+    def _reload_playlist(self) -> bool:
+        """Merge the current media playlist into the known segments; True if it grew"""
+        try:
+            playlist = parse_playlist(self._get(self.media_uri, self.segment_timeout).decode('utf-8'),
+                                      self.media_uri)
+        except (requests.RequestException, TimeoutError, ValueError, UnicodeDecodeError) as e:
+            with self._stats_lock:
+                self.counters['playlist_errors'] += 1
+            self.logger.warning(f"HLS playlist reload failed: {str(e)}")
+            return False
+
+        with self._stats_lock:
+            self.counters['playlist_reloads'] += 1
+        self.target_duration = playlist['target_duration'] or self.target_duration
+        self.endlist = playlist['endlist']
+        grew = False
+        for segment in playlist['segments']:
+            if segment['sequence'] not in self.segments:
+                self.segments[segment['sequence']] = segment
+                grew = True
+
+        if playlist['segments'] and self.next_sequence is None:
+            first = playlist['segments'][0]['sequence']
+            last = playlist['segments'][-1]['sequence']
+            self.next_sequence = first if self.endlist else max(first, last - self.live_edge_segments + 1)
+            self.logger.info(f"Starting at HLS segment {self.next_sequence} of {first}-{last}")
+
+        # Forget segments that have left the playlist window and were already handled
+        window_start = playlist['segments'][0]['sequence'] if playlist['segments'] else None
+        if window_start is not None:
+            if self.next_sequence is not None and self.next_sequence < window_start:
+                skipped = window_start - self.next_sequence
+                self.logger.warning(f"Fell behind the live window, skipping {skipped} segments")
+                with self._stats_lock:
+                    self.counters['skipped'] += skipped
+                self.next_sequence = window_start
+                for sequence in [s for s in self._futures if s < window_start]:
+                    self._forget(sequence)
+            for sequence in [s for s in self.segments if s < min(window_start, self.next_sequence or window_start)]:
+                del self.segments[sequence]
+        return grew
+
+    def _download(self, segment: Dict, cancelled: threading.Event):
+        """Fetch one segment with retries within its budget; returns (data or None, download_ms)"""
+        deadline = time.monotonic() + self.segment_budget()
+        for attempt in range(self.retries + 1):
+            timeout = min(self.segment_timeout, deadline - time.monotonic())
+            if self._stop_event.is_set() or cancelled.is_set() or timeout <= 0:
+                return None, 0
+            start = time.monotonic()
+            try:
+                fetch = lambda: self._get(segment['uri'], timeout, cancelled)
+                data = self.cache.get(segment['uri'], fetch, deadline, cancelled) if self.cache else fetch()
+                return data, (time.monotonic() - start) * 1000
+            except (requests.RequestException, OSError) as e:
+                self.logger.warning(f"Segment {segment['sequence']} attempt {attempt + 1} failed: {str(e)}")
+                if attempt < self.retries:
+                    with self._stats_lock:
+                        self.counters['retries'] += 1
+        return None, 0
+
+    def _schedule(self):
+        """Keep up to prefetch segments downloading or downloaded ahead of delivery"""
+        if self.next_sequence is None:
+            return
+        for sequence in range(self.next_sequence, self.next_sequence + self.prefetch):
+            if sequence in self._futures or sequence not in self.segments:
+                continue
+            self._cancel[sequence] = threading.Event()
+            future = self.executor.submit(self._download, self.segments[sequence], self._cancel[sequence])
+            future.add_done_callback(lambda f, sequence=sequence: self._on_done(sequence))
+            with self._stats_lock:
+                self._futures[sequence] = future
+
+    def _on_done(self, sequence: int):
+        if sequence in self._futures:
+            self._ready_at.setdefault(sequence, time.monotonic())
+        self._wakeup.set()
+
+    def _forget(self, sequence: int):
+        """Drop a download, stopping it at its next chunk if it is still running"""
+        with self._stats_lock:
+            future = self._futures.pop(sequence)
+        future.cancel()
+        self._cancel.pop(sequence).set()
+        self._ready_at.pop(sequence, None)
+        return future
+
+    def _skip_slow_head(self) -> bool:
+        """Give up on the head segment when a later one has been ready for a while"""
+        head = self._futures.get(self.next_sequence)
+        if head is None or head.done():
+            return False
+        later = [self._ready_at[s] for s in self._futures if s > self.next_sequence and s in self._ready_at]
+        grace = HEAD_SKIP_AFTER * (self.target_duration or DEFAULT_TARGET_DURATION)
+        if not later or time.monotonic() - min(later) < grace:
+            return False
+
+        sequence = self.next_sequence
+        self._forget(sequence)
+        self.next_sequence += 1
+        with self._stats_lock:
+            self.counters['skipped'] += 1
+        self.logger.warning(f"Skipping HLS segment {sequence}, still downloading while later segments are ready")
+        return True
+
+    def _deliver(self):
+        """Hand finished segments on in order, skipping a head segment that holds up ready ones"""
+        while True:
+            if self._skip_slow_head():
+                continue
+            future = self._futures.get(self.next_sequence)
+            if future is None or not future.done():
+                break
+            sequence = self.next_sequence
+            data, download_ms = self._forget(sequence).result()
+            segment = self.segments.get(sequence, {'sequence': sequence, 'duration': 0})
+            self.next_sequence += 1
+            with self._stats_lock:
+                if data is None:
+                    self.counters['failures'] += 1
+                else:
+                    self.counters['segments'] += 1
+                    self.counters['bytes'] += len(data)
+                    self.counters['download_ms_total'] += download_ms
+                    self.counters['download_ms_max'] = max(self.counters['download_ms_max'], download_ms)
+                    self._recent.append({'sequence': sequence, 'duration': segment['duration'],
+                                         'bytes': len(data), 'download_ms': round(download_ms, 1)})
+            if data is None:
+                self.logger.error(f"Skipping HLS segment {sequence}, not downloaded within {self.segment_budget():.1f}s")
+                continue
+            if segment.get('discontinuity'):
+                self.logger.info(f"Discontinuity at HLS segment {sequence}")
+            self.on_segment(data, segment)
+
+    def _run(self):
+        last_reload = 0.0
+        grew = True
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+            # Reload after a target duration when the playlist moved on, after half of one when it did not
+            interval = (self.target_duration or 1) * (1 if grew else 0.5)
+            if not self.endlist and now - last_reload >= interval:
+                grew = self._reload_playlist()
+                last_reload = now
+
+            self._schedule()
+            self._deliver()
+            if self.endlist and self.next_sequence is not None and self.next_sequence not in self.segments \
+                    and not self._futures:
+                self.logger.info("Reached the end of the HLS playlist")
+                break
+
+            self._wakeup.wait(0.1)
+            self._wakeup.clear()
+
+    def get_stats(self) -> Dict:
+        """Segment download stats since the last call"""
+        with self._stats_lock:
+            counters = dict(self.counters)
+            recent = list(self._recent)
+            # The fetcher thread only adds and removes downloads under the lock
+            futures = list(self._futures.values())
+            self._reset_counters()
+        segments = counters['segments']
+        ready = sum(1 for f in futures if f.done())
+        stats = {}
+        if self.cache:
+            stats = {f"cache_{key}": value for key, value in self.cache.get_stats().items()}
+        return {
+            **stats,
+            'segments_downloaded': segments,
+            'segment_bytes': counters['bytes'],
+            'segment_failures': counters['failures'],
+            'segment_retries': counters['retries'],
+            'segments_skipped': counters['skipped'],
+            'segment_download_ms_avg': counters['download_ms_total'] / segments if segments else 0,
+            'segment_download_ms_max': counters['download_ms_max'],
+            'segments_ready': ready,
+            'segments_in_flight': len(futures) - ready,
+            'playlist_reloads': counters['playlist_reloads'],
+            'playlist_errors': counters['playlist_errors'],
+            'next_sequence': self.next_sequence,
+            'variant_bandwidth': self.variant['bandwidth'] if self.variant else None,
+            'recent_segments': recent
+        }
@@ -16,6 +16,17 @@ import argparse
 from datetime import datetime
 from pathlib import Path
 from stats_collector import StatsCollector
+from loop_lag import GLibLagProbe
+from psi_discovery import PSIDiscovery
+from probe_cache import ProbeCache
+from ts_analyzer import create_analyzer
+from latency_probe import LatencyProbe
+from latency_profile import LatencySizing
+from gop_cache import GOPCache, gop_cache_settings
+from flight_recorder import create_flight_recorder
+from hls_fetcher import HLSFetcher
+from stream_set import stream_set, mux_video_pid, mux_audio_pids, write_stream_info, all_info_paths
+from stream_set import describe as describe_streams
 
 def setup_logging(channel_name, log_dir='logs', log_level='INFO'):
     if not os.path.exists(log_dir):
@@ -60,6 +71,17 @@ class InputPipelineHandler:
     def __init__(self, channel_name, source_index=0):
         self.logger = logging.getLogger(__name__)
         self.channel_name = channel_name
+        self.lag_probe = None
+        self.psi_validation = None
+        self.cached_probe = None
+        self.ts_analyzer = None
+        self.ts_analysis_timer = None
+        self.latency_probe = None
+        self.latency_timer = None
+        self.gop_cache = None
+        self.gop_cache_timer = None
+        self.flight_recorder = None
+        self.flight_recorder_timer = None
         self.source_index = source_index
         
         # Set up DOT file directory
@@ -70,6 +92,14 @@ class InputPipelineHandler:
         # Initialize configuration
         self.config = Configuration()
         self.channel_settings = self.config.get_channel_settings(channel_name)
+        self.sizing = LatencySizing(self.channel_settings, 'hls_input', self.logger)
+        # Only the streams the channel carries get a branch, a watchdog and an info file
+        self.streams = stream_set(self.channel_settings)
+        if self.streams['audio'] > 1:
+            raise ValueError(f"HLS inputs carry at most one audio track, the channel carries "
+                             f"{describe_streams(self.streams)}")
+        # The PIDs the transcoder looks for its streams on
+        self.mux_settings = self.config.get_plugin_settings(channel_name, 'mpegtsmux')
         self.pipeline = None
         self.elements = {}
         self.socket_paths = []
@@ -90,6 +120,13 @@ class InputPipelineHandler:
         # Verify input type is HLS
         if self.selected_input['type'] != 'hlssrc':
             raise ValueError("Only HLS input type is supported")
+
+        # Programs of one multiplex are analysed and cached separately
+        self.demux_program = (self.selected_input.get('demux') or {}).get('program-number')
+
+        # ingest: {mode: prefetch} replaces souphttpsrc ! hlsdemux with our own segment fetcher
+        self.ingest = self.selected_input.get('ingest') or {}
+        self.fetcher = None
         
         # Initialize Redis for stats
         try:
@@ -101,6 +138,9 @@ class InputPipelineHandler:
             self.logger.error("Failed to connect to Redis")
             self.redis_client = None
             self.stats_collector = None
+
+        # Stream analysis survives restarts; falls back to disk without Redis
+        self.probe_cache = ProbeCache(self.redis_client, logger=self.logger)
             
         # Create shared memory directory
         self.socket_dir = "/tmp/caricoder"
@@ -122,7 +162,8 @@ class InputPipelineHandler:
                 "-show_format",
                 "-show_streams",
                 "-show_programs",
-                "-i", uri
+                # Probe the pinned variant rather than whichever one ffprobe picks
+                "-i", self.fetcher.media_uri if self.fetcher else uri
             ]
             
             result = subprocess.run(cmd, capture_output=True, text=True, timeout=20)
@@ -138,15 +179,23 @@ class InputPipelineHandler:
             audio_stream = next((s for s in probe_data.get('streams', []) 
                                if s['codec_type'] == 'audio'), None)
             
-            if not video_stream or not audio_stream:
-                raise RuntimeError("No valid video or audio streams found")
+            if self.streams['video'] and not video_stream:
+                raise RuntimeError(f"No video stream found, the channel carries {describe_streams(self.streams)}")
+            if self.streams['audio'] and not audio_stream:
+                raise RuntimeError(f"No audio stream found, the channel carries {describe_streams(self.streams)}")
+            if not self.streams['video']:
+                video_stream = None
+            if not self.streams['audio']:
+                audio_stream = None
                 
             # Get program info if available
-            program = probe_data.get('programs', [{}])[0]
+            programs = probe_data.get('programs', [])
+            program = next((p for p in programs if p.get('program_num') == self.demux_program),
+                           programs[0] if programs else {})
             
             # Extract needed info
-            video_codec = video_stream.get('codec_name')
-            audio_codec = audio_stream.get('codec_name')
+            video_codec = video_stream.get('codec_name') if video_stream else None
+            audio_codec = audio_stream.get('codec_name') if audio_stream else None
             program_number = program.get('program_num', 0)
             
             # For HLS we don't use PIDs in the same way as MPEG-TS
@@ -155,6 +204,8 @@ class InputPipelineHandler:
             
             # Store complete probe data
             self._store_codec_info(video_codec, audio_codec, video_pid, audio_pid, program_number, probe_data)
+            self.cached_probe = self.probe_cache.put(uri, self.demux_program, video_codec, audio_codec,
+                                                     video_pid, audio_pid, program_number, probe_data)
             
             return video_codec, audio_codec, video_pid, audio_pid, program_number
 
@@ -162,6 +213,48 @@ class InputPipelineHandler:
             self.logger.error(f"Stream analysis failed: {str(e)}")
             raise
 
+#main indent
+    def load_stream_analysis(self):
+        """Codecs from the probe cache when there is an entry, otherwise a full ffprobe analysis"""
+        self.cached_probe = self.probe_cache.get(self.selected_input.get('uri'), self.demux_program)
+        if self.cached_probe and ((self.streams['video'] and not self.cached_probe['video_codec'])
+                                  or (self.streams['audio'] and not self.cached_probe['audio_codec'])):
+            # Analysed for another stream set; probe again so a missing stream is reported
+            self.cached_probe = None
+        if not self.cached_probe:
+            return self.analyze_stream()
+
+        entry = self.cached_probe
+        self.logger.info(f"Using cached stream analysis: video {entry['video_codec']}, audio {entry['audio_codec']}")
+        self._store_codec_info(entry['video_codec'], entry['audio_codec'], entry['video_pid'],
+                               entry['audio_pid'], entry['found_program'], entry['probe_data'])
+        return (entry['video_codec'], entry['audio_codec'], entry['video_pid'],
+                entry['audio_pid'], entry['found_program'])
+
+#main indent
+    def _on_psi_validated(self, probe_data):
+        """Compare the PMT in the segments with the cached analysis; runs in the streaming thread"""
+        if self.probe_cache.validate(self.cached_probe, probe_data):
+            self.logger.info(f"Cached stream analysis confirmed (PMT version {self.cached_probe['pmt_version']})")
+        else:
+            self.logger.warning("PMT differs from the cached stream analysis, re-probing")
+            self.probe_cache.invalidate(self.selected_input.get('uri'), self.demux_program)
+            GLib.idle_add(self._reprobe_and_restart)
+        return True
+
+    def _reprobe_and_restart(self):
+        """Full analysis followed by a pipeline rebuild with the new codecs"""
+        try:
+            (self.video_codec,
+             self.audio_codec,
+             self.video_pid,
+             self.audio_pid,
+             self.program_number) = self.analyze_stream()
+            self._handle_watchdog_timeout()
+        except Exception as e:
+            self.logger.error(f"Re-probe failed: {str(e)}")
+        return False
+
 #main indent
     def create_pipeline(self):
         """Create and configure the GStreamer pipeline."""
@@ -172,7 +265,8 @@ class InputPipelineHandler:
         self._link_static_elements()
         
         # Connect to pad-added signals for dynamic linking
-        self.elements['hlsdemux'].connect("pad-added", self.on_pad_added)
+        if not self.fetcher:
+            self.elements['hlsdemux'].connect("pad-added", self.on_pad_added)
         self.elements['tsdemux'].connect("pad-added", self.on_pad_added)
 
         # Set up message handling
@@ -183,6 +277,14 @@ class InputPipelineHandler:
         self.logger.info("Pipeline created successfully")
         self.setup_stats_collection()
 
+        # Check the cached analysis against the PMT in the first segment, without holding up data
+        if self.cached_probe:
+            self.psi_validation = PSIDiscovery(
+                self.elements['queue2'].get_static_pad('src'), None,
+                on_complete=self._on_psi_validated, logger=self.logger, block=False
+            )
+            self.psi_validation.start()
+
 #main indent
     def _store_codec_info(self, video_codec, audio_codec, video_pid, audio_pid, program_number, probe_data):
         """Store codec information in JSON files with backward compatibility."""
@@ -287,16 +389,10 @@ class InputPipelineHandler:
                 }
             }
         
-        # Write info files
-        video_info_path = f"{self.socket_dir}/{self.channel_name}_video_shm_info"
-        audio_info_path = f"{self.socket_dir}/{self.channel_name}_audio_shm_info"
-        
-        with open(video_info_path, 'w') as f:
-            json.dump(video_info, f, indent=2)
-        with open(audio_info_path, 'w') as f:
-            json.dump(audio_info, f, indent=2)
-            
-        self.logger.info(f"Stored codec info to: {video_info_path} and {audio_info_path}")
+        # Info files for the carried streams only; the transcoder waits for exactly these
+        paths = write_stream_info(self.channel_name, video_info if self.streams['video'] else None,
+                                  [audio_info] if self.streams['audio'] else [], self.socket_dir)
+        self.logger.info(f"Stored codec info to: {', '.join(paths)}")
 
 
 #main indent
@@ -350,11 +446,6 @@ class InputPipelineHandler:
             'queue2': Gst.ElementFactory.make("queue", "queue2"),
             'tsparse': Gst.ElementFactory.make("tsparse", "tsparse"),
             'tsdemux': Gst.ElementFactory.make("tsdemux", "tsdemux"),
-            'video_queue1': Gst.ElementFactory.make("queue", "video_queue1"),
-            'video_watchdog': Gst.ElementFactory.make("watchdog", "video_watchdog"),
-            'audio_queue1': Gst.ElementFactory.make("queue", "audio_queue1"),
-            'audio_watchdog': Gst.ElementFactory.make("watchdog", "audio_watchdog"),
-            'audio_queue2': Gst.ElementFactory.make("queue", "audio_queue2"),
             'mpegtsmux': Gst.ElementFactory.make("mpegtsmux", "mux"),
             'identity': Gst.ElementFactory.make("identity", "identity"),
             'final_queue': Gst.ElementFactory.make("queue", "final_queue"),
@@ -362,60 +453,89 @@ class InputPipelineHandler:
             'shmsink': Gst.ElementFactory.make("shmsink", "shmsink")
         })
 
-        # Create video parser based on detected codec
-        if self.video_codec == 'h264':
-            self.elements['video_parser'] = Gst.ElementFactory.make("h264parse", "video_parser")
-        elif self.video_codec in ['hevc', 'h265']:
-            self.elements['video_parser'] = Gst.ElementFactory.make("h265parse", "video_parser")
-        elif self.video_codec == 'mpeg2video':
-            self.elements['video_parser'] = Gst.ElementFactory.make("mpegvideoparse", "video_parser")
-        else:
-            raise ValueError(f"Unsupported video codec: {self.video_codec}")
-
-        # Create audio parser based on detected codec  
-        if self.audio_codec == 'aac':
-            self.elements['audio_parser'] = Gst.ElementFactory.make("aacparse", "audio_parser")
-        elif self.audio_codec in ['mp2', 'mp3']:
-            self.elements['audio_parser'] = Gst.ElementFactory.make("mpegaudioparse", "audio_parser")
-        else:
-            raise ValueError(f"Unsupported audio codec: {self.audio_codec}")
-
-        self.elements['video_queue2'] = Gst.ElementFactory.make("queue", "video_queue2")
-
-        # Verify parser creation
-        if not self.elements['video_parser']:
-            raise RuntimeError(f"Failed to create parser for video codec: {self.video_codec}")
-        if not self.elements['audio_parser']:
-            raise RuntimeError(f"Failed to create parser for audio codec: {self.audio_codec}")
+        if self.fetcher:
+            # Segments are pushed by HLSFetcher instead of fetched by souphttpsrc ! hlsdemux
+            self.elements['source'] = Gst.ElementFactory.make("appsrc", "source")
+            del self.elements['hlsdemux']
+
+        # A branch nothing feeds would trip its watchdog, so only the carried streams get one
+        if self.streams['video']:
+            self.elements.update({
+                'video_queue1': Gst.ElementFactory.make("queue", "video_queue1"),
+                'video_watchdog': Gst.ElementFactory.make("watchdog", "video_watchdog"),
+                'video_queue2': Gst.ElementFactory.make("queue", "video_queue2")
+            })
+
+            # Create video parser based on detected codec
+            if self.video_codec == 'h264':
+                self.elements['video_parser'] = Gst.ElementFactory.make("h264parse", "video_parser")
+            elif self.video_codec in ['hevc', 'h265']:
+                self.elements['video_parser'] = Gst.ElementFactory.make("h265parse", "video_parser")
+            elif self.video_codec == 'mpeg2video':
+                self.elements['video_parser'] = Gst.ElementFactory.make("mpegvideoparse", "video_parser")
+            else:
+                raise ValueError(f"Unsupported video codec: {self.video_codec}")
+            if not self.elements['video_parser']:
+                raise RuntimeError(f"Failed to create parser for video codec: {self.video_codec}")
+
+            if self.video_codec != 'mpeg2video' and gop_cache_settings(self.channel_settings) is not None:
+                # SPS/PPS with every IDR, so a cached GOP carries its own codec headers
+                self.elements['video_parser'].set_property('config-interval', -1)
+
+        if self.streams['audio']:
+            self.elements.update({
+                'audio_queue1': Gst.ElementFactory.make("queue", "audio_queue1"),
+                'audio_watchdog': Gst.ElementFactory.make("watchdog", "audio_watchdog"),
+                'audio_queue2': Gst.ElementFactory.make("queue", "audio_queue2")
+            })
+
+            # Create audio parser based on detected codec
+            if self.audio_codec == 'aac':
+                self.elements['audio_parser'] = Gst.ElementFactory.make("aacparse", "audio_parser")
+            elif self.audio_codec in ['mp2', 'mp3']:
+                self.elements['audio_parser'] = Gst.ElementFactory.make("mpegaudioparse", "audio_parser")
+            else:
+                raise ValueError(f"Unsupported audio codec: {self.audio_codec}")
+            if not self.elements['audio_parser']:
+                raise RuntimeError(f"Failed to create parser for audio codec: {self.audio_codec}")
 
         # Configure source
-        self.elements['source'].set_property('location', self.selected_input['uri'])
-        self.elements['source'].set_property('is-live', True)
+        if self.fetcher:
+            self.elements['source'].set_property('caps', Gst.Caps.from_string("video/mpegts,systemstream=true,packetsize=188"))
+            self.elements['source'].set_property('is-live', True)
+            self.elements['source'].set_property('format', Gst.Format.TIME)
+            self.elements['source'].set_property('do-timestamp', True)
+            self.elements['source'].set_property('block', True)
+        else:
+            self.elements['source'].set_property('location', self.selected_input['uri'])
+            self.elements['source'].set_property('is-live', True)
 
         # Configure tsparse
         #self.elements['tsparse'].set_property('set-timestamps', True)
         #self.elements['tsparse'].set_property('smoothing-latency', 1000)
 
-        # Configure watchdogs
-        self.elements['video_watchdog'].set_property('timeout', 50000)
-        self.elements['audio_watchdog'].set_property('timeout', 50000)
-        self.elements['output_watchdog'].set_property('timeout', 50000)
+        # Configure watchdogs; the prefetch fetcher bounds how long it can go without delivering,
+        # so it fails much faster than hlsdemux but never on one slow segment
+        default_timeout = 50000
+        if self.fetcher:
+            default_timeout = int(self.fetcher.max_delivery_gap() * 1000) + 2000
+        watchdog_timeout = int(self.ingest.get('watchdog-timeout', default_timeout))
+        if self.fetcher and watchdog_timeout < self.fetcher.max_delivery_gap() * 1000:
+            self.logger.warning(f"watchdog-timeout {watchdog_timeout} ms is shorter than the fetcher's longest "
+                                f"delivery gap of {self.fetcher.max_delivery_gap():.1f}s")
+        for name in ('video_watchdog', 'audio_watchdog', 'output_watchdog'):
+            if name in self.elements:
+                self.elements[name].set_property('timeout', watchdog_timeout)
 
         # Configure identity for stats
         self.elements['identity'].set_property('sync', True)
         self.elements['identity'].set_property('silent', False)
 
         # Configure queues
-        queue_config = {
-            'max-size-time': 300000000000,
-            'max-size-buffers': 1000000,
-            'leaky': 1
-        }
-
         for name in ['queue1', 'queue2', 'video_queue1', 'video_queue2', 
                     'audio_queue1', 'audio_queue2', 'final_queue']:
-            for prop, value in queue_config.items():
-                self.elements[name].set_property(prop, value)
+            if name in self.elements:
+                self.sizing.configure_queue(self.elements[name])
 
         # Configure muxer
         self.elements['mpegtsmux'].set_property('alignment', 7)
@@ -426,7 +546,7 @@ class InputPipelineHandler:
         self.elements['shmsink'].set_property('wait-for-connection', False)
         self.elements['shmsink'].set_property('sync', False)
         self.elements['shmsink'].set_property('async', False)
-        self.elements['shmsink'].set_property('shm-size', 2000000)
+        self.sizing.configure_shmsink(self.elements['shmsink'])
 
 
         # Add all elements to pipeline
@@ -437,10 +557,18 @@ class InputPipelineHandler:
     def _link_static_elements(self):
         """Link the static elements in the pipeline."""
         # Link initial chain
-        elements_to_link = [
-            ('source', 'queue1'),
-            ('queue1', 'hlsdemux')
-        ]
+        if self.fetcher:
+            elements_to_link = [
+                ('source', 'queue1'),
+                ('queue1', 'queue2'),
+                ('queue2', 'tsparse'),
+                ('tsparse', 'tsdemux')
+            ]
+        else:
+            elements_to_link = [
+                ('source', 'queue1'),
+                ('queue1', 'hlsdemux')
+            ]
         
         for src, dest in elements_to_link:
             if not self.elements[src].link(self.elements[dest]):
@@ -458,13 +586,27 @@ class InputPipelineHandler:
             if not self.elements[src].link(self.elements[dest]):
                 raise RuntimeError(f"Failed to link {src} to {dest}")
 
+#main indent
+    def _push_segment(self, data, segment):
+        """Hand one downloaded segment to the appsrc; runs in the fetcher thread"""
+        source = self.elements.get('source')
+        if source is None:
+            # Pipeline is being rebuilt after a watchdog timeout
+            return
+        buffer = Gst.Buffer.new_wrapped(data)
+        if segment.get('discontinuity'):
+            buffer.set_flags(Gst.BufferFlags.DISCONT)
+        ret = source.emit('push-buffer', buffer)
+        if ret != Gst.FlowReturn.OK:
+            self.logger.warning(f"Segment {segment['sequence']} not accepted by appsrc: {ret.value_nick}")
+
 #main indent
     def on_pad_added(self, element, pad):
         """Handle dynamic pad connections from demuxers."""
         pad_name = pad.get_name()
         self.logger.info(f"New pad added: {pad_name}")
 
-        if element == self.elements['hlsdemux']:
+        if element == self.elements.get('hlsdemux'):
             sink_pad = self.elements['queue2'].get_static_pad("sink")
             if pad.link(sink_pad) == Gst.PadLinkReturn.OK:
                 # Link the rest of the chain
@@ -477,7 +619,9 @@ class InputPipelineHandler:
                 self.logger.info("Successfully linked HLS demuxer chain")
 
         elif element == self.elements['tsdemux']:
-            if pad_name.startswith('video'):
+            if pad_name.startswith(('video', 'audio')) and f"{pad_name.split('_')[0]}_queue1" not in self.elements:
+                self.logger.info(f"Ignoring pad {pad_name}, the channel carries {describe_streams(self.streams)}")
+            elif pad_name.startswith('video'):
                 # Link video chain
                 sink_pad = self.elements['video_queue1'].get_static_pad("sink")
                 if pad.link(sink_pad) == Gst.PadLinkReturn.OK:
@@ -490,7 +634,8 @@ class InputPipelineHandler:
                     if not self.elements['video_parser'].link(self.elements['video_queue2']):
                         self.logger.error("Failed to link video_parser to video_queue2")
                         return
-                    if not self.elements['video_queue2'].link(self.elements['mpegtsmux']):
+                    if not self.elements['video_queue2'].link_pads(
+                            'src', self.elements['mpegtsmux'], f"sink_{mux_video_pid(self.mux_settings)}"):
                         self.logger.error("Failed to link video_queue2 to mpegtsmux")
                         return
                     self.logger.info("Successfully linked video chain")
@@ -510,7 +655,8 @@ class InputPipelineHandler:
                     if not self.elements['audio_parser'].link(self.elements['audio_queue2']):
                         self.logger.error("Failed to link audio_parser to audio_queue2")
                         return
-                    if not self.elements['audio_queue2'].link(self.elements['mpegtsmux']):
+                    if not self.elements['audio_queue2'].link_pads(
+                            'src', self.elements['mpegtsmux'], f"sink_{mux_audio_pids(self.mux_settings, 1)[0]}"):
                         self.logger.error("Failed to link audio_queue2 to mpegtsmux")
                         return
                     self.logger.info("Successfully linked audio chain")
@@ -536,6 +682,54 @@ class InputPipelineHandler:
             identity_pad.add_probe(Gst.PadProbeType.BUFFER, self._stats_probe_cb)
             self.logger.info("Added probe to identity element")
 
+        # TR 101 290 checks on the received transport stream
+        if self.ts_analysis_timer:
+            GLib.source_remove(self.ts_analysis_timer)
+            self.ts_analysis_timer = None
+        self.ts_analyzer = create_analyzer(self.selected_input, self.stats_collector, self.logger)
+        if self.ts_analyzer:
+            # queue2 carries the TS coming out of hlsdemux
+            ts_pad = self.elements['queue2'].get_static_pad('src')
+            ts_pad.add_probe(Gst.PadProbeType.BUFFER | Gst.PadProbeType.BUFFER_LIST,
+                             self.ts_analyzer.probe_buffer)
+            self.ts_analysis_timer = GLib.timeout_add(1000, self.ts_analyzer.publish)
+
+        # Raw input for post-mortem captures; one ring for the life of the process
+        if self.flight_recorder is None:
+            self.flight_recorder = create_flight_recorder(self.selected_input, self.channel_name,
+                                                          self.stats_collector, self.logger)
+            if self.flight_recorder:
+                self.flight_recorder_timer = GLib.timeout_add(1000, self.flight_recorder.poll)
+        if self.flight_recorder:
+            self.elements['queue2'].get_static_pad('src').add_probe(
+                Gst.PadProbeType.BUFFER | Gst.PadProbeType.BUFFER_LIST, self.flight_recorder.probe_buffer)
+
+        # Receive latency, and the stamps the next process matches the shm handoff against
+        if self.latency_timer:
+            GLib.source_remove(self.latency_timer)
+            self.latency_timer = None
+        if self.latency_probe:
+            self.latency_probe.close()
+        self.latency_probe = LatencyProbe(self.channel_name, 'input', stats_collector=self.stats_collector,
+                                          budgets=self.sizing.hop_budgets(), logger=self.logger)
+        self.latency_probe.add_ingress(self.elements['queue2'].get_static_pad('src'))
+        self.latency_probe.add_egress('receive', self.elements['shmsink'].get_static_pad('sink'))
+        self.latency_timer = GLib.timeout_add(1000, self.latency_probe.update)
+
+        # Latest GOP for the transcoder and outputs to start from when they connect
+        if self.gop_cache_timer:
+            GLib.source_remove(self.gop_cache_timer)
+            self.gop_cache_timer = None
+        if self.gop_cache:
+            self.gop_cache.close()
+            self.gop_cache = None
+        gop_settings = gop_cache_settings(self.channel_settings)
+        if gop_settings is not None:
+            self.gop_cache = GOPCache(self.channel_name, gop_settings, self.stats_collector, self.logger)
+            self.elements['shmsink'].get_static_pad('sink').add_probe(
+                Gst.PadProbeType.BUFFER | Gst.PadProbeType.BUFFER_LIST, self.gop_cache.probe_buffer)
+            self.gop_cache_timer = GLib.timeout_add(1000, self.gop_cache.publish)
+
         # Start stats collection timer
         self.stats_timer = GLib.timeout_add(5000, self.collect_stats)
         self.logger.info("Started stats collection timer")
@@ -575,6 +769,9 @@ class InputPipelineHandler:
                     self.stats['buffer_level_bytes'] = queue.get_property('current-level-bytes')
                     self.stats['buffer_level_time'] = queue.get_property('current-level-time')
 
+                if self.fetcher:
+                    self.stats.update(self.fetcher.get_stats())
+
                 # Log stats
                 self.logger.debug(f"HLS Input Stats: {json.dumps(self.stats, indent=2)}")
 
@@ -597,12 +794,17 @@ class InputPipelineHandler:
         self.logger.info("Starting main run loop")
         
         try:
+            if self.ingest.get('mode') == 'prefetch':
+                self.fetcher = HLSFetcher(self.selected_input['uri'], self.ingest, self._push_segment,
+                                          logger=self.logger)
+                self.fetcher.resolve()
+
             # Create and set up pipeline
             (self.video_codec, 
              self.audio_codec, 
              self.video_pid,
              self.audio_pid,
-             self.program_number) = self.analyze_stream()
+             self.program_number) = self.load_stream_analysis()
              
             self.logger.debug(f"Using video codec: {self.video_codec}")
             self.logger.debug(f"Using audio codec: {self.audio_codec}")
@@ -625,6 +827,16 @@ class InputPipelineHandler:
             
             # Generate DOT file after pipeline is playing
             self.generate_dot_file("playing")
+
+            if self.fetcher:
+                self.fetcher.start()
+            
+            # Measure main loop lag so blocking callbacks show up in stats
+            self.lag_probe = GLibLagProbe(
+                f"{self.channel_name}_hls_input", self.logger,
+                stats_collector=self.stats_collector, stat_type="loop_lag_input"
+            )
+            self.lag_probe.start()
             
             # Run the main loop
             loop = GLib.MainLoop()
@@ -645,10 +857,39 @@ class InputPipelineHandler:
         """Cleanup resources"""
         self.logger.info("Starting cleanup")
         
+        if self.lag_probe:
+            self.lag_probe.stop()
+
+        if self.psi_validation:
+            self.psi_validation.stop()
+
+        if self.fetcher:
+            self.fetcher.stop()
+
+        if self.ts_analysis_timer:
+            GLib.source_remove(self.ts_analysis_timer)
+            self.ts_analysis_timer = None
+
+        if self.latency_timer:
+            GLib.source_remove(self.latency_timer)
+            self.latency_timer = None
+        if self.latency_probe:
+            self.latency_probe.close()
+
+        if self.gop_cache_timer:
+            GLib.source_remove(self.gop_cache_timer)
+            self.gop_cache_timer = None
+        if self.gop_cache:
+            self.gop_cache.close()
+
+        if self.flight_recorder_timer:
+            GLib.source_remove(self.flight_recorder_timer)
+            self.flight_recorder_timer = None
+        if self.flight_recorder:
+            self.flight_recorder.close()
+        
         # Remove socket files and info files
-        paths_to_remove = self.socket_paths + [
-            f"{self.socket_dir}/{self.channel_name}_video_shm_info",
-            f"{self.socket_dir}/{self.channel_name}_audio_shm_info",
+        paths_to_remove = self.socket_paths + all_info_paths(self.channel_name, self.socket_dir) + [
             f"{self.socket_dir}/{self.channel_name}_muxed_shm"
         ]
         
@@ -683,14 +924,20 @@ class InputPipelineHandler:
             # Handle watchdog timeout
             if 'Watchdog triggered' in error_msg:
                 self.logger.error(f"Watchdog timeout detected - {element_name}")
+                if self.flight_recorder:
+                    self.flight_recorder.dump('watchdog', element_name)
                 self._handle_watchdog_timeout()
             else:
                 self.logger.error(f"Pipeline error: {error_msg}")
                 self.logger.error(f"Debug info: {debug_info}")
+                if self.flight_recorder:
+                    self.flight_recorder.dump('pipeline_error', f"{element_name}: {error_msg}")
 
         elif t == Gst.MessageType.WARNING:
             warn, debug = message.parse_warning()
             self.logger.warning(f"Pipeline warning: {warn.message}")
+            if self.flight_recorder:
+                self.flight_recorder.mark('warning', f"{message.src.get_name()}: {warn.message}")
             self.logger.debug(f"Warning debug info: {debug}")
             
         elif t == Gst.MessageType.STATE_CHANGED:
@@ -707,6 +954,10 @@ class InputPipelineHandler:
         """Handle pipeline failure and attempt restart"""
         self.logger.info("Handling watchdog timeout")
         try:
+            if self.psi_validation:
+                self.psi_validation.stop()
+                self.psi_validation = None
+
             # Stop current pipeline
             if self.pipeline:
                 self.pipeline.set_state(Gst.State.NULL)
@@ -723,7 +974,7 @@ class InputPipelineHandler:
                 if os.path.exists(path):
                     os.unlink(path)
                     
-            # Re-analyze stream and recreate pipeline
+            # Recreate pipeline from the cached analysis; it is revalidated against the PMT
             self.create_pipeline()
             
             # Start the pipeline
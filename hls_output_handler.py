@@ -4,7 +4,14 @@ import gi
 gi.require_version('Gst', '1.0')
 from gi.repository import Gst, GLib
 from config import Configuration
+from stats_collector import StatsCollector
+from loop_lag import GLibLagProbe
+from latency_probe import LatencyProbe
+from latency_profile import LatencySizing
+from gop_cache import GOPReplay, gop_cache_settings
+from stream_set import stream_set, audio_track_settings, info_paths, read_stream_info
 import logging
+import redis
 from logging.handlers import RotatingFileHandler
 import subprocess
 import sys
@@ -59,6 +66,9 @@ class HLSOutputHandler:
     def __init__(self, channel_name, output_index=0, mode='output'):
         self.logger = logging.getLogger(__name__)
         self.channel_name = channel_name
+        self.lag_probe = None
+        self.latency_probe = None
+        self.latency_timer = None
         self.output_index = output_index
         self.mode = mode
         
@@ -82,10 +92,28 @@ class HLSOutputHandler:
             
         if output_index < 0 or output_index >= len(self.outputs):
             raise ValueError(f"Invalid output index {output_index}")
+
+        # Queue and tsparse sizing from the channel's latency_profile
+        self.sizing = LatencySizing(self.channel_settings, 'hls_output', self.logger)
+
+        # Only the branches for the streams the channel carries are built; HLS takes the first audio track
+        self.streams = stream_set(self.channel_settings)
+        self.audio_settings = audio_track_settings(self.channel_settings)
         
         # Initialize pipeline elements
         self.pipeline = None
         self.elements = {}
+
+        # Initialize Redis for stats
+        try:
+            self.redis_client = redis.Redis(host='localhost', port=6379, decode_responses=True)
+            self.redis_client.ping()
+            self.logger.info("Successfully connected to Redis")
+            self.stats_collector = StatsCollector(channel_name, self.redis_client)
+        except redis.ConnectionError:
+            self.logger.error("Failed to connect to Redis")
+            self.redis_client = None
+            self.stats_collector = None
         
         # Set default HLS options
         self.hls_options = {
@@ -99,7 +127,7 @@ class HLSOutputHandler:
 
 #main indent
     def _get_parser_types(self):
-        """Determine which parsers to use based on input source and transcoding config"""
+        """Determine which parsers to use based on input source and transcoding config; None for a stream not carried"""
         video_parser = None
         audio_parser = None
         max_retries = 10
@@ -107,21 +135,18 @@ class HLSOutputHandler:
 
         while retry_count < max_retries:
             try:
-                video_info_path = f"{self.socket_dir}/{self.channel_name}_video_shm_info"
-                audio_info_path = f"{self.socket_dir}/{self.channel_name}_audio_shm_info"
-                
-                if not (os.path.exists(video_info_path) and os.path.exists(audio_info_path)):
+                info = read_stream_info(self.channel_name, self.streams, self.socket_dir)
+                if info is None:
                     retry_count += 1
                     self.logger.info(f"Waiting for codec info files... Attempt {retry_count}/{max_retries}")
                     time.sleep(5)
                     continue
 
+                video_info = info['video'] or {}
+                audio_info = info['audio'][0] if info['audio'] else {}
+                video_codec = audio_codec = None
+
                 if self.mode == 'input':
-                    with open(video_info_path, 'r') as f:
-                        video_info = json.loads(f.read())
-                    with open(audio_info_path, 'r') as f:
-                        audio_info = json.loads(f.read())
-                    
                     video_codec = video_info.get('codec')
                     audio_codec = audio_info.get('codec')
                     
@@ -140,16 +165,15 @@ class HLSOutputHandler:
                 else:  # mode == 'output'
                     transcoding = self.channel_settings.get('transcoding', {})
                     
-                    video_settings = transcoding.get('video', {})
-                    if isinstance(video_settings.get('streams'), list):
-                        video_codec = video_settings['streams'][0].get('codec', '')
-                    else:
-                        video_codec = video_settings.get('codec', '')
-                    
-                    if video_codec == 'passthrough':
-                        with open(video_info_path, 'r') as f:
-                            video_info = json.loads(f.read())
-                        video_codec = video_info.get('codec')
+                    if self.streams['video']:
+                        video_settings = transcoding.get('video', {})
+                        if isinstance(video_settings.get('streams'), list):
+                            video_codec = video_settings['streams'][0].get('codec', '')
+                        else:
+                            video_codec = video_settings.get('codec', '')
+                        
+                        if video_codec == 'passthrough':
+                            video_codec = video_info.get('codec')
                     
                     video_parser = {
                         'x264enc': 'h264parse',
@@ -159,13 +183,11 @@ class HLSOutputHandler:
                         'mpeg2video': 'mpegvideoparse'
                     }.get(video_codec)
                     
-                    audio_settings = transcoding.get('audio', {})
-                    audio_codec = audio_settings.get('codec', '')
-                    
-                    if audio_codec == 'passthrough':
-                        with open(audio_info_path, 'r') as f:
-                            audio_info = json.loads(f.read())
-                        audio_codec = audio_info.get('codec')
+                    if self.streams['audio']:
+                        audio_codec = self.audio_settings[0].get('codec', '')
+                        
+                        if audio_codec == 'passthrough':
+                            audio_codec = audio_info.get('codec')
                     
                     audio_parser = {
                         'avenc_aac': 'aacparse',
@@ -175,7 +197,7 @@ class HLSOutputHandler:
                         'mp3': 'mpegaudioparse'
                     }.get(audio_codec)
                 
-                if not video_parser or not audio_parser:
+                if (self.streams['video'] and not video_parser) or (self.streams['audio'] and not audio_parser):
                     raise ValueError(f"Unsupported codec combination: video={video_codec}, audio={audio_codec}")
                 
                 self.logger.info(f"Selected parsers - Video: {video_parser}, Audio: {audio_parser}")
@@ -188,6 +210,8 @@ class HLSOutputHandler:
                 retry_count += 1
                 time.sleep(5)
 
+        raise RuntimeError(f"Codec info files not available after {max_retries} retries")
+
 
 #main indent
     def create_pipeline(self):
@@ -228,39 +252,45 @@ class HLSOutputHandler:
                 'tsparse': Gst.ElementFactory.make("tsparse", "tsparse"),
                 'queue2': Gst.ElementFactory.make("queue", "queue2"),
                 'tsdemux': Gst.ElementFactory.make("tsdemux", "tsdemux"),
-                'queue_audio': Gst.ElementFactory.make("queue", "queue_audio"),
-                'queue_video': Gst.ElementFactory.make("queue", "queue_video"),
-                'videoparse': Gst.ElementFactory.make(video_parser_type, "videoparse"),
-                'audioparse': Gst.ElementFactory.make(audio_parser_type, "audioparse"),
-                'video_watchdog': Gst.ElementFactory.make("watchdog", "video_watchdog"),  # Added
-                'audio_watchdog': Gst.ElementFactory.make("watchdog", "audio_watchdog"),  # Added
-                'queue_audio_out': Gst.ElementFactory.make("queue", "queue_audio_out"),
-                'queue_video_out': Gst.ElementFactory.make("queue", "queue_video_out"),
                 'mux': Gst.ElementFactory.make("hlssink2", "mux")
             })
 
-            # Configure watchdogs
-            self.elements['video_watchdog'].set_property('timeout', 15000)  # 5 second timeout
-            self.elements['audio_watchdog'].set_property('timeout', 15000)  # 5 second timeout
+            # Branches only for the streams the channel carries
+            queues = ['queue1', 'queue2']
+            if video_parser_type:
+                self.elements.update({
+                    'queue_video': Gst.ElementFactory.make("queue", "queue_video"),
+                    'videoparse': Gst.ElementFactory.make(video_parser_type, "videoparse"),
+                    'video_watchdog': Gst.ElementFactory.make("watchdog", "video_watchdog"),  # Added
+                    'queue_video_out': Gst.ElementFactory.make("queue", "queue_video_out")
+                })
+                self.elements['video_watchdog'].set_property('timeout', 15000)  # 5 second timeout
+                queues += ['queue_video', 'queue_video_out']
+            if audio_parser_type:
+                self.elements.update({
+                    'queue_audio': Gst.ElementFactory.make("queue", "queue_audio"),
+                    'audioparse': Gst.ElementFactory.make(audio_parser_type, "audioparse"),
+                    'audio_watchdog': Gst.ElementFactory.make("watchdog", "audio_watchdog"),  # Added
+                    'queue_audio_out': Gst.ElementFactory.make("queue", "queue_audio_out")
+                })
+                self.elements['audio_watchdog'].set_property('timeout', 15000)  # 5 second timeout
+                queues += ['queue_audio', 'queue_audio_out']
             
             # Configure source
             self.elements['shmsrc'].set_property('socket-path', input_path)
             self.elements['shmsrc'].set_property('is-live', True)
+
+            # Start segmenting from the input handler's cached GOP instead of mid-GOP
+            if self.mode == 'input' and gop_cache_settings(self.channel_settings) is not None:
+                GOPReplay(self.channel_name, self.logger).attach(self.elements['shmsrc'].get_static_pad('src'))
             
             # Configure queues
-            queue_props = {
-                "leaky": 1,
-                "max-size-time": 500000000000,
-                "max-size-buffers": 1000000
-            }
-            
-            for queue in ['queue1', 'queue2', 'queue_audio', 'queue_video', 'queue_audio_out', 'queue_video_out']:
-                for prop, value in queue_props.items():
-                    self.elements[queue].set_property(prop, value)
+            for queue in queues:
+                self.sizing.configure_queue(self.elements[queue])
             
             # Configure tsparse
             self.elements['tsparse'].set_property('set-timestamps', True)
-            self.elements['tsparse'].set_property('smoothing-latency', 1000)
+            self.sizing.configure_tsparse(self.elements['tsparse'])
             
             #main indent
             # Configure HLS sink
@@ -300,7 +330,13 @@ class HLSOutputHandler:
             # Setup pad-added handler for tsdemux
             def on_pad_added(element, pad):
                 pad_name = pad.get_name()
-                if pad_name.startswith('video'):
+                if pad_name.startswith('video') and 'queue_video' not in self.elements:
+                    self.logger.info(f"Ignoring video pad {pad_name}, the channel carries no video")
+                elif pad_name.startswith('audio') and 'queue_audio' not in self.elements:
+                    self.logger.info(f"Ignoring audio pad {pad_name}, the channel carries no audio")
+                elif pad_name.startswith('audio') and self.elements['queue_audio'].get_static_pad('sink').is_linked():
+                    self.logger.info(f"Ignoring audio pad {pad_name}, HLS carries the first audio track")
+                elif pad_name.startswith('video'):
                     # Link video chain
                     sink_pad = self.elements['queue_video'].get_static_pad('sink')
                     if pad.link(sink_pad) == Gst.PadLinkReturn.OK:
@@ -352,6 +388,8 @@ class HLSOutputHandler:
                         self.logger.error("Failed to link audio pad")
             
             self.elements['tsdemux'].connect('pad-added', on_pad_added)
+
+            self._setup_latency_probe()
             
             self.logger.info("Pipeline created successfully")
             
@@ -359,6 +397,30 @@ class HLSOutputHandler:
             self.logger.error(f"Error creating pipeline: {str(e)}")
             raise
 
+    def _stop_latency_probe(self):
+        """Remove the timer and ring file of the previous pipeline's latency probe"""
+        if self.latency_timer:
+            GLib.source_remove(self.latency_timer)
+            self.latency_timer = None
+        if self.latency_probe:
+            self.latency_probe.close()
+            self.latency_probe = None
+
+    def _setup_latency_probe(self):
+        """Handoff from the upstream process, video latency up to hlssink2 and the channel's total"""
+        self._stop_latency_probe()
+        self.latency_probe = LatencyProbe(
+            self.channel_name, f"hls_output_{self.output_index}",
+            upstream='input' if self.mode == 'input' else 'transcoder',
+            stats_collector=self.stats_collector, budgets=self.sizing.hop_budgets(), logger=self.logger
+        )
+        self.latency_probe.add_ingress(self.elements['shmsrc'].get_static_pad('src'))
+        # Audio-only channels are measured on their audio branch
+        branch = 'video' if 'videoparse' in self.elements else 'audio'
+        self.latency_probe.add_stage('demux', self.elements[f'{branch}parse'].get_static_pad('sink'))
+        self.latency_probe.add_egress('send', self.elements[f'queue_{branch}_out'].get_static_pad('src'), ts=False)
+        self.latency_timer = GLib.timeout_add(1000, self.latency_probe.update)
+
 #main indent
     def _wait_for_shared_memory(self):
         """Wait for all required shared memory files to be available"""
@@ -366,12 +428,8 @@ class HLSOutputHandler:
         input_path = (f"{self.socket_dir}/{self.channel_name}_muxed_shm" if self.mode == 'input' 
                      else f"{self.socket_dir}/{self.channel_name}_transcoded_shm")
         
-        # Define all required files
-        required_files = [
-            input_path,
-            f"{self.socket_dir}/{self.channel_name}_video_shm_info",
-            f"{self.socket_dir}/{self.channel_name}_audio_shm_info"
-        ]
+        # Define all required files: the input and the codec info of each stream the channel carries
+        required_files = [input_path] + info_paths(self.channel_name, self.streams, self.socket_dir)
         
         max_retries = 30  # 2.5 minutes maximum wait time
         retry_count = 0
@@ -540,6 +598,13 @@ class HLSOutputHandler:
             # Generate DOT file after pipeline is playing
             self.generate_dot_file("playing")
             
+            # Measure main loop lag so blocking callbacks show up in stats
+            self.lag_probe = GLibLagProbe(
+                f"{self.channel_name}_hls_output_{self.output_index}", self.logger,
+                stats_collector=self.stats_collector, stat_type=f"loop_lag_hls_output_{self.output_index}"
+            )
+            self.lag_probe.start()
+            
             # Run the main loop
             loop = GLib.MainLoop()
             try:
@@ -558,6 +623,11 @@ class HLSOutputHandler:
         """Cleanup resources"""
         self.logger.info("Starting cleanup")
         
+        if self.lag_probe:
+            self.lag_probe.stop()
+
+        self._stop_latency_probe()
+        
         if self.pipeline:
             self.logger.info("Stopping pipeline")
             self.pipeline.set_state(Gst.State.NULL)
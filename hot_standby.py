@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+import logging
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+from ts_analyzer import TSAnalyzer, np
+from latency_profile import DEFAULT_SRT_LATENCY_MS
+from udp_receiver import check_receive_buffer, DEFAULT_BUFFER_SIZE
+
+CHECK_INTERVAL_MS = 100
+DEFAULT_LOSS_TIMEOUT_MS = 300
+DEFAULT_CC_ERROR_THRESHOLD = 5       # per second
+DEFAULT_PCR_ERROR_THRESHOLD = 3      # per second
+DEFAULT_HOLD_OFF_MS = 1000
+DEFAULT_REVERT_AFTER = 30            # seconds; 0 stays on the backup
+
+
+class _Branch:
+    """One receiving input feeding the selector"""
+
+    def __init__(self, index: int, config: Dict, source, pad, analyzer: Optional[TSAnalyzer]):
+        self.index = index
+        self.config = config
+        self.source = source
+        self.pad = pad
+        self.analyzer = analyzer
+        self.last_data = None
+        self.bytes = 0
+        self.errors = deque()
+        self.healthy_since = None
+
+
+class HotStandbySource:
+    """
+    Receives several inputs at once and forwards one of them through an input-selector.
+    Each input is watched for loss of data and for CC/PCR errors over the last second;
+    when the active input fails, the selector moves to a healthy one on the next check
+    without touching anything downstream. Exposed as a bin named "source" with one
+    "src" pad so it drops in where a single udpsrc/srtsrc would go.
+    """
+
+    def __init__(self, inputs: List[Dict], settings: Dict, active_index: int = 0,
+                 stats_collector=None, logger: Optional[logging.Logger] = None,
+                 srt_latency: int = DEFAULT_SRT_LATENCY_MS):
+        self.logger = logger or logging.getLogger(__name__)
+        self.stats_collector = stats_collector
+        # For SRT inputs without their own latency option, from the channel's latency_profile
+        self.srt_latency = srt_latency
+
+        indexes = settings.get('inputs', list(range(len(inputs))))
+        if len(indexes) < 2:
+            raise ValueError("Hot standby needs at least two inputs")
+        for index in indexes:
+            if index < 0 or index >= len(inputs):
+                raise ValueError(f"Invalid hot standby input index {index}")
+            if inputs[index]['type'] not in ('udpsrc', 'srtsrc'):
+                raise ValueError(f"Hot standby supports udpsrc and srtsrc inputs, not {inputs[index]['type']}")
+
+        self.loss_timeout = settings.get('loss-timeout-ms', DEFAULT_LOSS_TIMEOUT_MS) / 1000
+        self.cc_threshold = settings.get('cc-error-threshold', DEFAULT_CC_ERROR_THRESHOLD)
+        self.pcr_threshold = settings.get('pcr-error-threshold', DEFAULT_PCR_ERROR_THRESHOLD)
+        self.hold_off = settings.get('hold-off-ms', DEFAULT_HOLD_OFF_MS) / 1000
+        self.revert_after = settings.get('revert-after', DEFAULT_REVERT_AFTER)
+        if np is None:
+            self.logger.warning("NumPy not installed, hot standby will switch on loss of data only")
+
+        self.bin = Gst.Bin.new("source")
+        self.selector = Gst.ElementFactory.make("input-selector", "hot_standby_selector")
+        # Inactive inputs are dropped as they arrive rather than held in step with the active one
+        self.selector.set_property("sync-streams", False)
+        self.bin.add(self.selector)
+        self.bin.add_pad(Gst.GhostPad.new("src", self.selector.get_static_pad("src")))
+
+        self.branches: List[_Branch] = []
+        for index in indexes:
+            self.branches.append(self._create_branch(index, inputs[index]))
+
+        self.primary = next((b for b in self.branches if b.index == indexes[0]))
+        self.active = next((b for b in self.branches if b.index == active_index), self.primary)
+        self.selector.set_property("active-pad", self.active.pad)
+
+        self.switches = 0
+        self.last_switch = 0.0
+        self.last_reason = ''
+        self._timer = None
+        self._ticks = 0
+
+    def _create_branch(self, index: int, config: Dict) -> _Branch:
+        options = dict(config.get('options') or {})
+        if config['type'] == 'udpsrc':
+            source = Gst.ElementFactory.make("udpsrc", f"source_{index}")
+            source.set_property('uri', config.get('uri', ''))
+            buffer_size = int(options.pop('buffer-size', DEFAULT_BUFFER_SIZE))
+            check_receive_buffer(buffer_size, self.logger)
+            source.set_property('buffer-size', buffer_size)
+            for key, value in options.items():
+                try:
+                    source.set_property(key, value)
+                except (TypeError, ValueError) as e:
+                    self.logger.warning(f"Could not set {key}={value} on input {index}: {str(e)}")
+        else:
+            source = Gst.ElementFactory.make("srtsrc", f"source_{index}")
+            source.set_property('uri', config.get('uri', ''))
+            source.set_property('latency', options.get('latency', self.srt_latency))
+            if 'streamid' in options:
+                source.set_property('streamid', options['streamid'])
+        if not source:
+            raise RuntimeError(f"Failed to create source for input {index}")
+
+        self.bin.add(source)
+        pad = self.selector.get_request_pad("sink_%u")
+        if source.get_static_pad("src").link(pad) != Gst.PadLinkReturn.OK:
+            raise RuntimeError(f"Failed to link input {index} to the selector")
+
+        analyzer = TSAnalyzer(logger=self.logger) if np is not None else None
+        branch = _Branch(index, config, source, pad, analyzer)
+        source.get_static_pad("src").add_probe(
+            Gst.PadProbeType.BUFFER | Gst.PadProbeType.BUFFER_LIST,
+            lambda pad, info: self._probe_cb(branch, pad, info)
+        )
+        self.logger.info(f"Hot standby input {index}: {config['type']} {config.get('uri', '')}")
+        return branch
+
+    def _probe_cb(self, branch: _Branch, pad, info):
+        branch.last_data = time.monotonic()
+        if info.type & Gst.PadProbeType.BUFFER_LIST:
+            buffer_list = info.get_buffer_list()
+            branch.bytes += sum(buffer_list.get(i).get_size() for i in range(buffer_list.length()))
+        else:
+            branch.bytes += info.get_buffer().get_size()
+        if branch.analyzer:
+            return branch.analyzer.probe_buffer(pad, info)
+        return Gst.PadProbeReturn.OK
+
+    def start(self):
+        """Start watching the inputs; call from the thread running the GLib main loop"""
+        now = time.monotonic()
+        for branch in self.branches:
+            # An input that never delivers is declared lost after the same timeout
+            branch.last_data = branch.last_data or now
+        self._timer = GLib.timeout_add(CHECK_INTERVAL_MS, self._check)
+        self.logger.info(f"Hot standby active on input {self.active.index}")
+
+    def stop(self):
+        """Stop the health checks"""
+        if self._timer:
+            GLib.source_remove(self._timer)
+            self._timer = None
+
+    def _health(self, branch: _Branch, now: float):
+        """(healthy, reason) from data arrival and the errors seen in the last second"""
+        if branch.analyzer:
+            window = branch.analyzer.get_stats()
+            pcr_errors = window['pcr_repetition_errors'] + window['pcr_discontinuity_errors']
+            branch.errors.append((now, window['cc_errors'] + window['sync_loss'], pcr_errors))
+        while branch.errors and now - branch.errors[0][0] > 1.0:
+            branch.errors.popleft()
+
+        if now - branch.last_data > self.loss_timeout:
+            return False, f"no data for {int((now - branch.last_data) * 1000)}ms"
+        cc_errors = sum(e[1] for e in branch.errors)
+        if cc_errors >= self.cc_threshold:
+            return False, f"{cc_errors} CC errors in the last second"
+        pcr_errors = sum(e[2] for e in branch.errors)
+        if pcr_errors >= self.pcr_threshold:
+            return False, f"{pcr_errors} PCR errors in the last second"
+        return True, ''
+
+    def _check(self):
+        try:
+            now = time.monotonic()
+            health = {}
+            for branch in self.branches:
+                health[branch.index] = self._health(branch, now)
+                if health[branch.index][0]:
+                    branch.healthy_since = branch.healthy_since or now
+                else:
+                    branch.healthy_since = None
+
+            if now - self.last_switch >= self.hold_off:
+                healthy, reason = health[self.active.index]
+                if not healthy:
+                    # Inputs are tried in configured order, so the primary wins when it is fine
+                    candidate = next((b for b in self.branches if b is not self.active and health[b.index][0]), None)
+                    if candidate:
+                        self._switch(candidate, f"input {self.active.index} failed: {reason}")
+                elif (self.revert_after and self.active is not self.primary and self.primary.healthy_since
+                      and now - self.primary.healthy_since >= self.revert_after):
+                    self._switch(self.primary, f"primary healthy for {self.revert_after}s")
+
+            self._ticks += 1
+            if self._ticks % (1000 // CHECK_INTERVAL_MS) == 0:
+                self._publish(health, now)
+        except Exception as e:
+            self.logger.error(f"Error checking hot standby inputs: {str(e)}")
+        return True
+
+    def _switch(self, branch: _Branch, reason: str):
+        self.logger.warning(f"Switching from input {self.active.index} to input {branch.index}: {reason}")
+        self.selector.set_property("active-pad", branch.pad)
+        self.active = branch
+        self.switches += 1
+        self.last_switch = time.monotonic()
+        self.last_reason = reason
+
+    def _publish(self, health: Dict, now: float):
+        stats = {
+            'active_index': self.active.index,
+            'active_uri': self.active.config.get('uri', ''),
+            'switches': self.switches,
+            'last_switch_reason': self.last_reason,
+            'inputs': {}
+        }
+        for branch in self.branches:
+            healthy, reason = health[branch.index]
+            stats['inputs'][str(branch.index)] = {
+                'uri': branch.config.get('uri', ''),
+                'healthy': healthy,
+                'reason': reason,
+                'last_data_ms': int((now - branch.last_data) * 1000),
+                'bitrate_mbps': branch.bytes * 8 / 1e6,
+                'cc_errors': sum(e[1] for e in branch.errors),
+                'pcr_errors': sum(e[2] for e in branch.errors)
+            }
+            branch.bytes = 0
+        if self.stats_collector:
+            self.stats_collector.add_stats("hot_standby", stats)
@@ -17,8 +17,22 @@ import argparse
 from datetime import datetime
 from urllib.parse import urlparse, urlencode
 from stats_collector import StatsCollector
+from loop_lag import GLibLagProbe
+from psi_discovery import PSIDiscovery
+from probe_cache import ProbeCache
+from ts_analyzer import create_analyzer
+from latency_probe import LatencyProbe
+from latency_profile import LatencySizing
+from gop_cache import GOPCache, gop_cache_settings
+from flight_recorder import create_flight_recorder
+from srt_gateway import register_route, unregister_route, gateway_streamid
+from stream_set import stream_set, mux_video_pid, mux_audio_pids, write_stream_info, all_info_paths
+from stream_set import describe as describe_streams
 from pathlib import Path
 
+# How long to wait for srt_gateway.py to open this channel's socket
+GATEWAY_SOCKET_TIMEOUT = 30
+
 def setup_logging(channel_name, log_dir='logs', log_level='INFO'):
     """Set up logging configuration for the application."""
     if not os.path.exists(log_dir):
@@ -62,6 +76,17 @@ class InputPipelineHandler:
     def __init__(self, channel_name, source_index=0):
         self.logger = logging.getLogger(__name__)
         self.channel_name = channel_name
+        self.lag_probe = None
+        self.psi_discovery = None
+        self.cached_probe = None
+        self.ts_analyzer = None
+        self.ts_analysis_timer = None
+        self.latency_probe = None
+        self.latency_timer = None
+        self.gop_cache = None
+        self.gop_cache_timer = None
+        self.flight_recorder = None
+        self.flight_recorder_timer = None
         self.source_index = source_index
         
         # Watchdog and restart parameters
@@ -81,12 +106,23 @@ class InputPipelineHandler:
         
         self.config = Configuration()
         self.channel_settings = self.config.get_channel_settings(channel_name)
+        self.sizing = LatencySizing(self.channel_settings, 'srt_input', self.logger)
+        # Only the streams the channel carries get a branch, a watchdog and an info file
+        self.streams = stream_set(self.channel_settings)
+        if self.streams['audio'] > 1:
+            raise ValueError(f"SRT inputs carry at most one audio track, the channel carries "
+                             f"{describe_streams(self.streams)}")
+        # The PIDs the transcoder looks for its streams on
+        self.mux_settings = self.config.get_plugin_settings(channel_name, 'mpegtsmux')
         self.pipeline = None
         self.elements = {}
         self.socket_paths = []
         self.stats_collector = None
         self.srt_stats_timer = None
         self.fds = {}
+        self.video_codec = self.audio_codec = None
+        self.video_pid = self.audio_pid = None
+        self.program_number = None
         
         # Initialize GStreamer
         Gst.init(None)
@@ -105,6 +141,15 @@ class InputPipelineHandler:
         # Verify input type is SRT
         if self.selected_input['type'] != 'srtsrc':
             raise ValueError("Only SRT input type is supported")
+
+        # Gateway inputs are received by srt_gateway.py on its shared port and read from its socket
+        self.gateway = bool(self.selected_input.get('gateway'))
+        self.gateway_timer = None
+        # Cached stream analysis is keyed by where the stream comes from
+        self.probe_key = (f"srtgateway://{gateway_streamid(channel_name, self.selected_input)}" if self.gateway
+                          else self.selected_input.get('uri'))
+        # Programs of one multiplex are analysed and cached separately
+        self.demux_program = (self.selected_input.get('demux') or {}).get('program-number')
         
         # Initialize Redis for stats collection
         try:
@@ -116,65 +161,48 @@ class InputPipelineHandler:
             self.logger.error("Failed to connect to Redis")
             self.redis_client = None
             self.stats_collector = None
+
+        # Stream analysis survives restarts; falls back to disk without Redis
+        self.probe_cache = ProbeCache(self.redis_client, logger=self.logger)
             
         # Create shared memory directory
         self.socket_dir = "/tmp/caricoder"
         os.makedirs(self.socket_dir, exist_ok=True)
 
-    def analyze_stream(self):
-        """Analyze the input stream using ffprobe to detect codecs and PIDs."""
-        input_config = self.selected_input
-        uri = input_config.get('uri')
-        
-        self.logger.info(f"Analyzing stream: URI={uri}")
-
-        try:
-            cmd = [
-                "ffprobe",
-                "-v", "quiet",
-                "-print_format", "json",
-                "-show_format",
-                "-show_streams",
-                "-show_programs",
-                "-i", uri
-            ]
-            
-            self.logger.debug(f"Running ffprobe command: {' '.join(cmd)}")
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=20)
-            
-            self.logger.debug(f"ffprobe stdout: {result.stdout}")
-            if result.stderr:
-                self.logger.debug(f"ffprobe stderr: {result.stderr}")
-                
-            if result.returncode != 0:
-                raise RuntimeError(f"ffprobe failed with return code {result.returncode}")
-            
-            probe_data = json.loads(result.stdout)
-            self.logger.debug(f"Probe data: {json.dumps(probe_data, indent=2)}")
-            
-            program = probe_data.get('programs', [None])[0]
-            video_codec = audio_codec = None
-            video_pid = audio_pid = None
-            program_number = program.get('program_id') if program else None
-
-            streams = program.get('streams', []) if program else probe_data.get('streams', [])
-            for stream in streams:
-                if stream['codec_type'] == 'video' and not video_codec:
-                    video_codec = stream['codec_name']
-                    video_pid = format_pid(stream.get('id', '0'))
-                elif stream['codec_type'] == 'audio' and not audio_codec:
-                    audio_codec = stream['codec_name']
-                    audio_pid = format_pid(stream.get('id', '0'))
-
-            #self._store_codec_info(video_codec, audio_codec, video_pid, audio_pid, program_number)
-            # Store complete probe data
-            self._store_codec_info(video_codec, audio_codec, video_pid, audio_pid, program_number, probe_data)
-
-            return video_codec, audio_codec, video_pid, audio_pid, program_number
-
-        except Exception as e:
-            self.logger.error(f"Stream analysis failed: {str(e)}")
-            raise
+    def analyze_stream(self, probe_data):
+        """Pick codecs and PIDs from the PSI read off the live stream."""
+        self.logger.info(f"Analyzing stream: URI={self.selected_input.get('uri')}")
+        self.logger.debug(f"Probe data: {json.dumps(probe_data, indent=2)}")
+
+        programs = probe_data.get('programs', [])
+        program = next((p for p in programs if p.get('program_id') == self.demux_program), None)
+        if program is None and programs:
+            program = programs[0]
+            if self.demux_program is not None:
+                self.logger.warning(f"Specified program {self.demux_program} not found. "
+                                    f"Using program {program.get('program_id')}")
+        video_codec = audio_codec = None
+        video_pid = audio_pid = None
+        program_number = program.get('program_id') if program else None
+
+        streams = program.get('streams', []) if program else probe_data.get('streams', [])
+        for stream in streams:
+            if stream['codec_type'] == 'video' and self.streams['video'] and not video_codec:
+                video_codec = stream['codec_name']
+                video_pid = format_pid(stream.get('id', '0'))
+            elif stream['codec_type'] == 'audio' and self.streams['audio'] and not audio_codec:
+                audio_codec = stream['codec_name']
+                audio_pid = format_pid(stream.get('id', '0'))
+
+        if self.streams['video'] and not video_codec:
+            raise RuntimeError(f"No video stream found in PMT, the channel carries {describe_streams(self.streams)}")
+        if self.streams['audio'] and not audio_codec:
+            raise RuntimeError(f"No audio stream found in PMT, the channel carries {describe_streams(self.streams)}")
+
+        # Store complete probe data
+        self._store_codec_info(video_codec, audio_codec, video_pid, audio_pid, program_number, probe_data)
+
+        return video_codec, audio_codec, video_pid, audio_pid, program_number
 
 #main indent
     def _store_codec_info(self, video_codec, audio_codec, video_pid, audio_pid, program_number, probe_data):
@@ -280,16 +308,10 @@ class InputPipelineHandler:
                 }
             }
         
-        # Write info files
-        video_info_path = f"{self.socket_dir}/{self.channel_name}_video_shm_info"
-        audio_info_path = f"{self.socket_dir}/{self.channel_name}_audio_shm_info"
-        
-        with open(video_info_path, 'w') as f:
-            json.dump(video_info, f, indent=2)
-        with open(audio_info_path, 'w') as f:
-            json.dump(audio_info, f, indent=2)
-            
-        self.logger.info(f"Stored codec info to: {video_info_path} and {audio_info_path}")
+        # Info files for the carried streams only; the transcoder waits for exactly these
+        paths = write_stream_info(self.channel_name, video_info if self.streams['video'] else None,
+                                  [audio_info] if self.streams['audio'] else [], self.socket_dir)
+        self.logger.info(f"Stored codec info to: {', '.join(paths)}")
 
 #main indent
     def _adjust_watchdog_timeouts(self, initial=False):
@@ -316,10 +338,8 @@ class InputPipelineHandler:
     def _cleanup_shared_memory(self):
         """Clean up shared memory files and related resources"""
         files_to_cleanup = [
-            f"{self.socket_dir}/{self.channel_name}_muxed_shm",
-            f"{self.socket_dir}/{self.channel_name}_video_shm_info",
-            f"{self.socket_dir}/{self.channel_name}_audio_shm_info"
-        ]
+            f"{self.socket_dir}/{self.channel_name}_muxed_shm"
+        ] + all_info_paths(self.channel_name, self.socket_dir)
         
         for file_path in files_to_cleanup:
             try:
@@ -357,6 +377,10 @@ class InputPipelineHandler:
         try:
             self.logger.info(f"Waiting {self.RESTART_DELAY} seconds before restart attempt")
             time.sleep(self.RESTART_DELAY)
+
+            if self.psi_discovery:
+                self.psi_discovery.stop()
+                self.psi_discovery = None
             
             # Stop current pipeline
             if self.pipeline:
@@ -375,17 +399,7 @@ class InputPipelineHandler:
             # Reset watchdog timeout flag
             self.watchdog_timeouts_set = False
             
-            # Re-analyze stream to get fresh codec info
-            try:
-                self.video_codec, self.audio_codec, self.video_pid, self.audio_pid, self.program_number = self.analyze_stream()
-            except Exception as e:
-                self.logger.error(f"Stream analysis failed during restart: {str(e)}")
-                # If analysis fails, wait a bit and try the whole restart again
-                time.sleep(2)
-                self.handling_failure = False
-                return self._handle_watchdog_timeout()
-            
-            # Create new pipeline with fresh codec info
+            # Create new pipeline; codec info is read afresh from the stream's PSI
             self.create_pipeline()
             
             # Set up message handling
@@ -416,15 +430,11 @@ class InputPipelineHandler:
         
         # Create elements
         self.elements.update({
-            'source': Gst.ElementFactory.make("srtsrc", "source"),
+            'source': self._create_gateway_source() if self.gateway else Gst.ElementFactory.make("srtsrc", "source"),
             'queue1': Gst.ElementFactory.make("queue", "queue1"),
             'tsparse': Gst.ElementFactory.make("tsparse", "tsparse"),
             'queue2': Gst.ElementFactory.make("queue", "queue2"),
             'tsdemux': Gst.ElementFactory.make("tsdemux", "tsdemux"),
-            'video_queue1': Gst.ElementFactory.make("queue", "video_queue1"),
-            'audio_queue1': Gst.ElementFactory.make("queue", "audio_queue1"),
-            'video_watchdog': Gst.ElementFactory.make("watchdog", "video_watchdog"),
-            'audio_watchdog': Gst.ElementFactory.make("watchdog", "audio_watchdog"),
             'watchdog_output': Gst.ElementFactory.make("watchdog", "watchdog_output"),
             'mpegtsmux': Gst.ElementFactory.make("mpegtsmux", "mux"),
             'final_queue1': Gst.ElementFactory.make("queue", "final_queue1"),
@@ -432,25 +442,18 @@ class InputPipelineHandler:
             'final_queue2': Gst.ElementFactory.make("queue", "final_queue2"),
             'shmsink': Gst.ElementFactory.make("shmsink", "shmsink")
         })
-
-        # Configure source with SRT options
-        srt_settings = self.selected_input
-        base_uri = srt_settings.get('uri', '')
-        options = srt_settings.get('options', {})
-        
-        # Set SRT properties
-        self.elements['source'].set_property('uri', base_uri)
-        
-        # Set default latency if not specified
-        latency = options.get('latency', 1000)
-        self.elements['source'].set_property('latency', latency)
-        
-        # Set streamid if specified
-        if 'streamid' in options:
-            self.elements['source'].set_property('streamid', options['streamid'])
-        
-        # Set larger blocksize for better performance
-        self.elements['source'].set_property('blocksize', 2097152)
+        # A branch nothing feeds would trip its watchdog, so only the carried streams get one
+        if self.streams['video']:
+            self.elements['video_queue1'] = Gst.ElementFactory.make("queue", "video_queue1")
+            self.elements['video_watchdog'] = Gst.ElementFactory.make("watchdog", "video_watchdog")
+        if self.streams['audio']:
+            self.elements['audio_queue1'] = Gst.ElementFactory.make("queue", "audio_queue1")
+            self.elements['audio_watchdog'] = Gst.ElementFactory.make("watchdog", "audio_watchdog")
+
+        if not self.gateway:
+            self._configure_srt_source()
+        if self.demux_program is not None:
+            self.elements['tsdemux'].set_property('program-number', int(self.demux_program))
         
         
         # Configure watchdogs with initial high timeout
@@ -458,25 +461,8 @@ class InputPipelineHandler:
         
         # Configure queues
         for queue in ['queue1', 'queue2', 'video_queue1', 'audio_queue1', 'final_queue1', 'final_queue2']:
-            self.elements[queue].set_property("leaky", 1)
-            self.elements[queue].set_property("max-size-buffers", 0)
-            self.elements[queue].set_property("max-size-time", 3000000000)
-            self.elements[queue].set_property("max-size-bytes", 0)
-
-        # Create parsers based on codec detection
-        self.logger.info(f"Creating parsers for video codec: {self.video_codec}, audio codec: {self.audio_codec}")
-        
-        if self.video_codec == 'h264':
-            self.elements['video_parser'] = Gst.ElementFactory.make("h264parse", "video_parser")
-        elif self.video_codec == 'hevc':
-            self.elements['video_parser'] = Gst.ElementFactory.make("h265parse", "video_parser")
-        elif self.video_codec == 'mpeg2video':
-            self.elements['video_parser'] = Gst.ElementFactory.make("mpegvideoparse", "video_parser")
-
-        if self.audio_codec == 'aac':
-            self.elements['audio_parser'] = Gst.ElementFactory.make("aacparse", "audio_parser")
-        elif self.audio_codec in ['mp2', 'mp3']:
-            self.elements['audio_parser'] = Gst.ElementFactory.make("mpegaudioparse", "audio_parser")
+            if queue in self.elements:
+                self.sizing.configure_queue(self.elements[queue])
 
         # Configure shared memory sink
         shm_path = f"{self.socket_dir}/{self.channel_name}_muxed_shm"
@@ -491,7 +477,7 @@ class InputPipelineHandler:
         self.elements['shmsink'].set_property('wait-for-connection', False)
         self.elements['shmsink'].set_property('sync', False)
         self.elements['shmsink'].set_property('async', False)
-        self.elements['shmsink'].set_property('shm-size', 2000000)
+        self.sizing.configure_shmsink(self.elements['shmsink'])
 
         # Add all elements to pipeline
         for element in self.elements.values():
@@ -519,13 +505,163 @@ class InputPipelineHandler:
         # Connect to pad-added signal for dynamic linking
         self.elements['tsdemux'].connect("pad-added", self.on_pad_added)
 
+        source_pad = self.elements['source'].get_static_pad('src')
+
+        # TR 101 290 checks on the received transport stream
+        if self.ts_analysis_timer:
+            GLib.source_remove(self.ts_analysis_timer)
+            self.ts_analysis_timer = None
+        self.ts_analyzer = create_analyzer(self.selected_input, self.stats_collector, self.logger)
+        if self.ts_analyzer:
+            source_pad.add_probe(Gst.PadProbeType.BUFFER | Gst.PadProbeType.BUFFER_LIST,
+                               self.ts_analyzer.probe_buffer)
+            self.ts_analysis_timer = GLib.timeout_add(1000, self.ts_analyzer.publish)
+
+        # Raw input for post-mortem captures; one ring for the life of the process
+        if self.flight_recorder is None:
+            self.flight_recorder = create_flight_recorder(self.selected_input, self.channel_name,
+                                                          self.stats_collector, self.logger)
+            if self.flight_recorder:
+                self.flight_recorder_timer = GLib.timeout_add(1000, self.flight_recorder.poll)
+        if self.flight_recorder:
+            source_pad.add_probe(Gst.PadProbeType.BUFFER | Gst.PadProbeType.BUFFER_LIST,
+                               self.flight_recorder.probe_buffer)
+
+        # Receive latency, and the stamps the next process matches the shm handoff against
+        if self.latency_timer:
+            GLib.source_remove(self.latency_timer)
+            self.latency_timer = None
+        if self.latency_probe:
+            self.latency_probe.close()
+        self.latency_probe = LatencyProbe(self.channel_name, 'input', stats_collector=self.stats_collector,
+                                          budgets=self.sizing.hop_budgets(), logger=self.logger)
+        self.latency_probe.add_ingress(source_pad)
+        self.latency_probe.add_egress('receive', self.elements['shmsink'].get_static_pad('sink'))
+        self.latency_timer = GLib.timeout_add(1000, self.latency_probe.update)
+
+        # Latest GOP for the transcoder and outputs to start from when they connect
+        if self.gop_cache_timer:
+            GLib.source_remove(self.gop_cache_timer)
+            self.gop_cache_timer = None
+        if self.gop_cache:
+            self.gop_cache.close()
+            self.gop_cache = None
+        gop_settings = gop_cache_settings(self.channel_settings)
+        if gop_settings is not None:
+            self.gop_cache = GOPCache(self.channel_name, gop_settings, self.stats_collector, self.logger)
+            self.elements['shmsink'].get_static_pad('sink').add_probe(
+                Gst.PadProbeType.BUFFER | Gst.PadProbeType.BUFFER_LIST, self.gop_cache.probe_buffer)
+            self.gop_cache_timer = GLib.timeout_add(1000, self.gop_cache.publish)
+
+        self.cached_probe = self.probe_cache.get(self.probe_key, self.demux_program)
+        if self.cached_probe and ((self.streams['video'] and not self.cached_probe['video_codec'])
+                                  or (self.streams['audio'] and not self.cached_probe['audio_codec'])):
+            # Analysed for another stream set; probe again so a missing stream is reported
+            self.cached_probe = None
+        if self.cached_probe:
+            # Start straight from the cached analysis and check the PMT version in the background
+            self.logger.info(
+                f"Using cached stream analysis (PMT version {self.cached_probe.get('pmt_version')}): "
+                f"video {self.cached_probe['video_codec']}, audio {self.cached_probe['audio_codec']}"
+            )
+            self._apply_cached_probe(self.cached_probe)
+            self.psi_discovery = PSIDiscovery(
+                source_pad, None, on_complete=self._on_psi_validated,
+                logger=self.logger, block=False
+            )
+        else:
+            # Read PAT/PMT from the first packets; parsers are added once the codecs are known
+            self.psi_discovery = PSIDiscovery(
+                source_pad, None,
+                on_complete=self._on_psi_discovered, on_timeout=self._on_psi_timeout,
+                logger=self.logger
+            )
+        self.psi_discovery.start()
+
+#main indent
+    def _on_psi_discovered(self, probe_data):
+        """Create the codec parsers from the discovered PSI; runs in the source streaming thread"""
+        try:
+            self.video_codec, self.audio_codec, self.video_pid, self.audio_pid, self.program_number = \
+                self.analyze_stream(probe_data)
+        except Exception as e:
+            self.logger.error(f"Stream analysis failed: {str(e)}")
+            GLib.idle_add(self._restart_from_main_loop)
+            return False
+
+        self.probe_cache.put(self.probe_key, self.demux_program, self.video_codec, self.audio_codec,
+                             self.video_pid, self.audio_pid, self.program_number, probe_data)
+        self._add_codec_parsers()
+        return True
+
+    def _apply_cached_probe(self, entry):
+        """Set up codecs, info files and parsers from a cached analysis"""
+        self.video_codec = entry['video_codec']
+        self.audio_codec = entry['audio_codec']
+        self.video_pid = entry['video_pid']
+        self.audio_pid = entry['audio_pid']
+        self.program_number = entry['found_program']
+        self._store_codec_info(self.video_codec, self.audio_codec, self.video_pid, self.audio_pid,
+                               self.program_number, entry['probe_data'])
+        self._add_codec_parsers()
+
+    def _on_psi_validated(self, probe_data):
+        """Compare the live PMT with the cached analysis; re-probe in full on a mismatch"""
+        if self.probe_cache.validate(self.cached_probe, probe_data):
+            self.logger.info(f"Cached stream analysis confirmed (PMT version {self.cached_probe['pmt_version']})")
+        else:
+            self.logger.warning("PMT differs from the cached stream analysis, re-probing")
+            self.probe_cache.invalidate(self.probe_key, self.demux_program)
+            GLib.idle_add(self._restart_from_main_loop)
+        return True
+
+    def _add_codec_parsers(self):
+        """Create the parsers for the detected codecs and add them to the pipeline"""
+        # Create parsers based on codec detection
+        self.logger.info(f"Creating parsers for video codec: {self.video_codec}, audio codec: {self.audio_codec}")
+
+        # A cached analysis may name a stream the channel no longer carries
+        video_codec = self.video_codec if self.streams['video'] else None
+        audio_codec = self.audio_codec if self.streams['audio'] else None
+
+        if video_codec == 'h264':
+            self.elements['video_parser'] = Gst.ElementFactory.make("h264parse", "video_parser")
+        elif video_codec == 'hevc':
+            self.elements['video_parser'] = Gst.ElementFactory.make("h265parse", "video_parser")
+        elif video_codec == 'mpeg2video':
+            self.elements['video_parser'] = Gst.ElementFactory.make("mpegvideoparse", "video_parser")
+        if video_codec != 'mpeg2video' and self.elements.get('video_parser') \
+                and gop_cache_settings(self.channel_settings) is not None:
+            # SPS/PPS with every IDR, so a cached GOP carries its own codec headers
+            self.elements['video_parser'].set_property('config-interval', -1)
+
+        if audio_codec == 'aac':
+            self.elements['audio_parser'] = Gst.ElementFactory.make("aacparse", "audio_parser")
+        elif audio_codec in ['mp2', 'mp3']:
+            self.elements['audio_parser'] = Gst.ElementFactory.make("mpegaudioparse", "audio_parser")
+
+        for name in ('video_parser', 'audio_parser'):
+            if self.elements.get(name):
+                self.pipeline.add(self.elements[name])
+                self.elements[name].sync_state_with_parent()
+
+    def _on_psi_timeout(self):
+        """No usable PSI arrived in time; restart like a watchdog timeout"""
+        self._handle_watchdog_timeout()
+
+    def _restart_from_main_loop(self):
+        self._handle_watchdog_timeout()
+        return False
+
 #main indent
     def on_pad_added(self, element, pad):
         """Handle dynamic pad connections from demuxer."""
         pad_name = pad.get_name()
         self.logger.info(f"New pad added: {pad_name}")
 
-        if pad_name.startswith("video"):
+        if pad_name.startswith(("video", "audio")) and f"{pad_name.split('_')[0]}_queue1" not in self.elements:
+            self.logger.info(f"Ignoring pad {pad_name}, the channel carries {describe_streams(self.streams)}")
+        elif pad_name.startswith("video"):
             if 'video_parser' in self.elements:
                 sink_pad = self.elements['video_queue1'].get_static_pad("sink")
                 if pad.link(sink_pad) == Gst.PadLinkReturn.OK:
@@ -536,7 +672,8 @@ class InputPipelineHandler:
                     if not self.elements['video_watchdog'].link(self.elements['video_parser']):
                         self.logger.error("Failed to link video_watchdog to video_parser")
                         return
-                    if not self.elements['video_parser'].link(self.elements['mpegtsmux']):
+                    if not self.elements['video_parser'].link_pads(
+                            'src', self.elements['mpegtsmux'], f"sink_{mux_video_pid(self.mux_settings)}"):
                         self.logger.error("Failed to link video_parser to mpegtsmux")
                         return
                     self.logger.info("Successfully linked video chain")
@@ -554,7 +691,8 @@ class InputPipelineHandler:
                     if not self.elements['audio_watchdog'].link(self.elements['audio_parser']):
                         self.logger.error("Failed to link audio_watchdog to audio_parser")
                         return
-                    if not self.elements['audio_parser'].link(self.elements['mpegtsmux']):
+                    if not self.elements['audio_parser'].link_pads(
+                            'src', self.elements['mpegtsmux'], f"sink_{mux_audio_pids(self.mux_settings, 1)[0]}"):
                         self.logger.error("Failed to link audio_parser to mpegtsmux")
                         return
                     self.logger.info("Successfully linked audio chain")
@@ -583,16 +721,22 @@ class InputPipelineHandler:
                 elif 'watchdog_output' in element_name:
                     self.logger.error("Output stream watchdog timeout - possible pipeline stall")
                 
+                if self.flight_recorder:
+                    self.flight_recorder.dump('watchdog', element_name)
                 self._handle_watchdog_timeout()
                 
             else:
                 self.logger.error(f"Pipeline error from element {element_name} (state: {element_state})")
                 self.logger.error(f"Error message: {error_msg}")
                 self.logger.error(f"Debug info: {debug_info}")
+                if self.flight_recorder:
+                    self.flight_recorder.dump('pipeline_error', f"{element_name}: {error_msg}")
 
         elif t == Gst.MessageType.WARNING:
             warn, debug = message.parse_warning()
             self.logger.warning(f"Pipeline warning: {warn.message}")
+            if self.flight_recorder:
+                self.flight_recorder.mark('warning', f"{message.src.get_name()}: {warn.message}")
             self.logger.debug(f"Warning debug info: {debug}")
             
         elif t == Gst.MessageType.STATE_CHANGED:
@@ -611,6 +755,59 @@ class InputPipelineHandler:
         elif t == Gst.MessageType.EOS:
             self.logger.warning("End of stream reached")
 
+#main indent
+    def _configure_srt_source(self):
+        """Configure srtsrc from the input's uri and SRT options"""
+        srt_settings = self.selected_input
+        base_uri = srt_settings.get('uri', '')
+        options = srt_settings.get('options', {})
+        
+        # Set SRT properties
+        self.elements['source'].set_property('uri', base_uri)
+        
+        self.elements['source'].set_property('latency', self._srt_latency())
+        
+        # Set streamid if specified
+        if 'streamid' in options:
+            self.elements['source'].set_property('streamid', options['streamid'])
+        
+        # Set larger blocksize for better performance
+        self.elements['source'].set_property('blocksize', 2097152)
+
+#main indent
+    def _srt_latency(self):
+        """Latency from the input's options, else from the channel's latency_profile"""
+        return (self.selected_input.get('options') or {}).get('latency', self.sizing.srt_latency_ms())
+
+#main indent
+    def _create_gateway_source(self):
+        """Read this input from the SRT gateway instead of listening or calling ourselves"""
+        path = register_route(self.channel_name, self.selected_input, self._srt_latency())
+        self.logger.info(f"Registered stream id '{gateway_streamid(self.channel_name, self.selected_input)}' "
+                         f"with the SRT gateway, waiting for {path}")
+        deadline = time.time() + GATEWAY_SOCKET_TIMEOUT
+        while not os.path.exists(path):
+            if time.time() > deadline:
+                unregister_route(self.channel_name)
+                raise RuntimeError(f"SRT gateway did not create {path} within {GATEWAY_SOCKET_TIMEOUT}s, "
+                                   f"check the gateway log")
+            time.sleep(0.5)
+
+        source = Gst.ElementFactory.make("shmsrc", "source")
+        source.set_property('socket-path', path)
+        source.set_property('is-live', True)
+        source.set_property('do-timestamp', True)
+        return source
+
+#main indent
+    def _refresh_gateway(self):
+        """Keep the SRT gateway route alive"""
+        try:
+            register_route(self.channel_name, self.selected_input, self._srt_latency())
+        except OSError as e:
+            self.logger.error(f"Could not refresh SRT gateway route: {str(e)}")
+        return True
+
 #main indent
     def print_srt_stats(self):
         """Collect and store SRT statistics"""
@@ -641,11 +838,13 @@ class InputPipelineHandler:
         
         try:
             # Create and set up pipeline
-            self.video_codec, self.audio_codec, self.video_pid, self.audio_pid, self.program_number = self.analyze_stream()
             self.create_pipeline()
             
-            # Start SRT stats collection
-            self.srt_stats_timer = GLib.timeout_add(5000, self.print_srt_stats)
+            # Start SRT stats collection; the gateway publishes them for its callers
+            if self.gateway:
+                self.gateway_timer = GLib.timeout_add_seconds(5, self._refresh_gateway)
+            else:
+                self.srt_stats_timer = GLib.timeout_add(5000, self.print_srt_stats)
             
             # Generate initial DOT file
             self.generate_dot_file("initial")
@@ -663,6 +862,13 @@ class InputPipelineHandler:
             # Generate DOT file after pipeline is playing
             self.generate_dot_file("playing")
             
+            # Measure main loop lag so blocking callbacks show up in stats
+            self.lag_probe = GLibLagProbe(
+                f"{self.channel_name}_srt_input", self.logger,
+                stats_collector=self.stats_collector, stat_type="loop_lag_input"
+            )
+            self.lag_probe.start()
+            
             # Run the main loop
             loop = GLib.MainLoop()
             try:
@@ -682,12 +888,46 @@ class InputPipelineHandler:
         """Cleanup resources"""
         self.logger.info("Starting cleanup")
         
+        if self.lag_probe:
+            self.lag_probe.stop()
+
+        if self.psi_discovery:
+            self.psi_discovery.stop()
+
+        if self.ts_analysis_timer:
+            GLib.source_remove(self.ts_analysis_timer)
+            self.ts_analysis_timer = None
+
+        if self.latency_timer:
+            GLib.source_remove(self.latency_timer)
+            self.latency_timer = None
+        if self.latency_probe:
+            self.latency_probe.close()
+
+        if self.gop_cache_timer:
+            GLib.source_remove(self.gop_cache_timer)
+            self.gop_cache_timer = None
+        if self.gop_cache:
+            self.gop_cache.close()
+
+        if self.flight_recorder_timer:
+            GLib.source_remove(self.flight_recorder_timer)
+            self.flight_recorder_timer = None
+        if self.flight_recorder:
+            self.flight_recorder.close()
+        
         try:
             # Stop SRT stats collection
             if self.srt_stats_timer:
                 GLib.source_remove(self.srt_stats_timer)
                 self.logger.debug("Stopped SRT statistics collection")
 
+            if self.gateway:
+                if self.gateway_timer:
+                    GLib.source_remove(self.gateway_timer)
+                    self.gateway_timer = None
+                unregister_route(self.channel_name)
+
             # Stop pipeline
             if self.pipeline:
                 self.logger.info("Stopping pipeline")
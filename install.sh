@@ -25,7 +25,7 @@ xargs apt install -y < system-packages.txt
 # Install Python packages
 #pip install -r requirements.txt
 # Install essential packages via apt
-apt install -y python3-flask python3-flask-cors python3-redis python3-psutil python3-yaml python3-gi python3-pip
+apt install -y python3-flask python3-flask-cors python3-redis python3-psutil python3-yaml python3-gi python3-pip python3-numpy
 
 # Install Python packages based on Ubuntu version
 #pip install --break-system-packages aiohttp psutil redis Flask Flask-Cors PyYAML
@@ -66,6 +66,8 @@ declare -a services=(
     "channel-manager"
     "channel-monitor"
     "metrics-collector"
+    "shared-ingest"
+    "srt-gateway"
     "stats_api"
 )
 for service in "${services[@]}"; do
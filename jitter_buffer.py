@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from ts_psi import TS_PACKET_SIZE, SYNC_BYTE
+
+PCR_CLOCK = 27000000
+PCR_WRAP = (1 << 33) * 300
+
+DEFAULT_PERCENTILE = 99
+DEFAULT_MARGIN_MS = 20
+DEFAULT_MIN_MS = 20
+DEFAULT_MAX_MS = 1000
+DEFAULT_INITIAL_MS = 100
+DEFAULT_WINDOW = 10          # seconds of PCR arrivals the percentile is taken over
+SHRINK_AFTER = 10            # seconds the target must stay lower before the delay comes down
+STEP_MS = 10
+PCR_RESET = 1.0              # PCR and arrival clocks drifting apart by this much is a discontinuity
+
+
+def create_jitter_buffer(input_config: Dict, tsparse, pipeline, queue=None, stats_collector=None,
+                         defaults: Optional[Dict] = None,
+                         logger: Optional[logging.Logger] = None) -> Optional['AdaptiveJitterBuffer']:
+    """Jitter buffer for an input configured with `jitter_buffer: true` or a settings dict"""
+    settings = input_config.get('jitter_buffer')
+    if not settings:
+        return None
+    # Bounds from the latency profile, under whatever the input sets itself
+    settings = {**(defaults or {}), **(settings if isinstance(settings, dict) else {})}
+    return AdaptiveJitterBuffer(tsparse, pipeline, settings, queue=queue,
+                                stats_collector=stats_collector, logger=logger)
+
+
+class AdaptiveJitterBuffer:
+    """
+    Sizes tsparse's PCR smoothing to the jitter actually seen on the input. Each PCR's
+    arrival time is compared with the PCR itself; how late a packet is relative to the
+    earliest one in the window is its jitter, and the delay follows a percentile of that
+    plus a margin, within min/max bounds. The delay grows as soon as the target does and
+    only shrinks after the target has stayed lower for SHRINK_AFTER seconds. Packets later
+    than the current delay are counted as underruns, a full queue behind tsparse as overruns.
+    """
+
+    def __init__(self, tsparse, pipeline, settings: Dict, queue=None, stats_collector=None,
+                 logger: Optional[logging.Logger] = None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.tsparse = tsparse
+        self.pipeline = pipeline
+        self.queue = queue
+        self.stats_collector = stats_collector
+
+        self.percentile = float(settings.get('percentile', DEFAULT_PERCENTILE))
+        self.margin_ms = float(settings.get('margin-ms', DEFAULT_MARGIN_MS))
+        self.min_ms = float(settings.get('min-ms', DEFAULT_MIN_MS))
+        self.max_ms = float(settings.get('max-ms', DEFAULT_MAX_MS))
+        self.window = float(settings.get('window', DEFAULT_WINDOW))
+        if self.min_ms > self.max_ms:
+            raise ValueError("jitter_buffer min-ms is larger than max-ms")
+
+        self.pcr_pid = settings.get('pcr-pid')
+        self.delay_ms = min(self.max_ms, max(self.min_ms, float(settings.get('initial-ms', DEFAULT_INITIAL_MS))))
+        self.target_ms = self.delay_ms
+        self._lower_since = None
+
+        self._lock = threading.Lock()
+        self._samples = deque()
+        self._minimum = deque()      # running minimum of the offsets in the window
+        self._last_pcr = None
+        self._pcr_base = 0
+        self.underruns = 0
+        self.overruns = 0
+        self.resets = 0
+
+        self.tsparse.set_property('set-timestamps', True)
+        self.tsparse.set_property('smoothing-latency', int(self.delay_ms * 1000))
+        if self.pcr_pid is not None:
+            self.tsparse.set_property('pcr-pid', int(self.pcr_pid))
+        if self.queue:
+            self.queue.connect('overrun', self._on_overrun)
+        self.logger.info(f"Adaptive jitter buffer: p{self.percentile:g} + {self.margin_ms:g}ms, "
+                         f"{self.min_ms:g}-{self.max_ms:g}ms, starting at {self.delay_ms:g}ms")
+
+    def _on_overrun(self, queue):
+        with self._lock:
+            self.overruns += 1
+
+    def probe_buffer(self, pad, info):
+        """Pad probe callback for BUFFER and BUFFER_LIST probes on the input; never holds data back"""
+        buffers = [info.get_buffer()]
+        if info.type & Gst.PadProbeType.BUFFER_LIST:
+            buffer_list = info.get_buffer_list()
+            buffers = [buffer_list.get(i) for i in range(buffer_list.length())]
+        arrival = time.monotonic()
+        for buffer in buffers:
+            if buffer is None:
+                continue
+            success, map_info = buffer.map(Gst.MapFlags.READ)
+            if success:
+                try:
+                    self.feed(map_info.data, arrival)
+                finally:
+                    buffer.unmap(map_info)
+        return Gst.PadProbeReturn.OK
+
+    def feed(self, data, arrival: float):
+        """Record the arrival time of every PCR on the PCR PID in a chunk of TS"""
+        with self._lock:
+            for pos in range(0, len(data) - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+                # Adaptation field present, long enough for a PCR, PCR flag set
+                if data[pos] != SYNC_BYTE or not data[pos + 3] & 0x20 or data[pos + 4] < 7 \
+                        or not data[pos + 5] & 0x10:
+                    continue
+                pid = ((data[pos + 1] & 0x1F) << 8) | data[pos + 2]
+                if self.pcr_pid is None:
+                    self.pcr_pid = pid
+                    self.logger.info(f"Jitter buffer measuring PCR on PID {hex(pid)}")
+                elif pid != self.pcr_pid:
+                    continue
+                base = (data[pos + 6] << 25) | (data[pos + 7] << 17) | (data[pos + 8] << 9) \
+                    | (data[pos + 9] << 1) | (data[pos + 10] >> 7)
+                extension = ((data[pos + 10] & 0x01) << 8) | data[pos + 11]
+                self._add_sample(base * 300 + extension, arrival)
+
+    def _add_sample(self, pcr: int, arrival: float):
+        if self._last_pcr is not None and pcr < self._last_pcr and self._last_pcr - pcr > PCR_WRAP // 2:
+            self._pcr_base += PCR_WRAP
+        self._last_pcr = pcr
+        offset = arrival - (self._pcr_base + pcr) / PCR_CLOCK
+
+        if self._samples and abs(offset - self._samples[-1][1]) > PCR_RESET:
+            # Source restarted or PCR jumped; the old samples say nothing about the new timeline
+            self._samples.clear()
+            self._minimum.clear()
+            self.resets += 1
+        self._samples.append((arrival, offset))
+        while self._minimum and self._minimum[-1][1] >= offset:
+            self._minimum.pop()
+        self._minimum.append((arrival, offset))
+        while arrival - self._samples[0][0] > self.window:
+            self._samples.popleft()
+        while arrival - self._minimum[0][0] > self.window:
+            self._minimum.popleft()
+
+        # Arrived after the point it would have been played out at the current delay
+        if (offset - self._minimum[0][1]) * 1000 > self.delay_ms:
+            self.underruns += 1
+
+    def _measure(self) -> Optional[Dict]:
+        """Jitter percentile and maximum over the window, in ms"""
+        if len(self._samples) < 10:
+            return None
+        offsets = [sample[1] for sample in self._samples]
+        earliest = min(offsets)
+        lateness = sorted((offset - earliest) * 1000 for offset in offsets)
+        index = min(len(lateness) - 1, int(len(lateness) * self.percentile / 100))
+        return {'jitter_ms': lateness[index], 'jitter_max_ms': lateness[-1], 'samples': len(lateness)}
+
+    def update(self):
+        """Resize the delay from the latest measurement and publish; runs as a GLib timer"""
+        try:
+            now = time.monotonic()
+            with self._lock:
+                measurement = self._measure()
+                stats = {
+                    'underruns': self.underruns,
+                    'overruns': self.overruns,
+                    'pcr_resets': self.resets
+                }
+                self.underruns = self.overruns = self.resets = 0
+
+            if measurement:
+                target = measurement['jitter_ms'] + self.margin_ms
+                target = STEP_MS * -(-target // STEP_MS)
+                self.target_ms = min(self.max_ms, max(self.min_ms, target))
+                if self.target_ms > self.delay_ms:
+                    self._apply(self.target_ms, f"jitter p{self.percentile:g} {measurement['jitter_ms']:.1f}ms")
+                    self._lower_since = None
+                elif self.target_ms < self.delay_ms:
+                    self._lower_since = self._lower_since or now
+                    if now - self._lower_since >= SHRINK_AFTER:
+                        self._apply(self.target_ms, f"jitter down to {measurement['jitter_ms']:.1f}ms")
+                        self._lower_since = None
+                else:
+                    self._lower_since = None
+
+            stats.update({
+                'delay_ms': self.delay_ms,
+                'target_ms': self.target_ms,
+                'percentile': self.percentile,
+                'jitter_ms': measurement['jitter_ms'] if measurement else None,
+                'jitter_max_ms': measurement['jitter_max_ms'] if measurement else None,
+                'samples': measurement['samples'] if measurement else 0,
+                'pcr_pid': hex(self.pcr_pid) if self.pcr_pid is not None else None
+            })
+            if self.queue:
+                stats['queue_level_ms'] = self.queue.get_property('current-level-time') / 1e6
+            if self.stats_collector:
+                self.stats_collector.add_stats("jitter_buffer", stats)
+        except Exception as e:
+            self.logger.error(f"Error updating jitter buffer: {str(e)}")
+        return True
+
+    def _apply(self, delay_ms: float, reason: str):
+        self.logger.info(f"Jitter buffer delay {self.delay_ms:g}ms -> {delay_ms:g}ms ({reason})")
+        self.delay_ms = delay_ms
+        self.tsparse.set_property('smoothing-latency', int(delay_ms * 1000))
+        # Sinks only hold data back by the new amount once the pipeline latency is recomputed
+        self.pipeline.recalculate_latency()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from ts_psi import TS_PACKET_SIZE, SYNC_BYTE
+
+LATENCY_DIR = "/tmp/caricoder"
+# cumulative latency and latency budget at this process's egress (ms), records written,
+# monotonic time of the last update
+HEADER = struct.Struct('<ddQd')
+# stream key, monotonic time it left the process
+RECORD = struct.Struct('<Qd')
+RING_SIZE = 1024             # about 10 s of PCRs and video PTSs at typical rates
+SAMPLE_INTERVAL = 0.05       # how often each stage samples a buffer's age
+STALE_AFTER = 5.0            # an upstream that has not updated for this long is not counted
+MAX_HANDOFF = 10.0           # matches further apart than this are taken to be a wrapped or reused key
+KEY_PTS = 1 << 63            # PCR and PTS keys share one 64 bit space
+
+
+def ts_timestamps(data) -> List[int]:
+    """PCRs and video PES PTSs in a chunk of TS as keys carrying their PID"""
+    keys = []
+    for pos in range(0, len(data) - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+        if data[pos] != SYNC_BYTE:
+            continue
+        pid = ((data[pos + 1] & 0x1F) << 8) | data[pos + 2]
+        payload = pos + 4
+        if data[pos + 3] & 0x20:
+            length = data[pos + 4]
+            if length >= 7 and data[pos + 5] & 0x10:
+                base = (data[pos + 6] << 25) | (data[pos + 7] << 17) | (data[pos + 8] << 9) \
+                    | (data[pos + 9] << 1) | (data[pos + 10] >> 7)
+                keys.append((pid << 33) | base)
+            payload += 1 + length
+        # Start of a video PES with a PTS
+        if data[pos + 1] & 0x40 and data[pos + 3] & 0x10 and payload + 14 <= pos + TS_PACKET_SIZE \
+                and data[payload] == 0 and data[payload + 1] == 0 and data[payload + 2] == 1 \
+                and 0xE0 <= data[payload + 3] <= 0xEF and data[payload + 7] & 0x80:
+            p = payload + 9
+            pts = ((data[p] & 0x0E) << 29) | (data[p + 1] << 22) | ((data[p + 2] & 0xFE) << 14) \
+                | (data[p + 3] << 7) | (data[p + 4] >> 1)
+            keys.append(KEY_PTS | (pid << 33) | pts)
+    return keys
+
+
+def latency_path(channel_name: str, process_name: str) -> str:
+    return os.path.join(LATENCY_DIR, f"{channel_name}_{process_name}_latency")
+
+
+class LatencyProbe:
+    """
+    Latency of one process in a channel's chain and of the chain up to it. Stage pads
+    sample how far each buffer's running time is behind the pipeline clock; the difference
+    between consecutive stages is the time spent in between. The TS at the ingress and
+    egress pads is stamped by its PCRs and video PTSs against the monotonic clock, which
+    every process on the host shares. Egress stamps go to a small ring file the next
+    process reads, so the shm handoff is matched on identical packets, and the chain's
+    total so far is carried in the same file. With hop budgets from a latency profile each
+    hop is checked against its budget and the chain's budget is carried alongside the total.
+    """
+
+    def __init__(self, channel_name: str, process_name: str, upstream: Optional[str] = None,
+                 stats_collector=None, budgets: Optional[Dict[str, float]] = None,
+                 logger: Optional[logging.Logger] = None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.channel_name = channel_name
+        self.process_name = process_name
+        self.upstream = upstream
+        self.stats_collector = stats_collector
+        self.budgets = budgets
+        self._over_budget = ''
+
+        self.stages = []
+        self._lock = threading.Lock()
+        self._ages = {'ingress': []}
+        self._last_sample = {}
+        self._ingress_stamps = deque(maxlen=RING_SIZE * 4)
+        self.egress_stage = None
+
+        self._path = latency_path(channel_name, process_name)
+        self._ring = None
+        self._written = 0
+        self._cumulative_ms = float('nan')
+        self._cumulative_budget_ms = float('nan')
+
+    def add_ingress(self, pad):
+        """TS entering the process; the zero point of its stages and the far end of the handoff"""
+        pad.add_probe(Gst.PadProbeType.BUFFER | Gst.PadProbeType.BUFFER_LIST, self._probe, 'ingress', 'ingress')
+
+    def add_stage(self, name: str, pad):
+        """Buffers after a step of the process; the hop is measured from the previous stage"""
+        self.stages.append(name)
+        self._ages[name] = []
+        pad.add_probe(Gst.PadProbeType.BUFFER | Gst.PadProbeType.BUFFER_LIST, self._probe, name, None)
+
+    def add_egress(self, name: str, pad, ts: bool = True):
+        """Last stage of the process; with ts its stamps are published for the next process"""
+        self.add_stage(name, pad)
+        self.egress_stage = name
+        if ts:
+            self._open_ring()
+            pad.add_probe(Gst.PadProbeType.BUFFER | Gst.PadProbeType.BUFFER_LIST, self._probe, None, 'egress')
+
+    def _open_ring(self):
+        os.makedirs(LATENCY_DIR, exist_ok=True)
+        size = HEADER.size + RING_SIZE * RECORD.size
+        fd = os.open(self._path, os.O_CREAT | os.O_RDWR | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, size)
+            self._ring = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        HEADER.pack_into(self._ring, 0, self._cumulative_ms, self._cumulative_budget_ms, 0, time.monotonic())
+
+    def _probe(self, pad, info, stage, stamp):
+        try:
+            buffers = [info.get_buffer()]
+            if info.type & Gst.PadProbeType.BUFFER_LIST:
+                buffer_list = info.get_buffer_list()
+                buffers = [buffer_list.get(i) for i in range(buffer_list.length())]
+            buffers = [buffer for buffer in buffers if buffer is not None]
+            if stage and buffers:
+                self._sample_age(pad, buffers[0], stage)
+            if stamp:
+                self._stamp(buffers, stamp)
+        except Exception as e:
+            self.logger.debug(f"Latency probe error: {str(e)}")
+        return Gst.PadProbeReturn.OK
+
+    def _sample_age(self, pad, buffer, stage: str):
+        now = time.monotonic()
+        if now - self._last_sample.get(stage, 0) < SAMPLE_INTERVAL:
+            return
+        # Decode order timestamp where there is one, which is when the buffer was due
+        timestamp = buffer.dts if buffer.dts != Gst.CLOCK_TIME_NONE else buffer.pts
+        element = pad.get_parent_element()
+        clock = element.get_clock() if element else None
+        event = pad.get_sticky_event(Gst.EventType.SEGMENT, 0)
+        if timestamp == Gst.CLOCK_TIME_NONE or clock is None or event is None:
+            return
+        running_time = event.parse_segment().to_running_time(Gst.Format.TIME, timestamp)
+        if running_time == Gst.CLOCK_TIME_NONE:
+            return
+        age_ms = (clock.get_time() - element.get_base_time() - running_time) / 1e6
+        self._last_sample[stage] = now
+        with self._lock:
+            self._ages[stage].append(age_ms)
+
+    def _stamp(self, buffers, stamp: str):
+        now = time.monotonic()
+        keys = []
+        for buffer in buffers:
+            success, map_info = buffer.map(Gst.MapFlags.READ)
+            if success:
+                try:
+                    keys.extend(ts_timestamps(map_info.data))
+                finally:
+                    buffer.unmap(map_info)
+        if not keys:
+            return
+        if stamp == 'ingress':
+            with self._lock:
+                self._ingress_stamps.extend((key, now) for key in keys)
+        elif self._ring is not None:
+            for key in keys:
+                RECORD.pack_into(self._ring, HEADER.size + (self._written % RING_SIZE) * RECORD.size, key, now)
+                self._written += 1
+            HEADER.pack_into(self._ring, 0, self._cumulative_ms, self._cumulative_budget_ms, self._written, now)
+
+    def _read_upstream(self):
+        """Upstream egress stamps by key and its cumulative latency and budget, or None if it is not running"""
+        try:
+            with open(latency_path(self.channel_name, self.upstream), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if len(data) < HEADER.size:
+            return None
+        cumulative_ms, cumulative_budget_ms, written, updated = HEADER.unpack_from(data, 0)
+        if time.monotonic() - updated > STALE_AFTER:
+            return None
+        stamps = {}
+        count = min(written, RING_SIZE, (len(data) - HEADER.size) // RECORD.size)
+        for i in range(count):
+            key, stamped = RECORD.unpack_from(data, HEADER.size + i * RECORD.size)
+            stamps[key] = stamped
+        return stamps, cumulative_ms, cumulative_budget_ms
+
+    def _handoff(self, ingress_stamps) -> Optional[Dict]:
+        """Time from the upstream egress to this ingress for the stamps both sides saw"""
+        upstream = self._read_upstream()
+        if upstream is None:
+            return None
+        stamps, cumulative_ms, cumulative_budget_ms = upstream
+        delays = []
+        for key, stamped in ingress_stamps:
+            sent = stamps.get(key)
+            if sent is not None and 0 <= stamped - sent <= MAX_HANDOFF:
+                delays.append((stamped - sent) * 1000)
+        return {
+            'upstream_total_ms': None if cumulative_ms != cumulative_ms else cumulative_ms,
+            'upstream_budget_ms': None if cumulative_budget_ms != cumulative_budget_ms else cumulative_budget_ms,
+            'handoff_ms': sum(delays) / len(delays) if delays else None,
+            'handoff_max_ms': max(delays) if delays else None,
+            'handoff_matched': len(delays)
+        }
+
+    def update(self):
+        """Publish the hops measured since the last call; runs as a GLib timer"""
+        try:
+            with self._lock:
+                ages = {stage: values for stage, values in self._ages.items()}
+                self._ages = {stage: [] for stage in ages}
+                ingress_stamps = list(self._ingress_stamps)
+                self._ingress_stamps.clear()
+
+            def mean(values):
+                return sum(values) / len(values) if values else None
+
+            stats = {'process': self.process_name}
+            baseline = mean(ages['ingress']) or 0.0
+            previous = baseline
+            for stage in self.stages:
+                age = mean(ages[stage])
+                stats[f'{stage}_ms'] = age - previous if age is not None and previous is not None else None
+                previous = age
+
+            egress = ages.get(self.egress_stage) if self.egress_stage else None
+            stats['process_ms'] = mean(egress) - baseline if egress else None
+            stats['process_max_ms'] = max(egress) - baseline if egress else None
+
+            total = stats['process_ms']
+            if self.upstream:
+                handoff = self._handoff(ingress_stamps) or {
+                    'upstream_total_ms': None, 'upstream_budget_ms': None,
+                    'handoff_ms': None, 'handoff_max_ms': None, 'handoff_matched': 0
+                }
+                stats.update(handoff)
+                if None in (total, handoff['upstream_total_ms'], handoff['handoff_ms']):
+                    total = None
+                else:
+                    total += handoff['upstream_total_ms'] + handoff['handoff_ms']
+            stats['total_ms'] = total
+            if self.budgets:
+                stats.update(self._check_budget(stats))
+
+            if self._ring is not None:
+                self._cumulative_ms = total if total is not None else float('nan')
+                budget = stats.get('total_budget_ms')
+                self._cumulative_budget_ms = budget if budget is not None else float('nan')
+                HEADER.pack_into(self._ring, 0, self._cumulative_ms, self._cumulative_budget_ms,
+                                 self._written, time.monotonic())
+            if self.stats_collector:
+                self.stats_collector.add_stats(f"latency_{self.process_name}", stats)
+        except Exception as e:
+            self.logger.error(f"Error updating latency stats: {str(e)}")
+        return True
+
+    def _check_budget(self, stats: Dict) -> Dict:
+        """This process's budget, the chain's budget so far and the hops that went over"""
+        hops = (['handoff'] if self.upstream else []) + self.stages
+        budget = sum(self.budgets.get(hop, 0.0) for hop in hops)
+        over = [hop for hop in hops if hop in self.budgets and stats.get(f'{hop}_ms') is not None
+                and stats[f'{hop}_ms'] > self.budgets[hop]]
+
+        over_budget = ', '.join(f"{hop} {stats[f'{hop}_ms']:.0f}/{self.budgets[hop]:.0f}ms" for hop in over)
+        if bool(over) != bool(self._over_budget):
+            if over:
+                self.logger.warning(f"Latency over budget in {self.process_name}: {over_budget}")
+            else:
+                self.logger.info(f"Latency back within budget in {self.process_name}")
+        self._over_budget = over_budget
+
+        total_budget = budget
+        if self.upstream:
+            upstream = stats.get('upstream_budget_ms')
+            total_budget = budget + upstream if upstream is not None else None
+        return {
+            'budget_ms': budget,
+            'total_budget_ms': total_budget,
+            'over_budget': ', '.join(over),
+            'within_budget': None if stats['total_ms'] is None or total_budget is None
+            else stats['total_ms'] <= total_budget
+        }
+
+    def close(self):
+        """Stop publishing egress stamps and remove the ring file"""
+        if self._ring is not None:
+            ring, self._ring = self._ring, None
+            ring.close()
+            try:
+                os.unlink(self._path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+import logging
+from typing import Dict, Optional
+
+# SRT receive latency of inputs without a profile or their own latency option
+DEFAULT_SRT_LATENCY_MS = 1000
+
+# What each handler has always used, for channels without a latency_profile.
+# None leaves the element's own default in place.
+LEGACY = {
+    'udp_input': {'queue-time-ms': 3000, 'queue-buffers': 0, 'queue-bytes': 0, 'leaky': 1, 'shm-size': 2000000},
+    'srt_input': {'queue-time-ms': 3000, 'queue-buffers': 0, 'queue-bytes': 0, 'leaky': 1, 'shm-size': 2000000,
+                  'srt-latency-ms': DEFAULT_SRT_LATENCY_MS},
+    'hls_input': {'queue-time-ms': 300000, 'queue-buffers': 1000000, 'queue-bytes': None, 'leaky': 1,
+                  'shm-size': 2000000},
+    'transcoder': {'queue-time-ms': 3000, 'queue-buffers': 0, 'queue-bytes': 0, 'leaky': 1, 'shm-size': 4000000,
+                   'encoders': {'x264enc': {'tune': 0x00000004, 'speed-preset': 2},
+                                'x265enc': {'tune': 'zerolatency', 'speed-preset': 'superfast'}}},
+    'udp_output': {'queue-time-ms': 3000, 'queue-buffers': 0, 'queue-bytes': 0, 'leaky': 1},
+    'hls_output': {'queue-time-ms': 500000, 'queue-buffers': 1000000, 'queue-bytes': None, 'leaky': 1,
+                   'tsparse-smoothing-us': 1000},
+    'caricoder': {'queue-time-ms': 500000, 'queue-buffers': 1000000, 'queue-bytes': None, 'leaky': 1,
+                  'tsparse-smoothing-us': {'tsparse1': 1000, 'tsparse2': 4000}},
+}
+
+# leaky 2 drops the oldest data so a stall never turns into standing delay; leaky 1 drops
+# the newest and keeps everything already queued, which rides out longer stalls
+PROFILES = {
+    'ultra-low': {
+        'queue-time-ms': 200, 'queue-buffers': 0, 'queue-bytes': 0, 'leaky': 2,
+        'tsparse-smoothing-us': 10000,
+        'shm-size': 1000000,
+        'srt-latency-ms': 120,
+        'jitter-buffer': {'min-ms': 10, 'max-ms': 100, 'initial-ms': 30},
+        'encoders': {
+            'x264enc': {'tune': 0x00000004, 'speed-preset': 1, 'bframes': 0, 'rc-lookahead': 0,
+                        'sync-lookahead': 0, 'sliced-threads': True},
+            'x265enc': {'tune': 'zerolatency', 'speed-preset': 'ultrafast'},
+            'avenc_mpeg2video': {'bf': 0}
+        },
+        'budget-ms': {'receive': 50, 'handoff': 10, 'demux': 20, 'decode': 40, 'encode': 80, 'mux': 50,
+                      'send': 50}
+    },
+    'low': {
+        'queue-time-ms': 1000, 'queue-buffers': 0, 'queue-bytes': 0, 'leaky': 2,
+        'tsparse-smoothing-us': 50000,
+        'shm-size': 2000000,
+        'srt-latency-ms': 400,
+        'jitter-buffer': {'min-ms': 20, 'max-ms': 300, 'initial-ms': 100},
+        'encoders': {
+            'x264enc': {'tune': 0x00000004, 'speed-preset': 2},
+            'x265enc': {'tune': 'zerolatency', 'speed-preset': 'superfast'},
+            'avenc_mpeg2video': {'bf': 0}
+        },
+        'budget-ms': {'receive': 200, 'handoff': 20, 'demux': 50, 'decode': 100, 'encode': 250, 'mux': 150,
+                      'send': 200}
+    },
+    'resilient': {
+        'queue-time-ms': 3000, 'queue-buffers': 0, 'queue-bytes': 0, 'leaky': 1,
+        'tsparse-smoothing-us': 200000,
+        'shm-size': 8000000,
+        'srt-latency-ms': 2000,
+        'jitter-buffer': {'min-ms': 50, 'max-ms': 1000, 'initial-ms': 200},
+        'encoders': {
+            'x264enc': {'tune': 0, 'speed-preset': 3, 'bframes': 2, 'rc-lookahead': 20},
+            'x265enc': {'speed-preset': 'veryfast'},
+            'avenc_mpeg2video': {'bf': 2}
+        },
+        'budget-ms': {'receive': 1000, 'handoff': 50, 'demux': 200, 'decode': 200, 'encode': 1500, 'mux': 500,
+                      'send': 1000}
+    }
+}
+
+# HLS arrives a whole segment at a time at download speed, so whatever the profile its
+# queues hold several segments and never drop what is already buffered
+ROLE_OVERRIDES = {
+    'hls_input': {'queue-time-ms': 30000, 'leaky': 1}
+}
+
+
+class LatencySizing:
+    """
+    Turns a channel's `latency_profile` into the sizing of one handler's elements: queue
+    limits and leak policy, tsparse smoothing, shm sizes, jitter buffer bounds and encoder
+    tuning, plus the latency budget of each hop the latency probes measure. The profile is
+    a name from PROFILES or a dict with a `name` and any of its keys overridden. Without
+    one every element keeps the sizing its handler used before, and there is no budget.
+    """
+
+    def __init__(self, channel_settings: Dict, role: str, logger: Optional[logging.Logger] = None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.role = role
+
+        setting = channel_settings.get('latency_profile')
+        overrides = {}
+        if isinstance(setting, dict):
+            overrides = {key: value for key, value in setting.items() if key != 'name'}
+            setting = setting.get('name')
+        self.profile = setting
+
+        if self.profile is None:
+            self.settings = dict(LEGACY[role])
+        elif self.profile in PROFILES:
+            self.settings = {**PROFILES[self.profile], **ROLE_OVERRIDES.get(role, {}), **overrides}
+            self.logger.info(f"Sizing {role} elements for latency profile '{self.profile}'")
+        else:
+            raise ValueError(f"Unknown latency_profile '{self.profile}', expected one of {', '.join(PROFILES)}")
+
+    def configure_queue(self, queue):
+        """Time limit and leak policy for a queue"""
+        queue.set_property("leaky", self.settings['leaky'])
+        queue.set_property("max-size-buffers", self.settings['queue-buffers'])
+        queue.set_property("max-size-time", int(self.settings['queue-time-ms'] * 1000000))
+        if self.settings.get('queue-bytes') is not None:
+            queue.set_property("max-size-bytes", self.settings['queue-bytes'])
+
+    def configure_tsparse(self, tsparse):
+        """Smoothing latency for a tsparse that sets timestamps"""
+        smoothing = self.settings.get('tsparse-smoothing-us')
+        if isinstance(smoothing, dict):
+            smoothing = smoothing.get(tsparse.get_name())
+        if smoothing is not None:
+            tsparse.set_property("smoothing-latency", int(smoothing))
+
+    def configure_shmsink(self, shmsink):
+        shmsink.set_property('shm-size', int(self.settings['shm-size']))
+
+    def encoder_properties(self, factory_name: str) -> Dict:
+        """Tuning for an encoder factory; channel encoder options are applied on top"""
+        return dict(self.settings.get('encoders', {}).get(factory_name, {}))
+
+    def srt_latency_ms(self) -> int:
+        """SRT receive latency for inputs that do not set their own"""
+        return int(self.settings.get('srt-latency-ms', DEFAULT_SRT_LATENCY_MS))
+
+    def jitter_buffer_defaults(self) -> Dict:
+        """Jitter buffer bounds; explicit jitter_buffer settings on the input win"""
+        return dict(self.settings.get('jitter-buffer', {}))
+
+    def hop_budgets(self) -> Optional[Dict[str, float]]:
+        """Latency budget of each hop the latency probes measure, or None without a profile"""
+        budgets = self.settings.get('budget-ms')
+        return {hop: float(value) for hop, value in budgets.items()} if budgets else None
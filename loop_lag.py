@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+# Histogram bucket upper bounds in milliseconds
+LAG_BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000]
+
+
+class LoopLagProbe:
+    """Measures how late a periodic timer fires on an event loop"""
+
+    def __init__(self, name: str, logger: Optional[logging.Logger] = None,
+                 publish: Optional[Callable[[Dict], None]] = None,
+                 stats_collector=None, stat_type: str = "loop_lag",
+                 interval: float = 0.1, threshold_ms: float = 200, publish_interval: float = 5):
+        self.name = name
+        self.logger = logger or logging.getLogger(__name__)
+        self.publish = publish
+        if publish is None and stats_collector is not None:
+            self.publish = lambda stats: stats_collector.add_stats(stat_type, stats)
+        self.interval = interval
+        self.threshold_ms = threshold_ms
+        self.publish_interval = publish_interval
+
+        self._lock = threading.Lock()
+        self._reset_window()
+
+        self._loop_thread_id = None
+        self._expected = None
+        self._last_tick = None
+        self._stall_reported = False
+        self._stall_callback = None
+
+        self._stop_event = threading.Event()
+        self._monitor_thread = None
+
+    def _reset_window(self):
+        self._buckets = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self._samples = 0
+        self._total_ms = 0.0
+        self._max_ms = 0.0
+        self._slow = 0
+
+    def start(self):
+        """Start the timer on the loop and the monitor thread; call from the loop thread"""
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._expected = self._last_tick + self.interval
+        self._schedule()
+
+        self._stop_event.clear()
+        self._monitor_thread = threading.Thread(
+            target=self._monitor, name=f"LoopLag-{self.name}", daemon=True
+        )
+        self._monitor_thread.start()
+        self.logger.info(
+            f"Loop lag probe started for {self.name} "
+            f"(interval {self.interval * 1000:.0f}ms, threshold {self.threshold_ms:.0f}ms)"
+        )
+
+    def stop(self):
+        """Stop the timer and monitor thread"""
+        self._stop_event.set()
+        self._cancel()
+        if self._monitor_thread:
+            self._monitor_thread.join(timeout=1)
+
+    def _schedule(self):
+        raise NotImplementedError
+
+    def _cancel(self):
+        raise NotImplementedError
+
+    def _tick(self):
+        """Timer callback running on the loop"""
+        now = time.monotonic()
+        lag_ms = max(0.0, (now - self._expected) * 1000)
+
+        with self._lock:
+            self._samples += 1
+            self._total_ms += lag_ms
+            self._max_ms = max(self._max_ms, lag_ms)
+            for i, bound in enumerate(LAG_BUCKETS_MS):
+                if lag_ms <= bound:
+                    self._buckets[i] += 1
+                    break
+            else:
+                self._buckets[-1] += 1
+
+            if lag_ms > self.threshold_ms:
+                self._slow += 1
+                callback = self._stall_callback or "unknown (blocked between samples)"
+                self.logger.warning(f"{self.name} loop lagged {lag_ms:.0f}ms, slow callback: {callback}")
+
+            self._stall_reported = False
+            self._stall_callback = None
+
+        self._last_tick = now
+        self._expected = now + self.interval
+
+    def _describe_loop_stack(self) -> Optional[str]:
+        """Name the innermost frames currently running on the loop thread"""
+        frame = sys._current_frames().get(self._loop_thread_id)
+        names = []
+        while frame is not None and len(names) < 3:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        return " <- ".join(names) if names else None
+
+    def _monitor(self):
+        """Catch stalls while they happen and publish the histogram periodically"""
+        next_publish = time.monotonic() + self.publish_interval
+        while not self._stop_event.wait(self.interval):
+            now = time.monotonic()
+
+            stalled_ms = (now - self._expected) * 1000
+            if stalled_ms > self.threshold_ms and not self._stall_reported:
+                callback = self._describe_loop_stack()
+                with self._lock:
+                    self._stall_callback = callback
+                    self._stall_reported = True
+                self.logger.warning(f"{self.name} loop stalled for {stalled_ms:.0f}ms in {callback}")
+
+            if now >= next_publish:
+                next_publish += self.publish_interval
+                self._publish()
+
+    def get_stats(self) -> Dict:
+        """Histogram and summary for the current window"""
+        with self._lock:
+            stats = {
+                "samples": self._samples,
+                "avg_lag_ms": self._total_ms / self._samples if self._samples else 0.0,
+                "max_lag_ms": self._max_ms,
+                "slow_callbacks": self._slow
+            }
+            for i, bound in enumerate(LAG_BUCKETS_MS):
+                stats[f"lag_le_{bound}ms"] = self._buckets[i]
+            stats[f"lag_gt_{LAG_BUCKETS_MS[-1]}ms"] = self._buckets[-1]
+        return stats
+
+    def _publish(self):
+        """Hand the finished window to the publish callback and start a new one"""
+        stats = self.get_stats()
+        with self._lock:
+            self._reset_window()
+
+        if self.publish:
+            try:
+                self.publish(stats)
+            except Exception as e:
+                self.logger.error(f"Error publishing loop lag stats for {self.name}: {str(e)}")
+
+
+class GLibLagProbe(LoopLagProbe):
+    """Lag probe for a GLib MainLoop"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._source_id = None
+
+    def _schedule(self):
+        from gi.repository import GLib
+        self._source_id = GLib.timeout_add(int(self.interval * 1000), self._on_timeout)
+
+    def _on_timeout(self):
+        self._tick()
+        return not self._stop_event.is_set()
+
+    def _cancel(self):
+        from gi.repository import GLib
+        if self._source_id:
+            GLib.source_remove(self._source_id)
+            self._source_id = None
+
+
+class AsyncioLagProbe(LoopLagProbe):
+    """Lag probe for an asyncio event loop"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._handle = None
+
+    def _schedule(self):
+        self._handle = asyncio.get_running_loop().call_later(self.interval, self._on_timer)
+
+    def _on_timer(self):
+        self._tick()
+        if not self._stop_event.is_set():
+            self._handle = asyncio.get_running_loop().call_later(self.interval, self._on_timer)
+
+    def _cancel(self):
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
@@ -7,6 +7,9 @@ import yaml
 import requests
 import logging
 from datetime import datetime, timedelta
+from stats_collector import StatsCollector
+from loop_lag import AsyncioLagProbe
+from capacity_estimator import CapacityEstimator
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -20,10 +23,24 @@ REDIS_DB = 0
 # Define metrics to collect
 METRICS = ['cpu', 'memory', 'network', 'hdd', 'gpu', 'channels']
 
+# Live samples are taken on wall-clock aligned ticks
+TICK_INTERVAL = 5
+
+# How often running channels are sampled to refine the capacity cost model
+CAPACITY_OBSERVE_INTERVAL = 60
+
+# Rollup windows, ordered so coarser windows are built from finer ones
+ROLLUP_WINDOWS = {
+    '5m': {'seconds': 300, 'source': 'live', 'prefix': 'historic', 'retention': 288},    # 24 hours
+    '1h': {'seconds': 3600, 'source': '5m', 'prefix': 'historic_1h', 'retention': 168}  # 7 days
+}
+
 # Initialize Redis client
 redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
 logger.info(f"Redis client initialized with host: {REDIS_HOST}, port: {REDIS_PORT}, db: {REDIS_DB}")
 
+capacity_estimator = CapacityEstimator(redis_client)
+
 # Global variable to store the last network measurement
 last_net_io = {}
 
@@ -94,8 +111,8 @@ async def collect_metrics():
         total_channels = get_total_channel_count()
         running_channels = get_running_channel_count()
         
-        # Get CPU usage
-        cpu_usage = psutil.cpu_percent(interval=1)
+        # Get CPU usage since the previous tick without blocking the event loop
+        cpu_usage = psutil.cpu_percent(interval=None)
         logger.debug(f"CPU usage: {cpu_usage}%")
         
         # Get memory usage
@@ -133,9 +150,10 @@ async def collect_metrics():
         logger.error(f"Error collecting metrics: {str(e)}")
         return None
 
-def store_live_data(metric_name, value):
+def store_live_data(metric_name, value, timestamp=None):
     logger.debug(f"Storing live data for {metric_name}")
-    timestamp = int(time.time())
+    if timestamp is None:
+        timestamp = int(time.time())
     if metric_name == 'network':
         for interface, data in value.items():
             key = f"live:network:{interface}"
@@ -149,52 +167,137 @@ def store_live_data(metric_name, value):
         redis_client.ltrim(key, 0, 59)
     logger.debug(f"Live data stored for {metric_name}")
 
-def store_historic_data(metric_name, value):
-    logger.debug(f"Storing historic data for {metric_name}")
-    timestamp = int(time.time())
+def store_historic_data(metric_name, value, timestamp=None, samples=None, window='5m'):
+    logger.debug(f"Storing {window} historic data for {metric_name}")
+    if timestamp is None:
+        timestamp = int(time.time())
+    prefix = ROLLUP_WINDOWS[window]['prefix']
+    retention = ROLLUP_WINDOWS[window]['retention']
+    seconds = ROLLUP_WINDOWS[window]['seconds']
     if metric_name == 'network':
         for interface, data in value.items():
-            key = f"historic:network:{interface}"
-            interface_data = json.dumps({'timestamp': timestamp, 'value': data})
+            key = f"{prefix}:network:{interface}"
+            interface_data = json.dumps({
+                'timestamp': timestamp,
+                'window': seconds,
+                'samples': data.get('samples', 0),
+                'value': data.get('value')
+            })
             redis_client.lpush(key, interface_data)
-            redis_client.ltrim(key, 0, 287)  # Keep only last 24 hours (288 data points)
+            redis_client.ltrim(key, 0, retention - 1)
     else:
-        key = f"historic:{metric_name}"
-        data = json.dumps({'timestamp': timestamp, 'value': value})
+        key = f"{prefix}:{metric_name}"
+        data = json.dumps({
+            'timestamp': timestamp,
+            'window': seconds,
+            'samples': samples if samples is not None else 0,
+            'value': value
+        })
         redis_client.lpush(key, data)
-        redis_client.ltrim(key, 0, 287)
-    logger.debug(f"Historic data stored for {metric_name}")
+        redis_client.ltrim(key, 0, retention - 1)
+    logger.debug(f"{window} historic data stored for {metric_name}")
 
-def calculate_average(metric_name):
-    logger.debug(f"Calculating average for {metric_name}")
+def _entries_in_window(key, start, end):
+    """Return decoded list entries whose timestamp falls in [start, end)"""
+    entries = [json.loads(item) for item in redis_client.lrange(key, 0, -1)]
+    return [e for e in entries if start <= e['timestamp'] < end]
+
+def _average_values(metric_name, entries, weights):
+    """Weighted average of entry values; channels keeps the most recent value"""
+    total = sum(weights)
+    if not entries or total == 0:
+        return None
+    if metric_name == 'channels':
+        return max(entries, key=lambda e: e['timestamp'])['value']
+    return sum(e['value'] * w for e, w in zip(entries, weights)) / total
+
+def calculate_average(metric_name, start, end):
+    """Average live samples in [start, end), returning (value, sample_count)"""
+    logger.debug(f"Calculating average for {metric_name} over {start}-{end}")
     if metric_name == 'network':
-        # Handle network interfaces separately
-        interfaces = redis_client.keys("live:network:*")
         averages = {}
-        for interface_key in interfaces:
+        for interface_key in redis_client.keys("live:network:*"):
             interface = interface_key.decode().split(':')[-1]
-            data = redis_client.lrange(interface_key, 0, -1)
-            if not data:
-                continue
-            values = [json.loads(item)['value'] for item in data]
-            avg_send_rate = sum(v['send_rate'] for v in values) / len(values)
-            avg_recv_rate = sum(v['recv_rate'] for v in values) / len(values)
-            averages[interface] = {'avg_send_rate': avg_send_rate, 'avg_recv_rate': avg_recv_rate}
-        return averages
-    else:
-        key = f"live:{metric_name}"
-        data = redis_client.lrange(key, 0, -1)
-        if not data:
-            logger.warning(f"No data found for {metric_name}")
-            return None
-        values = [json.loads(item)['value'] for item in data]
-        if metric_name == 'channels':
-            # For channels, we'll return the most recent value instead of an average
-            logger.debug(f"Returning most recent value for channels: {values[0]}")
-            return values[0]
-        average = sum(values) / len(values)
-        logger.debug(f"Average calculated for {metric_name}: {average}")
-        return average
+            entries = _entries_in_window(interface_key, start, end)
+            values = [e['value'] for e in entries]
+            averages[interface] = {
+                'samples': len(values),
+                'value': {
+                    'avg_send_rate': sum(v['send_rate'] for v in values) / len(values),
+                    'avg_recv_rate': sum(v['recv_rate'] for v in values) / len(values)
+                } if values else None
+            }
+        return averages, sum(a['samples'] for a in averages.values())
+
+    entries = _entries_in_window(f"live:{metric_name}", start, end)
+    average = _average_values(metric_name, entries, [1] * len(entries))
+    logger.debug(f"Average calculated for {metric_name}: {average} ({len(entries)} samples)")
+    return average, len(entries)
+
+def calculate_rollup(metric_name, start, end, source_window='5m'):
+    """Combine finer rollups in (start, end] into one value weighted by sample count"""
+    logger.debug(f"Calculating rollup for {metric_name} over {start}-{end} from {source_window}")
+    prefix = ROLLUP_WINDOWS[source_window]['prefix']
+    if metric_name == 'network':
+        rollups = {}
+        for interface_key in redis_client.keys(f"{prefix}:network:*"):
+            interface = interface_key.decode().split(':')[-1]
+            entries = _entries_in_window(interface_key, start + 1, end + 1)
+            entries = [e for e in entries if e.get('value') is not None]
+            samples = sum(e.get('samples', 0) for e in entries)
+            value = None
+            if samples:
+                value = {
+                    field: sum(e['value'][field] * e.get('samples', 0) for e in entries) / samples
+                    for field in ('avg_send_rate', 'avg_recv_rate')
+                }
+            rollups[interface] = {'samples': samples, 'value': value}
+        return rollups, sum(r['samples'] for r in rollups.values())
+
+    entries = _entries_in_window(f"{prefix}:{metric_name}", start + 1, end + 1)
+    entries = [e for e in entries if e.get('value') is not None]
+    weights = [e.get('samples', 0) for e in entries]
+    return _average_values(metric_name, entries, weights), sum(weights)
+
+def run_rollup(window, start, end):
+    """Compute and store one rollup window for every metric"""
+    seconds = ROLLUP_WINDOWS[window]['seconds']
+    source = ROLLUP_WINDOWS[window]['source']
+    for metric_name in METRICS:
+        if source == 'live':
+            value, samples = calculate_average(metric_name, start, end)
+        else:
+            value, samples = calculate_rollup(metric_name, start, end, source)
+        expected = seconds // (TICK_INTERVAL if source == 'live' else ROLLUP_WINDOWS[source]['seconds'])
+        if source == 'live' and 0 < samples < expected:
+            logger.warning(f"{window} rollup for {metric_name} ending {end} has {samples}/{expected} samples")
+        store_historic_data(metric_name, value, timestamp=end, samples=samples, window=window)
+    logger.info(f"Stored {window} rollup for window {start}-{end}")
+
+def run_due_rollups(now):
+    """Run every rollup window that has closed since the last run, catching up after restarts"""
+    for window, settings in ROLLUP_WINDOWS.items():
+        seconds = settings['seconds']
+        boundary = now - (now % seconds)
+        state_key = f"rollup:last:{window}"
+        last = redis_client.get(state_key)
+        if last is None:
+            # First run: nothing to catch up on, start from the current boundary
+            redis_client.set(state_key, boundary)
+            continue
+
+        last = int(last)
+        oldest = boundary - settings['retention'] * seconds
+        if last < oldest:
+            logger.warning(f"Skipping {window} rollups older than retention ({last} -> {oldest})")
+            last = oldest
+
+        missed = (boundary - last) // seconds
+        if missed > 1:
+            logger.info(f"Catching up {missed} missed {window} rollup windows")
+        for end in range(last + seconds, boundary + 1, seconds):
+            run_rollup(window, end - seconds, end)
+            redis_client.set(state_key, end)
 
 def get_live_data(metric_name):
     logger.debug(f"Getting live data for {metric_name}")
@@ -212,10 +315,11 @@ def get_live_data(metric_name):
         logger.debug(f"Retrieved {len(data)} live data points for {metric_name}")
         return [json.loads(item) for item in data]
 
-def get_historic_data(metric_name):
-    logger.debug(f"Getting historic data for {metric_name}")
+def get_historic_data(metric_name, window='5m'):
+    logger.debug(f"Getting {window} historic data for {metric_name}")
+    prefix = ROLLUP_WINDOWS[window]['prefix']
     if metric_name == 'network':
-        interfaces = redis_client.keys("historic:network:*")
+        interfaces = redis_client.keys(f"{prefix}:network:*")
         network_data = {}
         for interface_key in interfaces:
             interface = interface_key.decode().split(':')[-1]
@@ -223,38 +327,52 @@ def get_historic_data(metric_name):
             network_data[interface] = [json.loads(item) for item in data]
         return network_data
     else:
-        key = f"historic:{metric_name}"
+        key = f"{prefix}:{metric_name}"
         data = redis_client.lrange(key, 0, -1)
         logger.debug(f"Retrieved {len(data)} historic data points for {metric_name}")
         return [json.loads(item) for item in data]
 
 async def metrics_collection_loop():
     logger.info("Starting metrics collection loop")
+    loop = asyncio.get_running_loop()
+    next_tick = (int(time.time()) // TICK_INTERVAL + 1) * TICK_INTERVAL
     while True:
         try:
+            # Sleep until the next wall-clock tick, measured from now so collection time doesn't drift the schedule
+            delay = next_tick - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tick = next_tick
+
+            # Close any finished windows before the new sample lands in the live lists
+            await loop.run_in_executor(None, run_due_rollups, tick)
+
             metrics = await collect_metrics()
             if metrics:
                 for metric_name, value in metrics.items():
-                    store_live_data(metric_name, value)
-                    
-                    # Store historic data every 5 minutes
-                    if int(time.time()) % 300 == 0:
-                        if metric_name == 'network':
-                            avg_value = calculate_average(metric_name)
-                            store_historic_data(metric_name, avg_value)
-                        else:
-                            avg_value = calculate_average(metric_name)
-                            if avg_value is not None:
-                                store_historic_data(metric_name, avg_value)
-            
-            logger.info("Metrics collected and stored successfully")
-            await asyncio.sleep(5)  # Collect metrics every 5 seconds
+                    store_live_data(metric_name, value, timestamp=tick)
+                logger.info("Metrics collected and stored successfully")
+
+            if tick % CAPACITY_OBSERVE_INTERVAL == 0:
+                await loop.run_in_executor(None, capacity_estimator.observe)
+
         except Exception as e:
             logger.error(f"Error in metrics collection loop: {str(e)}")
-            await asyncio.sleep(5)
+
+        next_tick += TICK_INTERVAL
+        now = time.time()
+        if now >= next_tick:
+            skipped = int((now - next_tick) // TICK_INTERVAL) + 1
+            logger.warning(f"Metrics collection overran, skipping {skipped} tick(s)")
+            next_tick += skipped * TICK_INTERVAL
 
 async def main():
     logger.info("Starting metrics collection")
+    lag_probe = AsyncioLagProbe(
+        "metrics_collector", logger,
+        stats_collector=StatsCollector("metrics_collector", redis_client)
+    )
+    lag_probe.start()
     try:
         await metrics_collection_loop()
     except KeyboardInterrupt:
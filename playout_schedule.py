@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+SCHEDULE_DIR = "/root/caricoder/schedules"
+LIVE_INPUT_TYPES = ('udpsrc', 'srtsrc')
+
+
+def schedule_path(channel_name: str) -> str:
+    return os.path.join(SCHEDULE_DIR, f"{channel_name}.json")
+
+
+def parse_start(value) -> float:
+    """Epoch seconds from an epoch number or an ISO 8601 time"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+
+
+def validate_item(item: Dict, inputs: List[Dict]) -> Dict:
+    """Normalised copy of a schedule item; raises ValueError if it cannot be played"""
+    has_input = item.get('input') is not None
+    has_file = bool(item.get('file'))
+    if has_input == has_file:
+        raise ValueError("A schedule item needs exactly one of input or file")
+    if item.get('start') is None:
+        raise ValueError("A schedule item needs a start time")
+
+    normalised = {'id': item.get('id') or uuid.uuid4().hex[:12], 'start': parse_start(item['start'])}
+    if has_input:
+        index = int(item['input'])
+        if index < 0 or index >= len(inputs):
+            raise ValueError(f"Invalid input index {index}")
+        if inputs[index]['type'] not in LIVE_INPUT_TYPES:
+            raise ValueError(f"Scheduled playout supports udpsrc and srtsrc inputs, not {inputs[index]['type']}")
+        normalised['input'] = index
+    else:
+        # Caught here rather than at the cut, where playout would fail and retry until the next item
+        if not os.path.isfile(item['file']):
+            raise ValueError(f"{item['file']} does not exist or is not a file")
+        if not os.access(item['file'], os.R_OK):
+            raise ValueError(f"{item['file']} is not readable")
+        normalised['file'] = item['file']
+        normalised['loop'] = bool(item.get('loop', True))
+    return normalised
+
+
+def load_schedule(channel_name: str) -> List[Dict]:
+    """The channel's schedule in start order; empty if it has none"""
+    try:
+        with open(schedule_path(channel_name)) as f:
+            items = json.load(f).get('items', [])
+    except FileNotFoundError:
+        return []
+    return sorted(items, key=lambda item: item['start'])
+
+
+def save_schedule(channel_name: str, items: List[Dict]):
+    """Replace the channel's schedule; the input handler picks it up within a second"""
+    os.makedirs(SCHEDULE_DIR, exist_ok=True)
+    path = schedule_path(channel_name)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump({
+            'channel': channel_name,
+            'updated': time.time(),
+            'items': sorted(items, key=lambda item: item['start'])
+        }, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def current_and_next(items: List[Dict], now: float) -> Tuple[Optional[Dict], Optional[Dict]]:
+    """The item that should be on air at `now` and the one after it"""
+    current = None
+    for item in items:
+        if item['start'] > now:
+            return current, item
+        current = item
+    return current, None
+
+
+def prune_schedule(items: List[Dict], now: float) -> List[Dict]:
+    """Drop items that have already been followed by another, keeping the one on air"""
+    current, _ = current_and_next(items, now)
+    if current is None:
+        return list(items)
+    return [item for item in items if item['start'] >= current['start']]
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+from gop_cache import starts_keyframe
+from playout_schedule import load_schedule, schedule_path, current_and_next
+from ts_file_player import TSFilePlayer
+from ts_psi import TS_PACKET_SIZE, SYNC_BYTE, PAT_PID, PSIParser
+from latency_profile import DEFAULT_SRT_LATENCY_MS
+from udp_receiver import check_receive_buffer, DEFAULT_BUFFER_SIZE
+
+CHECK_INTERVAL_MS = 100
+DEFAULT_PREROLL = 5.0        # seconds ahead of its start an item's branch is brought up
+DEFAULT_CUT_TIMEOUT_MS = 2000
+
+
+def describe(item: Dict) -> str:
+    return f"file {item['file']}" if 'file' in item else f"input {item['input']}"
+
+
+class _Branch:
+    """One scheduled item feeding the selector, with what is needed to cut into it cleanly"""
+
+    def __init__(self, item: Dict, source, pad, player: Optional[TSFilePlayer] = None):
+        self.item = item
+        self.source = source
+        self.pad = pad
+        self.player = player
+        self.psi = PSIParser()
+        self.psi_packets: Dict[int, List[bytes]] = {}
+        self.video_pid = None
+        self.codec = None
+        self.armed_at = None
+        self.force = False
+        self.on_air = False
+        self.replaying = False
+        self.last_data = None
+
+    def track(self, data: bytes):
+        """Keep the latest PAT and PMT packets and follow the video PID"""
+        pids = self._psi_pids()
+        for pos in range(0, len(data) - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+            pid = ((data[pos + 1] & 0x1F) << 8) | data[pos + 2]
+            if data[pos] != SYNC_BYTE or pid not in pids:
+                continue
+            packet = data[pos:pos + TS_PACKET_SIZE]
+            if packet[1] & 0x40:
+                self.psi_packets[pid] = [packet]
+            elif pid in self.psi_packets:
+                self.psi_packets[pid].append(packet)
+            self.psi.feed(packet)
+            if pid == PAT_PID:
+                pids = self._psi_pids()
+
+        program = self.psi.selected_program()
+        pmt = self.psi.pmts.get(program) if program is not None else None
+        if pmt:
+            video = next((s for s in pmt['streams'] if s['codec_type'] == 'video'), None)
+            self.video_pid = video['pid'] if video else None
+            self.codec = video['codec_name'] if video else None
+
+    def _psi_pids(self):
+        pids = {PAT_PID}
+        if self.psi.pat:
+            pids.update(self.psi.pat['programs'].values())
+        return pids
+
+    def cut_offset(self, data: bytes) -> Optional[int]:
+        """Offset of the first packet a decoder can start from: a keyframe on the video PID,
+        or for audio-only programs the start of any PES once the PMT is known"""
+        if not self.psi.complete:
+            return None
+        for pos in range(0, len(data) - TS_PACKET_SIZE + 1, TS_PACKET_SIZE):
+            if data[pos] != SYNC_BYTE or not data[pos + 1] & 0x40:
+                continue
+            pid = ((data[pos + 1] & 0x1F) << 8) | data[pos + 2]
+            if self.video_pid is None:
+                if pid not in self.psi_packets:
+                    return pos
+                continue
+            if pid != self.video_pid:
+                continue
+            offset = pos + 4
+            if data[pos + 3] & 0x20:
+                if data[pos + 4] and data[pos + 5] & 0x40:     # random_access_indicator
+                    return pos
+                offset += 1 + data[pos + 4]
+            if data[pos + 3] & 0x10 and offset < pos + TS_PACKET_SIZE \
+                    and starts_keyframe(data[offset:pos + TS_PACKET_SIZE], self.codec):
+                return pos
+        return None
+
+    def psi_prefix(self) -> bytes:
+        return b''.join(b''.join(packets) for _, packets in sorted(self.psi_packets.items()))
+
+
+class PlayoutSource:
+    """
+    Plays a channel's schedule of live inputs and files through an input-selector,
+    exposed as a bin named "source" like HotStandbySource. The next item is brought up
+    on a second selector pad preroll seconds before it starts: live inputs start
+    receiving, and have their PSI tracked while the selector drops their data, and files
+    are opened and mapped. At the start time files begin playing and the selector moves
+    to the new branch at its first keyframe, which goes out with the branch's PAT and PMT
+    in front of it, so the output carries on without a gap or a restart. The schedule is
+    reread when playout_schedule.save_schedule() replaces it.
+    """
+
+    def __init__(self, channel_name: str, inputs: List[Dict], settings: Dict, fallback_index: int = 0,
+                 stats_collector=None, logger: Optional[logging.Logger] = None,
+                 srt_latency: int = DEFAULT_SRT_LATENCY_MS):
+        self.logger = logger or logging.getLogger(__name__)
+        self.channel_name = channel_name
+        self.inputs = inputs
+        self.stats_collector = stats_collector
+        # For SRT inputs without their own latency option, from the channel's latency_profile
+        self.srt_latency = srt_latency
+        self.preroll = float(settings.get('preroll-s', DEFAULT_PREROLL))
+        self.cut_timeout = settings.get('cut-timeout-ms', DEFAULT_CUT_TIMEOUT_MS) / 1000
+        # Played when nothing in the schedule has started yet
+        fallback_input = inputs[fallback_index]
+        if fallback_input['type'] == 'filesrc':
+            self.fallback = {'id': 'fallback', 'start': 0, 'file': fallback_input.get('uri', ''), 'loop': True}
+        else:
+            self.fallback = {'id': 'fallback', 'start': 0, 'input': fallback_index}
+
+        self.bin = Gst.Bin.new("source")
+        self.selector = Gst.ElementFactory.make("input-selector", "playout_selector")
+        # The standby branch is dropped as it arrives rather than held in step with the one on air
+        self.selector.set_property("sync-streams", False)
+        self.bin.add(self.selector)
+        self.bin.add_pad(Gst.GhostPad.new("src", self.selector.get_static_pad("src")))
+
+        self._lock = threading.Lock()
+        self._branch_count = 0
+        self._schedule_mtime = None
+        self.items = []
+        self._reload()
+        current, _ = current_and_next(self.items, time.time())
+        self.on_air = self._create_branch(current or self.fallback)
+        self.on_air.on_air = True
+        self.selector.set_property("active-pad", self.on_air.pad)
+        self.standby: Optional[_Branch] = None
+
+        self.cuts = 0
+        self.forced_cuts = 0
+        self.last_cut_late_ms = None
+        self._timer = None
+        self._ticks = 0
+
+    def _reload(self) -> bool:
+        """Reread the schedule file if it changed"""
+        try:
+            mtime = os.stat(schedule_path(self.channel_name)).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._schedule_mtime:
+            return False
+        self._schedule_mtime = mtime
+        self.items = load_schedule(self.channel_name)
+        self.logger.info(f"Loaded playout schedule with {len(self.items)} item(s)")
+        return True
+
+    def _same_input(self, item: Dict, other: Dict) -> bool:
+        """Whether two items receive the same live input, which can only have one socket"""
+        if 'input' not in item or 'input' not in other:
+            return False
+        config, other_config = self.inputs[item['input']], self.inputs[other['input']]
+        return config['type'] == other_config['type'] and config.get('uri') == other_config.get('uri')
+
+    def _create_branch(self, item: Dict) -> _Branch:
+        self._branch_count += 1
+        name = f"playout_{self._branch_count}"
+        player = None
+        if 'file' in item:
+            source = Gst.ElementFactory.make("appsrc", name)
+            source.set_property('caps', Gst.Caps.from_string("video/mpegts,systemstream=true,packetsize=188"))
+            source.set_property('is-live', True)
+            source.set_property('format', Gst.Format.TIME)
+            source.set_property('do-timestamp', True)
+            source.set_property('block', False)
+            player = TSFilePlayer(
+                item['file'], {'loop': item.get('loop', True)},
+                lambda data, packets, source=source: source.emit('push-buffer', Gst.Buffer.new_wrapped(data)),
+                on_end=lambda: self.logger.warning(f"{describe(item)} ended before the next item"),
+                logger=self.logger
+            )
+        else:
+            config = self.inputs[item['input']]
+            options = dict(config.get('options') or {})
+            if config['type'] == 'udpsrc':
+                source = Gst.ElementFactory.make("udpsrc", name)
+                source.set_property('uri', config.get('uri', ''))
+                buffer_size = int(options.pop('buffer-size', DEFAULT_BUFFER_SIZE))
+                check_receive_buffer(buffer_size, self.logger)
+                source.set_property('buffer-size', buffer_size)
+            else:
+                source = Gst.ElementFactory.make("srtsrc", name)
+                source.set_property('uri', config.get('uri', ''))
+                source.set_property('latency', options.get('latency', self.srt_latency))
+                if 'streamid' in options:
+                    source.set_property('streamid', options['streamid'])
+        if not source:
+            raise RuntimeError(f"Failed to create source for {describe(item)}")
+
+        self.bin.add(source)
+        pad = self.selector.get_request_pad("sink_%u")
+        if source.get_static_pad("src").link(pad) != Gst.PadLinkReturn.OK:
+            raise RuntimeError(f"Failed to link {describe(item)} to the selector")
+        branch = _Branch(item, source, pad, player)
+        source.get_static_pad("src").add_probe(
+            Gst.PadProbeType.BUFFER, lambda pad, info: self._probe_cb(branch, pad, info))
+        source.sync_state_with_parent()
+        self.logger.info(f"Playout branch {name} for item {item['id']}: {describe(item)}")
+        return branch
+
+    def _remove_branch(self, branch: _Branch):
+        if branch.player:
+            branch.player.stop()
+        branch.source.set_state(Gst.State.NULL)
+        branch.source.get_static_pad("src").unlink(branch.pad)
+        self.selector.release_request_pad(branch.pad)
+        self.bin.remove(branch.source)
+        return False
+
+    def _probe_cb(self, branch: _Branch, pad, info):
+        if branch.on_air or branch.replaying:
+            return Gst.PadProbeReturn.OK
+        buffer = info.get_buffer()
+        if buffer is None:
+            return Gst.PadProbeReturn.OK
+        success, map_info = buffer.map(Gst.MapFlags.READ)
+        if not success:
+            return Gst.PadProbeReturn.OK
+        try:
+            data = bytes(map_info.data)
+        finally:
+            buffer.unmap(map_info)
+
+        branch.last_data = time.monotonic()
+        branch.track(data)
+        if branch.armed_at is None:
+            return Gst.PadProbeReturn.OK
+        offset = branch.cut_offset(data)
+        if offset is None and not branch.force:
+            return Gst.PadProbeReturn.OK
+        return self._cut(branch, pad, buffer, data[offset or 0:])
+
+    def _cut(self, branch: _Branch, pad, buffer, data: bytes):
+        """Put the branch on air from this buffer on; runs in the branch's streaming thread"""
+        with self._lock:
+            if self.standby is not branch:
+                return Gst.PadProbeReturn.OK
+            previous = self.on_air
+            self.selector.set_property("active-pad", branch.pad)
+            self.on_air = branch
+            self.standby = None
+            branch.on_air = True
+            self.cuts += 1
+            if branch.force:
+                self.forced_cuts += 1
+            self.last_cut_late_ms = round((time.time() - branch.item['start']) * 1000, 1)
+
+        output = Gst.Buffer.new_wrapped(branch.psi_prefix() + data)
+        output.pts = buffer.pts
+        output.dts = buffer.dts
+        branch.replaying = True
+        try:
+            result = pad.push(output)
+        finally:
+            branch.replaying = False
+        self.logger.info(f"Cut to item {branch.item['id']} ({describe(branch.item)}) "
+                         f"{self.last_cut_late_ms}ms after its start{', forced' if branch.force else ''}")
+        if result != Gst.FlowReturn.OK:
+            self.logger.warning(f"First buffer of item {branch.item['id']} not accepted: {result}")
+        GLib.idle_add(self._remove_branch, previous)
+        return Gst.PadProbeReturn.DROP
+
+    def start(self):
+        """Start the schedule checks and any file on air; call from the GLib main loop thread"""
+        if self.on_air.player:
+            self.on_air.player.start()
+        self._timer = GLib.timeout_add(CHECK_INTERVAL_MS, self._check)
+        self.logger.info(f"Scheduled playout on air with item {self.on_air.item['id']}: {describe(self.on_air.item)}")
+
+    def stop(self):
+        if self._timer:
+            GLib.source_remove(self._timer)
+            self._timer = None
+        for branch in (self.on_air, self.standby):
+            if branch and branch.player:
+                branch.player.stop()
+
+    def _check(self):
+        try:
+            now = time.time()
+            if self._reload() and self.standby:
+                with self._lock:
+                    standby, self.standby = self.standby, None
+                if standby:
+                    self.logger.info(f"Schedule changed, dropping the prerolled item {standby.item['id']}")
+                    self._remove_branch(standby)
+
+            current, upcoming = current_and_next(self.items, now)
+            # A current item that is not on air yet (missed preroll, or a schedule edit) cuts as soon as it can
+            if current and current['id'] != self.on_air.item['id'] and not (
+                    self.standby and self.standby.item['id'] == current['id']):
+                target = current
+            elif upcoming and upcoming['start'] - now <= self.preroll:
+                target = upcoming
+            else:
+                target = None
+            if target and self._same_input(target, self.on_air.item):
+                # A second udpsrc or srtsrc on the input on air would fail to bind or split its
+                # packets, so the branch on air simply carries on as the new item
+                if target['start'] <= now:
+                    self.logger.info(f"Item {target['id']} continues on the same {describe(target)}")
+                    self.on_air.item = target
+                target = None
+            if target and self.standby is None:
+                self.standby = self._create_branch(target)
+
+            standby = self.standby
+            if standby and standby.item['start'] <= now:
+                if standby.armed_at is None:
+                    standby.armed_at = time.monotonic()
+                    if standby.player:
+                        standby.player.start()
+                elif not standby.force and time.monotonic() - standby.armed_at > self.cut_timeout:
+                    self.logger.warning(f"No keyframe on item {standby.item['id']} within "
+                                        f"{self.cut_timeout * 1000:.0f}ms, cutting on the next buffer")
+                    standby.force = True
+
+            self._ticks += 1
+            if self._ticks % (1000 // CHECK_INTERVAL_MS) == 0:
+                self._publish(upcoming, now)
+        except Exception as e:
+            self.logger.error(f"Error checking playout schedule: {str(e)}")
+        return True
+
+    def _publish(self, upcoming: Optional[Dict], now: float):
+        standby = self.standby
+        if standby is None:
+            state = 'idle'
+        elif standby.armed_at is None:
+            state = 'prerolling'
+        else:
+            state = 'cutting'
+        stats = {
+            'on_air_id': self.on_air.item['id'],
+            'on_air': describe(self.on_air.item),
+            'next_id': upcoming['id'] if upcoming else None,
+            'next_in_s': round(upcoming['start'] - now, 1) if upcoming else None,
+            'standby_state': state,
+            'standby_receiving': bool(standby and standby.last_data
+                                      and time.monotonic() - standby.last_data < 1.0),
+            'cuts': self.cuts,
+            'forced_cuts': self.forced_cuts,
+            'last_cut_late_ms': self.last_cut_late_ms,
+            'schedule_items': len(self.items)
+        }
+        if self.stats_collector:
+            self.stats_collector.add_stats("playout", stats)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+# Used when Redis is not available
+PROBE_CACHE_DIR = "/root/caricoder/probe_cache"
+
+# Entries not revalidated for this long are treated as missing
+PROBE_CACHE_TTL = 7 * 24 * 3600
+
+
+def _pid(value) -> Optional[int]:
+    """PIDs are written as '0x0100' by the handlers and '0x100' by ffprobe"""
+    if value is None:
+        return None
+    return int(value, 16) if isinstance(value, str) else int(value)
+
+
+class ProbeCache:
+    """Stream analysis results keyed by source URI and program number, in Redis or on disk"""
+
+    def __init__(self, redis_client=None, cache_dir: str = PROBE_CACHE_DIR, ttl: int = PROBE_CACHE_TTL,
+                 logger: Optional[logging.Logger] = None):
+        self.redis_client = redis_client
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.logger = logger or logging.getLogger(__name__)
+
+    def _key(self, uri: str, program_number) -> str:
+        return f"{uri}|{program_number if program_number is not None else 'any'}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+    def get(self, uri: str, program_number=None) -> Optional[Dict]:
+        """Cached analysis for a source, or None"""
+        key = self._key(uri, program_number)
+        try:
+            if self.redis_client:
+                data = self.redis_client.get(f"probe_cache:{key}")
+            else:
+                path = self._path(key)
+                if not os.path.exists(path):
+                    return None
+                with open(path, 'r') as f:
+                    data = f.read()
+            if not data:
+                return None
+            entry = json.loads(data)
+        except Exception as e:
+            self.logger.warning(f"Could not read probe cache for {key}: {str(e)}")
+            return None
+
+        if time.time() - entry.get('validated_at', 0) > self.ttl:
+            self.logger.info(f"Probe cache entry for {key} has expired")
+            return None
+        return entry
+
+    def put(self, uri: str, program_number, video_codec, audio_codec, video_pid, audio_pid,
+            found_program, probe_data: Dict) -> Dict:
+        """Store the result of a full analysis"""
+        program = next((p for p in probe_data.get('programs', []) if p.get('program_id') == found_program), {})
+        entry = {
+            'uri': uri,
+            'program_number': program_number,
+            'video_codec': video_codec,
+            'audio_codec': audio_codec,
+            'video_pid': video_pid,
+            'audio_pid': audio_pid,
+            'found_program': found_program,
+            'pmt_version': program.get('pmt_version'),
+            'probe_data': probe_data,
+            'validated_at': time.time()
+        }
+        self._write(self._key(uri, program_number), entry)
+        return entry
+
+    def _write(self, key: str, entry: Dict):
+        try:
+            if self.redis_client:
+                self.redis_client.set(f"probe_cache:{key}", json.dumps(entry), ex=self.ttl)
+            else:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                path = self._path(key)
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, 'w') as f:
+                    json.dump(entry, f)
+                os.replace(tmp_path, path)
+        except Exception as e:
+            self.logger.warning(f"Could not write probe cache for {key}: {str(e)}")
+
+    def invalidate(self, uri: str, program_number=None):
+        """Drop the cached analysis so the next start probes in full"""
+        key = self._key(uri, program_number)
+        try:
+            if self.redis_client:
+                self.redis_client.delete(f"probe_cache:{key}")
+            elif os.path.exists(self._path(key)):
+                os.unlink(self._path(key))
+        except Exception as e:
+            self.logger.warning(f"Could not invalidate probe cache for {key}: {str(e)}")
+
+    def validate(self, entry: Dict, probe_data: Dict) -> bool:
+        """
+        Compare freshly read PSI with a cached entry. The PMT version decides;
+        entries stored without one (ffprobe results) are checked on codecs and PIDs
+        once and then pinned to the version seen on the wire.
+        """
+        programs = probe_data.get('programs', [])
+        program = next((p for p in programs if p.get('program_id') == entry['found_program']), None)
+        if program is None:
+            # HLS variants can renumber programs; fall back to the only program present
+            program = programs[0] if len(programs) == 1 and entry['video_pid'] == 'auto' else None
+        if program is None:
+            return False
+
+        version = program.get('pmt_version')
+        if entry.get('pmt_version') is not None:
+            matches = version == entry['pmt_version']
+        else:
+            codecs = {s.get('codec_name') for s in program.get('streams', [])}
+            matches = {c for c in (entry['video_codec'], entry['audio_codec']) if c} <= codecs
+            if entry['video_pid'] != 'auto':
+                pids = {_pid(s.get('id')) for s in program.get('streams', [])}
+                cached_pids = {_pid(entry['video_pid']), _pid(entry['audio_pid'])} - {None}
+                matches = matches and cached_pids <= pids
+
+        if matches:
+            entry['pmt_version'] = version
+            entry['validated_at'] = time.time()
+            self._write(self._key(entry['uri'], entry['program_number']), entry)
+        return matches
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+import psutil
+
+
+class ProcessSampler:
+    """Background sampler that keeps a snapshot of handler process stats"""
+
+    def __init__(self, interval: float = 1.0, logger: Optional[logging.Logger] = None):
+        self.interval = interval
+        self.logger = logger or logging.getLogger(__name__)
+        self.cpu_count = psutil.cpu_count() or 1
+
+        # key -> (pid, psutil.Process); cpu_percent needs the same Process object between samples
+        self._tracked: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+        # Replaced wholesale on every pass so readers never see a half-built snapshot
+        self._snapshot: Dict[str, Dict] = {}
+        self._host: Dict = {"cpu_count": self.cpu_count, "per_cpu": [], "sampled_at": None}
+
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the sampling thread"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="ProcessSampler", daemon=True)
+        self._thread.start()
+        self.logger.info(f"Process sampler started with {self.interval}s interval")
+
+    def stop(self):
+        """Stop the sampling thread"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=self.interval * 2)
+        self.logger.info("Process sampler stopped")
+
+    def register(self, key: str, pid: int):
+        """Start tracking a process under the given key"""
+        try:
+            process = psutil.Process(pid)
+            # Prime the CPU counter so the first sample has a baseline
+            process.cpu_percent(interval=None)
+        except (psutil.NoSuchProcess, psutil.AccessDenied) as e:
+            self.logger.warning(f"Cannot track process {pid} for {key}: {str(e)}")
+            process = None
+
+        with self._lock:
+            self._tracked[key] = (pid, process)
+        self.logger.debug(f"Tracking process {pid} as {key}")
+
+    def unregister(self, key: str):
+        """Stop tracking a process"""
+        with self._lock:
+            self._tracked.pop(key, None)
+        snapshot = dict(self._snapshot)
+        snapshot.pop(key, None)
+        self._snapshot = snapshot
+        self.logger.debug(f"Stopped tracking {key}")
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Latest sample for a key, or None if it has not been sampled yet"""
+        return self._snapshot.get(key)
+
+    def snapshot(self) -> Dict:
+        """Latest samples for all tracked processes plus host CPU usage"""
+        return {"processes": self._snapshot, "host": self._host}
+
+    def _sample(self, pid: int, process: Optional[psutil.Process], now: float) -> Dict:
+        """Take one sample of a process"""
+        sample = {
+            "pid": pid,
+            "state": "gone",
+            "running": False,
+            "uptime": 0,
+            "cpu_percent": 0.0,
+            "cpu_per_core": 0.0,
+            "rss": 0,
+            "sampled_at": now
+        }
+        if process is None:
+            return sample
+
+        try:
+            with process.oneshot():
+                state = process.status()
+                cpu_percent = process.cpu_percent(interval=None)
+                sample.update({
+                    "state": state,
+                    "running": state != psutil.STATUS_ZOMBIE,
+                    "uptime": int(now - process.create_time()),
+                    "cpu_percent": cpu_percent,
+                    "cpu_per_core": cpu_percent / self.cpu_count,
+                    "rss": process.memory_info().rss
+                })
+        except psutil.NoSuchProcess:
+            pass
+        except psutil.AccessDenied:
+            sample["state"] = "access_denied"
+        return sample
+
+    def _run(self):
+        """Sampling loop, aligned to the interval so it does not drift"""
+        next_run = time.monotonic()
+        # The first per-core reading covers whatever came before; only later ones cover one interval
+        psutil.cpu_percent(interval=None, percpu=True)
+        first = True
+        while not self._stop_event.is_set():
+            try:
+                now = time.time()
+                with self._lock:
+                    tracked = dict(self._tracked)
+
+                snapshot = {}
+                for key, (pid, process) in tracked.items():
+                    snapshot[key] = self._sample(pid, process, now)
+
+                per_cpu = psutil.cpu_percent(interval=None, percpu=True)
+                if not first:
+                    self._host = {"cpu_count": self.cpu_count, "per_cpu": per_cpu, "sampled_at": now}
+                first = False
+                self._snapshot = snapshot
+            except Exception as e:
+                self.logger.error(f"Error sampling processes: {str(e)}")
+
+            next_run += self.interval
+            delay = next_run - time.monotonic()
+            if delay < 0:
+                next_run = time.monotonic()
+                delay = 0
+            self._stop_event.wait(delay)
+
+
+def format_uptime(uptime_seconds: int) -> str:
+    """Format seconds as HH:MM:SS"""
+    hours = uptime_seconds // 3600
+    minutes = (uptime_seconds % 3600) // 60
+    seconds = uptime_seconds % 60
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import logging
+import threading
+from typing import Callable, Dict, Optional
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+from ts_psi import PSIParser
+
+# How long to wait for PAT/PMT before giving up, same as the old ffprobe timeout
+DISCOVERY_TIMEOUT = 20
+
+
+class PSIDiscovery:
+    """
+    Reads PAT/PMT from the buffers flowing out of a pipeline's source pad.
+    Buffers are dropped until the PSI is complete, then on_complete(probe_data)
+    runs in the streaming thread so the rest of the pipeline can be set up
+    before the first packet reaches the demuxer. With block=False buffers pass
+    through untouched, for checking PSI on a pipeline that is already built.
+    """
+
+    def __init__(self, pad, program_number: Optional[int], on_complete: Callable[[Dict], bool],
+                 on_timeout: Optional[Callable[[], None]] = None,
+                 logger: Optional[logging.Logger] = None, timeout: float = DISCOVERY_TIMEOUT,
+                 block: bool = True):
+        self.pad = pad
+        self.block = block
+        self.parser = PSIParser(program_number)
+        self.on_complete = on_complete
+        self.on_timeout = on_timeout
+        self.logger = logger or logging.getLogger(__name__)
+        self.timeout = timeout
+
+        self.probe_data = None
+        self.done = threading.Event()
+        self._probe_id = None
+        self._timeout_id = None
+
+    def start(self):
+        """Attach the probe and arm the timeout"""
+        self._probe_id = self.pad.add_probe(Gst.PadProbeType.BUFFER, self._probe_cb)
+        if self.on_timeout:
+            self._timeout_id = GLib.timeout_add_seconds(int(self.timeout), self._on_timeout)
+        self.logger.info(f"Waiting for PAT/PMT on {self.pad.get_parent_element().get_name()}")
+
+    def stop(self):
+        """Detach the probe and cancel the timeout"""
+        if self._timeout_id:
+            GLib.source_remove(self._timeout_id)
+            self._timeout_id = None
+        if self._probe_id:
+            self.pad.remove_probe(self._probe_id)
+            self._probe_id = None
+
+    def _probe_cb(self, pad, info):
+        if self.done.is_set():
+            if not self.block:
+                return Gst.PadProbeReturn.REMOVE
+            # Setup failed; keep the demuxer starved while the pipeline is torn down
+            return Gst.PadProbeReturn.DROP
+
+        buffer = info.get_buffer()
+        if buffer:
+            success, map_info = buffer.map(Gst.MapFlags.READ)
+            if success:
+                try:
+                    self.parser.feed(map_info.data)
+                finally:
+                    buffer.unmap(map_info)
+
+        if not self.parser.complete:
+            return Gst.PadProbeReturn.DROP if self.block else Gst.PadProbeReturn.OK
+
+        self.probe_data = self.parser.to_probe_data()
+        self.done.set()
+        if self._timeout_id:
+            GLib.source_remove(self._timeout_id)
+            self._timeout_id = None
+        self.logger.info(
+            f"PSI complete after {self.parser.packets} packets: "
+            f"{len(self.probe_data['programs'])} program(s), {len(self.probe_data['streams'])} stream(s)"
+        )
+
+        try:
+            ready = self.on_complete(self.probe_data)
+        except Exception as e:
+            self.logger.error(f"Error setting up pipeline from PSI: {str(e)}")
+            ready = False
+        if not ready and self.block:
+            return Gst.PadProbeReturn.DROP
+        # This buffer goes on to the demuxer, later ones pass untouched
+        self._probe_id = None
+        return Gst.PadProbeReturn.REMOVE
+
+    def _on_timeout(self):
+        self._timeout_id = None
+        if self.done.is_set():
+            return False
+        self.logger.error(f"No PAT/PMT received within {self.timeout}s "
+                          f"({self.parser.packets} packets, {self.parser.crc_errors} CRC errors)")
+        if self._probe_id:
+            self.pad.remove_probe(self._probe_id)
+            self._probe_id = None
+        self.on_timeout()
+        return False
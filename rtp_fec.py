@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+
+import logging
+import struct
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+from hitless_merge import parse_rtp
+from udp_receiver import BatchedUDPReceiver, DEFAULT_BUFFER_SIZE
+
+# SMPTE 2022-1 puts the column FEC stream on the media port + 2 and the row stream on + 4
+COLUMN_PORT_OFFSET = 2
+ROW_PORT_OFFSET = 4
+FEC_HEADER = struct.Struct('!HHB3sIBBBB')
+RTP_HEADER = struct.Struct('!BBHII')
+PT_MP2T = 33
+PT_FEC = 96
+DEFAULT_REORDER_MS = 50      # hold for gaps when there is no FEC to wait for
+DEFAULT_MAX_LATENCY_MS = 1000
+MIN_HOLD_MS = 20
+MATRIX_MARGIN = 2.5          # column FEC for a matrix arrives while the next one is being sent
+EMIT_INTERVAL = 0.002
+RATE_WINDOW = 1.0
+MIN_HISTORY = 1024           # packets already passed on that FEC can still use
+MAX_RECURSION = 4
+
+
+def make_rtp(seq: int, timestamp: int, payload_type: int, ssrc: int, payload: bytes) -> bytes:
+    return RTP_HEADER.pack(0x80, payload_type & 0x7F, seq & 0xFFFF, timestamp & 0xFFFFFFFF, ssrc) + payload
+
+
+def _xor(blocks: List[bytes], size: int) -> bytes:
+    result = 0
+    for block in blocks:
+        result ^= int.from_bytes(block.ljust(size, b'\x00'), 'big')
+    return result.to_bytes(size, 'big')
+
+
+def parse_fec(payload: bytes) -> Optional[Dict]:
+    """SMPTE 2022-1 FEC header and recovery payload, or None if too short"""
+    if len(payload) < FEC_HEADER.size:
+        return None
+    snbase, length, pt, mask, ts, flags, offset, na, snbase_ext = FEC_HEADER.unpack_from(payload)
+    return {
+        'snbase': snbase,
+        'length_recovery': length,
+        'pt_recovery': pt & 0x7F,
+        'ts_recovery': ts,
+        'row': bool(flags & 0x40),
+        'offset': offset,
+        'na': na,
+        'data': payload[FEC_HEADER.size:]
+    }
+
+
+def _nearest(seq: int, reference: int) -> int:
+    """16-bit sequence number to the running count closest to reference"""
+    base = reference - (reference & 0xFFFF) + seq
+    return min((base - 0x10000, base, base + 0x10000), key=lambda value: abs(value - reference))
+
+
+class FECEncoder:
+    """
+    SMPTE 2022-1 column and row FEC for a stream of RTP payloads, L columns by D rows.
+    Used by the test sender; feed() returns the FEC datagrams that become due.
+    """
+
+    def __init__(self, columns: int, rows: int, ssrc: int = 0):
+        self.columns = columns
+        self.rows = rows
+        self.ssrc = ssrc
+        self._matrix = []
+        self._matrix_base = None
+        self._column_seq = 0
+        self._row_seq = 0
+
+    def _fec(self, seq: int, snbase: int, offset: int, na: int, row: bool, packets: List) -> bytes:
+        size = max(len(payload) for _, _, payload in packets)
+        length = pt = ts = 0
+        for _, timestamp, payload in packets:
+            length ^= len(payload)
+            pt ^= PT_MP2T
+            ts ^= timestamp
+        header = FEC_HEADER.pack(snbase & 0xFFFF, length, 0x80 | pt, b'\x00\x00\x00', ts,
+                                 0x40 if row else 0, offset, na, 0)
+        return make_rtp(seq, 0, PT_FEC, self.ssrc, header + _xor([p for _, _, p in packets], size))
+
+    def feed(self, seq: int, timestamp: int, payload: bytes) -> Dict[str, List[bytes]]:
+        """Add a media packet; returns {'column': [...], 'row': [...]} FEC datagrams to send"""
+        due = {'column': [], 'row': []}
+        if self._matrix_base is None:
+            self._matrix_base = seq
+        self._matrix.append((seq, timestamp, payload))
+        if self.rows > 1 and len(self._matrix) % self.columns == 0:
+            row = self._matrix[-self.columns:]
+            due['row'].append(self._fec(self._row_seq, row[0][0], 1, self.columns, True, row))
+            self._row_seq += 1
+        if len(self._matrix) == self.columns * self.rows:
+            for column in range(self.columns):
+                packets = self._matrix[column::self.columns]
+                due['column'].append(self._fec(self._column_seq, packets[0][0], self.columns, self.rows,
+                                               False, packets))
+                self._column_seq += 1
+            self._matrix = []
+            self._matrix_base = None
+        return due
+
+
+class FECDecoder:
+    """
+    Puts RTP media back in sequence order and fills gaps from SMPTE 2022-1 column and row
+    FEC. In-order packets go straight out; a gap holds the output until the packet turns
+    up, FEC recovers it or the hold runs out, when it is counted as unrecoverable. Unless a
+    fixed latency is given the hold is sized from the FEC matrix and the measured packet
+    rate, so it covers the time until the column FEC protecting a lost packet can arrive.
+    Packets already passed on are kept for a few matrices since FEC needs them to recover
+    the ones after them. A jump in sequence numbers further than that history, as when the
+    sender restarts, is followed rather than counted as loss.
+    """
+
+    def __init__(self, latency: Optional[float] = None, max_latency: float = DEFAULT_MAX_LATENCY_MS / 1000):
+        self.latency = latency
+        self.max_latency = max_latency
+        self.hold = latency if latency is not None else DEFAULT_REORDER_MS / 1000
+        self.columns = None
+        self.rows = None
+        self.history = MIN_HISTORY
+
+        self._packets: Dict[int, tuple] = {}
+        self._fec_by_seq: Dict[int, List[Dict]] = {}
+        self._highest = None
+        self._next_seq = None
+        self._shift = 0
+        self._rate_count = 0
+        self._rate_start = None
+        self.rate = None
+        self._reset_window()
+
+    def _reset_window(self):
+        self.stats = {'media_packets': 0, 'fec_column_packets': 0, 'fec_row_packets': 0, 'reordered': 0,
+                      'duplicates': 0, 'late': 0, 'recovered': 0, 'unrecoverable': 0, 'resyncs': 0}
+
+    def _extend(self, seq: int) -> int:
+        seq = (seq + self._shift) & 0xFFFF
+        if self._highest is None:
+            self._highest = seq
+            return seq
+        extended = _nearest(seq, self._highest)
+        if self._next_seq is not None and extended < self._next_seq - self.history:
+            # Further back than reordering explains: the sender restarted with a lower
+            # sequence number, so number its packets on from the last one
+            self._shift += self._highest + 1 - extended
+            self.stats['resyncs'] += 1
+            extended = self._highest + 1
+        self._highest = max(self._highest, extended)
+        return extended
+
+    def _measure_rate(self, now: float):
+        if self._rate_start is None:
+            self._rate_start = now
+        self._rate_count += 1
+        if now - self._rate_start >= RATE_WINDOW:
+            self.rate = self._rate_count / (now - self._rate_start)
+            self._rate_count = 0
+            self._rate_start = now
+            self._size_hold()
+
+    def _size_hold(self):
+        if not self.columns:
+            return
+        matrix = self.columns * (self.rows or 1)
+        self.history = max(MIN_HISTORY, 2 * matrix)
+        if self.latency is None:
+            # Until the packet rate is known, wait as long as allowed for the FEC
+            hold = MATRIX_MARGIN * matrix / self.rate if self.rate else self.max_latency
+            self.hold = min(self.max_latency, max(MIN_HOLD_MS / 1000, hold))
+
+    def push_media(self, datagram: bytes, now: float):
+        parsed = parse_rtp(datagram)
+        if parsed is None:
+            return
+        seq, payload = parsed
+        self.stats['media_packets'] += 1
+        self._measure_rate(now)
+        highest = self._highest
+        extended = self._extend(seq)
+        if extended in self._packets:
+            self.stats['duplicates'] += 1
+            return
+        if self._next_seq is not None and extended < self._next_seq:
+            self.stats['late'] += 1
+            return
+        if highest is not None and extended < highest:
+            self.stats['reordered'] += 1
+        self._packets[extended] = (payload, now)
+
+    def push_fec(self, datagram: bytes, row: bool):
+        parsed = parse_rtp(datagram)
+        fec = parse_fec(parsed[1]) if parsed else None
+        if fec is None or self._highest is None or not fec['na']:
+            return
+        self.stats['fec_row_packets' if row else 'fec_column_packets'] += 1
+        if row:
+            self.columns = self.columns or fec['na']
+        elif (fec['offset'], fec['na']) != (self.columns, self.rows):
+            self.columns, self.rows = fec['offset'], fec['na']
+            self._size_hold()
+
+        base = _nearest((fec['snbase'] + self._shift) & 0xFFFF, self._highest)
+        step = max(1, fec['offset'])
+        fec['protected'] = [base + i * step for i in range(fec['na'])]
+        oldest = self._next_seq - self.history if self._next_seq is not None else None
+        for seq in fec['protected']:
+            if oldest is None or seq >= oldest:
+                self._fec_by_seq.setdefault(seq, []).append(fec)
+
+    def _recover(self, seq: int, now: float, visiting: set) -> bool:
+        """Rebuild a missing packet from any FEC packet it is the only gap in, first trying
+        to fill the other gaps of that FEC packet from the other direction"""
+        visiting.add(seq)
+        for fec in self._fec_by_seq.get(seq, ()):
+            missing = [s for s in fec['protected'] if s != seq and s not in self._packets]
+            for other in missing:
+                if other not in visiting and other >= self._next_seq - self.history \
+                        and len(visiting) < MAX_RECURSION:
+                    self._recover(other, now, visiting)
+            if any(s != seq and s not in self._packets for s in fec['protected']):
+                continue
+            others = [self._packets[s][0] for s in fec['protected'] if s != seq]
+            length = fec['length_recovery']
+            for payload in others:
+                length ^= len(payload)
+            size = max([len(fec['data'])] + [len(payload) for payload in others])
+            self._packets[seq] = (_xor([fec['data']] + others, size)[:length], now)
+            self.stats['recovered'] += 1
+            return True
+        return False
+
+    def pop_ready(self, now: float) -> List[bytes]:
+        """Payloads that can be passed on, in sequence order"""
+        ready = []
+        if self._next_seq is None:
+            if not self._packets:
+                return ready
+            self._next_seq = min(self._packets)
+        while self._next_seq <= self._highest:
+            seq = self._next_seq
+            if seq in self._packets or self._recover(seq, now, set()):
+                ready.append(self._packets[seq][0])
+                self._advance()
+                continue
+            # The hold runs from when the packet after the gap arrived, so a burst
+            # shares one hold and the output never falls further behind than that
+            following = min(s for s in self._packets if s > seq)
+            if now - self._packets[following][1] < self.hold:
+                break
+            if following - seq > self.history:
+                # Further than any FEC reaches: the sender jumped ahead, carry on from there
+                self._resync(following)
+                continue
+            # Last chance for FEC across the whole gap, then past it in one go
+            for missing in range(seq, following):
+                if missing in self._packets or self._recover(missing, now, set()):
+                    ready.append(self._packets[missing][0])
+                else:
+                    self.stats['unrecoverable'] += 1
+                self._advance()
+        return ready
+
+    def _resync(self, seq: int):
+        oldest = seq - self.history
+        self._packets = {s: packet for s, packet in self._packets.items() if s >= oldest}
+        self._fec_by_seq = {s: fecs for s, fecs in self._fec_by_seq.items() if s >= oldest}
+        self._next_seq = seq
+        self.stats['resyncs'] += 1
+
+    def _advance(self):
+        expired = self._next_seq - self.history
+        self._packets.pop(expired, None)
+        self._fec_by_seq.pop(expired, None)
+        self._next_seq += 1
+
+    def get_stats(self) -> Dict:
+        """Counters since the last call"""
+        stats = dict(self.stats)
+        stats.update({
+            'lost': stats['recovered'] + stats['unrecoverable'],
+            'fec_columns': self.columns or 0,
+            'fec_rows': self.rows or 0,
+            'hold_ms': round(self.hold * 1000, 1),
+            'packet_rate': round(self.rate, 1) if self.rate else 0
+        })
+        self._reset_window()
+        return stats
+
+
+class RTPFECReceiver:
+    """
+    Receives RTP/MPEG-TS on a UDP port, with its column and row FEC streams when it has
+    them, and passes the depayloaded, reordered and repaired TS to on_output(data,
+    datagrams) from its own thread.
+    """
+
+    def __init__(self, uri: str, settings: Dict, on_output: Callable[[bytes, int], None],
+                 buffer_size: int = DEFAULT_BUFFER_SIZE, multicast_iface: Optional[str] = None,
+                 stats_collector=None, logger: Optional[logging.Logger] = None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.uri = uri
+        self.on_output = on_output
+        self.stats_collector = stats_collector
+        self.buffer_size = buffer_size
+        self.multicast_iface = multicast_iface
+
+        parsed = urlparse(uri)
+        if parsed.port is None:
+            raise ValueError(f"No port in RTP URI: {uri}")
+        self.fec_uris = {}
+        if settings.get('fec', True):
+            host = parsed.hostname or '0.0.0.0'
+            column_port = int(settings.get('fec-column-port', parsed.port + COLUMN_PORT_OFFSET))
+            self.fec_uris['column'] = f"udp://{host}:{column_port}"
+            if settings.get('fec-rows', True):
+                row_port = int(settings.get('fec-row-port', parsed.port + ROW_PORT_OFFSET))
+                self.fec_uris['row'] = f"udp://{host}:{row_port}"
+
+        latency = settings.get('latency-ms')
+        self.decoder = FECDecoder(
+            latency=float(latency) / 1000 if latency is not None else None,
+            max_latency=float(settings.get('max-latency-ms', DEFAULT_MAX_LATENCY_MS)) / 1000
+        )
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._receivers = []
+
+    def start(self):
+        """Start receiving media and FEC and the output thread"""
+        self._stop_event.clear()
+        streams = [('media', self.uri)] + list(self.fec_uris.items())
+        for kind, uri in streams:
+            receiver = BatchedUDPReceiver(
+                uri, lambda datagrams, count, kind=kind: self._receive(kind, datagrams),
+                buffer_size=self.buffer_size, multicast_iface=self.multicast_iface,
+                join=False, logger=self.logger
+            )
+            receiver.start()
+            self._receivers.append(receiver)
+        fec = ', '.join(f"{kind} FEC on {uri}" for kind, uri in self.fec_uris.items()) or "no FEC"
+        self.logger.info(f"RTP input on {self.uri} with {fec}")
+
+        self._thread = threading.Thread(target=self._output_loop, name="RTPFEC", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the receivers and the output thread"""
+        self._stop_event.set()
+        for receiver in self._receivers:
+            receiver.stop()
+        if self._thread:
+            self._thread.join(timeout=1)
+        self._receivers = []
+
+    def _receive(self, kind: str, datagrams: List[bytes]):
+        now = time.monotonic()
+        with self._lock:
+            for datagram in datagrams:
+                if kind == 'media':
+                    self.decoder.push_media(datagram, now)
+                else:
+                    self.decoder.push_fec(datagram, kind == 'row')
+
+    def _output_loop(self):
+        while not self._stop_event.wait(EMIT_INTERVAL):
+            with self._lock:
+                ready = self.decoder.pop_ready(time.monotonic())
+            if ready:
+                try:
+                    self.on_output(b''.join(ready), len(ready))
+                except Exception as e:
+                    self.logger.error(f"Error passing on RTP payload: {str(e)}")
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return self.decoder.get_stats()
+
+    def publish(self):
+        """Push stats to Redis; returns True so it can run as a GLib timer"""
+        try:
+            stats = self.get_stats()
+            if stats['unrecoverable']:
+                self.logger.warning(f"RTP input lost {stats['unrecoverable']} packets FEC could not recover "
+                                    f"({stats['recovered']} recovered)")
+            if self.stats_collector:
+                self.stats_collector.add_stats("rtp_fec", stats)
+        except Exception as e:
+            self.logger.error(f"Error publishing RTP FEC stats: {str(e)}")
+        return True
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import random
+import socket
+import threading
+import time
+
+from rtp_fec import FECEncoder, RTPFECReceiver, make_rtp, PT_MP2T, COLUMN_PORT_OFFSET, ROW_PORT_OFFSET
+
+TS_PACKET_SIZE = 188
+PACKETS_PER_DATAGRAM = 7
+RTP_CLOCK = 90000
+
+
+def generated_ts():
+    """Endless TS on one PID with a running counter in the payload, so every datagram differs"""
+    counter = 0
+    while True:
+        header = bytes([0x47, 0x01, 0x00, 0x10 | (counter & 0x0F)])
+        yield header + counter.to_bytes(8, 'big') + bytes(TS_PACKET_SIZE - 12)
+        counter += 1
+
+
+def file_ts(path: str):
+    """TS packets of a file, looped"""
+    while True:
+        with open(path, 'rb') as f:
+            while True:
+                packet = f.read(TS_PACKET_SIZE)
+                if len(packet) < TS_PACKET_SIZE:
+                    break
+                yield packet
+
+
+class LossPattern:
+    """Decides which media datagrams are not sent: random drops that start bursts"""
+
+    def __init__(self, drop_rate: float, burst: int, seed: int):
+        self.drop_rate = drop_rate
+        self.burst = burst
+        self.random = random.Random(seed)
+        self._remaining = 0
+
+    def drop(self) -> bool:
+        if self._remaining:
+            self._remaining -= 1
+            return True
+        if self.random.random() < self.drop_rate:
+            self._remaining = self.burst - 1
+            return True
+        return False
+
+
+def send(args, payloads_sent: list, stop: threading.Event):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if args.ttl:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, args.ttl)
+    media = (args.host, args.port)
+    columns = (args.host, args.port + COLUMN_PORT_OFFSET)
+    rows = (args.host, args.port + ROW_PORT_OFFSET)
+
+    source = file_ts(args.file) if args.file else generated_ts()
+    encoder = FECEncoder(args.columns, args.rows)
+    loss = LossPattern(args.drop_rate, args.burst, args.seed)
+    interval = PACKETS_PER_DATAGRAM * TS_PACKET_SIZE * 8 / (args.rate_mbps * 1000000)
+
+    start = time.perf_counter()
+    sent = 0
+    seq = 0
+    dropped = 0
+    pending_fec = []
+    restart_at = args.duration / 2 if args.restart_seq is not None else None
+    while not stop.is_set() and time.perf_counter() - start < args.duration:
+        if restart_at is not None and time.perf_counter() - start >= restart_at:
+            # As a restarted sender would: new sequence numbers and FEC matrix, unsent FEC gone
+            seq = args.restart_seq & 0xFFFF
+            encoder = FECEncoder(args.columns, args.rows)
+            pending_fec = []
+            restart_at = None
+        payload = b''.join(next(source) for _ in range(PACKETS_PER_DATAGRAM))
+        timestamp = int((time.perf_counter() - start) * RTP_CLOCK)
+        if loss.drop():
+            dropped += 1
+        else:
+            sock.sendto(make_rtp(seq, timestamp, PT_MP2T, 0, payload), media)
+        payloads_sent.append(payload)
+
+        due = encoder.feed(seq, timestamp, payload)
+        if args.row_fec:
+            for datagram in due['row']:
+                sock.sendto(datagram, rows)
+        # Column FEC goes out spread over the next matrix instead of in one burst
+        pending_fec.extend(due['column'])
+        if pending_fec and seq % max(1, args.rows) == 0:
+            sock.sendto(pending_fec.pop(0), columns)
+
+        seq = (seq + 1) & 0xFFFF
+        sent += 1
+        delay = start + sent * interval - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    for datagram in pending_fec:
+        sock.sendto(datagram, columns)
+    sock.close()
+    return sent, dropped
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Send RTP/MPEG-TS with SMPTE 2022-1 FEC, dropping media packets on purpose")
+    parser.add_argument("--host", default="127.0.0.1", help="Destination address (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=5000,
+                        help="Media port; column FEC goes to port+2 and row FEC to port+4 (default: 5000)")
+    parser.add_argument("--file", help="TS file to send in a loop (default: generated packets)")
+    parser.add_argument("--rate-mbps", type=float, default=10, help="Media bitrate (default: 10)")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to send (default: 10)")
+    parser.add_argument("--columns", type=int, default=10, help="FEC matrix columns, L (default: 10)")
+    parser.add_argument("--rows", type=int, default=10, help="FEC matrix rows, D (default: 10)")
+    parser.add_argument("--no-row-fec", dest="row_fec", action="store_false", help="Send column FEC only")
+    parser.add_argument("--drop-rate", type=float, default=0.001,
+                        help="Probability a media datagram starts a loss burst (default: 0.001)")
+    parser.add_argument("--burst", type=int, default=1, help="Datagrams lost per burst (default: 1)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed for the loss pattern (default: 1)")
+    parser.add_argument("--ttl", type=int, default=0, help="Multicast TTL")
+    parser.add_argument("--check", action="store_true",
+                        help="Receive on the port in this process and compare what comes out with what was sent")
+    parser.add_argument("--latency-ms", type=float, help="Fixed receiver hold when checking (default: sized from FEC)")
+    parser.add_argument("--restart-seq", type=int,
+                        help="Halfway through, restart the sequence numbers from this value as a restarted sender "
+                             "would; with --check, the receiver should follow the jump without counting it as loss")
+    args = parser.parse_args()
+
+    received = []
+    receiver = None
+    if args.check:
+        logging.basicConfig(level=logging.WARNING)
+        settings = {'fec': True, 'fec-rows': args.row_fec}
+        if args.latency_ms is not None:
+            settings['latency-ms'] = args.latency_ms
+        receiver = RTPFECReceiver(f"udp://{args.host}:{args.port}", settings,
+                                  lambda data, count: received.append(data))
+        receiver.start()
+
+    payloads_sent = []
+    stop = threading.Event()
+    try:
+        sent, dropped = send(args, payloads_sent, stop)
+    except KeyboardInterrupt:
+        stop.set()
+        sent, dropped = len(payloads_sent), 0
+    print(f"Sent {sent} media datagrams, dropped {dropped} on purpose")
+
+    if receiver:
+        # Let the last hold run out
+        time.sleep(max(1.0, receiver.decoder.hold * 2))
+        receiver.stop()
+        stats = receiver.decoder.get_stats()
+        output = b''.join(received)
+        datagram_size = PACKETS_PER_DATAGRAM * TS_PACKET_SIZE
+        chunks = {output[pos:pos + datagram_size] for pos in range(0, len(output), datagram_size)}
+        missing = sum(1 for payload in payloads_sent if payload not in chunks)
+        print(f"Recovered {stats['recovered']}, unrecoverable {stats['unrecoverable']}, "
+              f"resyncs {stats['resyncs']}, FEC matrix {stats['fec_columns']}x{stats['fec_rows']}, "
+              f"hold {stats['hold_ms']} ms")
+        print(f"{missing} of {sent} datagrams missing from the receiver output")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ import argparse
 import asyncio
 import logging
 from logging.handlers import TimedRotatingFileHandler
-from typing import Dict, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 from collections import deque
 import os
 from datetime import datetime, timedelta
@@ -17,6 +17,11 @@ import yaml
 import subprocess
 import psutil
 import time
+from process_sampler import ProcessSampler, format_uptime
+from loop_lag import AsyncioLagProbe
+from stats_collector import StatsCollector
+from playout_schedule import load_schedule, save_schedule, validate_item, prune_schedule
+import redis
 
 def setup_logging(log_dir: str) -> logging.Logger:
     log_dir = os.path.abspath(log_dir)
@@ -141,6 +146,10 @@ class Scheduler:
         self.packet_threshold = 100
         self.source_check_interval = 60
         self.channel_initializing = {}
+
+        # Process stats are sampled in the background so /list never blocks on psutil
+        self.process_sampler = ProcessSampler(interval=1.0, logger=self.logger)
+        self.process_sampler.start()
         
         if not os.path.exists(self.caricoder_path):
             raise FileNotFoundError(f"CariCoder script not found at {self.caricoder_path}")
@@ -186,6 +195,7 @@ class Scheduler:
         try:
             process = await self.start_caricoder(channel, source_index)
             self.processes[channel] = (process, source_index)
+            self.process_sampler.register(channel, process.pid)
             self.channel_initializing[channel] = True
             asyncio.create_task(self.initialize_channel_monitoring(channel))
             self.logger.info(f"Successfully started channel {channel} with source index {source_index}")
@@ -210,6 +220,7 @@ class Scheduler:
             process.kill()
         
         del self.processes[channel]
+        self.process_sampler.unregister(channel)
         self.logger.info(f"Channel {channel} removed from active processes")
         return True
 
@@ -303,6 +314,7 @@ class Scheduler:
                         
                         # Remove the crashed process from the active processes
                         del self.processes[channel]
+                        self.process_sampler.unregister(channel)
                     
                     await self.check_stream_health(channel)
                     
@@ -477,6 +489,16 @@ class ChannelRequest(BaseModel):
    channel: str
    source_index: int
 
+class ScheduleItem(BaseModel):
+   id: Optional[str] = None
+   start: Union[float, str]
+   input: Optional[int] = None
+   file: Optional[str] = None
+   loop: bool = True
+
+class ScheduleRequest(BaseModel):
+   items: List[ScheduleItem]
+
 app = FastAPI()
 
 app.add_middleware(
@@ -500,6 +522,18 @@ async def startup_event():
    log_dir = os.path.abspath(args.log_dir)
    
    scheduler = Scheduler(log_dir)
+
+   # Loop lag stats go to Redis when it is available, otherwise they are only logged
+   stats_collector = None
+   try:
+       redis_client = redis.Redis(host='localhost', port=6379, decode_responses=True)
+       redis_client.ping()
+       stats_collector = StatsCollector("scheduler", redis_client)
+   except redis.ConnectionError:
+       scheduler.logger.error("Failed to connect to Redis, loop lag stats will not be stored")
+   scheduler.lag_probe = AsyncioLagProbe("scheduler", scheduler.logger, stats_collector=stats_collector)
+   scheduler.lag_probe.start()
+
    asyncio.create_task(scheduler.monitor_processes())
    asyncio.create_task(scheduler.periodic_source_check())
 
@@ -558,60 +592,46 @@ async def list_channels():
    logger.info("Received request to list all running channels")
    channels = []
    
-   cpu_count = psutil.cpu_count()
+   cpu_count = scheduler.process_sampler.cpu_count
    
    for channel, (process, source_index) in scheduler.processes.items():
-       try:
-           pid = process.pid
-           if pid:
-               try:
-                   p = psutil.Process(pid)
-                   uptime_seconds = int(time.time() - p.create_time())
-                   hours = uptime_seconds // 3600
-                   minutes = (uptime_seconds % 3600) // 60
-                   seconds = uptime_seconds % 60
-                   uptime = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-                   
-                   cpu_percent = p.cpu_percent(interval=0.1)
-                   per_core_usage = cpu_percent / cpu_count
-                   
-                   channels.append({
-                       "channel": channel,
-                       "source_index": source_index,
-                       "pid": pid,
-                       "status": "running",
-                       "uptime": uptime,
-                       "cpu_usage_total": f"{cpu_percent:.1f}%",
-                       "cpu_usage_per_core": f"{per_core_usage:.1f}%",
-                       "cpu_cores": cpu_count
-                   })
-               except (psutil.NoSuchProcess, psutil.AccessDenied) as e:
-                   logger.error(f"Process error for channel {channel}: {str(e)}")
-                   channels.append({
-                       "channel": channel,
-                       "source_index": source_index,
-                       "pid": pid,
-                       "status": "error"
-                   })
-           else:
-               channels.append({
-                   "channel": channel,
-                   "source_index": source_index,
-                   "pid": None,
-                   "status": "error"
-               })
-       except Exception as e:
-           logger.error(f"Error getting process info for channel {channel}: {str(e)}")
+       sample = scheduler.process_sampler.get(channel)
+       if sample is None:
+           # Registered but not sampled yet
+           channels.append({
+               "channel": channel,
+               "source_index": source_index,
+               "pid": process.pid,
+               "status": "starting"
+           })
+       elif not sample["running"]:
            channels.append({
                "channel": channel,
                "source_index": source_index,
-               "pid": None,
+               "pid": process.pid,
                "status": "error"
            })
+       else:
+           channels.append({
+               "channel": channel,
+               "source_index": source_index,
+               "pid": process.pid,
+               "status": "running",
+               "uptime": format_uptime(sample["uptime"]),
+               "cpu_usage_total": f"{sample['cpu_percent']:.1f}%",
+               "cpu_usage_per_core": f"{sample['cpu_per_core']:.1f}%",
+               "cpu_cores": cpu_count,
+               "memory_rss": sample["rss"],
+               "sampled_at": sample["sampled_at"]
+           })
 
    logger.info(f"Returning list of {len(channels)} channels")
    return {"channels": channels}
 
+@app.get("/processes")
+async def get_process_snapshot():
+   return scheduler.process_sampler.snapshot()
+
 @app.get("/queue")
 async def get_queue_state():
    logger = logging.getLogger("SchedulerService")
@@ -620,5 +640,57 @@ async def get_queue_state():
    logger.info(f"Returning queue state with {len(queue_state)} entries")
    return {"queue_state": queue_state}
 
+def _schedule_inputs(channel: str) -> list:
+   settings = scheduler.config.get_channel_settings(channel)
+   if not settings:
+       raise HTTPException(status_code=404, detail=f"Unknown channel {channel}")
+   if not settings.get('scheduled_playout'):
+       raise HTTPException(status_code=400, detail=f"Channel {channel} does not have scheduled_playout enabled")
+   return settings.get('inputs', [])
+
+@app.get("/schedule/{channel}")
+async def get_schedule(channel: str):
+   _schedule_inputs(channel)
+   return {"channel": channel, "items": load_schedule(channel)}
+
+@app.put("/schedule/{channel}")
+async def replace_schedule(channel: str, request: ScheduleRequest):
+   logger = logging.getLogger("SchedulerService")
+   inputs = _schedule_inputs(channel)
+   try:
+       items = [validate_item(item.dict(), inputs) for item in request.items]
+   except ValueError as e:
+       raise HTTPException(status_code=400, detail=str(e))
+   items = prune_schedule(sorted(items, key=lambda item: item['start']), time.time())
+   save_schedule(channel, items)
+   logger.info(f"Replaced playout schedule of channel {channel} with {len(items)} item(s)")
+   return {"channel": channel, "items": items}
+
+@app.post("/schedule/{channel}/items")
+async def add_schedule_item(channel: str, item: ScheduleItem):
+   logger = logging.getLogger("SchedulerService")
+   inputs = _schedule_inputs(channel)
+   try:
+       new_item = validate_item(item.dict(), inputs)
+   except ValueError as e:
+       raise HTTPException(status_code=400, detail=str(e))
+   items = [existing for existing in load_schedule(channel) if existing['id'] != new_item['id']]
+   items = prune_schedule(sorted(items + [new_item], key=lambda item: item['start']), time.time())
+   save_schedule(channel, items)
+   logger.info(f"Scheduled item {new_item['id']} on channel {channel} at {new_item['start']}")
+   return new_item
+
+@app.delete("/schedule/{channel}/items/{item_id}")
+async def delete_schedule_item(channel: str, item_id: str):
+   logger = logging.getLogger("SchedulerService")
+   _schedule_inputs(channel)
+   items = load_schedule(channel)
+   remaining = [item for item in items if item['id'] != item_id]
+   if len(remaining) == len(items):
+       raise HTTPException(status_code=404, detail=f"No schedule item {item_id} on channel {channel}")
+   save_schedule(channel, remaining)
+   logger.info(f"Removed item {item_id} from the schedule of channel {channel}")
+   return {"message": f"Removed item {item_id} from channel {channel}"}
+
 if __name__ == "__main__":
    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from typing import Dict, List, Optional, Set
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+try:
+    import numpy as np
+except ImportError:  # PID filtering falls back to slicing in Python
+    np = None
+
+import redis
+
+from latency_profile import DEFAULT_SRT_LATENCY_MS
+from stats_collector import StatsCollector
+from ts_psi import TS_PACKET_SIZE, SYNC_BYTE
+
+# Consumers register here and the service creates their sockets here
+SHARED_DIR = "/tmp/caricoder/shared"
+# A consumer that has not refreshed its registration for this long is dropped
+CONSUMER_TTL = 15
+SCAN_INTERVAL = 2
+STATS_INTERVAL = 5
+SHM_SIZE = 64 * 1024 * 1024
+
+
+def setup_logging(log_dir: str = 'logs/shared_ingest', log_level: str = 'INFO') -> logging.Logger:
+    """Set up logging with both console and file outputs"""
+    os.makedirs(log_dir, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    log_file = os.path.join(log_dir, f'shared_ingest_{timestamp}.log')
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.DEBUG)
+    while root_logger.handlers:
+        root_logger.removeHandler(root_logger.handlers[0])
+
+    file_handler = RotatingFileHandler(log_file, maxBytes=5*1024*1024, backupCount=10, encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - [%(levelname)s] - %(message)s'))
+    file_handler.setLevel(logging.DEBUG)
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    console_handler.setLevel(getattr(logging, log_level))
+    root_logger.addHandler(file_handler)
+    root_logger.addHandler(console_handler)
+    return logging.getLogger(__name__)
+
+
+def socket_path(channel_name: str, source_index: int) -> str:
+    return os.path.join(SHARED_DIR, f"{channel_name}_{source_index}_shm")
+
+
+def _registration_path(channel_name: str, source_index: int) -> str:
+    return os.path.join(SHARED_DIR, f"{channel_name}_{source_index}.consumer")
+
+
+def source_key(input_config: Dict) -> str:
+    """Consumers with the same key share one receiver"""
+    return f"{input_config['type']}|{input_config.get('uri', '')}"
+
+
+def register_consumer(channel_name: str, source_index: int, input_config: Dict,
+                      latency: Optional[int] = None) -> str:
+    """Ask the shared ingest service for this input; call again to keep the registration alive.
+    latency is the consumer's SRT receive latency in ms, used when the input sets none."""
+    os.makedirs(SHARED_DIR, exist_ok=True)
+    path = _registration_path(channel_name, source_index)
+    registration = {
+        'channel': channel_name,
+        'source_index': source_index,
+        'input': input_config,
+        'socket_path': socket_path(channel_name, source_index),
+        'latency': latency,
+        'updated': time.time()
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(registration, f)
+    os.replace(tmp_path, path)
+    return registration['socket_path']
+
+
+def unregister_consumer(channel_name: str, source_index: int):
+    """Release this input so the service can stop receiving it"""
+    try:
+        os.unlink(_registration_path(channel_name, source_index))
+    except FileNotFoundError:
+        pass
+
+
+def filter_pids(data: bytes, pids) -> bytes:
+    """Keep only the TS packets on the given PIDs; data must start on a packet boundary"""
+    usable = len(data) - len(data) % TS_PACKET_SIZE
+    if np is not None:
+        packets = np.frombuffer(data, dtype=np.uint8, count=usable).reshape(-1, TS_PACKET_SIZE)
+        packet_pids = ((packets[:, 1].astype(np.uint16) & 0x1F) << 8) | packets[:, 2]
+        return packets[np.isin(packet_pids, list(pids))].tobytes()
+    keep = []
+    for pos in range(0, usable, TS_PACKET_SIZE):
+        if (((data[pos + 1] & 0x1F) << 8) | data[pos + 2]) in pids:
+            keep.append(data[pos:pos + TS_PACKET_SIZE])
+    return b''.join(keep)
+
+
+class SharedSource:
+    """
+    One receiver for a source and a tsparse that splits it. Each consumer gets a branch
+    ending in its own shmsink: a tsparse program pad when it asks for a program number,
+    a PID-filtered copy when it asks for a PID set, the whole stream otherwise.
+    """
+
+    def __init__(self, key: str, input_config: Dict, logger: logging.Logger,
+                 latency: int = DEFAULT_SRT_LATENCY_MS):
+        self.key = key
+        self.input_config = input_config
+        self.latency = latency
+        self.logger = logger
+        self.pipeline = None
+        self.elements = {}
+        self.branches: Dict[str, Dict] = {}
+        # Consumers whose old branch is still being torn down; they share its names and socket
+        self.disposing: Set[str] = set()
+        self.bytes = 0
+
+    def start(self):
+        """Build and start the receiving half of the pipeline"""
+        self.pipeline = Gst.Pipeline.new("shared_source")
+        options = self.input_config.get('options') or {}
+        if self.input_config['type'] == 'udpsrc':
+            source = Gst.ElementFactory.make("udpsrc", "source")
+            source.set_property('uri', self.input_config['uri'])
+            source.set_property('buffer-size', int(options.get('buffer-size', 2097152)))
+        elif self.input_config['type'] == 'srtsrc':
+            source = Gst.ElementFactory.make("srtsrc", "source")
+            source.set_property('uri', self.input_config['uri'])
+            source.set_property('latency', options.get('latency', self.latency))
+            if 'streamid' in options:
+                source.set_property('streamid', options['streamid'])
+        else:
+            raise ValueError(f"Shared ingest supports udpsrc and srtsrc, not {self.input_config['type']}")
+
+        self.elements = {
+            'source': source,
+            'queue': Gst.ElementFactory.make("queue", "queue"),
+            'tsparse': Gst.ElementFactory.make("tsparse", "split"),
+            'tee': Gst.ElementFactory.make("tee", "tee"),
+            'fakesink': Gst.ElementFactory.make("fakesink", "fakesink")
+        }
+        self.elements['queue'].set_property("leaky", 2)
+        self.elements['queue'].set_property("max-size-buffers", 0)
+        self.elements['queue'].set_property("max-size-bytes", 0)
+        self.elements['queue'].set_property("max-size-time", 1000000000)
+        self.elements['tsparse'].set_property("set-timestamps", True)
+        # Keeps the always pad flowing when every consumer uses program pads
+        self.elements['tee'].set_property("allow-not-linked", True)
+        self.elements['fakesink'].set_property("sync", False)
+        self.elements['fakesink'].set_property("async", False)
+
+        for element in self.elements.values():
+            self.pipeline.add(element)
+        if not (source.link(self.elements['queue']) and self.elements['queue'].link(self.elements['tsparse'])
+                and self.elements['tsparse'].link(self.elements['tee'])
+                and self.elements['tee'].link(self.elements['fakesink'])):
+            raise RuntimeError(f"Failed to link shared source {self.key}")
+
+        source.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, self._count_bytes)
+        bus = self.pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect("message", self._on_message)
+        if self.pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+            raise RuntimeError(f"Unable to start shared source {self.key}")
+        self.logger.info(f"Started shared receiver for {self.key}")
+
+    def _count_bytes(self, pad, info):
+        buffer = info.get_buffer()
+        if buffer:
+            self.bytes += buffer.get_size()
+        return Gst.PadProbeReturn.OK
+
+    def _on_message(self, bus, message):
+        if message.type == Gst.MessageType.ERROR:
+            err, debug = message.parse_error()
+            self.logger.error(f"Shared source {self.key} error from {message.src.get_name()}: {err.message}")
+        elif message.type == Gst.MessageType.WARNING:
+            warn, debug = message.parse_warning()
+            self.logger.warning(f"Shared source {self.key} warning: {warn.message}")
+
+    def _make_sink(self, name: str, path: str):
+        sink = Gst.ElementFactory.make("shmsink", f"{name}_sink")
+        sink.set_property("socket-path", path)
+        sink.set_property("shm-size", SHM_SIZE)
+        sink.set_property("wait-for-connection", False)
+        sink.set_property("sync", False)
+        sink.set_property("async", False)
+        return sink
+
+    def add_consumer(self, registration: Dict):
+        """Add a branch feeding a consumer's socket"""
+        name = f"{registration['channel']}_{registration['source_index']}"
+        path = registration['socket_path']
+        if os.path.exists(path):
+            os.unlink(path)
+
+        demux = registration['input'].get('demux') or {}
+        program_number = demux.get('program-number')
+        pids = registration['input'].get('pids')
+
+        queue = Gst.ElementFactory.make("queue", f"{name}_queue")
+        queue.set_property("leaky", 2)
+        queue.set_property("max-size-time", 1000000000)
+        sink = self._make_sink(name, path)
+        elements = [queue]
+        if pids:
+            # appsink/appsrc pair so the packets can be filtered in between
+            appsink = Gst.ElementFactory.make("appsink", f"{name}_filter_in")
+            appsink.set_property("emit-signals", True)
+            appsink.set_property("sync", False)
+            appsrc = Gst.ElementFactory.make("appsrc", f"{name}_filter_out")
+            appsrc.set_property("is-live", True)
+            appsrc.set_property("format", Gst.Format.TIME)
+            appsrc.set_property("do-timestamp", True)
+            appsrc.set_property("caps", Gst.Caps.from_string("video/mpegts,systemstream=true,packetsize=188"))
+            pid_set = {int(pid, 16) if isinstance(pid, str) else int(pid) for pid in pids}
+            appsink.connect("new-sample", self._on_filter_sample, appsrc, pid_set)
+            elements += [appsink, appsrc, sink]
+        else:
+            elements.append(sink)
+
+        for element in elements:
+            self.pipeline.add(element)
+        if pids:
+            linked = queue.link(elements[1]) and elements[2].link(sink)
+        else:
+            linked = queue.link(sink)
+
+        if program_number is not None and not pids:
+            src_pad = self.elements['tsparse'].get_request_pad(f"program_{int(program_number)}")
+            source_element = self.elements['tsparse']
+        else:
+            src_pad = self.elements['tee'].get_request_pad("src_%u")
+            source_element = self.elements['tee']
+        if not linked or src_pad is None or src_pad.link(queue.get_static_pad('sink')) != Gst.PadLinkReturn.OK:
+            raise RuntimeError(f"Failed to add shared branch for {name}")
+
+        for element in elements:
+            element.sync_state_with_parent()
+        self.branches[name] = {'elements': elements, 'pad': src_pad, 'owner': source_element,
+                               'registration': registration}
+        what = f"program {program_number}" if program_number is not None and not pids else \
+            f"PIDs {pids}" if pids else "full stream"
+        self.logger.info(f"Feeding {name} from {self.key} ({what}) at {path}")
+
+    def _on_filter_sample(self, appsink, appsrc, pids):
+        sample = appsink.emit("pull-sample")
+        buffer = sample.get_buffer() if sample else None
+        if buffer:
+            success, map_info = buffer.map(Gst.MapFlags.READ)
+            if success:
+                try:
+                    data = filter_pids(bytes(map_info.data), pids) if map_info.data[0] == SYNC_BYTE else b''
+                finally:
+                    buffer.unmap(map_info)
+                if data:
+                    appsrc.emit("push-buffer", Gst.Buffer.new_wrapped(data))
+        return Gst.FlowReturn.OK
+
+    def remove_consumer(self, name: str):
+        """Detach a consumer's branch without interrupting the others"""
+        branch = self.branches.pop(name, None)
+        if not branch:
+            return
+        self.disposing.add(name)
+
+        def _unlink(pad, info):
+            queue_pad = branch['elements'][0].get_static_pad('sink')
+            pad.unlink(queue_pad)
+            GLib.idle_add(self._dispose_branch, name, branch)
+            return Gst.PadProbeReturn.REMOVE
+
+        branch['pad'].add_probe(Gst.PadProbeType.IDLE, _unlink)
+
+    def _dispose_branch(self, name: str, branch: Dict):
+        if name not in self.disposing:
+            # The source was stopped in the meantime and its sockets already removed
+            return False
+        for element in branch['elements']:
+            element.set_state(Gst.State.NULL)
+            self.pipeline.remove(element)
+        branch['owner'].release_request_pad(branch['pad'])
+        path = branch['registration']['socket_path']
+        if os.path.exists(path):
+            os.unlink(path)
+        self.disposing.discard(name)
+        self.logger.info(f"Stopped feeding {name} from {self.key}")
+        return False
+
+    def stop(self):
+        """Stop receiving and remove every consumer socket"""
+        if self.pipeline:
+            self.pipeline.get_bus().remove_signal_watch()
+            self.pipeline.set_state(Gst.State.NULL)
+        for branch in self.branches.values():
+            path = branch['registration']['socket_path']
+            if os.path.exists(path):
+                os.unlink(path)
+        self.branches = {}
+        self.disposing = set()
+        self.logger.info(f"Stopped shared receiver for {self.key}")
+
+
+class SharedIngestService:
+    """Keeps one SharedSource per unique source that registered consumers ask for"""
+
+    def __init__(self, redis_client=None, logger: Optional[logging.Logger] = None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.redis_client = redis_client
+        self.sources: Dict[str, SharedSource] = {}
+        self.stats_collectors = {}
+        self.last_stats = time.time()
+        os.makedirs(SHARED_DIR, exist_ok=True)
+
+    def _read_registrations(self) -> List[Dict]:
+        registrations = []
+        now = time.time()
+        for filename in os.listdir(SHARED_DIR):
+            if not filename.endswith('.consumer'):
+                continue
+            path = os.path.join(SHARED_DIR, filename)
+            try:
+                with open(path, 'r') as f:
+                    registration = json.load(f)
+            except (OSError, ValueError) as e:
+                self.logger.warning(f"Could not read consumer registration {path}: {str(e)}")
+                continue
+            if now - registration.get('updated', 0) > CONSUMER_TTL:
+                self.logger.info(f"Dropping stale consumer registration {filename}")
+                os.unlink(path)
+                continue
+            registrations.append(registration)
+        return registrations
+
+    def scan(self):
+        """Bring receivers and branches in line with the current registrations"""
+        try:
+            wanted: Dict[str, Dict[str, Dict]] = {}
+            for registration in self._read_registrations():
+                key = source_key(registration['input'])
+                name = f"{registration['channel']}_{registration['source_index']}"
+                wanted.setdefault(key, {})[name] = registration
+
+            for key in list(self.sources):
+                if key not in wanted:
+                    self.sources.pop(key).stop()
+
+            for key, consumers in wanted.items():
+                source = self.sources.get(key)
+                if source is None:
+                    # One receiver serves every consumer, so it uses the largest latency any asked for
+                    latencies = [c['latency'] for c in consumers.values() if c.get('latency')]
+                    source = SharedSource(key, next(iter(consumers.values()))['input'], self.logger,
+                                          latency=max(latencies, default=DEFAULT_SRT_LATENCY_MS))
+                    try:
+                        source.start()
+                    except Exception as e:
+                        self.logger.error(f"Could not start shared source {key}: {str(e)}")
+                        source.stop()
+                        continue
+                    self.sources[key] = source
+                for name in list(source.branches):
+                    if name not in consumers or source.branches[name]['registration']['input'] != consumers[name]['input']:
+                        source.remove_consumer(name)
+
+            # A consumer whose old branch is still being disposed of is added on a later scan,
+            # so its element names and socket are free again
+            disposing = set().union(*(source.disposing for source in self.sources.values()))
+            for key, consumers in wanted.items():
+                source = self.sources.get(key)
+                if source is None:
+                    continue
+                for name, registration in consumers.items():
+                    if name not in source.branches and name not in disposing:
+                        try:
+                            source.add_consumer(registration)
+                        except Exception as e:
+                            self.logger.error(f"Could not add consumer {name}: {str(e)}")
+
+            if time.time() - self.last_stats >= STATS_INTERVAL:
+                self._publish_stats()
+        except Exception as e:
+            self.logger.error(f"Error scanning shared ingest consumers: {str(e)}")
+        return True
+
+    def _publish_stats(self):
+        now = time.time()
+        elapsed = max(now - self.last_stats, 1e-3)
+        self.last_stats = now
+        for key, source in self.sources.items():
+            stats = {
+                'source': key,
+                'consumers': len(source.branches),
+                'source_bitrate_mbps': source.bytes * 8 / elapsed / 1e6
+            }
+            source.bytes = 0
+            self.logger.debug(f"Shared source stats: {stats}")
+            if not self.redis_client:
+                continue
+            for branch in source.branches.values():
+                channel = branch['registration']['channel']
+                if channel not in self.stats_collectors:
+                    self.stats_collectors[channel] = StatsCollector(channel, self.redis_client)
+                self.stats_collectors[channel].add_stats("shared_ingest", stats)
+
+    def run(self):
+        """Scan registrations until interrupted"""
+        GLib.timeout_add_seconds(SCAN_INTERVAL, self.scan)
+        loop = GLib.MainLoop()
+        self.logger.info(f"Shared ingest service watching {SHARED_DIR}")
+        try:
+            loop.run()
+        except KeyboardInterrupt:
+            self.logger.info("Keyboard interrupt received, stopping shared ingest")
+        finally:
+            for source in self.sources.values():
+                source.stop()
+
+
+#main indent
+def main():
+    """Main entry point"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Shared receiver for inputs used by several channels")
+    parser.add_argument("--log-dir", default="/root/caricoder/logs/shared_ingest",
+                        help="Directory for log files")
+    parser.add_argument("--log-level", choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        default='INFO', help="Set the logging level")
+    args = parser.parse_args()
+
+    logger = setup_logging(args.log_dir, args.log_level)
+    Gst.init(None)
+
+    try:
+        redis_client = redis.Redis(host='localhost', port=6379, decode_responses=True)
+        redis_client.ping()
+    except redis.ConnectionError:
+        logger.warning("Failed to connect to Redis, shared ingest stats disabled")
+        redis_client = None
+
+    SharedIngestService(redis_client, logger).run()
+
+
+if __name__ == "__main__":
+    main()
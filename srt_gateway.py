@@ -0,0 +1,659 @@
+#!/usr/bin/env python3
+
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+from typing import Callable, Dict, List, Optional
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+
+import redis
+
+from stats_collector import StatsCollector
+
+# Channels register their stream id here and the gateway creates their sockets here
+GATEWAY_DIR = "/tmp/caricoder/srt_gateway"
+# A route that has not refreshed its registration for this long is dropped
+ROUTE_TTL = 15
+SCAN_INTERVAL = 2
+STATS_INTERVAL = 5
+SHM_SIZE = 16 * 1024 * 1024
+DEFAULT_PORT = 9000
+DEFAULT_LATENCY = 1000
+RECV_TIMEOUT_MS = 1000       # how often a connection thread wakes to notice it was replaced or stopped
+MAX_MESSAGE = 1500
+
+# SRT_SOCKOPT values from srt.h
+SRTO_RCVTIMEO = 14
+SRTO_LATENCY = 23
+SRTO_PASSPHRASE = 26
+SRTO_STREAMID = 46
+SRT_ERROR = -1
+SRT_INVALID_SOCK = -1
+SRT_EASYNCRCV = 6002         # what a blocking receive returns when SRTO_RCVTIMEO runs out
+
+# int (*srt_listen_callback_fn)(void* opaque, SRTSOCKET ns, int hsversion,
+#                               const struct sockaddr* peeraddr, const char* streamid)
+LISTEN_CALLBACK = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_int,
+                                   ctypes.c_void_p, ctypes.c_char_p)
+
+
+def setup_logging(log_dir: str = 'logs/srt_gateway', log_level: str = 'INFO') -> logging.Logger:
+    """Set up logging with both console and file outputs"""
+    os.makedirs(log_dir, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    log_file = os.path.join(log_dir, f'srt_gateway_{timestamp}.log')
+
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.DEBUG)
+    while root_logger.handlers:
+        root_logger.removeHandler(root_logger.handlers[0])
+
+    file_handler = RotatingFileHandler(log_file, maxBytes=5*1024*1024, backupCount=10, encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - [%(levelname)s] - %(message)s'))
+    file_handler.setLevel(logging.DEBUG)
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    console_handler.setLevel(getattr(logging, log_level))
+    root_logger.addHandler(file_handler)
+    root_logger.addHandler(console_handler)
+    return logging.getLogger(__name__)
+
+
+def socket_path(channel_name: str) -> str:
+    return os.path.join(GATEWAY_DIR, f"{channel_name}_shm")
+
+
+def _registration_path(channel_name: str) -> str:
+    return os.path.join(GATEWAY_DIR, f"{channel_name}.route")
+
+
+def gateway_streamid(channel_name: str, input_config: Dict) -> str:
+    """Stream id callers use for a channel: the input's streamid option, else the channel name"""
+    return (input_config.get('options') or {}).get('streamid') or channel_name
+
+
+def parse_streamid(streamid: str) -> str:
+    """Resource a caller asks for; `#!::r=name,m=publish` access control syntax or a plain id"""
+    if streamid.startswith('#!::'):
+        for item in streamid[4:].split(','):
+            key, _, value = item.partition('=')
+            if key.strip() == 'r':
+                return value.strip()
+    return streamid
+
+
+def register_route(channel_name: str, input_config: Dict, latency: Optional[int] = None) -> str:
+    """
+    Ask the gateway to route this channel's stream id; call again to keep the route alive.
+    The latency and the input's passphrase option are applied to each caller of the route.
+    """
+    os.makedirs(GATEWAY_DIR, exist_ok=True)
+    path = _registration_path(channel_name)
+    registration = {
+        'channel': channel_name,
+        'streamid': gateway_streamid(channel_name, input_config),
+        'socket_path': socket_path(channel_name),
+        'latency': latency,
+        'passphrase': (input_config.get('options') or {}).get('passphrase'),
+        'updated': time.time()
+    }
+    tmp_path = f"{path}.tmp"
+    # Holds the passphrase, so only readable by the user the channels and gateway run as
+    fd = os.open(tmp_path, os.O_CREAT | os.O_TRUNC | os.O_WRONLY, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(registration, f)
+    os.replace(tmp_path, path)
+    return registration['socket_path']
+
+
+def unregister_route(channel_name: str):
+    """Release this channel's route so the gateway stops accepting its callers"""
+    try:
+        os.unlink(_registration_path(channel_name))
+    except FileNotFoundError:
+        pass
+
+
+class SRTStats(ctypes.Structure):
+    """The leading fields of libsrt's SRT_TRACEBSTATS, up to the receiver buffer state"""
+    _fields_ = [
+        ('msTimeStamp', ctypes.c_int64),
+        ('pktSentTotal', ctypes.c_int64),
+        ('pktRecvTotal', ctypes.c_int64),
+        ('pktSndLossTotal', ctypes.c_int),
+        ('pktRcvLossTotal', ctypes.c_int),
+        ('pktRetransTotal', ctypes.c_int),
+        ('pktSentACKTotal', ctypes.c_int),
+        ('pktRecvACKTotal', ctypes.c_int),
+        ('pktSentNAKTotal', ctypes.c_int),
+        ('pktRecvNAKTotal', ctypes.c_int),
+        ('usSndDurationTotal', ctypes.c_int64),
+        ('pktSndDropTotal', ctypes.c_int),
+        ('pktRcvDropTotal', ctypes.c_int),
+        ('pktRcvUndecryptTotal', ctypes.c_int),
+        ('byteSentTotal', ctypes.c_uint64),
+        ('byteRecvTotal', ctypes.c_uint64),
+        ('byteRcvLossTotal', ctypes.c_uint64),
+        ('byteRetransTotal', ctypes.c_uint64),
+        ('byteSndDropTotal', ctypes.c_uint64),
+        ('byteRcvDropTotal', ctypes.c_uint64),
+        ('byteRcvUndecryptTotal', ctypes.c_uint64),
+        ('pktSent', ctypes.c_int64),
+        ('pktRecv', ctypes.c_int64),
+        ('pktSndLoss', ctypes.c_int),
+        ('pktRcvLoss', ctypes.c_int),
+        ('pktRetrans', ctypes.c_int),
+        ('pktRcvRetrans', ctypes.c_int),
+        ('pktSentACK', ctypes.c_int),
+        ('pktRecvACK', ctypes.c_int),
+        ('pktSentNAK', ctypes.c_int),
+        ('pktRecvNAK', ctypes.c_int),
+        ('mbpsSendRate', ctypes.c_double),
+        ('mbpsRecvRate', ctypes.c_double),
+        ('usSndDuration', ctypes.c_int64),
+        ('pktReorderDistance', ctypes.c_int),
+        ('pktRcvAvgBelatedTime', ctypes.c_double),
+        ('pktRcvBelated', ctypes.c_int64),
+        ('pktSndDrop', ctypes.c_int),
+        ('pktRcvDrop', ctypes.c_int),
+        ('pktRcvUndecrypt', ctypes.c_int),
+        ('byteSent', ctypes.c_uint64),
+        ('byteRecv', ctypes.c_uint64),
+        ('byteRcvLoss', ctypes.c_uint64),
+        ('byteRetrans', ctypes.c_uint64),
+        ('byteSndDrop', ctypes.c_uint64),
+        ('byteRcvDrop', ctypes.c_uint64),
+        ('byteRcvUndecrypt', ctypes.c_uint64),
+        ('usPktSndPeriod', ctypes.c_double),
+        ('pktFlowWindow', ctypes.c_int),
+        ('pktCongestionWindow', ctypes.c_int),
+        ('pktFlightSize', ctypes.c_int),
+        ('msRTT', ctypes.c_double),
+        ('mbpsBandwidth', ctypes.c_double),
+        ('byteAvailSndBuf', ctypes.c_int),
+        ('byteAvailRcvBuf', ctypes.c_int),
+        ('mbpsMaxBW', ctypes.c_double),
+        ('byteMSS', ctypes.c_int),
+        ('pktSndBuf', ctypes.c_int),
+        ('byteSndBuf', ctypes.c_int),
+        ('msSndBuf', ctypes.c_int),
+        ('msSndTsbPdDelay', ctypes.c_int),
+        ('pktRcvBuf', ctypes.c_int),
+        ('byteRcvBuf', ctypes.c_int),
+        ('msRcvBuf', ctypes.c_int),
+        ('msRcvTsbPdDelay', ctypes.c_int),
+        # Later libsrt versions append more fields
+        ('_reserved', ctypes.c_byte * 512)
+    ]
+
+
+class SRTLibrary:
+    """The few libsrt calls the gateway needs, through ctypes"""
+
+    NAMES = ('srt', 'srt-gnutls', 'srt-openssl')
+
+    def __init__(self):
+        path = next((found for found in map(ctypes.util.find_library, self.NAMES) if found), None)
+        if path is None:
+            raise RuntimeError("libsrt not found; install the SRT library GStreamer's srt plugin uses")
+        self.lib = ctypes.CDLL(path)
+        self.lib.srt_getlasterror_str.restype = ctypes.c_char_p
+        self.lib.srt_bstats.argtypes = [ctypes.c_int, ctypes.POINTER(SRTStats), ctypes.c_int]
+        self.lib.srt_recvmsg.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+        # Per-caller options need libsrt 1.4.2 or later
+        self.has_listen_callback = hasattr(self.lib, 'srt_listen_callback')
+        self._listen_callback = None
+        if self.lib.srt_startup() < 0:
+            raise RuntimeError(f"srt_startup failed: {self.error()}")
+
+    def error(self) -> str:
+        return self.lib.srt_getlasterror_str().decode(errors='replace')
+
+    def set_int(self, sock: int, option: int, value: int):
+        value = ctypes.c_int(int(value))
+        if self.lib.srt_setsockflag(sock, option, ctypes.byref(value), ctypes.sizeof(value)) == SRT_ERROR:
+            raise RuntimeError(f"Setting SRT option {option} failed: {self.error()}")
+
+    def set_string(self, sock: int, option: int, value: str):
+        data = value.encode()
+        if self.lib.srt_setsockflag(sock, option, data, len(data)) == SRT_ERROR:
+            raise RuntimeError(f"Setting SRT option {option} failed: {self.error()}")
+
+    def get_string(self, sock: int, option: int) -> str:
+        data = ctypes.create_string_buffer(512)
+        length = ctypes.c_int(len(data))
+        if self.lib.srt_getsockflag(sock, option, data, ctypes.byref(length)) == SRT_ERROR:
+            return ''
+        return data.raw[:length.value].decode(errors='replace')
+
+    def listen(self, host: str, port: int, latency: int, passphrase: Optional[str],
+               on_caller: Optional[Callable[[int, str], bool]] = None) -> int:
+        """
+        Listening socket. on_caller(socket, stream id) runs during each caller's handshake,
+        where it can set that caller's options or turn it away by returning False.
+        """
+        sock = self.lib.srt_create_socket()
+        if sock == SRT_INVALID_SOCK:
+            raise RuntimeError(f"srt_create_socket failed: {self.error()}")
+        # Accepted sockets inherit these from the listener
+        self.set_int(sock, SRTO_LATENCY, latency)
+        self.set_int(sock, SRTO_RCVTIMEO, RECV_TIMEOUT_MS)
+        if passphrase:
+            self.set_string(sock, SRTO_PASSPHRASE, passphrase)
+        if on_caller is not None:
+            def hook(opaque, caller, hsversion, peer, streamid):
+                try:
+                    return 0 if on_caller(caller, (streamid or b'').decode(errors='replace')) else -1
+                except Exception:
+                    return -1
+            # libsrt keeps the pointer, so the ctypes wrapper must outlive the listener
+            self._listen_callback = LISTEN_CALLBACK(hook)
+            if self.lib.srt_listen_callback(sock, self._listen_callback, None) == SRT_ERROR:
+                error = self.error()
+                self.lib.srt_close(sock)
+                raise RuntimeError(f"Setting the SRT listen callback failed: {error}")
+        # sockaddr_in: family in host byte order, port and address in network order
+        address = struct.pack('=H', socket.AF_INET) + struct.pack('!H4s8x', port, socket.inet_aton(host))
+        if self.lib.srt_bind(sock, address, len(address)) == SRT_ERROR \
+                or self.lib.srt_listen(sock, 64) == SRT_ERROR:
+            error = self.error()
+            self.lib.srt_close(sock)
+            raise RuntimeError(f"Cannot listen on {host}:{port}: {error}")
+        return sock
+
+    def accept(self, sock: int):
+        """Block for the next caller; returns (socket, peer address) or (None, None) once closed"""
+        address = ctypes.create_string_buffer(128)
+        length = ctypes.c_int(len(address))
+        caller = self.lib.srt_accept(sock, address, ctypes.byref(length))
+        if caller == SRT_INVALID_SOCK:
+            return None, None
+        family = struct.unpack_from('=H', address.raw)[0]
+        if family == socket.AF_INET:
+            port, host = struct.unpack_from('!H4s', address.raw, 2)
+            return caller, f"{socket.inet_ntoa(host)}:{port}"
+        return caller, 'unknown'
+
+    def recv(self, sock: int, buffer) -> int:
+        """Bytes of one message into buffer; 0 on timeout, -1 once the connection is gone"""
+        received = self.lib.srt_recvmsg(sock, buffer, len(buffer))
+        if received == SRT_ERROR:
+            return 0 if self.lib.srt_getlasterror(None) == SRT_EASYNCRCV else -1
+        return received
+
+    def stats(self, sock: int) -> Optional[SRTStats]:
+        """Counters for a connection; the interval ones restart from this call"""
+        perf = SRTStats()
+        if self.lib.srt_bstats(sock, ctypes.byref(perf), 1) == SRT_ERROR:
+            return None
+        return perf
+
+    def close(self, sock: int):
+        self.lib.srt_close(sock)
+
+
+class Route:
+    """
+    One channel's way out of the gateway: appsrc ! queue ! shmsink feeding the socket its
+    input handler reads. It lives as long as the channel is registered, so callers come
+    and go without the handler seeing its source disappear.
+    """
+
+    def __init__(self, registration: Dict, logger: logging.Logger):
+        self.registration = registration
+        self.channel = registration['channel']
+        self.streamid = registration['streamid']
+        self.logger = logger
+        self.pipeline = None
+        self.appsrc = None
+        self.connection: Optional['Connection'] = None
+        self.connections = 0
+
+    def start(self):
+        path = self.registration['socket_path']
+        if os.path.exists(path):
+            os.unlink(path)
+        self.pipeline = Gst.Pipeline.new(f"route_{self.channel}")
+        self.appsrc = Gst.ElementFactory.make("appsrc", "source")
+        self.appsrc.set_property("is-live", True)
+        self.appsrc.set_property("format", Gst.Format.TIME)
+        self.appsrc.set_property("do-timestamp", True)
+        self.appsrc.set_property("caps", Gst.Caps.from_string("video/mpegts,systemstream=true,packetsize=188"))
+        queue = Gst.ElementFactory.make("queue", "queue")
+        queue.set_property("leaky", 2)
+        queue.set_property("max-size-time", 1000000000)
+        sink = Gst.ElementFactory.make("shmsink", "sink")
+        sink.set_property("socket-path", path)
+        sink.set_property("shm-size", SHM_SIZE)
+        sink.set_property("wait-for-connection", False)
+        sink.set_property("sync", False)
+        sink.set_property("async", False)
+        for element in (self.appsrc, queue, sink):
+            self.pipeline.add(element)
+        if not (self.appsrc.link(queue) and queue.link(sink)):
+            raise RuntimeError(f"Failed to link route for {self.channel}")
+        if self.pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+            raise RuntimeError(f"Unable to start route for {self.channel}")
+        self.logger.info(f"Routing stream id '{self.streamid}' to {self.channel} at {path}")
+
+    def push(self, data: bytes):
+        self.appsrc.emit("push-buffer", Gst.Buffer.new_wrapped(data))
+
+    def stop(self):
+        if self.connection:
+            self.connection.stop()
+        if self.pipeline:
+            self.pipeline.set_state(Gst.State.NULL)
+        path = self.registration['socket_path']
+        if os.path.exists(path):
+            os.unlink(path)
+        self.logger.info(f"Stopped route for {self.channel}")
+
+
+class Connection:
+    """One caller feeding a route, read on its own thread until it drops or is replaced"""
+
+    def __init__(self, srt: SRTLibrary, sock: int, peer: str, streamid: str, route: Route,
+                 logger: logging.Logger):
+        self.srt = srt
+        self.sock = sock
+        self.peer = peer
+        self.streamid = streamid
+        self.route = route
+        self.logger = logger
+        self.connected_at = time.time()
+        self.running = True
+        self.thread = threading.Thread(target=self._receive, name=f"srt_{route.channel}", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def _receive(self):
+        buffer = ctypes.create_string_buffer(MAX_MESSAGE)
+        while self.running:
+            received = self.srt.recv(self.sock, buffer)
+            if received < 0:
+                self.logger.info(f"Caller {self.peer} for {self.route.channel} disconnected")
+                break
+            if received and self.route.connection is self:
+                self.route.push(ctypes.string_at(buffer, received))
+        self.running = False
+        self.srt.close(self.sock)
+
+    def stop(self):
+        self.running = False
+
+
+class SRTGatewayService:
+    """
+    A single SRT listener for every channel whose SRT input sets `gateway: true`. Input
+    handlers register the stream id they answer to; callers on the shared port are routed
+    by the stream id they connect with, and a caller for a stream id nobody registered is
+    turned away. A new caller for a route replaces the one it has, so an encoder that
+    reconnects before its old session times out takes over at once. Connection stats are
+    published under each channel's srt_input key, where srtsrc's used to be.
+
+    The latency and passphrase a channel registers are set on each of its callers during
+    the handshake; the gateway's own --latency/--passphrase apply to routes that set none.
+    A libsrt without srt_listen_callback can only use the gateway's, so a route asking for
+    anything else is refused rather than run with settings it did not ask for.
+    """
+
+    def __init__(self, host: str = '0.0.0.0', port: int = DEFAULT_PORT, latency: int = DEFAULT_LATENCY,
+                 passphrase: Optional[str] = None, redis_client=None, logger: Optional[logging.Logger] = None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.passphrase = passphrase
+        self.redis_client = redis_client
+        self.srt = SRTLibrary()
+        self.listener = None
+        self.routes: Dict[str, Route] = {}
+        self._lock = threading.Lock()
+        self.stats_collectors = {}
+        self.rejected = 0
+        self.refused = set()
+        self.last_stats = time.time()
+        os.makedirs(GATEWAY_DIR, exist_ok=True)
+
+    def _read_registrations(self) -> List[Dict]:
+        registrations = []
+        now = time.time()
+        for filename in os.listdir(GATEWAY_DIR):
+            if not filename.endswith('.route'):
+                continue
+            path = os.path.join(GATEWAY_DIR, filename)
+            try:
+                with open(path, 'r') as f:
+                    registration = json.load(f)
+            except (OSError, ValueError) as e:
+                self.logger.warning(f"Could not read route registration {path}: {str(e)}")
+                continue
+            if now - registration.get('updated', 0) > ROUTE_TTL:
+                self.logger.info(f"Dropping stale route registration {filename}")
+                os.unlink(path)
+                continue
+            registrations.append(registration)
+        return registrations
+
+    def _caller_options(self, registration: Dict):
+        """Latency and passphrase callers of a route are held to"""
+        latency = registration.get('latency')
+        passphrase = registration.get('passphrase')
+        return (self.latency if latency is None else latency,
+                passphrase if passphrase else self.passphrase)
+
+    def _conflict(self, registration: Dict) -> Optional[str]:
+        """Why a route cannot run on this libsrt, if it cannot"""
+        if self.srt.has_listen_callback:
+            return None
+        latency, passphrase = self._caller_options(registration)
+        if latency != self.latency:
+            return f"latency {latency} ms differs from the gateway's {self.latency} ms"
+        if passphrase != self.passphrase:
+            return "passphrase differs from the gateway's"
+        return None
+
+    def _on_caller(self, sock: int, raw: str) -> bool:
+        """Handshake hook: turn away unknown stream ids, give known ones their route's options"""
+        streamid = parse_streamid(raw)
+        with self._lock:
+            route = self.routes.get(streamid)
+            if route is None:
+                self.rejected += 1
+        if route is None:
+            self.logger.warning(f"Rejected caller with unknown stream id '{raw}'")
+            return False
+        latency, passphrase = self._caller_options(route.registration)
+        try:
+            self.srt.set_int(sock, SRTO_LATENCY, latency)
+            if passphrase:
+                self.srt.set_string(sock, SRTO_PASSPHRASE, passphrase)
+        except RuntimeError as e:
+            self.logger.error(f"Rejected caller for {route.channel}: {str(e)}")
+            return False
+        return True
+
+    def scan(self):
+        """Bring routes in line with the current registrations"""
+        try:
+            wanted = {}
+            for registration in self._read_registrations():
+                if registration['streamid'] in wanted:
+                    self.logger.error(f"Stream id '{registration['streamid']}' registered by both "
+                                      f"{wanted[registration['streamid']]['channel']} and {registration['channel']}")
+                    continue
+                wanted[registration['streamid']] = registration
+
+            with self._lock:
+                for streamid in list(self.routes):
+                    route = self.routes[streamid]
+                    if streamid not in wanted or wanted[streamid]['channel'] != route.channel:
+                        self.routes.pop(streamid).stop()
+
+            for streamid, registration in wanted.items():
+                if streamid in self.routes:
+                    # Picks up a changed latency or passphrase for the next caller
+                    self.routes[streamid].registration = registration
+                    continue
+                conflict = self._conflict(registration)
+                if conflict:
+                    if registration['channel'] not in self.refused:
+                        self.logger.error(f"Refusing route for {registration['channel']}: {conflict}, "
+                                          f"and this libsrt has no srt_listen_callback to set it per caller")
+                        self.refused.add(registration['channel'])
+                    continue
+                self.refused.discard(registration['channel'])
+                route = Route(registration, self.logger)
+                try:
+                    route.start()
+                except Exception as e:
+                    self.logger.error(f"Could not start route for {registration['channel']}: {str(e)}")
+                    route.stop()
+                    continue
+                with self._lock:
+                    self.routes[streamid] = route
+
+            if time.time() - self.last_stats >= STATS_INTERVAL:
+                self._publish_stats()
+        except Exception as e:
+            self.logger.error(f"Error scanning SRT gateway routes: {str(e)}")
+        return True
+
+    def _accept_loop(self):
+        while self.listener is not None:
+            sock, peer = self.srt.accept(self.listener)
+            if sock is None:
+                if self.listener is not None:
+                    self.logger.error(f"srt_accept failed: {self.srt.error()}")
+                    time.sleep(0.1)
+                continue
+            raw = self.srt.get_string(sock, SRTO_STREAMID)
+            streamid = parse_streamid(raw)
+            with self._lock:
+                route = self.routes.get(streamid)
+                if route is None:
+                    self.rejected += 1
+                else:
+                    previous = route.connection
+                    route.connection = Connection(self.srt, sock, peer, streamid, route, self.logger)
+                    route.connections += 1
+            if route is None:
+                self.logger.warning(f"Rejected caller {peer} with unknown stream id '{raw}'")
+                self.srt.close(sock)
+                continue
+            if previous:
+                self.logger.info(f"Caller {peer} replaces {previous.peer} on {route.channel}")
+                previous.stop()
+            else:
+                self.logger.info(f"Caller {peer} connected to {route.channel}")
+            route.connection.start()
+
+    def _publish_stats(self):
+        now = time.time()
+        self.last_stats = now
+        with self._lock:
+            routes = list(self.routes.values())
+        for route in routes:
+            connection = route.connection
+            stats = {
+                'gateway-port': self.port,
+                'connected': 1 if connection and connection.running else 0,
+                'connections': route.connections,
+                'rejected-callers': self.rejected
+            }
+            if connection and connection.running:
+                perf = self.srt.stats(connection.sock)
+                stats['caller'] = connection.peer
+                stats['connected-seconds'] = now - connection.connected_at
+                if perf:
+                    stats.update({
+                        'packets-received': perf.pktRecvTotal,
+                        'packets-received-lost': perf.pktRcvLossTotal,
+                        'packets-received-retransmitted': perf.pktRcvRetrans,
+                        'packets-received-dropped': perf.pktRcvDropTotal,
+                        'packet-ack-sent': perf.pktSentACKTotal,
+                        'packet-nack-sent': perf.pktSentNAKTotal,
+                        'bytes-received': perf.byteRecvTotal,
+                        'bytes-received-lost': perf.byteRcvLossTotal,
+                        'receive-rate-mbps': perf.mbpsRecvRate,
+                        'bandwidth-mbps': perf.mbpsBandwidth,
+                        'rtt-ms': perf.msRTT,
+                        'negotiated-latency-ms': perf.msRcvTsbPdDelay
+                    })
+            self.logger.debug(f"SRT gateway stats for {route.channel}: {stats}")
+            if not self.redis_client:
+                continue
+            if route.channel not in self.stats_collectors:
+                self.stats_collectors[route.channel] = StatsCollector(route.channel, self.redis_client)
+            self.stats_collectors[route.channel].add_stats("srt_input", stats)
+        self.rejected = 0
+
+    def run(self):
+        """Accept callers and scan registrations until interrupted"""
+        on_caller = self._on_caller if self.srt.has_listen_callback else None
+        if on_caller is None:
+            self.logger.warning("libsrt has no srt_listen_callback, every route uses the gateway's "
+                                "latency and passphrase")
+        self.listener = self.srt.listen(self.host, self.port, self.latency, self.passphrase, on_caller)
+        threading.Thread(target=self._accept_loop, name="srt_accept", daemon=True).start()
+        GLib.timeout_add_seconds(SCAN_INTERVAL, self.scan)
+        loop = GLib.MainLoop()
+        self.logger.info(f"SRT gateway listening on {self.host}:{self.port}, routes from {GATEWAY_DIR}")
+        try:
+            loop.run()
+        except KeyboardInterrupt:
+            self.logger.info("Keyboard interrupt received, stopping SRT gateway")
+        finally:
+            listener, self.listener = self.listener, None
+            self.srt.close(listener)
+            for route in self.routes.values():
+                route.stop()
+            self.srt.lib.srt_cleanup()
+
+
+#main indent
+def main():
+    """Main entry point"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description="One SRT listener routing callers to channels by stream id")
+    parser.add_argument("--host", default="0.0.0.0", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="SRT port shared by every channel")
+    parser.add_argument("--latency", type=int, default=DEFAULT_LATENCY, help="SRT receive latency in ms for routes that do not set their own")
+    parser.add_argument("--passphrase", default=os.environ.get('SRT_GATEWAY_PASSPHRASE'),
+                        help="Passphrase for routes that do not set their own, "
+                             "defaults to $SRT_GATEWAY_PASSPHRASE")
+    parser.add_argument("--log-dir", default="/root/caricoder/logs/srt_gateway",
+                        help="Directory for log files")
+    parser.add_argument("--log-level", choices=['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL'],
+                        default='INFO', help="Set the logging level")
+    args = parser.parse_args()
+
+    logger = setup_logging(args.log_dir, args.log_level)
+    Gst.init(None)
+
+    try:
+        redis_client = redis.Redis(host='localhost', port=6379, decode_responses=True)
+        redis_client.ping()
+    except redis.ConnectionError:
+        logger.warning("Failed to connect to Redis, SRT gateway stats disabled")
+        redis_client = None
+
+    SRTGatewayService(args.host, args.port, args.latency, args.passphrase, redis_client, logger).run()
+
+
+if __name__ == "__main__":
+    main()
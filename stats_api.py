@@ -7,6 +7,7 @@ import traceback
 import yaml
 import os
 import subprocess
+from stream_set import stream_set, read_stream_info
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -108,8 +109,15 @@ def get_live_metrics(metric_name):
 @app.route('/metrics/historic/<metric_name>')
 def get_historic_metrics(metric_name):
     try:
+        # 5 minute rollups by default, ?window=1h for hourly rollups
+        window = request.args.get('window', '5m')
+        prefixes = {'5m': 'historic', '1h': 'historic_1h'}
+        if window not in prefixes:
+            return jsonify({"error": f"Invalid window: {window}"}), 400
+        prefix = prefixes[window]
+
         if metric_name == 'network':
-            interfaces = redis_client.keys("historic:network:*")
+            interfaces = redis_client.keys(f"{prefix}:network:*")
             network_data = {}
             for interface_key in interfaces:
                 interface = interface_key.split(':')[-1]
@@ -117,7 +125,7 @@ def get_historic_metrics(metric_name):
                 network_data[interface] = [json.loads(item) for item in data]
             return jsonify(network_data)
         else:
-            key = f"historic:{metric_name}"
+            key = f"{prefix}:{metric_name}"
             data = redis_client.lrange(key, 0, -1)
             return jsonify([json.loads(item) for item in data])
     except Exception as e:
@@ -154,6 +162,99 @@ def get_latest_metrics():
         app.logger.error(traceback.format_exc())
         return jsonify({"error": "An internal error occurred"}), 500
 
+# Capacity headroom endpoints
+@app.route('/capacity')
+def get_capacity():
+    try:
+        from capacity_estimator import CapacityEstimator
+        return jsonify(CapacityEstimator(redis_client).estimate_all())
+    except Exception as e:
+        app.logger.error(f"Error in get_capacity: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({"error": "An internal error occurred"}), 500
+
+@app.route('/capacity/<channel_name>')
+def get_channel_capacity(channel_name):
+    try:
+        from capacity_estimator import CapacityEstimator
+        config = read_yaml_config()
+        if config is None or channel_name not in config['channels']:
+            return jsonify({"error": f"Channel {channel_name} not found"}), 404
+        source_index = request.args.get('source_index', 0, type=int)
+        return jsonify(CapacityEstimator(redis_client).estimate(config['channels'][channel_name], source_index))
+    except Exception as e:
+        app.logger.error(f"Error in get_channel_capacity: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({"error": "An internal error occurred"}), 500
+
+@app.route('/capacity/estimate', methods=['POST'])
+def estimate_capacity():
+    """Estimate headroom for a channel config that has not been saved yet"""
+    try:
+        from capacity_estimator import CapacityEstimator
+        data = request.get_json()
+        if not data or 'config' not in data:
+            return jsonify({"error": "Missing config parameter"}), 400
+        return jsonify(CapacityEstimator(redis_client).estimate(data['config'], data.get('source_index', 0)))
+    except Exception as e:
+        app.logger.error(f"Error in estimate_capacity: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({"error": "An internal error occurred"}), 500
+
+# Federation endpoint merging every server in servers.json into one view
+federation_aggregator = None
+
+@app.route('/federation/fleet')
+def get_fleet_view():
+    global federation_aggregator
+    try:
+        from federation import FederationAggregator, load_servers
+        if federation_aggregator is None:
+            federation_aggregator = FederationAggregator(load_servers())
+        include_stats = request.args.get('stats', '0') in ('1', 'true')
+        return jsonify(federation_aggregator.get_fleet_view(include_stats=include_stats))
+    except Exception as e:
+        app.logger.error(f"Error in get_fleet_view: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({"error": "An internal error occurred"}), 500
+
+# Input flight recorder endpoints
+@app.route('/recorder/<channel_name>/dump', methods=['POST'])
+def dump_flight_recorder(channel_name):
+    """Ask the channel's input handler to write its flight recorder to a capture"""
+    try:
+        from flight_recorder import request_dump, recorder_path
+        if not os.path.exists(recorder_path(channel_name)):
+            return jsonify({"error": f"No flight recorder running for {channel_name}"}), 404
+        reason = (request.get_json(silent=True) or {}).get('reason', 'api')
+        request_dump(channel_name, ''.join(c for c in reason if c.isalnum() or c in '-_') or 'api')
+        return jsonify({"status": "requested"}), 202
+    except Exception as e:
+        app.logger.error(f"Error in dump_flight_recorder: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({"error": "An internal error occurred"}), 500
+
+@app.route('/recorder/<channel_name>/captures')
+def list_flight_recorder_captures(channel_name):
+    try:
+        from flight_recorder import CAPTURE_DIR, capture_names
+        captures = []
+        for name in capture_names(channel_name, CAPTURE_DIR, ".json"):
+            with open(os.path.join(CAPTURE_DIR, name)) as f:
+                info = json.load(f)
+            captures.append({
+                'capture': os.path.join(CAPTURE_DIR, name[:-5] + ".ts"),
+                'reason': info.get('reason'),
+                'created': info.get('created'),
+                'bytes': info.get('bytes'),
+                'events': len(info.get('events', []))
+            })
+        return jsonify({"channel": channel_name, "captures": captures})
+    except Exception as e:
+        app.logger.error(f"Error in list_flight_recorder_captures: {str(e)}")
+        app.logger.error(traceback.format_exc())
+        return jsonify({"error": "An internal error occurred"}), 500
+
 # Helper endpoint to list available stat types
 @app.route('/stats/types')
 def get_stat_types():
@@ -163,7 +264,26 @@ def get_stat_types():
             "srt_input",
             "video_encoder_input",
             "video_encoder_output",
-            "udp_output"
+            "udp_output",
+            "loop_lag_input",
+            "loop_lag_transcoder",
+            "loop_lag_output_0",
+            "loop_lag_hls_output_0",
+            "loop_lag_caricoder",
+            "ts_analysis",
+            "hot_standby",
+            "hitless_merge",
+            "shared_ingest",
+            "jitter_buffer",
+            "latency_input",
+            "latency_transcoder",
+            "latency_udp_output_0",
+            "latency_hls_output_0",
+            "gop_cache",
+            "flight_recorder",
+            "rtp_fec",
+            "file_playout",
+            "playout"
         ]
     })
 
@@ -173,41 +293,42 @@ def get_stat_types():
 def get_stream_info(channel_name):
     """Get comprehensive stream information for a channel supporting all input types."""
     try:
-        socket_dir = "/tmp/caricoder"
-        video_info_path = f"{socket_dir}/{channel_name}_video_shm_info"
-        audio_info_path = f"{socket_dir}/{channel_name}_audio_shm_info"
-        
-        # Check if files exist
-        if not os.path.exists(video_info_path) or not os.path.exists(audio_info_path):
+        # Read current configuration
+        config = read_yaml_config()
+        channel_config = config['channels'].get(channel_name, {}) if config else {}
+        streams = stream_set(channel_config)
+
+        # Read the codec info files of the streams the channel carries
+        info = read_stream_info(channel_name, streams)
+        if info is None:
             return jsonify({
                 "error": "Stream info not found",
                 "details": "Channel may not be running"
             }), 404
-            
-        # Read codec info files
-        with open(video_info_path, 'r') as f:
-            video_info = json.load(f)
-        with open(audio_info_path, 'r') as f:
-            audio_info = json.load(f)
-        
-        # Read current configuration
-        config = read_yaml_config()
-        channel_config = config['channels'].get(channel_name, {}) if config else {}
+        video_info = info['video'] or {}
+        audio_infos = info['audio']
+        audio_info = audio_infos[0] if audio_infos else {}
         
         # Basic stream status - always available regardless of input type
         stream_info = {
             "name": channel_name,
+            "streams": streams,
             "status": {
                 "video": {
                     "codec": video_info.get('codec'),
                     "pid": video_info.get('pid'),
                     "program_number": video_info.get('program_number')
-                },
+                } if streams['video'] else None,
                 "audio": {
                     "codec": audio_info.get('codec'),
                     "pid": audio_info.get('pid'),
                     "program_number": audio_info.get('program_number')
-                }
+                } if audio_infos else None,
+                "audio_tracks": [{
+                    "codec": track.get('codec'),
+                    "pid": track.get('pid'),
+                    "language": track.get('language')
+                } for track in audio_infos]
             },
             "config": {
                 "inputs": channel_config.get('inputs', []),
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+import json
+import os
+from typing import Dict, List, Optional
+
+SOCKET_DIR = "/tmp/caricoder"
+MAX_AUDIO_TRACKS = 8
+
+# Shorthands accepted for a channel's streams setting
+STREAM_SET_PRESETS = {
+    'av': {'video': True, 'audio': 1},
+    'audio-only': {'video': False, 'audio': 1},
+    'video-only': {'video': True, 'audio': 0}
+}
+
+
+def stream_set(channel_settings: Dict) -> Dict:
+    """
+    The elementary streams a channel carries, as {'video': bool, 'audio': number of tracks}.
+    Taken from the channel's streams setting (a preset name or a dict), otherwise from which
+    of transcoding.video and transcoding.audio are configured; one of each by default.
+    """
+    value = channel_settings.get('streams')
+    if isinstance(value, str):
+        if value not in STREAM_SET_PRESETS:
+            raise ValueError(f"Unknown streams setting {value}, expected one of {', '.join(STREAM_SET_PRESETS)}")
+        streams = dict(STREAM_SET_PRESETS[value])
+    elif isinstance(value, dict):
+        streams = {'video': bool(value.get('video', True)), 'audio': int(value.get('audio', 1))}
+    else:
+        transcoding = channel_settings.get('transcoding') or {}
+        audio = transcoding.get('audio')
+        streams = {
+            'video': bool(transcoding.get('video')) or not transcoding,
+            'audio': len(audio) if isinstance(audio, list) else int(bool(audio) or not transcoding)
+        }
+
+    if not 0 <= streams['audio'] <= MAX_AUDIO_TRACKS:
+        raise ValueError(f"A channel carries 0 to {MAX_AUDIO_TRACKS} audio tracks, not {streams['audio']}")
+    if not streams['video'] and not streams['audio']:
+        raise ValueError("A channel needs at least one video or audio stream")
+    return streams
+
+
+def describe(streams: Dict) -> str:
+    video = 'video' if streams['video'] else 'no video'
+    return f"{video}, {streams['audio']} audio track(s)"
+
+
+def track_suffix(track: int) -> str:
+    """Element and file name suffix of an audio track; the first track keeps the plain names"""
+    return '' if track == 0 else f"_{track + 1}"
+
+
+def audio_track_settings(channel_settings: Dict) -> List[Dict]:
+    """Transcoding settings for each audio track; a single dict applies to every track"""
+    tracks = stream_set(channel_settings)['audio']
+    audio = (channel_settings.get('transcoding') or {}).get('audio') or {'codec': 'passthrough'}
+    if isinstance(audio, list):
+        if len(audio) != tracks:
+            raise ValueError(f"transcoding.audio lists {len(audio)} track(s) but the channel carries {tracks}")
+        return audio
+    return [audio] * tracks
+
+
+def mux_video_pid(mux_settings: Dict) -> int:
+    """Output PID of the video stream: the first of video-pid"""
+    value = mux_settings.get('video-pid', [60])
+    if isinstance(value, list):
+        value = value[0]
+    return int(str(value))
+
+
+def mux_audio_pids(mux_settings: Dict, tracks: int) -> List[int]:
+    """Output PID of each audio track: a list from audio-pid, or consecutive PIDs from it"""
+    value = mux_settings.get('audio-pid', 61)
+    if isinstance(value, list):
+        if len(value) < tracks:
+            raise ValueError(f"mux audio-pid lists {len(value)} PID(s) for {tracks} audio track(s)")
+        return [int(str(pid)) for pid in value[:tracks]]
+    return [int(str(value)) + track for track in range(tracks)]
+
+
+def is_passthrough(channel_settings: Dict) -> bool:
+    """True when every stream the channel carries is set to passthrough, so no transcoder is needed"""
+    streams = stream_set(channel_settings)
+    video = (channel_settings.get('transcoding') or {}).get('video') or {}
+    if streams['video']:
+        video_streams = video.get('streams')
+        if video_streams:
+            if not all(stream.get('codec') == 'passthrough' for stream in video_streams):
+                return False
+        elif video.get('codec') != 'passthrough':
+            return False
+    return all(track.get('codec') == 'passthrough' for track in audio_track_settings(channel_settings))
+
+
+def video_info_path(channel_name: str, socket_dir: str = SOCKET_DIR) -> str:
+    return f"{socket_dir}/{channel_name}_video_shm_info"
+
+
+def audio_info_path(channel_name: str, track: int = 0, socket_dir: str = SOCKET_DIR) -> str:
+    return f"{socket_dir}/{channel_name}_audio{track_suffix(track)}_shm_info"
+
+
+def info_paths(channel_name: str, streams: Dict, socket_dir: str = SOCKET_DIR) -> List[str]:
+    """Codec info files the input handler writes for this stream set"""
+    paths = [video_info_path(channel_name, socket_dir)] if streams['video'] else []
+    return paths + [audio_info_path(channel_name, track, socket_dir) for track in range(streams['audio'])]
+
+
+def all_info_paths(channel_name: str, socket_dir: str = SOCKET_DIR) -> List[str]:
+    """Every codec info file a channel might have, for cleanup"""
+    return info_paths(channel_name, {'video': True, 'audio': MAX_AUDIO_TRACKS}, socket_dir)
+
+
+def write_stream_info(channel_name: str, video_info: Optional[Dict], audio_infos: List[Dict],
+                      socket_dir: str = SOCKET_DIR) -> List[str]:
+    """Write the codec info files of the streams carried and remove any left from other stream sets"""
+    files = {}
+    if video_info is not None:
+        files[video_info_path(channel_name, socket_dir)] = video_info
+    for track, info in enumerate(audio_infos):
+        files[audio_info_path(channel_name, track, socket_dir)] = info
+
+    for path in all_info_paths(channel_name, socket_dir):
+        if path in files:
+            # Readers poll for these, so they must never see a half-written file
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(files[path], f, indent=2)
+            os.replace(temp_path, path)
+        elif os.path.exists(path):
+            os.unlink(path)
+    return list(files)
+
+
+def read_stream_info(channel_name: str, streams: Dict, socket_dir: str = SOCKET_DIR) -> Optional[Dict]:
+    """{'video': info or None, 'audio': [info per track]}, or None until every file is there"""
+    try:
+        video = None
+        if streams['video']:
+            with open(video_info_path(channel_name, socket_dir)) as f:
+                video = json.load(f)
+        audio = []
+        for track in range(streams['audio']):
+            with open(audio_info_path(channel_name, track, socket_dir)) as f:
+                audio.append(json.load(f))
+    except FileNotFoundError:
+        return None
+    return {'video': video, 'audio': audio}
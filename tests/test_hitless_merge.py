@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+import socket
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("gi")
+
+from hitless_merge import HitlessMerge, MergeBuffer
+
+PID = 0x100
+PACKETS_PER_DATAGRAM = 7
+DATAGRAMS = 400
+MAX_SKEW_MS = 50
+PATH_DELAY = 0.005
+
+
+def make_datagrams(count):
+    """TS datagrams with running continuity counters and a unique payload each"""
+    datagrams = []
+    cc = 0
+    for index in range(count):
+        packets = []
+        for packet in range(PACKETS_PER_DATAGRAM):
+            header = bytes([0x47, PID >> 8, PID & 0xFF, 0x10 | cc])
+            payload = f"{index}:{packet}".encode().ljust(184, b'\xff')
+            packets.append(header + payload)
+            cc = (cc + 1) & 0x0F
+        datagrams.append(b''.join(packets))
+    return datagrams
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def send_paths(datagrams, ports, drops, delays):
+    """Send every datagram on each path except that path's drops, path n lagging by delays[n]"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    events = sorted(
+        (index * 0.001 + delays[path], path, index)
+        for path in range(len(ports))
+        for index in range(len(datagrams))
+        if index not in drops[path]
+    )
+    start = time.monotonic()
+    for at, path, index in events:
+        wait = start + at - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        sock.sendto(datagrams[index], ('127.0.0.1', ports[path]))
+    sock.close()
+
+
+def run_merge(drops):
+    datagrams = make_datagrams(DATAGRAMS)
+    ports = [free_port(), free_port()]
+    inputs = [{'type': 'udpsrc', 'uri': f"udp://127.0.0.1:{port}"} for port in ports]
+
+    output = []
+    lock = threading.Lock()
+
+    def on_output(data, count):
+        with lock:
+            output.append(data)
+
+    merge = HitlessMerge(inputs, {'alignment': 'ts', 'max-skew-ms': MAX_SKEW_MS}, on_output)
+    merge.start()
+    try:
+        send_paths(datagrams, ports, drops, [0.0, PATH_DELAY])
+        # Long enough for the last datagrams to go out and for loss to be counted on expiry
+        time.sleep(4 * MAX_SKEW_MS / 1000)
+        stats = merge.get_stats()
+    finally:
+        merge.stop()
+    return datagrams, b''.join(output), stats
+
+
+def test_merge_hides_loss_on_either_path():
+    drops = [
+        {index for index in range(DATAGRAMS) if index % 10 == 3},
+        {index for index in range(DATAGRAMS) if index % 10 == 7}
+    ]
+    datagrams, output, stats = run_merge(drops)
+
+    assert output == b''.join(datagrams)
+    assert stats['alignment'] == 'ts'
+    assert stats['output_datagrams'] == DATAGRAMS
+    assert stats['output_lost'] == 0
+    assert stats['paths']['0']['lost'] == len(drops[0])
+    assert stats['paths']['1']['lost'] == len(drops[1])
+    assert stats['paths']['0']['first'] + stats['paths']['1']['first'] == DATAGRAMS
+    # Path 1 is sent 5 ms behind path 0
+    assert stats['paths']['0']['skew_ms'] == 0
+    assert 1 < stats['paths']['1']['skew_ms'] < 20
+
+
+def test_loss_on_both_paths_is_output_loss():
+    drops = [{100, 200}, {100, 250}]
+    datagrams, output, stats = run_merge(drops)
+
+    expected = [datagram for index, datagram in enumerate(datagrams) if index != 100]
+    assert output == b''.join(expected)
+    assert stats['output_lost'] == 1
+
+
+def rtp(seq, payload):
+    return bytes([0x80, 33]) + seq.to_bytes(2, 'big') + bytes(8) + payload
+
+
+def test_rtp_alignment_by_sequence_number():
+    buffer = MergeBuffer(2, 'rtp', max_skew=0.05)
+    payloads = [bytes([index]) * 188 for index in range(20)]
+    # Sequence numbers wrap, path 0 loses 2 and 3, path 1 loses 5
+    for index, payload in enumerate(payloads):
+        seq = (0xFFF8 + index) & 0xFFFF
+        if index not in (2, 3):
+            buffer.push(0, rtp(seq, payload), 1.0 + index * 0.001)
+        if index != 5:
+            buffer.push(1, rtp(seq, payload), 1.002 + index * 0.001)
+
+    assert buffer.pop_ready(2.0) == payloads
+    stats = buffer.get_stats()
+    assert stats['output_lost'] == 0
+    assert stats['paths']['0']['lost'] == 2
+    assert stats['paths']['1']['lost'] == 1
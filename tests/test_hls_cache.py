@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+
+import pytest
+
+from hls_cache import SegmentCache
+
+URL = "http://origin.example/live/1.ts"
+
+
+class SlowFetch:
+    """fetch() callable that takes a while and counts how often it ran"""
+
+    def __init__(self, body, delay=0.3):
+        self.body = body
+        self.delay = delay
+        self.calls = 0
+        self.started = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        time.sleep(self.delay)
+        return self.body
+
+
+def test_concurrent_misses_share_one_download(tmp_path):
+    cache = SegmentCache(str(tmp_path))
+    fetch = SlowFetch(b'\x47' * 188)
+    results = []
+
+    def get():
+        results.append(cache.get(URL, fetch))
+
+    first = threading.Thread(target=get)
+    first.start()
+    assert fetch.started.wait(2)
+    second = threading.Thread(target=get)
+    second.start()
+    first.join(5)
+    second.join(5)
+
+    assert results == [fetch.body, fetch.body]
+    assert fetch.calls == 1
+    stats = cache.get_stats()
+    assert stats['misses'] == 1
+    assert stats['coalesced'] == 1
+
+
+@pytest.mark.parametrize('cancel', [False, True])
+def test_waiter_gives_up_at_deadline_or_cancel(tmp_path, cancel):
+    cache = SegmentCache(str(tmp_path))
+    fetch = SlowFetch(b'\x47' * 188, delay=1.0)
+    downloader = threading.Thread(target=cache.get, args=(URL, fetch))
+    downloader.start()
+    assert fetch.started.wait(2)
+
+    cancelled = threading.Event()
+    if cancel:
+        threading.Timer(0.1, cancelled.set).start()
+    start = time.monotonic()
+    with pytest.raises(InterruptedError if cancel else TimeoutError):
+        cache.get(URL, lambda: b'', deadline=start + 0.2, cancelled=cancelled)
+    assert time.monotonic() - start < 0.5
+    downloader.join(5)
+    assert fetch.calls == 1
+
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    cache = SegmentCache(str(tmp_path), max_bytes=2500)
+    for name in ('a', 'b'):
+        cache.get(f"{URL}?{name}", lambda: b'\x47' * 1000)
+    # Reading a makes b the least recently used
+    cache.get(f"{URL}?a", lambda: pytest.fail("a should be cached"))
+    cache.get(f"{URL}?c", lambda: b'\x47' * 1000)
+
+    assert cache.get_stats()['evictions'] == 1
+    cache.get(f"{URL}?a", lambda: pytest.fail("a should still be cached"))
+    cache.get(f"{URL}?c", lambda: pytest.fail("c should still be cached"))
+    refetched = []
+    cache.get(f"{URL}?b", lambda: refetched.append('b') or b'\x47' * 1000)
+    assert refetched == ['b']
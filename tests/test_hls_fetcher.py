@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("requests")
+
+from hls_fetcher import HLSFetcher
+
+SEGMENT_SIZE = 188 * 1000
+SEGMENTS = 6
+
+
+def segment_body(sequence):
+    return bytes([0x47]) + bytes([sequence]) * (SEGMENT_SIZE - 1)
+
+
+class ThrottledHLSServer(ThreadingHTTPServer):
+    """Serves a master playlist, two media playlists and their segments with per-segment delays"""
+    daemon_threads = True
+
+    def __init__(self, live=False):
+        super().__init__(('127.0.0.1', 0), _Handler)
+        self.live = live
+        # Seconds to hold each segment back before sending it, and to stall halfway through
+        self.delays = {}
+        self.stalls = {}
+        self.connections = 0
+        self.requests = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def base(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def playlist(self, variant):
+        first = 10 if self.live else 0
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:1', f'#EXT-X-MEDIA-SEQUENCE:{first}']
+        for sequence in range(first, first + SEGMENTS):
+            lines += ['#EXTINF:1.0,', f'{variant}/{sequence}.ts']
+        if not self.live:
+            lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, body, content_type, delay=0.0, stall=0.0):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        time.sleep(delay)
+        try:
+            half = len(body) // 2
+            self.wfile.write(body[:half])
+            self.wfile.flush()
+            time.sleep(stall)
+            self.wfile.write(body[half:])
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+        if self.path == '/master.m3u8':
+            body = ('#EXTM3U\n'
+                    '#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360\nlow.m3u8\n'
+                    '#EXT-X-STREAM-INF:BANDWIDTH=3000000,RESOLUTION=1280x720\nhigh.m3u8\n')
+            self._send(body.encode(), 'application/vnd.apple.mpegurl')
+        elif self.path in ('/low.m3u8', '/high.m3u8'):
+            self._send(server.playlist(self.path[1:-5]).encode(), 'application/vnd.apple.mpegurl')
+        elif self.path.endswith('.ts'):
+            sequence = int(self.path.rsplit('/', 1)[1][:-3])
+            self._send(segment_body(sequence), 'video/mp2t',
+                       server.delays.get(sequence, 0.0), server.stalls.get(sequence, 0.0))
+        else:
+            self.send_error(404)
+
+
+def fetch(server, settings, wanted, timeout=10):
+    """Run a fetcher until it has delivered `wanted` segments; returns (sequences, data, stats, fetcher)"""
+    delivered = []
+    done = threading.Event()
+
+    def on_segment(data, segment):
+        delivered.append((segment['sequence'], data))
+        if len(delivered) >= wanted:
+            done.set()
+
+    fetcher = HLSFetcher(f"{server.base}/master.m3u8", dict({'cache': False}, **settings), on_segment)
+    fetcher.start()
+    try:
+        done.wait(timeout)
+        stats = fetcher.get_stats()
+    finally:
+        fetcher.stop()
+    return [sequence for sequence, _ in delivered], [data for _, data in delivered], stats, fetcher
+
+
+def test_variant_pinning():
+    with ThrottledHLSServer() as server:
+        high = HLSFetcher(f"{server.base}/master.m3u8", {'cache': False, 'variant': {'resolution': '720'}}, None)
+        low = HLSFetcher(f"{server.base}/master.m3u8", {'cache': False, 'variant': {'bandwidth': 900000}}, None)
+        assert high.resolve() == f"{server.base}/high.m3u8"
+        assert low.resolve() == f"{server.base}/low.m3u8"
+        # The media playlist is read on resolve so budgets are known before start
+        assert high.target_duration == 1
+        assert high.segment_budget() == 1
+        assert high.max_delivery_gap() == 2.5
+
+
+def test_parallel_downloads_keep_alive_and_stats():
+    with ThrottledHLSServer() as server:
+        server.delays = {sequence: 0.2 for sequence in range(SEGMENTS)}
+        start = time.monotonic()
+        sequences, data, stats, _ = fetch(server, {'parallel': 3, 'prefetch': 3}, SEGMENTS)
+        elapsed = time.monotonic() - start
+
+    assert sequences == list(range(SEGMENTS))
+    assert data == [segment_body(sequence) for sequence in range(SEGMENTS)]
+    # Three at a time: about two rounds of 0.2 s rather than six
+    assert elapsed < 0.2 * SEGMENTS
+    assert stats['segments_downloaded'] == SEGMENTS
+    assert stats['segment_download_ms_avg'] >= 200
+    assert [s['sequence'] for s in stats['recent_segments']] == list(range(SEGMENTS))
+    # Pooled keep-alive connections: at most one per parallel download plus the playlist
+    assert server.connections <= 4 < len(server.requests)
+
+
+def test_slow_head_segment_is_skipped():
+    with ThrottledHLSServer() as server:
+        # Segment 2 stalls halfway for far longer than the watchdog would allow
+        server.stalls = {2: 30.0}
+        start = time.monotonic()
+        sequences, data, stats, fetcher = fetch(server, {'parallel': 3, 'prefetch': 3}, SEGMENTS - 1)
+        elapsed = time.monotonic() - start
+
+    assert sequences == [0, 1, 3, 4, 5]
+    assert data == [segment_body(sequence) for sequence in sequences]
+    assert stats['segments_skipped'] + stats['segment_failures'] == 1
+    assert elapsed < fetcher.max_delivery_gap()
+
+
+def test_slow_segment_is_bounded_by_its_budget():
+    with ThrottledHLSServer() as server:
+        # One download at a time, so nothing later is ready and only the budget can move things on
+        server.stalls = {1: 30.0}
+        start = time.monotonic()
+        sequences, _, stats, fetcher = fetch(server, {'parallel': 1, 'prefetch': 1, 'retries': 2}, 2)
+        elapsed = time.monotonic() - start
+
+    assert sequences == [0, 2]
+    assert stats['segment_failures'] == 1
+    assert elapsed < fetcher.max_delivery_gap()
+
+
+def test_live_start_relative_to_edge():
+    with ThrottledHLSServer(live=True) as server:
+        sequences, _, _, _ = fetch(server, {'live-edge-segments': 2}, 2)
+
+    # Playlist holds 10-15, so two back from the live edge is 14
+    assert sequences == [14, 15]
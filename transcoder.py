@@ -8,7 +8,6 @@ import logging
 from logging.handlers import RotatingFileHandler
 import subprocess
 import redis
-import json
 import sys
 import os
 import time
@@ -17,6 +16,11 @@ from datetime import datetime
 from collections import deque
 from urllib.parse import urlparse, urlencode
 from stats_collector import StatsCollector
+from loop_lag import GLibLagProbe
+from latency_probe import LatencyProbe
+from latency_profile import LatencySizing
+from stream_set import (stream_set, is_passthrough, audio_track_settings, mux_audio_pids, track_suffix,
+                        info_paths, read_stream_info, describe as describe_streams)
 from pathlib import Path
 
 def setup_logging(channel_name, log_dir='logs', log_level='INFO'):
@@ -204,16 +208,8 @@ class PipelineStateAdapter(logging.LoggerAdapter):
         return f"{msg}{state_info}", kwargs
 
 def check_passthrough(config, channel_name):
-    """Check if both audio and video are set to passthrough"""
-    transcoding = config.get_channel_settings(channel_name).get('transcoding', {})
-    
-    video_streams = transcoding.get('video', {}).get('streams', [])
-    all_video_passthrough = all(stream.get('codec') == 'passthrough' for stream in video_streams)
-    
-    audio_codec = transcoding.get('audio', {}).get('codec')
-    audio_passthrough = audio_codec == 'passthrough'
-    
-    return all_video_passthrough and audio_passthrough
+    """Check if every stream the channel carries is set to passthrough"""
+    return is_passthrough(config.get_channel_settings(channel_name))
 
 #main indent
     
@@ -227,6 +223,9 @@ class TranscodePipelineHandler:
         self.logger = PipelineStateAdapter(self.base_logger, self.logger_extra)
         self.channel_name = channel_name
         self.source_index = source_index
+        self.lag_probe = None
+        self.latency_probe = None
+        self.latency_timer = None
         
 
         # Add restart counter
@@ -262,12 +261,20 @@ class TranscodePipelineHandler:
         self.socket_dir = "/tmp/caricoder"
         self.fds = {}
         self.video_info = None
-        self.audio_info = None
+        self.audio_infos = []
         
+        # Queue, shm and encoder sizing from the channel's latency_profile
+        self.sizing = LatencySizing(self.channel_settings, 'transcoder', self.logger)
+
         # Get transcoding settings
         self.transcode_settings = self.channel_settings.get('transcoding', {})
         if not self.transcode_settings:
             raise ValueError(f"No transcoding settings defined for channel: {channel_name}")
+
+        # Branches are only built for the streams the channel carries
+        self.streams = stream_set(self.channel_settings)
+        self.audio_settings = audio_track_settings(self.channel_settings)
+        self.logger.info(f"Channel carries {describe_streams(self.streams)}")
         
         # Initialize Redis for stats
         try:
@@ -281,26 +288,23 @@ class TranscodePipelineHandler:
             self.stats_collector = None
 
     def _wait_for_codec_info(self):
-        """Wait for codec info files to be available"""
+        """Wait for the codec info files of the streams the channel carries"""
         max_retries = 30  # 2.5 minutes maximum wait time
         retry_count = 0
         
-        video_info_path = f"{self.socket_dir}/{self.channel_name}_video_shm_info"
-        audio_info_path = f"{self.socket_dir}/{self.channel_name}_audio_shm_info"
-        
-        self.logger.info(f"Waiting for codec info files")
+        self.logger.info(f"Waiting for codec info files: {', '.join(info_paths(self.channel_name, self.streams, self.socket_dir))}")
         
         while retry_count < max_retries:
-            if os.path.exists(video_info_path) and os.path.exists(audio_info_path):
-                try:
-                    with open(video_info_path, 'r') as f:
-                        self.video_info = json.load(f)
-                    with open(audio_info_path, 'r') as f:
-                        self.audio_info = json.load(f)
-                    self.logger.info("Successfully loaded codec info files")
-                    return True
-                except Exception as e:
-                    self.logger.warning(f"Error reading codec info files: {str(e)}")
+            try:
+                info = read_stream_info(self.channel_name, self.streams, self.socket_dir)
+            except Exception as e:
+                self.logger.warning(f"Error reading codec info files: {str(e)}")
+                info = None
+            if info:
+                self.video_info = info['video']
+                self.audio_infos = info['audio']
+                self.logger.info("Successfully loaded codec info files")
+                return True
             
             retry_count += 1
             self.logger.debug(f"Codec info files not ready, retry {retry_count}/{max_retries}")
@@ -314,22 +318,20 @@ class TranscodePipelineHandler:
     def _create_queue(self, name):
         """Helper method to create a standardized queue element"""
         queue = Gst.ElementFactory.make("queue", name)
-        queue.set_property("leaky", 1)
-        queue.set_property("max-size-buffers", 0)
-        queue.set_property("max-size-time", 3000000000)
-        queue.set_property("max-size-bytes", 0)
+        self.sizing.configure_queue(queue)
         return queue
 
     def _load_codec_info(self):
         """Load codec information from shared memory info files"""
         try:
-            with open(f"{self.socket_dir}/{self.channel_name}_video_shm_info", 'r') as f:
-                self.video_info = json.load(f)
-            with open(f"{self.socket_dir}/{self.channel_name}_audio_shm_info", 'r') as f:
-                self.audio_info = json.load(f)
+            info = read_stream_info(self.channel_name, self.streams, self.socket_dir)
+            if info is None:
+                raise FileNotFoundError("Codec info files are missing")
+            self.video_info = info['video']
+            self.audio_infos = info['audio']
                 
             self.logger.info(f"Loaded video codec info: {self.video_info}")
-            self.logger.info(f"Loaded audio codec info: {self.audio_info}")
+            self.logger.info(f"Loaded audio codec info: {self.audio_infos}")
         except Exception as e:
             self.logger.error(f"Failed to load codec info: {e}")
             raise
@@ -388,6 +390,8 @@ class TranscodePipelineHandler:
 
         # Connect pad-added signal for dynamic linking
         self.elements['tsdemux'].connect("pad-added", self.on_pad_added)
+
+        self._setup_latency_probe()
         
         # Verify all elements are created
         for name, element in self.elements.items():
@@ -396,6 +400,29 @@ class TranscodePipelineHandler:
             else:
                 self.logger.debug(f"Element {name} created successfully")
 
+    def _stop_latency_probe(self):
+        """Remove the timer and ring file of the previous pipeline's latency probe"""
+        if self.latency_timer:
+            GLib.source_remove(self.latency_timer)
+            self.latency_timer = None
+        if self.latency_probe:
+            self.latency_probe.close()
+            self.latency_probe = None
+
+    def _setup_latency_probe(self):
+        """Per-stage latency of the first video stream and the handoff from the input handler"""
+        self._stop_latency_probe()
+        self.latency_probe = LatencyProbe(self.channel_name, 'transcoder', upstream='input',
+                                          stats_collector=self.stats_collector,
+                                          budgets=self.sizing.hop_budgets(), logger=self.logger)
+        self.latency_probe.add_ingress(self.elements['shmsrc'].get_static_pad('src'))
+        if 'videodecode1' in self.elements:
+            self.latency_probe.add_stage('demux', self.elements['videodecode1'].get_static_pad('sink'))
+            self.latency_probe.add_stage('decode', self.elements['videodecode1'].get_static_pad('src'))
+            self.latency_probe.add_stage('encode', self.elements['videoenc1'].get_static_pad('src'))
+        self.latency_probe.add_egress('mux', self.elements['shmsink'].get_static_pad('sink'))
+        self.latency_timer = GLib.timeout_add(1000, self.latency_probe.update)
+
     def _create_elements(self):
         """Create all GStreamer elements"""
         self.logger.info("Creating elements")
@@ -410,8 +437,6 @@ class TranscodePipelineHandler:
             'queue1': self._create_queue("queue1"),
             'tsparse1': Gst.ElementFactory.make("tsparse", "tsparse1"),
             'queue_tsparse1': self._create_queue("queue_tsparse1"),
-            'watchdog_video': Gst.ElementFactory.make("watchdog", "watchdog_video"),
-            'watchdog_audio': Gst.ElementFactory.make("watchdog", "watchdog_audio"),
             'watchdog_output': Gst.ElementFactory.make("watchdog", "watchdog_output"),
             'tsdemux': Gst.ElementFactory.make("tsdemux", "tsdemux")
 
@@ -424,17 +449,18 @@ class TranscodePipelineHandler:
 
 
         # Configure Watch dogs
-        self.elements['watchdog_video'].set_property('timeout', 5000)  # 5 second timeout
-        self.elements['watchdog_audio'].set_property('timeout', 10000)  # 5 second timeout
         self.elements['watchdog_output'].set_property('timeout', 15000)  # 5 second timeout
 
         # Create video elements based on input codec and passthrough settings
-        video_streams = self.transcode_settings['video']['streams']
-        self._create_video_elements(video_streams)
+        if self.streams['video']:
+            self.elements['watchdog_video'] = Gst.ElementFactory.make("watchdog", "watchdog_video")
+            self.elements['watchdog_video'].set_property('timeout', 5000)  # 5 second timeout
+            video_streams = self.transcode_settings['video']['streams']
+            self._create_video_elements(video_streams)
 
-        # Create audio elements based on input codec and passthrough settings
-        audio_settings = self.transcode_settings['audio']
-        self._create_audio_elements(audio_settings)
+        # Create audio elements for each track based on its input codec and passthrough settings
+        for track, audio_settings in enumerate(self.audio_settings):
+            self._create_audio_elements(track, audio_settings)
 
         # Create muxer and output elements
         self._create_output_elements()
@@ -513,16 +539,12 @@ class TranscodePipelineHandler:
                 case 'x264enc':
                     self.elements[f'videoenc{i}'] = Gst.ElementFactory.make("x264enc", f"videoenc{i}")
                     # Configure x264 specific properties
-                    self.elements[f'videoenc{i}'].set_property("tune", 0x00000004)  # zero-latency
-                    self.elements[f'videoenc{i}'].set_property("speed-preset", 2)  # superfast
                     self.elements[f'videoenc{i}'].set_property("bitrate", stream.get('options', {}).get('bitrate', 2000))
                     self.elements[f'videoenc{i}'].set_property("key-int-max", stream.get('options', {}).get('key-int-max', 60))
                     
                 case 'x265enc':
                     self.elements[f'videoenc{i}'] = Gst.ElementFactory.make("x265enc", f"videoenc{i}")
                     # Configure x265 specific properties
-                    self.elements[f'videoenc{i}'].set_property("tune", "zerolatency")
-                    self.elements[f'videoenc{i}'].set_property("speed-preset", "superfast")
                     self.elements[f'videoenc{i}'].set_property("bitrate", stream.get('options', {}).get('bitrate', 2000))
                     
                 case 'mpeg2enc':
@@ -530,6 +552,14 @@ class TranscodePipelineHandler:
                 case _:
                     raise ValueError(f"Unsupported output video codec: {stream['codec']}")
 
+            # Tuning for the latency profile, then the channel's own options on top
+            factory_name = self.elements[f'videoenc{i}'].get_factory().get_name()
+            for key, value in self.sizing.encoder_properties(factory_name).items():
+                try:
+                    self.elements[f'videoenc{i}'].set_property(key, value)
+                except Exception as e:
+                    self.logger.warning(f"Failed to set encoder tuning {key}={value}: {str(e)}")
+
             # Configure general encoder options
             for key, value in stream.get('options', {}).items():
                 if key not in ['tune', 'speed-preset']:  # Skip already configured properties
@@ -559,47 +589,52 @@ class TranscodePipelineHandler:
             except Exception as e:
                 self.logger.warning(f"Failed to log encoder settings: {str(e)}")
 
-    def _create_audio_elements(self, audio_settings):
-        """Create audio processing elements with additional queues"""
-        # Create audio queue
-        self.elements['queue_audio'] = self._create_queue("queue_audio")
+    def _create_audio_elements(self, track, audio_settings):
+        """Create audio processing elements for one track with additional queues"""
+        suffix = track_suffix(track)
+        audio_codec = self.audio_infos[track]['codec']
+
+        # Create audio queue and watchdog
+        self.elements[f'queue_audio{suffix}'] = self._create_queue(f"queue_audio{suffix}")
+        self.elements[f'watchdog_audio{suffix}'] = Gst.ElementFactory.make("watchdog", f"watchdog_audio{suffix}")
+        self.elements[f'watchdog_audio{suffix}'].set_property('timeout', 10000)  # 10 second timeout
 
         # Create audio parser based on input codec
-        match self.audio_info['codec']:
+        match audio_codec:
             case 'mp2':
-                self.elements['audioparse'] = Gst.ElementFactory.make("mpegaudioparse", "audioparse")
+                self.elements[f'audioparse{suffix}'] = Gst.ElementFactory.make("mpegaudioparse", f"audioparse{suffix}")
             case 'aac':
-                self.elements['audioparse'] = Gst.ElementFactory.make("aacparse", "audioparse")
+                self.elements[f'audioparse{suffix}'] = Gst.ElementFactory.make("aacparse", f"audioparse{suffix}")
             case _:
-                raise ValueError(f"Unsupported input audio codec: {self.audio_info['codec']}")
+                raise ValueError(f"Unsupported input audio codec: {audio_codec} (track {track + 1})")
 
-        self.elements['queue_audioparse'] = self._create_queue("queue_audioparse")
+        self.elements[f'queue_audioparse{suffix}'] = self._create_queue(f"queue_audioparse{suffix}")
 
         if audio_settings['codec'] != 'passthrough':
             # Create decoder and its queue
-            match self.audio_info['codec']:
+            match audio_codec:
                 case 'mp2':
-                    self.elements['audiodecode'] = Gst.ElementFactory.make("avdec_mp2float", "audiodecode")
+                    self.elements[f'audiodecode{suffix}'] = Gst.ElementFactory.make("avdec_mp2float", f"audiodecode{suffix}")
                 case 'aac':
-                    self.elements['audiodecode'] = Gst.ElementFactory.make("avdec_aac", "audiodecode")
+                    self.elements[f'audiodecode{suffix}'] = Gst.ElementFactory.make("avdec_aac", f"audiodecode{suffix}")
             
-            self.elements['queue_audiodecode'] = self._create_queue("queue_audiodecode")
+            self.elements[f'queue_audiodecode{suffix}'] = self._create_queue(f"queue_audiodecode{suffix}")
 
             # Create converters and their queues
-            self.elements['audioconvert'] = Gst.ElementFactory.make("audioconvert", "audioconvert")
-            self.elements['queue_audioconvert'] = self._create_queue("queue_audioconvert")
+            self.elements[f'audioconvert{suffix}'] = Gst.ElementFactory.make("audioconvert", f"audioconvert{suffix}")
+            self.elements[f'queue_audioconvert{suffix}'] = self._create_queue(f"queue_audioconvert{suffix}")
             
-            self.elements['audioresample'] = Gst.ElementFactory.make("audioresample", "audioresample")
-            self.elements['queue_audioresample'] = self._create_queue("queue_audioresample")
+            self.elements[f'audioresample{suffix}'] = Gst.ElementFactory.make("audioresample", f"audioresample{suffix}")
+            self.elements[f'queue_audioresample{suffix}'] = self._create_queue(f"queue_audioresample{suffix}")
 
             # Create encoder
             match audio_settings['codec']:
                 case 'avenc_aac':
-                    self.elements['audioenc'] = Gst.ElementFactory.make("avenc_aac", "audioenc")
+                    self.elements[f'audioenc{suffix}'] = Gst.ElementFactory.make("avenc_aac", f"audioenc{suffix}")
                 case 'avenc_ac3':
-                    self.elements['audioenc'] = Gst.ElementFactory.make("avenc_ac3", "audioenc")
+                    self.elements[f'audioenc{suffix}'] = Gst.ElementFactory.make("avenc_ac3", f"audioenc{suffix}")
                 case 'avenc_mp2':
-                    self.elements['audioenc'] = Gst.ElementFactory.make("avenc_mp2", "audioenc")
+                    self.elements[f'audioenc{suffix}'] = Gst.ElementFactory.make("avenc_mp2", f"audioenc{suffix}")
                 case _:
                     raise ValueError(f"Unsupported output audio codec: {audio_settings['codec']}")
 
@@ -607,10 +642,10 @@ class TranscodePipelineHandler:
             for key, value in audio_settings.get('options', {}).items():
                 if key == 'bitrate':
                     value = value * 1000  # Convert kbps to bps
-                self.elements['audioenc'].set_property(key, value)
+                self.elements[f'audioenc{suffix}'].set_property(key, value)
 
         # Create audio output queue
-        self.elements['queue_audio_out'] = self._create_queue("queue_audio_out")
+        self.elements[f'queue_audio_out{suffix}'] = self._create_queue(f"queue_audio_out{suffix}")
 
     def _create_output_elements(self):
         """Create muxer and output elements with additional queues"""
@@ -619,10 +654,13 @@ class TranscodePipelineHandler:
         self.elements['mpegtsmux'] = Gst.ElementFactory.make("mpegtsmux", "mux")
         
         # Configure muxer PIDs
-        self.mux_video_pids = mux_settings.get('video-pid', [60])
+        self.mux_video_pids = mux_settings.get('video-pid', [60]) if self.streams['video'] else []
         if not isinstance(self.mux_video_pids, list):
             self.mux_video_pids = [self.mux_video_pids]
-        self.mux_audio_pid = mux_settings.get('audio-pid', 61)
+        self.mux_audio_pids = mux_audio_pids(mux_settings, self.streams['audio'])
+        if set(int(str(pid)) for pid in self.mux_video_pids) & set(self.mux_audio_pids):
+            raise ValueError(f"Audio PIDs {self.mux_audio_pids} overlap video PIDs {self.mux_video_pids}; "
+                             f"list one audio-pid per track in the mux settings")
         self.mux_program_number = mux_settings.get('program-number', 1000)
         
         # Create program map
@@ -635,9 +673,12 @@ class TranscodePipelineHandler:
             self.mux_video_pads.append(video_pad)
             pm.set_value(video_pad.get_name(), self.mux_program_number)
             
-        # Request audio pad
-        self.mux_audio_pad = self.elements['mpegtsmux'].request_pad_simple(f"sink_{self.mux_audio_pid}")
-        pm.set_value(self.mux_audio_pad.get_name(), self.mux_program_number)
+        # Request an audio pad per track
+        self.mux_audio_pads = []
+        for audio_pid in self.mux_audio_pids:
+            audio_pad = self.elements['mpegtsmux'].request_pad_simple(f"sink_{audio_pid}")
+            self.mux_audio_pads.append(audio_pad)
+            pm.set_value(audio_pad.get_name(), self.mux_program_number)
         
         # Create output elements with queues
         self.elements.update({
@@ -653,7 +694,7 @@ class TranscodePipelineHandler:
         self.elements['shmsink'].set_property('wait-for-connection', False)
         self.elements['shmsink'].set_property('sync', True)
         self.elements['shmsink'].set_property('async', True)
-        self.elements['shmsink'].set_property('shm-size', 4000000)
+        self.sizing.configure_shmsink(self.elements['shmsink'])
 
     def _link_static_elements(self):
         """Link all static elements in the pipeline"""
@@ -732,44 +773,45 @@ class TranscodePipelineHandler:
                 self.logger.error(f"Error linking video chain {i}: {str(e)}")
                 raise
 
-    def _link_audio_chain(self):
-        """Link the audio processing chain with added queues"""
+    def _link_audio_chain(self, track):
+        """Link the processing chain of one audio track with added queues"""
+        suffix = track_suffix(track)
         try:
-            if self.transcode_settings['audio']['codec'] == 'passthrough':
+            if self.audio_settings[track]['codec'] == 'passthrough':
                 # Passthrough mode
                 self._link_elements_chain([
-                    ('queue_audio', 'watchdog_audio'),
-                    ('watchdog_audio', 'audioparse'),
-                    ('audioparse', 'queue_audioparse'),
-                    ('queue_audioparse', 'queue_audio_out')
+                    (f'queue_audio{suffix}', f'watchdog_audio{suffix}'),
+                    (f'watchdog_audio{suffix}', f'audioparse{suffix}'),
+                    (f'audioparse{suffix}', f'queue_audioparse{suffix}'),
+                    (f'queue_audioparse{suffix}', f'queue_audio_out{suffix}')
                 ])
             else:
                 # Full processing chain with queues
                 self._link_elements_chain([
-                    ('queue_audio', 'watchdog_audio'),
-                    ('watchdog_audio', 'audioparse'),
-                    ('audioparse', 'queue_audioparse'),
-                    ('queue_audioparse', 'audiodecode'),
-                    ('audiodecode', 'queue_audiodecode'),
-                    ('queue_audiodecode', 'audioconvert'),
-                    ('audioconvert', 'queue_audioconvert'),
-                    ('queue_audioconvert', 'audioresample'),
-                    ('audioresample', 'queue_audioresample'),
-                    ('queue_audioresample', 'audioenc'),
-                    ('audioenc', 'queue_audio_out')
+                    (f'queue_audio{suffix}', f'watchdog_audio{suffix}'),
+                    (f'watchdog_audio{suffix}', f'audioparse{suffix}'),
+                    (f'audioparse{suffix}', f'queue_audioparse{suffix}'),
+                    (f'queue_audioparse{suffix}', f'audiodecode{suffix}'),
+                    (f'audiodecode{suffix}', f'queue_audiodecode{suffix}'),
+                    (f'queue_audiodecode{suffix}', f'audioconvert{suffix}'),
+                    (f'audioconvert{suffix}', f'queue_audioconvert{suffix}'),
+                    (f'queue_audioconvert{suffix}', f'audioresample{suffix}'),
+                    (f'audioresample{suffix}', f'queue_audioresample{suffix}'),
+                    (f'queue_audioresample{suffix}', f'audioenc{suffix}'),
+                    (f'audioenc{suffix}', f'queue_audio_out{suffix}')
                 ])
 
             # Link to muxer
-            self.elements['queue_audio_out'].link_pads(
+            self.elements[f'queue_audio_out{suffix}'].link_pads(
                 "src", 
                 self.elements['mpegtsmux'], 
-                self.mux_audio_pad.get_name()
+                self.mux_audio_pads[track].get_name()
             )
             
-            self.logger.info("Successfully linked audio chain")
+            self.logger.info(f"Successfully linked audio chain {track + 1}")
             
         except Exception as e:
-            self.logger.error(f"Error linking audio chain: {str(e)}")
+            self.logger.error(f"Error linking audio chain {track + 1}: {str(e)}")
             raise
 
     def _link_elements_chain(self, links):
@@ -795,6 +837,9 @@ class TranscodePipelineHandler:
         self.generate_dot_file(f"pad_added_{pad_name}")
         
         if structure.get_name().startswith('video'):
+            if not self.streams['video']:
+                self.logger.info(f"Ignoring video pad {pad_name}, the channel carries no video")
+                return
             self.logger.info(f"Found video pad {pad_name}, linking...")
             sink_pad = self.elements['queue_video'].get_static_pad("sink")
             if not sink_pad:
@@ -810,19 +855,31 @@ class TranscodePipelineHandler:
             self._link_video_chain()
                 
         elif structure.get_name().startswith('audio'):
-            self.logger.info(f"Found audio pad {pad_name}, linking...")
-            sink_pad = self.elements['queue_audio'].get_static_pad("sink")
+            # The input handler muxes each track on its PID from the same mux settings as ours;
+            # pads can appear in any order, so the PID in the pad name says which track it is
+            pad_pid = int(pad_name.split('_')[-1], 16)
+            if pad_pid not in self.mux_audio_pids:
+                self.logger.info(f"Ignoring audio pad {pad_name}, PID {pad_pid} is not one of the channel's "
+                                 f"audio PIDs {self.mux_audio_pids}")
+                return
+            track = self.mux_audio_pids.index(pad_pid)
+            suffix = track_suffix(track)
+            self.logger.info(f"Found audio pad {pad_name} for track {track + 1}, linking...")
+            sink_pad = self.elements[f'queue_audio{suffix}'].get_static_pad("sink")
             if not sink_pad:
-                self.logger.error("No sink pad on queue_audio")
+                self.logger.error(f"No sink pad on queue_audio{suffix}")
                 return
                 
+            if sink_pad.is_linked():
+                self.logger.warning(f"Audio track {track + 1} already linked, skipping additional pad {pad_name}")
+                return
             ret = pad.link(sink_pad)
             if ret != Gst.PadLinkReturn.OK:
                 self.logger.error(f"Failed to link audio pad: {ret}")
                 return
                 
             self.logger.info("Successfully linked audio pad, setting up chain")
-            self._link_audio_chain()
+            self._link_audio_chain(track)
             
         # Generate DOT file after pad is linked
         self.generate_dot_file(f"pad_linked_{pad_name}")
@@ -859,6 +916,13 @@ class TranscodePipelineHandler:
             # Generate DOT file after pipeline is playing
             self.generate_dot_file("after_playing")
             
+            # Measure main loop lag so blocking callbacks show up in stats
+            self.lag_probe = GLibLagProbe(
+                f"{self.channel_name}_transcode", self.logger,
+                stats_collector=self.stats_collector, stat_type="loop_lag_transcoder"
+            )
+            self.lag_probe.start()
+            
             # Run the main loop
             loop = GLib.MainLoop()
             try:
@@ -1031,6 +1095,17 @@ class TranscodePipelineHandler:
             # Generate DOT file after pipeline is playing
             self.generate_dot_file("after_playing")
             
+            # The outer loop is blocked while this one runs, so replace its probe
+            if self.lag_probe:
+                self.lag_probe.stop()
+
+            # Measure main loop lag so blocking callbacks show up in stats
+            self.lag_probe = GLibLagProbe(
+                f"{self.channel_name}_transcode", self.logger,
+                stats_collector=self.stats_collector, stat_type="loop_lag_transcoder"
+            )
+            self.lag_probe.start()
+            
             # Run the main loop
             loop = GLib.MainLoop()
             try:
@@ -1053,6 +1128,11 @@ class TranscodePipelineHandler:
         """Cleanup resources"""
         self.logger.info("Starting cleanup")
         
+        if self.lag_probe:
+            self.lag_probe.stop()
+
+        self._stop_latency_probe()
+        
         if self.pipeline:
             self.pipeline.set_state(Gst.State.NULL)
             self.logger.info("Pipeline stopped")
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+
+import logging
+import threading
+import time
+from typing import Dict, Optional
+
+try:
+    import numpy as np
+except ImportError:  # analysis is disabled without NumPy
+    np = None
+
+from ts_psi import PSIParser, TS_PACKET_SIZE, SYNC_BYTE, PAT_PID, NULL_PID
+
+CAT_PID = 0x0001
+PCR_CLOCK = 27000000
+PCR_WRAP = (1 << 33) * 300
+
+# TR 101 290 limits
+PSI_INTERVAL = 0.5         # PAT/PMT at least every 0.5s
+PID_TIMEOUT = 5.0          # "user specified period" for referenced PIDs
+PCR_REPETITION = 0.04      # PCR at least every 40ms
+PCR_DISCONTINUITY = 0.1    # PCR steps over 100ms without the discontinuity flag
+PCR_ACCURACY_NS = 500      # +/-500ns
+
+# Analyse in batches so the per-call NumPy overhead is paid a few times a second
+BATCH_BYTES = 1024 * 1024
+
+
+def create_analyzer(input_config: Dict, stats_collector, logger: logging.Logger) -> Optional['TSAnalyzer']:
+    """Analyser for an input unless it is switched off with `ts_analysis: false` or NumPy is missing"""
+    if not input_config.get('ts_analysis', True):
+        return None
+    if np is None:
+        logger.warning("NumPy not installed, TR 101 290 analysis disabled")
+        return None
+    return TSAnalyzer(stats_collector, logger=logger)
+
+
+class TSAnalyzer:
+    """
+    TR 101 290 priority 1 and 2 checks over TS buffers taken from an input pipeline.
+    feed() is cheap and runs in the streaming thread; the checks run on (N, 188)
+    arrays a batch at a time, and publish() hands per-second counters to StatsCollector.
+    """
+
+    def __init__(self, stats_collector=None, stat_type: str = "ts_analysis",
+                 logger: Optional[logging.Logger] = None):
+        if np is None:
+            raise RuntimeError("NumPy is required for TS analysis")
+        self.stats_collector = stats_collector
+        self.stat_type = stat_type
+        self.logger = logger or logging.getLogger(__name__)
+        self.psi = PSIParser()
+
+        self._lock = threading.Lock()
+        self._pending = bytearray()
+        self._pending_ends = []
+        self._pending_times = []
+
+        self._packet_index = 0
+        self._last_cc = np.full(8192, -1, dtype=np.int16)
+        self._last_seen = np.zeros(8192, dtype=np.float64)
+        self._psi_last = {}
+        self._psi_flagged = set()
+        self._pid_flagged = set()
+        self._pcr_last = {}
+        self._cat_seen = False
+        self._last_crc_errors = 0
+        self._last_publish = time.monotonic()
+        self._reset_window()
+
+    def _reset_window(self):
+        self.counters = {
+            'sync_loss': 0,
+            'sync_bytes_skipped': 0,
+            'pat_errors': 0,
+            'cc_errors': 0,
+            'pmt_errors': 0,
+            'pid_errors': 0,
+            'transport_errors': 0,
+            'crc_errors': 0,
+            'pcr_repetition_errors': 0,
+            'pcr_discontinuity_errors': 0,
+            'pcr_accuracy_errors': 0,
+            'cat_errors': 0
+        }
+        self._pid_packets = np.zeros(8192, dtype=np.int64)
+        self._cc_errors_by_pid = np.zeros(8192, dtype=np.int64)
+        self._pcr_points = {}
+
+    def feed(self, data, arrival: Optional[float] = None):
+        """Queue raw TS bytes from a buffer; analyses once a batch has built up"""
+        arrival = time.monotonic() if arrival is None else arrival
+        with self._lock:
+            self._pending += data
+            self._pending_ends.append(len(self._pending))
+            self._pending_times.append(arrival)
+            if len(self._pending) >= BATCH_BYTES:
+                self._analyse_pending()
+
+    def probe_buffer(self, pad, info):
+        """Pad probe callback for BUFFER and BUFFER_LIST probes; never holds data back"""
+        from gi.repository import Gst
+        buffers = [info.get_buffer()]
+        if info.type & Gst.PadProbeType.BUFFER_LIST:
+            buffer_list = info.get_buffer_list()
+            buffers = [buffer_list.get(i) for i in range(buffer_list.length())]
+        arrival = time.monotonic()
+        for buffer in buffers:
+            if buffer is None:
+                continue
+            success, map_info = buffer.map(Gst.MapFlags.READ)
+            if success:
+                try:
+                    self.feed(map_info.data, arrival)
+                finally:
+                    buffer.unmap(map_info)
+        return Gst.PadProbeReturn.OK
+
+    def _find_sync(self, data, pos: int) -> int:
+        """Offset of the next sync byte that is followed by another one a packet later"""
+        while True:
+            pos = data.find(SYNC_BYTE.to_bytes(1, 'big'), pos)
+            if pos < 0 or pos + TS_PACKET_SIZE >= len(data) or data[pos + TS_PACKET_SIZE] == SYNC_BYTE:
+                return pos
+            pos += 1
+
+    def _analyse_pending(self):
+        data = self._pending
+        ends = np.asarray(self._pending_ends)
+        times = np.asarray(self._pending_times)
+
+        pos = 0
+        while len(data) - pos >= TS_PACKET_SIZE:
+            start = self._find_sync(data, pos)
+            if start < 0:
+                self.counters['sync_bytes_skipped'] += len(data) - pos
+                pos = len(data)
+                break
+            if start > pos:
+                self.counters['sync_bytes_skipped'] += start - pos
+            count = (len(data) - start) // TS_PACKET_SIZE
+            if count == 0:
+                pos = start
+                break
+            packets = np.frombuffer(data, dtype=np.uint8, count=count * TS_PACKET_SIZE,
+                                    offset=start).reshape(count, TS_PACKET_SIZE)
+            bad = np.flatnonzero(packets[:, 0] != SYNC_BYTE)
+            good = count if bad.size == 0 else int(bad[0])
+            if good:
+                offsets = start + np.arange(good) * TS_PACKET_SIZE
+                arrivals = times[np.minimum(np.searchsorted(ends, offsets, side='right'), len(times) - 1)]
+                self._analyse_packets(packets[:good], arrivals)
+            pos = start + good * TS_PACKET_SIZE
+            if bad.size:
+                self.counters['sync_loss'] += 1
+                pos += 1
+
+        # Keep the partial packet at the end for the next batch
+        remainder = data[pos:]
+        self._pending = bytearray(remainder)
+        self._pending_ends = [len(remainder)] if remainder else []
+        self._pending_times = [self._pending_times[-1]] if remainder else []
+
+    def _analyse_packets(self, packets, arrivals):
+        b1 = packets[:, 1]
+        b3 = packets[:, 3]
+        pids = ((b1 & 0x1F).astype(np.uint16) << 8) | packets[:, 2]
+        pusi = (b1 & 0x40) != 0
+        scrambled = (b3 & 0xC0) != 0
+        afc = (b3 >> 4) & 0x03
+        has_payload = (afc & 0x01) != 0
+        has_af = (afc & 0x02) != 0
+        af_len = np.where(has_af, packets[:, 4], 0)
+        discontinuity = has_af & (af_len > 0) & ((packets[:, 5] & 0x80) != 0)
+
+        # Transport_error (2.1)
+        self.counters['transport_errors'] += int(np.count_nonzero(b1 & 0x80))
+
+        # Per-PID packet counts; last arrival is tracked per batch, plenty for the PID timeout
+        counts = np.bincount(pids, minlength=8192)
+        self._pid_packets += counts
+        self._last_seen[counts > 0] = arrivals[-1]
+
+        self._check_continuity(pids, b3 & 0x0F, has_payload, discontinuity)
+        self._check_pcr(packets, pids, has_af, af_len, discontinuity, arrivals)
+        self._check_psi(packets, pids, pusi, scrambled, arrivals)
+
+        if not self._cat_seen and np.any(scrambled):
+            # CAT_error (2.6): scrambled packets without a CAT
+            self.counters['cat_errors'] += 1
+
+        self._packet_index += len(packets)
+
+    def _check_continuity(self, pids, cc, has_payload, discontinuity):
+        """Continuity_count_error (1.4); duplicates and flagged discontinuities are allowed"""
+        mask = has_payload & (pids != NULL_PID)
+        sel_pids = pids[mask]
+        if sel_pids.size == 0:
+            return
+        order = np.argsort(sel_pids, kind='stable')
+        sp = sel_pids[order]
+        sc = cc[mask][order].astype(np.int16)
+        sd = discontinuity[mask][order]
+
+        prev = np.empty_like(sc)
+        prev[1:] = sc[:-1]
+        group_start = np.ones(sp.size, dtype=bool)
+        group_start[1:] = sp[1:] != sp[:-1]
+        prev[group_start] = self._last_cc[sp[group_start]]
+
+        step = (sc - prev) & 0x0F
+        errors = (prev >= 0) & (step > 1) & ~sd
+        if np.any(errors):
+            self.counters['cc_errors'] += int(np.count_nonzero(errors))
+            self._cc_errors_by_pid += np.bincount(sp[errors], minlength=8192)
+
+        group_end = np.ones(sp.size, dtype=bool)
+        group_end[:-1] = sp[1:] != sp[:-1]
+        self._last_cc[sp[group_end]] = sc[group_end]
+
+    def _check_pcr(self, packets, pids, has_af, af_len, discontinuity, arrivals):
+        """PCR_repetition (2.3), PCR discontinuity (2.3b) and PCR points for accuracy/jitter"""
+        rows = np.flatnonzero(has_af & (af_len >= 7) & ((packets[:, 5] & 0x10) != 0))
+        if rows.size == 0:
+            return
+        raw = packets[rows, 6:12].astype(np.int64)
+        base = (raw[:, 0] << 25) | (raw[:, 1] << 17) | (raw[:, 2] << 9) | (raw[:, 3] << 1) | (raw[:, 4] >> 7)
+        ext = ((raw[:, 4] & 0x01) << 8) | raw[:, 5]
+        pcrs = base * 300 + ext
+
+        for row, pcr in zip(rows.tolist(), pcrs.tolist()):
+            pid = int(pids[row])
+            index = self._packet_index + row
+            arrival = float(arrivals[row])
+            last = self._pcr_last.get(pid)
+            if last is not None and not discontinuity[row]:
+                delta = ((pcr - last[0]) % PCR_WRAP) / PCR_CLOCK
+                if delta > PCR_DISCONTINUITY:
+                    self.counters['pcr_discontinuity_errors'] += 1
+                elif delta > PCR_REPETITION:
+                    self.counters['pcr_repetition_errors'] += 1
+            if discontinuity[row]:
+                self._pcr_points.pop(pid, None)
+            self._pcr_last[pid] = (pcr, index)
+            self._pcr_points.setdefault(pid, []).append((index, pcr, arrival))
+
+    def _check_psi(self, packets, pids, pusi, scrambled, arrivals):
+        """PAT_error (1.3), PMT_error (1.5) and CRC_error (2.2); PSI packets go to the section parser"""
+        pmt_pids = set(self.psi.pat['programs'].values()) if self.psi.pat else set()
+        psi_pids = np.array([PAT_PID, CAT_PID] + sorted(pmt_pids))
+        rows = np.flatnonzero(np.isin(pids, psi_pids))
+        if rows.size == 0:
+            return
+        self.psi.feed(packets[rows].tobytes())
+        if np.any(pids[rows] == CAT_PID):
+            self._cat_seen = True
+
+        for row in rows[pusi[rows]].tolist():
+            pid = int(pids[row])
+            if pid == CAT_PID:
+                continue
+            counter = 'pat_errors' if pid == PAT_PID else 'pmt_errors'
+            if scrambled[row]:
+                self.counters[counter] += 1
+            if pid == PAT_PID:
+                # PID 0 carrying something other than a PAT
+                offset = 4 + (1 + int(packets[row, 4]) if packets[row, 3] & 0x20 else 0)
+                if offset < TS_PACKET_SIZE - 1:
+                    table_offset = offset + 1 + int(packets[row, offset])
+                    if table_offset < TS_PACKET_SIZE and packets[row, table_offset] != 0x00:
+                        self.counters['pat_errors'] += 1
+            self._psi_seen(pid, float(arrivals[row]), counter)
+
+        crc_errors = self.psi.crc_errors
+        self.counters['crc_errors'] += crc_errors - self._last_crc_errors
+        self._last_crc_errors = crc_errors
+
+    def _psi_seen(self, pid: int, arrival: float, counter: str):
+        last = self._psi_last.get(pid)
+        if last is not None and arrival - last > PSI_INTERVAL and pid not in self._psi_flagged:
+            self.counters[counter] += 1
+        self._psi_last[pid] = arrival
+        self._psi_flagged.discard(pid)
+
+    def _check_timeouts(self, now: float):
+        """PAT/PMT missing for 0.5s and referenced PIDs missing; each outage counts once"""
+        pmt_pids = set(self.psi.pat['programs'].values()) if self.psi.pat else set()
+        for pid, last in self._psi_last.items():
+            if now - last > PSI_INTERVAL and pid not in self._psi_flagged:
+                self.counters['pat_errors' if pid == PAT_PID else 'pmt_errors'] += 1
+                self._psi_flagged.add(pid)
+        for pid in pmt_pids - set(self._psi_last):
+            # PMT listed in the PAT but never received
+            self._psi_last[pid] = now
+
+        for pmt in self.psi.pmts.values():
+            for stream in pmt['streams']:
+                pid = stream['pid']
+                last = self._last_seen[pid] or self._psi_last.get(PAT_PID, now)
+                if now - last > PID_TIMEOUT:
+                    if pid not in self._pid_flagged:
+                        self.counters['pid_errors'] += 1
+                        self._pid_flagged.add(pid)
+                else:
+                    self._pid_flagged.discard(pid)
+
+    def _pcr_metrics(self) -> Dict:
+        """PCR accuracy (2.4) from a constant-rate fit of PCR against byte position, and PCR arrival jitter"""
+        accuracy_ns = 0.0
+        jitter_ms = 0.0
+        for points in self._pcr_points.values():
+            if len(points) < 3:
+                continue
+            data = np.asarray(points, dtype=np.float64)
+            index, pcr, arrival = data[:, 0], np.unwrap(data[:, 1], period=PCR_WRAP), data[:, 2]
+            slope, intercept = np.polyfit(index - index[0], pcr - pcr[0], 1)
+            residual_ns = np.abs((pcr - pcr[0]) - (slope * (index - index[0]) + intercept)) / PCR_CLOCK * 1e9
+            errors = int(np.count_nonzero(residual_ns > PCR_ACCURACY_NS))
+            self.counters['pcr_accuracy_errors'] += errors
+            accuracy_ns = max(accuracy_ns, float(residual_ns.max()))
+
+            offsets = arrival - (pcr - pcr[0]) / PCR_CLOCK
+            jitter_ms = max(jitter_ms, float(offsets.max() - offsets.min()) * 1000)
+        return {'pcr_accuracy_max_ns': accuracy_ns, 'pcr_jitter_ms': jitter_ms}
+
+    def get_stats(self) -> Dict:
+        """Counters for the window since the last call; resets the window"""
+        now = time.monotonic()
+        with self._lock:
+            if self._pending:
+                self._analyse_pending()
+            self._check_timeouts(now)
+            elapsed = max(now - self._last_publish, 1e-3)
+            self._last_publish = now
+
+            pcr_metrics = self._pcr_metrics()
+            stats = dict(self.counters)
+            stats.update(pcr_metrics)
+            active = np.flatnonzero(self._pid_packets)
+            bits = self._pid_packets[active] * TS_PACKET_SIZE * 8
+            stats['bitrate_mbps'] = float(bits.sum()) / elapsed / 1e6
+            stats['pid_bitrates'] = {
+                f"0x{pid:04x}": round(float(b) / elapsed / 1e6, 3) for pid, b in zip(active.tolist(), bits.tolist())
+            }
+            cc_pids = np.flatnonzero(self._cc_errors_by_pid)
+            stats['cc_errors_by_pid'] = {
+                f"0x{pid:04x}": int(self._cc_errors_by_pid[pid]) for pid in cc_pids.tolist()
+            }
+            stats['priority1_errors'] = (stats['sync_loss'] + stats['pat_errors'] + stats['cc_errors']
+                                         + stats['pmt_errors'] + stats['pid_errors'])
+            stats['priority2_errors'] = (stats['transport_errors'] + stats['crc_errors']
+                                         + stats['pcr_repetition_errors'] + stats['pcr_discontinuity_errors']
+                                         + stats['pcr_accuracy_errors'] + stats['cat_errors'])
+            self._reset_window()
+        return stats
+
+    def publish(self):
+        """Push the last window to Redis; returns True so it can run as a GLib timer"""
+        try:
+            stats = self.get_stats()
+            if stats['priority1_errors']:
+                self.logger.warning(
+                    f"TR 101 290 priority 1 errors: sync_loss={stats['sync_loss']} "
+                    f"pat={stats['pat_errors']} cc={stats['cc_errors']} "
+                    f"pmt={stats['pmt_errors']} pid={stats['pid_errors']}"
+                )
+            if self.stats_collector:
+                self.stats_collector.add_stats(self.stat_type, stats)
+        except Exception as e:
+            self.logger.error(f"Error publishing TS analysis: {str(e)}")
+        return True
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+
+import logging
+import mmap
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+from urllib.parse import urlparse
+
+from ts_psi import TS_PACKET_SIZE, SYNC_BYTE
+
+PCR_CLOCK = 27000000
+PTS_WRAP = 1 << 33
+PCR_WRAP = PTS_WRAP * 300
+CHUNK_PACKETS = 7
+DEFAULT_RATE_MBPS = 10.0     # pacing for files that carry no PCR
+MAX_DRIFT = 1.0              # further off schedule than this restarts the clock rather than bursting or stalling
+SYNC_CHECK = 5               # consecutive sync bytes needed to trust the packet alignment
+MAX_SCAN_BYTES = 16 * 1024 * 1024
+
+
+def file_path(uri: str) -> str:
+    """Local path of a file:// URI or a plain path"""
+    parsed = urlparse(uri)
+    return parsed.path if parsed.scheme == 'file' else uri
+
+
+def read_pcr(data, pos: int) -> Optional[int]:
+    """PCR of the packet at pos in 27 MHz ticks, or None if it carries none"""
+    if not data[pos + 3] & 0x20 or data[pos + 4] < 7 or not data[pos + 5] & 0x10:
+        return None
+    b = data[pos + 6:pos + 12]
+    base = (b[0] << 25) | (b[1] << 17) | (b[2] << 9) | (b[3] << 1) | (b[4] >> 7)
+    return base * 300 + (((b[4] & 0x01) << 8) | b[5])
+
+
+def _write_pcr(data: bytearray, pos: int, pcr: int):
+    base, ext = divmod(pcr, 300)
+    data[pos + 6:pos + 12] = bytes([
+        (base >> 25) & 0xFF, (base >> 17) & 0xFF, (base >> 9) & 0xFF, (base >> 1) & 0xFF,
+        ((base & 0x01) << 7) | 0x7E | (ext >> 8), ext & 0xFF
+    ])
+
+
+def _shift_timestamp(data: bytearray, pos: int, shift: int):
+    """Add shift to the 33-bit PTS or DTS field at pos, keeping its prefix and marker bits"""
+    value = (((data[pos] >> 1) & 0x07) << 30) | (data[pos + 1] << 22) | ((data[pos + 2] >> 1) << 15) \
+        | (data[pos + 3] << 7) | (data[pos + 4] >> 1)
+    value = (value + shift) % PTS_WRAP
+    data[pos] = (data[pos] & 0xF1) | ((value >> 29) & 0x0E)
+    data[pos + 1] = (value >> 22) & 0xFF
+    data[pos + 2] = ((value >> 14) & 0xFE) | 0x01
+    data[pos + 3] = (value >> 7) & 0xFF
+    data[pos + 4] = ((value << 1) & 0xFE) | 0x01
+
+
+def _shift_pes_timestamps(data: bytearray, pos: int, shift: int):
+    """Move the PTS and DTS of a PES header starting in the packet at pos"""
+    offset = pos + 4
+    if data[pos + 3] & 0x20:
+        offset += 1 + data[pos + 4]
+    end = pos + TS_PACKET_SIZE
+    if offset + 14 > end or data[offset:offset + 3] != b'\x00\x00\x01' or data[offset + 3] < 0xBD \
+            or data[offset + 3] in (0xBE, 0xBF):
+        return
+    flags = data[offset + 7] >> 6
+    if flags & 0x02:
+        _shift_timestamp(data, offset + 9, shift)
+    if flags == 0x03 and offset + 19 <= end:
+        _shift_timestamp(data, offset + 14, shift)
+
+
+class TSFilePlayer:
+    """
+    Plays a local TS file out in real time for slates, loops and fill. The file is
+    memory-mapped and sent a few packets at a time, paced so each PCR leaves at its
+    wall clock time and the bytes between PCRs at the rate they were muxed at. When
+    looping, every pass after the first has its PCR, PTS and DTS moved on by the length
+    of the file and its continuity counters carried on from the previous pass, so what
+    comes out is one unbroken stream.
+    """
+
+    def __init__(self, uri: str, settings: Dict, on_output: Callable[[bytes, int], None],
+                 on_end: Optional[Callable[[], None]] = None, stats_collector=None,
+                 logger: Optional[logging.Logger] = None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.path = file_path(uri)
+        self.loop = settings.get('loop', True)
+        self.fallback_rate = float(settings.get('rate-mbps', DEFAULT_RATE_MBPS)) * 1000000 / 8
+        self.on_output = on_output
+        self.on_end = on_end
+        self.stats_collector = stats_collector
+
+        self._map = None
+        self._open()
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.position = self.data_start
+        self.passes = 0
+        self.rate = self.average_rate or self.fallback_rate
+        self._reset_window()
+
+    def _reset_window(self):
+        self.stats = {'bytes_sent': 0, 'max_late_ms': 0.0, 'clock_restarts': 0, 'loops': 0}
+
+    def _open(self):
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            if size < TS_PACKET_SIZE * SYNC_CHECK:
+                raise ValueError(f"{self.path} is too short to be a transport stream")
+            self._map = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        if hasattr(mmap, 'MADV_SEQUENTIAL'):
+            self._map.madvise(mmap.MADV_SEQUENTIAL)
+
+        self.data_start = next((offset for offset in range(TS_PACKET_SIZE)
+                                if all(self._map[offset + i * TS_PACKET_SIZE] == SYNC_BYTE
+                                       for i in range(SYNC_CHECK))), None)
+        if self.data_start is None:
+            raise ValueError(f"No 188-byte TS packet alignment found in {self.path}")
+        self.data_end = self.data_start + (size - self.data_start) // TS_PACKET_SIZE * TS_PACKET_SIZE
+        self._scan_pcr()
+
+    def _scan_pcr(self):
+        """PCR PID, first and last PCR, and from them the length of one pass of the file"""
+        self.pcr_pid = None
+        self.loop_ticks = None
+        self.average_rate = None
+        first = last = None
+        limit = min(self.data_end, self.data_start + MAX_SCAN_BYTES)
+        for pos in range(self.data_start, limit, TS_PACKET_SIZE):
+            pcr = read_pcr(self._map, pos)
+            if pcr is not None:
+                self.pcr_pid = ((self._map[pos + 1] & 0x1F) << 8) | self._map[pos + 2]
+                first = (pos, pcr)
+                break
+        if first is None:
+            self.logger.warning(f"No PCR in {self.path}, pacing at {self.fallback_rate * 8 / 1000000:g} Mbps "
+                                f"without timestamp fix-ups on loop")
+            return
+
+        limit = max(first[0], self.data_end - MAX_SCAN_BYTES)
+        for pos in range(self.data_end - TS_PACKET_SIZE, limit - 1, -TS_PACKET_SIZE):
+            if ((self._map[pos + 1] & 0x1F) << 8) | self._map[pos + 2] == self.pcr_pid:
+                pcr = read_pcr(self._map, pos)
+                if pcr is not None:
+                    last = (pos, pcr)
+                    break
+        span = (last[1] - first[1]) % PCR_WRAP if last else 0
+        if not span:
+            self.logger.warning(f"Only one PCR found in {self.path}, loops will not be retimed")
+            return
+
+        self.average_rate = (last[0] - first[0]) * PCR_CLOCK / span
+        # The bytes after the last PCR and before the first one play out at the average rate
+        gap = (self.data_end - last[0] + first[0] - self.data_start) * PCR_CLOCK / self.average_rate
+        self.loop_ticks = int(span + gap)
+        self.logger.info(f"Playing {self.path}: PCR on PID {hex(self.pcr_pid)}, "
+                         f"{self.loop_ticks / PCR_CLOCK:.2f}s per pass at "
+                         f"{self.average_rate * 8 / 1000000:.2f} Mbps")
+
+    def start(self):
+        """Start the playout thread"""
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="TSFilePlayer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the playout thread and unmap the file"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=1)
+        if self._map:
+            self._map.close()
+            self._map = None
+
+    def _run(self):
+        try:
+            self._play()
+        except Exception as e:
+            self.logger.error(f"File playout failed: {str(e)}")
+
+    def _play(self):
+        ts_shift = 0                     # 27 MHz ticks added to PCR, PTS and DTS this pass
+        cc_shift: Dict[int, int] = {}
+        first_cc: Dict[int, int] = {}
+        last_cc: Dict[int, int] = {}
+        anchor = None                    # (monotonic time, PCR) the schedule is built from
+        last_pcr = None                  # (PCR, bytes sent when it went out)
+        sent = 0
+        send_at = time.monotonic()
+
+        pos = self.data_start
+        while not self._stop_event.is_set():
+            if pos >= self.data_end:
+                if not self.loop:
+                    self.logger.info(f"Reached the end of {self.path}")
+                    if self.on_end:
+                        self.on_end()
+                    return
+                pos = self.data_start
+                with self._lock:
+                    self.passes += 1
+                    self.stats['loops'] += 1
+                if self.loop_ticks:
+                    ts_shift = (ts_shift + self.loop_ticks) % PCR_WRAP
+                cc_shift = {pid: (last_cc[pid] + 1 - cc) % 16 for pid, cc in first_cc.items() if pid in last_cc}
+
+            end = min(self.data_end, pos + CHUNK_PACKETS * TS_PACKET_SIZE)
+            data = self._map[pos:end]
+            rewrite = self.passes > 0
+            if rewrite:
+                data = bytearray(data)
+
+            chunk_pcr = None
+            for offset in range(0, len(data), TS_PACKET_SIZE):
+                if data[offset] != SYNC_BYTE:
+                    continue
+                pid = ((data[offset + 1] & 0x1F) << 8) | data[offset + 2]
+                cc = data[offset + 3] & 0x0F
+                if rewrite and cc_shift.get(pid):
+                    cc = (cc + cc_shift[pid]) % 16
+                    data[offset + 3] = (data[offset + 3] & 0xF0) | cc
+                if data[offset + 3] & 0x10:
+                    first_cc.setdefault(pid, cc)
+                    last_cc[pid] = cc
+
+                pcr = read_pcr(data, offset)
+                if pcr is not None:
+                    if rewrite and ts_shift:
+                        pcr = (pcr + ts_shift) % PCR_WRAP
+                        _write_pcr(data, offset, pcr)
+                    if pid == self.pcr_pid and chunk_pcr is None:
+                        chunk_pcr = (pcr, offset)
+                if rewrite and ts_shift and data[offset + 1] & 0x40:
+                    _shift_pes_timestamps(data, offset, ts_shift // 300)
+
+            # Each PCR sets when its packet goes out; the bytes before it follow the rate
+            # measured over the last PCR interval
+            now = time.monotonic()
+            if chunk_pcr is not None:
+                pcr, offset = chunk_pcr
+                if last_pcr is not None:
+                    elapsed = ((pcr - last_pcr[0]) % PCR_WRAP) / PCR_CLOCK
+                    if 0 < elapsed < MAX_DRIFT:
+                        self.rate = (sent + offset - last_pcr[1]) / elapsed
+                last_pcr = (pcr, sent + offset)
+                if anchor is not None:
+                    send_at = anchor[0] + ((pcr - anchor[1]) % PCR_WRAP) / PCR_CLOCK - offset / self.rate
+                if anchor is None or abs(send_at - now) > MAX_DRIFT:
+                    if anchor is not None:
+                        with self._lock:
+                            self.stats['clock_restarts'] += 1
+                    send_at = now
+                    anchor = (now + offset / self.rate, pcr)
+            elif now - send_at > MAX_DRIFT:
+                send_at = now
+
+            delay = send_at - time.monotonic()
+            if delay > 0:
+                if self._stop_event.wait(delay):
+                    return
+            else:
+                with self._lock:
+                    self.stats['max_late_ms'] = max(self.stats['max_late_ms'], -delay * 1000)
+
+            self.on_output(bytes(data), len(data) // TS_PACKET_SIZE)
+            sent += len(data)
+            send_at += len(data) / self.rate
+            pos = end
+            with self._lock:
+                self.position = pos
+                self.stats['bytes_sent'] += len(data)
+
+    def get_stats(self) -> Dict:
+        """Playout state and counters since the last call"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats.update({
+                'passes': self.passes,
+                'position_percent': round((self.position - self.data_start) * 100 / max(1, self.data_end - self.data_start), 1),
+                'bitrate_mbps': round(self.rate * 8 / 1000000, 3),
+                'pass_duration_s': round(self.loop_ticks / PCR_CLOCK, 3) if self.loop_ticks else None,
+                'pcr_pid': hex(self.pcr_pid) if self.pcr_pid is not None else None
+            })
+            self._reset_window()
+        return stats
+
+    def publish(self):
+        """Push stats to Redis; returns True so it can run as a GLib timer"""
+        try:
+            stats = self.get_stats()
+            if stats['clock_restarts']:
+                self.logger.warning(f"File playout fell off its PCR schedule {stats['clock_restarts']} time(s)")
+            if self.stats_collector:
+                self.stats_collector.add_stats("file_playout", stats)
+        except Exception as e:
+            self.logger.error(f"Error publishing file playout stats: {str(e)}")
+        return True
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+
+import threading
+from typing import Dict, List, Optional
+
+TS_PACKET_SIZE = 188
+SYNC_BYTE = 0x47
+PAT_PID = 0x0000
+NULL_PID = 0x1FFF
+
+TABLE_ID_PAT = 0x00
+TABLE_ID_PMT = 0x02
+
+# stream_type -> (codec_type, codec_name) using ffprobe's codec names
+STREAM_TYPES = {
+    0x01: ('video', 'mpeg1video'),
+    0x02: ('video', 'mpeg2video'),
+    0x03: ('audio', 'mp2'),
+    0x04: ('audio', 'mp2'),
+    0x0F: ('audio', 'aac'),
+    0x10: ('video', 'mpeg4'),
+    0x11: ('audio', 'aac_latm'),
+    0x1B: ('video', 'h264'),
+    0x24: ('video', 'hevc'),
+    0x42: ('video', 'cavs'),
+    0x81: ('audio', 'ac3'),
+    0x82: ('audio', 'dts'),
+    0x87: ('audio', 'eac3'),
+    0xD1: ('video', 'dirac'),
+    0xEA: ('video', 'vc1')
+}
+
+# Descriptors that identify the content of private (0x06) streams
+PRIVATE_STREAM_DESCRIPTORS = {
+    0x56: ('subtitle', 'dvb_teletext'),
+    0x59: ('subtitle', 'dvb_subtitle'),
+    0x6A: ('audio', 'ac3'),
+    0x7A: ('audio', 'eac3'),
+    0x7B: ('audio', 'dts'),
+    0x7C: ('audio', 'aac')
+}
+
+# Registration descriptor (0x05) format identifiers
+REGISTRATION_FORMATS = {
+    b'AC-3': ('audio', 'ac3'),
+    b'EAC3': ('audio', 'eac3'),
+    b'DTS1': ('audio', 'dts'),
+    b'DTS2': ('audio', 'dts'),
+    b'DTS3': ('audio', 'dts'),
+    b'HEVC': ('video', 'hevc'),
+    b'Opus': ('audio', 'opus')
+}
+
+
+def _crc32_table():
+    table = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+_CRC_TABLE = _crc32_table()
+
+
+def crc32_mpeg(data: bytes) -> int:
+    """CRC-32/MPEG-2 as used by PSI sections"""
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ _CRC_TABLE[((crc >> 24) ^ byte) & 0xFF]
+    return crc
+
+
+def parse_descriptors(data: bytes) -> List[Dict]:
+    """Split a descriptor loop into tag/data entries"""
+    descriptors = []
+    pos = 0
+    while pos + 2 <= len(data):
+        tag, length = data[pos], data[pos + 1]
+        descriptors.append({'tag': tag, 'data': data[pos + 2:pos + 2 + length]})
+        pos += 2 + length
+    return descriptors
+
+
+def identify_stream(stream_type: int, descriptors: List[Dict]):
+    """Work out codec type and name from stream_type and ES descriptors"""
+    for descriptor in descriptors:
+        if descriptor['tag'] == 0x05 and descriptor['data'][:4] in REGISTRATION_FORMATS:
+            if stream_type in (0x06, 0x81, 0x87, 0x24) or stream_type >= 0x80:
+                return REGISTRATION_FORMATS[descriptor['data'][:4]]
+    if stream_type == 0x06:
+        for descriptor in descriptors:
+            if descriptor['tag'] in PRIVATE_STREAM_DESCRIPTORS:
+                return PRIVATE_STREAM_DESCRIPTORS[descriptor['tag']]
+        return ('data', 'bin_data')
+    return STREAM_TYPES.get(stream_type, ('data', 'unknown'))
+
+
+def parse_pat(section: bytes) -> Dict:
+    """Parse a PAT section into {program_number: pmt_pid}"""
+    section_length = ((section[1] & 0x0F) << 8) | section[2]
+    programs = {}
+    end = 3 + section_length - 4
+    for pos in range(8, end, 4):
+        program_number = (section[pos] << 8) | section[pos + 1]
+        pid = ((section[pos + 2] & 0x1F) << 8) | section[pos + 3]
+        if program_number != 0:  # program 0 points at the NIT
+            programs[program_number] = pid
+    return {
+        'transport_stream_id': (section[3] << 8) | section[4],
+        'version': (section[5] >> 1) & 0x1F,
+        'section_number': section[6],
+        'last_section_number': section[7],
+        'programs': programs
+    }
+
+
+def parse_pmt(section: bytes) -> Dict:
+    """Parse a PMT section into program info and its elementary streams"""
+    section_length = ((section[1] & 0x0F) << 8) | section[2]
+    program_info_length = ((section[10] & 0x0F) << 8) | section[11]
+    end = 3 + section_length - 4
+
+    streams = []
+    pos = 12 + program_info_length
+    while pos + 5 <= end:
+        stream_type = section[pos]
+        pid = ((section[pos + 1] & 0x1F) << 8) | section[pos + 2]
+        es_info_length = ((section[pos + 3] & 0x0F) << 8) | section[pos + 4]
+        descriptors = parse_descriptors(section[pos + 5:pos + 5 + es_info_length])
+        codec_type, codec_name = identify_stream(stream_type, descriptors)
+
+        stream = {
+            'pid': pid,
+            'stream_type': stream_type,
+            'codec_type': codec_type,
+            'codec_name': codec_name,
+            'descriptors': [d['tag'] for d in descriptors],
+            'es_info': section[pos + 5:pos + 5 + es_info_length]
+        }
+        for descriptor in descriptors:
+            if descriptor['tag'] == 0x0A and len(descriptor['data']) >= 3:
+                stream['language'] = descriptor['data'][:3].decode('latin-1')
+        streams.append(stream)
+        pos += 5 + es_info_length
+
+    return {
+        'program_number': (section[3] << 8) | section[4],
+        'version': (section[5] >> 1) & 0x1F,
+        'pcr_pid': ((section[8] & 0x1F) << 8) | section[9],
+        'program_descriptors': [d['tag'] for d in parse_descriptors(section[12:12 + program_info_length])],
+        'program_info': section[12:12 + program_info_length],
+        'streams': streams
+    }
+
+
+class PSIParser:
+    """Collects PAT and PMT sections from a transport stream fed in arbitrary chunks"""
+
+    def __init__(self, program_number: Optional[int] = None):
+        self.program_number = program_number
+        self.pat: Optional[Dict] = None
+        self.pmts: Dict[int, Dict] = {}
+        self.packets = 0
+        self.crc_errors = 0
+
+        self._remainder = b''
+        self._sections: Dict[int, bytearray] = {}
+        self._pat_sections: Dict[int, Dict] = {}
+        self._lock = threading.Lock()
+
+    def feed(self, data: bytes):
+        """Feed raw TS bytes; partial packets are kept until the next call"""
+        with self._lock:
+            data = self._remainder + bytes(data)
+            pos = 0
+            length = len(data)
+            while pos + TS_PACKET_SIZE <= length:
+                if data[pos] != SYNC_BYTE:
+                    # Resync on the next sync byte
+                    next_sync = data.find(bytes([SYNC_BYTE]), pos + 1)
+                    if next_sync < 0:
+                        pos = length
+                        break
+                    pos = next_sync
+                    continue
+                self._parse_packet(data[pos:pos + TS_PACKET_SIZE])
+                pos += TS_PACKET_SIZE
+            self._remainder = data[pos:]
+
+    def _wanted_pids(self):
+        pids = {PAT_PID}
+        if self.pat:
+            pids.update(self.pat['programs'].values())
+        return pids
+
+    def _parse_packet(self, packet: bytes):
+        self.packets += 1
+        pid = ((packet[1] & 0x1F) << 8) | packet[2]
+        if pid not in self._wanted_pids():
+            return
+
+        payload_unit_start = packet[1] & 0x40
+        adaptation_field_control = (packet[3] >> 4) & 0x03
+        if not adaptation_field_control & 0x01:
+            return
+        offset = 4
+        if adaptation_field_control & 0x02:
+            offset += 1 + packet[4]
+        if offset >= TS_PACKET_SIZE:
+            return
+        payload = packet[offset:]
+
+        if payload_unit_start:
+            pointer = payload[0]
+            if pid in self._sections:
+                # Bytes before the pointer finish the previous section
+                self._sections[pid].extend(payload[1:1 + pointer])
+                self._drain_sections(pid)
+            self._sections[pid] = bytearray(payload[1 + pointer:])
+        elif pid in self._sections:
+            self._sections[pid].extend(payload)
+        else:
+            return
+        self._drain_sections(pid)
+
+    def _drain_sections(self, pid: int):
+        buffer = self._sections.get(pid)
+        while buffer is not None and len(buffer) >= 3:
+            if buffer[0] == 0xFF:
+                # Stuffing until the next payload unit start
+                del self._sections[pid]
+                return
+            total = 3 + (((buffer[1] & 0x0F) << 8) | buffer[2])
+            if len(buffer) < total:
+                return
+            section = bytes(buffer[:total])
+            del buffer[:total]
+            self._handle_section(pid, section)
+
+    def _handle_section(self, pid: int, section: bytes):
+        if len(section) < 12 or not section[1] & 0x80:
+            return
+        if crc32_mpeg(section) != 0:
+            self.crc_errors += 1
+            return
+        # Ignore sections that are not yet applicable
+        if not section[5] & 0x01:
+            return
+
+        table_id = section[0]
+        if pid == PAT_PID and table_id == TABLE_ID_PAT:
+            pat = parse_pat(section)
+            self._pat_sections[pat['section_number']] = pat
+            if all(n in self._pat_sections for n in range(pat['last_section_number'] + 1)):
+                programs = {}
+                for part in self._pat_sections.values():
+                    programs.update(part['programs'])
+                if self.pat is None or self.pat['version'] != pat['version'] or self.pat['programs'] != programs:
+                    self.pat = {
+                        'transport_stream_id': pat['transport_stream_id'],
+                        'version': pat['version'],
+                        'programs': programs
+                    }
+        elif table_id == TABLE_ID_PMT:
+            pmt = parse_pmt(section)
+            pmt['pmt_pid'] = pid
+            self.pmts[pmt['program_number']] = pmt
+
+    def selected_program(self) -> Optional[int]:
+        """The configured program if present in the PAT, otherwise the first one"""
+        if not self.pat or not self.pat['programs']:
+            return None
+        if self.program_number in self.pat['programs']:
+            return self.program_number
+        return next(iter(self.pat['programs']))
+
+    @property
+    def complete(self) -> bool:
+        """PAT seen and the PMT of the selected program parsed"""
+        with self._lock:
+            program = self.selected_program()
+            return program is not None and program in self.pmts
+
+    def get_pmt_version(self, program_number: int) -> Optional[int]:
+        pmt = self.pmts.get(program_number)
+        return pmt['version'] if pmt else None
+
+    def to_probe_data(self) -> Dict:
+        """Results in the shape of `ffprobe -show_programs -show_streams -show_format` JSON"""
+        with self._lock:
+            programs = []
+            streams = []
+            for program_number in (self.pat or {}).get('programs', {}):
+                pmt = self.pmts.get(program_number)
+                if not pmt:
+                    continue
+                program_streams = []
+                for stream in pmt['streams']:
+                    entry = {
+                        'index': len(streams),
+                        'id': hex(stream['pid']),
+                        'codec_type': stream['codec_type'],
+                        'codec_name': stream['codec_name'],
+                        'stream_type': hex(stream['stream_type']),
+                        'tags': {'language': stream['language']} if 'language' in stream else {}
+                    }
+                    program_streams.append(entry)
+                    streams.append(entry)
+                programs.append({
+                    'program_id': program_number,
+                    'program_num': program_number,
+                    'pmt_pid': pmt['pmt_pid'],
+                    'pcr_pid': pmt['pcr_pid'],
+                    'pmt_version': pmt['version'],
+                    'nb_streams': len(program_streams),
+                    'tags': {},
+                    'streams': program_streams
+                })
+
+            return {
+                'programs': programs,
+                'streams': streams,
+                'format': {
+                    'format_name': 'mpegts',
+                    'nb_streams': len(streams),
+                    'nb_programs': len(programs)
+                },
+                'source': 'psi'
+            }
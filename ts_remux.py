@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # packets are rewritten one at a time in Python
+    np = None
+
+from ts_psi import PSIParser, crc32_mpeg, TS_PACKET_SIZE, SYNC_BYTE, PAT_PID, TABLE_ID_PAT, TABLE_ID_PMT
+
+# mpegtsmux puts the first program's PMT here
+DEFAULT_PMT_PID = 0x0020
+DEFAULT_TRANSPORT_STREAM_ID = 1
+# PAT/PMT repetition; TR 101 290 asks for at least every 0.5s
+PSI_INTERVAL = 0.1
+
+
+def build_section(table_id: int, table_id_extension: int, version: int, body: bytes) -> bytes:
+    """Long-form PSI section with a single section_number and its CRC"""
+    section_length = 5 + len(body) + 4
+    header = bytes([
+        table_id,
+        0xB0 | (section_length >> 8), section_length & 0xFF,
+        table_id_extension >> 8, table_id_extension & 0xFF,
+        0xC1 | ((version & 0x1F) << 1),
+        0x00, 0x00
+    ])
+    section = header + body
+    return section + crc32_mpeg(section).to_bytes(4, 'big')
+
+
+def packetize_section(pid: int, section: bytes, continuity_counter: int):
+    """Split a section into TS packets stuffed with 0xFF; returns (packets, next continuity counter)"""
+    payload = b'\x00' + section  # pointer_field
+    packets = []
+    for pos in range(0, len(payload), TS_PACKET_SIZE - 4):
+        chunk = payload[pos:pos + TS_PACKET_SIZE - 4]
+        header = bytes([
+            SYNC_BYTE,
+            (0x40 if pos == 0 else 0x00) | (pid >> 8),
+            pid & 0xFF,
+            0x10 | continuity_counter
+        ])
+        packets.append(header + chunk + b'\xFF' * (TS_PACKET_SIZE - 4 - len(chunk)))
+        continuity_counter = (continuity_counter + 1) & 0x0F
+    return b''.join(packets), continuity_counter
+
+
+class PIDRemuxer:
+    """
+    Cuts one program out of a transport stream packet by packet. The video, audio and PCR
+    PIDs of the selected program are kept, the audio PIDs in track order, and moved to the
+    output PIDs by rewriting the
+    packet headers; everything else, including the original PAT and PMT, is dropped and
+    a PAT/PMT for the output program is inserted every PSI_INTERVAL. Payloads, PCR and
+    continuity counters are left as they arrived.
+    """
+
+    def __init__(self, program_number: int, video_pid: Optional[int], audio_pids: List[int],
+                 pmt_pid: int = DEFAULT_PMT_PID, transport_stream_id: int = DEFAULT_TRANSPORT_STREAM_ID,
+                 logger: Optional[logging.Logger] = None):
+        self.logger = logger or logging.getLogger(__name__)
+        self.out_program_number = program_number
+        self.out_video_pid = video_pid
+        self.out_audio_pids = list(audio_pids)
+        self.out_pmt_pid = pmt_pid
+        self.transport_stream_id = transport_stream_id
+
+        self.program_number = None
+        self._video_pid = None
+        self._audio_pids = []
+        self.pid_map: Dict[int, int] = {}
+        self.psi = None
+        self.pmt_version = -1
+        self._pmt_source_version = None
+        self._pat_cc = 0
+        self._pmt_cc = 0
+        self._last_psi = 0.0
+        self._remainder = b''
+        self._pid_table = None
+        self._lock = threading.Lock()
+        self.stats = {'packets_in': 0, 'packets_out': 0, 'psi_inserted': 0, 'resyncs': 0, 'pmt_updates': 0}
+
+    def select(self, program_number: int, pmt: Dict, video_pid: Optional[int], audio_pids: List[int]):
+        """Start passing the given program; pmt is a parsed PMT from ts_psi"""
+        with self._lock:
+            self.program_number = program_number
+            self._video_pid = video_pid
+            self._audio_pids = list(audio_pids)
+            self.psi = PSIParser(program_number)
+            self._apply_pmt(pmt)
+
+    def _apply_pmt(self, pmt: Dict):
+        """Rebuild the PID map and the output PAT/PMT from an input PMT"""
+        pid_map = {}
+        streams = []
+        for stream in pmt['streams']:
+            if stream['pid'] == self._video_pid:
+                out_pid = self.out_video_pid if self.out_video_pid is not None else stream['pid']
+            elif stream['pid'] in self._audio_pids:
+                track = self._audio_pids.index(stream['pid'])
+                out_pid = self.out_audio_pids[track] if track < len(self.out_audio_pids) else stream['pid']
+            else:
+                continue
+            pid_map[stream['pid']] = out_pid
+            streams.append((stream['stream_type'], out_pid, stream.get('es_info', b'')))
+        if not streams:
+            self.logger.warning(f"Program {self.program_number} no longer carries the selected PIDs")
+
+        # PCR may ride on the video PID or have a PID of its own, which keeps its number
+        pid_map.setdefault(pmt['pcr_pid'], pmt['pcr_pid'])
+        pcr_pid = pid_map[pmt['pcr_pid']]
+        self.pid_map = pid_map
+
+        table = list(range(8192))
+        for pid, out_pid in pid_map.items():
+            table[pid] = out_pid
+        self._pid_table = np.array(table, dtype=np.uint16) if np is not None else table
+        self._kept = np.array(sorted(pid_map), dtype=np.uint16) if np is not None else set(pid_map)
+
+        self.pmt_version = (self.pmt_version + 1) & 0x1F
+        self._pmt_source_version = pmt['version']
+        pat = build_section(TABLE_ID_PAT, self.transport_stream_id, self.pmt_version, bytes([
+            self.out_program_number >> 8, self.out_program_number & 0xFF,
+            0xE0 | (self.out_pmt_pid >> 8), self.out_pmt_pid & 0xFF
+        ]))
+        program_info = pmt.get('program_info', b'')
+        body = bytes([
+            0xE0 | (pcr_pid >> 8), pcr_pid & 0xFF,
+            0xF0 | (len(program_info) >> 8), len(program_info) & 0xFF
+        ]) + program_info
+        for stream_type, out_pid, es_info in streams:
+            body += bytes([
+                stream_type, 0xE0 | (out_pid >> 8), out_pid & 0xFF,
+                0xF0 | (len(es_info) >> 8), len(es_info) & 0xFF
+            ]) + es_info
+        self._pat_section = pat
+        self._pmt_section = build_section(TABLE_ID_PMT, self.out_program_number, self.pmt_version, body)
+        # Force the new tables out with the next packets
+        self._last_psi = 0.0
+
+        mapping = ", ".join(f"{hex(pid)}->{hex(out)}" for pid, out in sorted(pid_map.items()))
+        self.logger.info(f"Remuxing program {self.program_number} as program {self.out_program_number}: {mapping}")
+
+    def _psi_packets(self) -> bytes:
+        pat, self._pat_cc = packetize_section(PAT_PID, self._pat_section, self._pat_cc)
+        pmt, self._pmt_cc = packetize_section(self.out_pmt_pid, self._pmt_section, self._pmt_cc)
+        self.stats['psi_inserted'] += 1
+        return pat + pmt
+
+    def _check_pmt(self, data: bytes, pids):
+        """Feed the input PAT/PMT to the parser and pick up new PMT versions"""
+        if np is not None:
+            psi_pids = [PAT_PID] + list((self.psi.pat or {}).get('programs', {}).values())
+            packets = data[np.isin(pids, psi_pids)]
+            if not len(packets):
+                return
+            self.psi.feed(packets.tobytes())
+        else:
+            self.psi.feed(data)
+        pmt = self.psi.pmts.get(self.program_number)
+        if pmt and pmt['version'] != self._pmt_source_version:
+            self.logger.info(f"PMT version {pmt['version']} for program {self.program_number}, updating output tables")
+            self.stats['pmt_updates'] += 1
+            self._apply_pmt(pmt)
+
+    def process(self, data: bytes) -> bytes:
+        """Remux a chunk of TS; partial packets are held until the next call"""
+        with self._lock:
+            if self.program_number is None:
+                return b''
+            data = self._remainder + bytes(data)
+            if data[:1] != bytes([SYNC_BYTE]) or (len(data) > TS_PACKET_SIZE and data[TS_PACKET_SIZE] != SYNC_BYTE):
+                data = self._resync(data)
+            usable = len(data) - len(data) % TS_PACKET_SIZE
+            self._remainder = data[usable:]
+            if not usable:
+                return b''
+
+            if np is not None:
+                packets = np.frombuffer(data, dtype=np.uint8, count=usable).reshape(-1, TS_PACKET_SIZE)
+                pids = ((packets[:, 1].astype(np.uint16) & 0x1F) << 8) | packets[:, 2]
+                self._check_pmt(packets, pids)
+                mask = np.isin(pids, self._kept) & (packets[:, 0] == SYNC_BYTE)
+                out = packets[mask]
+                new_pids = self._pid_table[pids[mask]]
+                out[:, 1] = (out[:, 1] & 0xE0) | (new_pids >> 8).astype(np.uint8)
+                out[:, 2] = (new_pids & 0xFF).astype(np.uint8)
+                self.stats['packets_in'] += len(packets)
+                self.stats['packets_out'] += len(out)
+                output = out.tobytes()
+            else:
+                self._check_pmt(data[:usable], None)
+                kept = []
+                for pos in range(0, usable, TS_PACKET_SIZE):
+                    pid = ((data[pos + 1] & 0x1F) << 8) | data[pos + 2]
+                    if pid in self._kept:
+                        out_pid = self._pid_table[pid]
+                        kept.append(bytes([SYNC_BYTE, (data[pos + 1] & 0xE0) | (out_pid >> 8), out_pid & 0xFF]))
+                        kept.append(data[pos + 3:pos + TS_PACKET_SIZE])
+                self.stats['packets_in'] += usable // TS_PACKET_SIZE
+                self.stats['packets_out'] += len(kept) // 2
+                output = b''.join(kept)
+
+            now = time.monotonic()
+            if now - self._last_psi >= PSI_INTERVAL:
+                self._last_psi = now
+                output = self._psi_packets() + output
+            return output
+
+    def _resync(self, data: bytes) -> bytes:
+        """Drop bytes up to the next position where two sync bytes line up a packet apart"""
+        self.stats['resyncs'] += 1
+        pos = data.find(bytes([SYNC_BYTE]))
+        while 0 <= pos and pos + TS_PACKET_SIZE < len(data) and data[pos + TS_PACKET_SIZE] != SYNC_BYTE:
+            pos = data.find(bytes([SYNC_BYTE]), pos + 1)
+        return data[pos:] if pos >= 0 else b''
+
+    def get_stats(self) -> Dict:
+        """Counters since the last call"""
+        with self._lock:
+            stats = dict(self.stats)
+            for key in ('packets_in', 'packets_out', 'psi_inserted', 'resyncs'):
+                self.stats[key] = 0
+        stats['pmt_version'] = self.pmt_version
+        return stats
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+import argparse
+import multiprocessing
+import socket
+import threading
+import time
+
+from udp_receiver import BatchedUDPReceiver, socket_drops
+
+# 7 TS packets per datagram, as sent by encoders and multicast gateways
+DATAGRAM_SIZE = 1316
+DEFAULT_RATES = [20000, 50000, 100000, 150000, 200000, 300000, 400000]
+MAX_DROP_RATIO = 0.001
+
+
+def send_at_rate(port: int, rate: int, duration: float, ready: multiprocessing.Event,
+                 sent_count: multiprocessing.Value):
+    """Send TS-sized datagrams to the port at a fixed packet rate in 1 ms bursts"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    payload = (b'\x47' + bytes(187)) * 7
+    per_burst = max(1, rate // 1000)
+    ready.wait()
+    start = time.perf_counter()
+    sent = 0
+    while True:
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration:
+            break
+        target = int(elapsed * rate)
+        while sent < target:
+            burst = min(per_burst, target - sent)
+            for _ in range(burst):
+                sock.sendto(payload, ('127.0.0.1', port))
+            sent += burst
+        time.sleep(0.0005)
+    sock.close()
+    with sent_count.get_lock():
+        sent_count.value += sent
+
+
+class RecvLoop:
+    """One datagram per system call, the same read pattern udpsrc uses"""
+
+    def __init__(self, port: int, buffer_size: int):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, buffer_size)
+        self.sock.bind(('127.0.0.1', port))
+        self.sock.settimeout(0.1)
+        self.received = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        buffer = bytearray(2048)
+        while not self._stop.is_set():
+            try:
+                self.sock.recv_into(buffer)
+            except socket.timeout:
+                continue
+            self.received += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def drops(self):
+        return socket_drops(self.sock.fileno()) or 0
+
+    def close(self):
+        self.sock.close()
+
+
+class BatchedLoop:
+    """BatchedUDPReceiver with a callback that only counts"""
+
+    def __init__(self, port: int, buffer_size: int, batch_size: int):
+        self.received = 0
+        self.receiver = BatchedUDPReceiver(f"udp://127.0.0.1:{port}", self._on_batch,
+                                           buffer_size=buffer_size, batch_size=batch_size)
+        self.drop_count = 0
+
+    def _on_batch(self, data, datagrams):
+        self.received += datagrams
+
+    def start(self):
+        self.receiver.start()
+
+    def stop(self):
+        self.drop_count = self.receiver.get_stats()['socket_drops']
+        self.receiver.stop()
+
+    def drops(self):
+        return self.drop_count
+
+    def close(self):
+        pass
+
+
+class UdpsrcLoop:
+    """udpsrc ! fakesink, counting buffers on the fakesink"""
+
+    def __init__(self, port: int, buffer_size: int):
+        import gi
+        gi.require_version('Gst', '1.0')
+        from gi.repository import Gst
+        Gst.init(None)
+        self.Gst = Gst
+        self.received = 0
+        self.pipeline = Gst.parse_launch(
+            f"udpsrc address=127.0.0.1 port={port} buffer-size={buffer_size} ! "
+            f"fakesink name=sink sync=false signal-handoffs=true"
+        )
+        self.pipeline.get_by_name("sink").connect("handoff", self._on_handoff)
+
+    def _on_handoff(self, sink, buffer, pad):
+        self.received += 1
+
+    def start(self):
+        self.pipeline.set_state(self.Gst.State.PLAYING)
+        self.pipeline.get_state(self.Gst.CLOCK_TIME_NONE)
+
+    def stop(self):
+        self.pipeline.set_state(self.Gst.State.NULL)
+
+    def drops(self):
+        return 0
+
+    def close(self):
+        pass
+
+
+def run_rate(mode: str, rate: int, args) -> dict:
+    """Receive one paced run and return sent/received/drop counts"""
+    if mode == 'recv':
+        receiver = RecvLoop(args.port, args.buffer_size)
+    elif mode == 'batched':
+        receiver = BatchedLoop(args.port, args.buffer_size, args.batch_size)
+    else:
+        receiver = UdpsrcLoop(args.port, args.buffer_size)
+
+    # One Python sender tops out well below what the kernel can deliver, so split the rate
+    ready = multiprocessing.Event()
+    sent_count = multiprocessing.Value('q', 0)
+    senders = [
+        multiprocessing.Process(target=send_at_rate,
+                                args=(args.port, rate // args.senders, args.duration, ready, sent_count))
+        for _ in range(args.senders)
+    ]
+    for sender in senders:
+        sender.start()
+    receiver.start()
+    ready.set()
+    for sender in senders:
+        sender.join()
+    # Let the receiver drain what is still queued in the socket
+    time.sleep(0.5)
+    receiver.stop()
+
+    # Measure against what was actually sent in case the senders fell behind
+    sent = sent_count.value
+    lost = max(0, sent - receiver.received)
+    result = {
+        'rate': rate,
+        'sent': sent,
+        'received': receiver.received,
+        'socket_drops': receiver.drops(),
+        'loss_ratio': lost / sent if sent else 0
+    }
+    receiver.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback benchmark of UDP ingest read paths")
+    parser.add_argument("--modes", default="recv,batched",
+                        help="Comma separated read paths: recv, batched, udpsrc (default: recv,batched)")
+    parser.add_argument("--rates", default=",".join(str(r) for r in DEFAULT_RATES),
+                        help="Comma separated datagram rates per second to try")
+    parser.add_argument("--duration", type=float, default=3, help="Seconds per rate (default: 3)")
+    parser.add_argument("--port", type=int, default=45000, help="Loopback port (default: 45000)")
+    parser.add_argument("--senders", type=int, default=4, help="Sender processes sharing the rate (default: 4)")
+    parser.add_argument("--buffer-size", type=int, default=2097152, help="Socket receive buffer (default: 2097152)")
+    parser.add_argument("--batch-size", type=int, default=64, help="Datagrams per batched read (default: 64)")
+    args = parser.parse_args()
+
+    rates = [int(r) for r in args.rates.split(",")]
+    for mode in args.modes.split(","):
+        print(f"\n{mode}")
+        print(f"{'pps':>8} {'Mbps':>8} {'received':>10} {'sent':>10} {'drops':>8} {'loss %':>8}")
+        sustained = 0
+        for rate in rates:
+            result = run_rate(mode, rate, args)
+            mbps = rate * DATAGRAM_SIZE * 8 / 1e6
+            print(f"{rate:>8} {mbps:>8.1f} {result['received']:>10} {result['sent']:>10} "
+                  f"{result['socket_drops']:>8} {result['loss_ratio'] * 100:>8.3f}")
+            if result['loss_ratio'] <= MAX_DROP_RATIO:
+                sustained = rate
+        print(f"Highest rate with loss under {MAX_DROP_RATIO * 100:.1f}%: {sustained} pps "
+              f"({sustained * DATAGRAM_SIZE * 8 / 1e6:.1f} Mbps)")
+
+
+if __name__ == "__main__":
+    main()
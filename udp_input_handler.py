@@ -16,12 +16,40 @@ import time
 from datetime import datetime
 from urllib.parse import urlparse, urlencode
 from stats_collector import StatsCollector
+from loop_lag import GLibLagProbe
+from psi_discovery import PSIDiscovery
+from ts_analyzer import create_analyzer
+from jitter_buffer import create_jitter_buffer
+from latency_probe import LatencyProbe
+from latency_profile import LatencySizing
+from gop_cache import GOPCache, gop_cache_settings
+from flight_recorder import create_flight_recorder
+from hitless_merge import HitlessMerge
+from hot_standby import HotStandbySource
+from playout_source import PlayoutSource
+from rtp_fec import RTPFECReceiver
+from ts_file_player import TSFilePlayer
+from shared_ingest import register_consumer, unregister_consumer
+from stream_set import (stream_set, is_passthrough, mux_video_pid, mux_audio_pids, track_suffix, write_stream_info,
+                        all_info_paths)
+from stream_set import describe as describe_streams
+from ts_remux import PIDRemuxer, DEFAULT_PMT_PID
+from udp_receiver import BatchedUDPReceiver, check_receive_buffer, DEFAULT_BUFFER_SIZE, DEFAULT_BATCH_SIZE
 from pathlib import Path
 
 
 
 
 
+# How long to wait for shared_ingest.py to open this channel's socket
+SHARED_SOCKET_TIMEOUT = 30
+
+
+def check_full_passthrough(config, channel_name):
+    """Check if every stream the channel carries is set to passthrough"""
+    return is_passthrough(config.get_channel_settings(channel_name))
+
+
 def setup_logging(channel_name, log_dir='logs', log_level='INFO'):
     """
     Set up logging configuration for the application.
@@ -86,6 +114,25 @@ class InputPipelineHandler:
         """
         self.logger = logging.getLogger(__name__)
         self.channel_name = channel_name
+        self.lag_probe = None
+        self.psi_discovery = None
+        self.ts_analyzer = None
+        self.ts_analysis_timer = None
+        self.jitter_buffer = None
+        self.jitter_buffer_timer = None
+        self.latency_probe = None
+        self.latency_timer = None
+        self.gop_cache = None
+        self.gop_cache_timer = None
+        self.flight_recorder = None
+        self.flight_recorder_timer = None
+        self.udp_receiver = None
+        self.rtp_receiver = None
+        self.rtp_stats_timer = None
+        self.file_player = None
+        self.file_stats_timer = None
+        self.loop = None
+        self.exit_code = 0
 
 
         # Set up DOT file directory before any pipeline operations
@@ -104,7 +151,11 @@ class InputPipelineHandler:
         self.stats_collector = None
         self.srt_stats_timer = None
         self.video_pid = None
-        self.audio_pid = None
+        self.video_codec = None
+        self.audio_tracks = []
+        self.program_number = None
+        # Only the branches for the streams in the channel's stream set are built
+        self.streams = stream_set(self.channel_settings)
 
         self.fds = {}  # Initialize the fds dictionary
         
@@ -128,9 +179,42 @@ class InputPipelineHandler:
         self.selected_input = self.inputs[self.source_index]
         self.logger.debug(f"Selected input configuration: {self.selected_input}")
         
+        # Hot standby receives several inputs at once and switches between them in-process;
+        # hitless merge receives copies of one stream and rebuilds it packet by packet
+        self.hot_standby_settings = self.channel_settings.get('hot_standby')
+        self.hot_standby = None
+        self.hitless_settings = self.channel_settings.get('hitless_merge')
+        self.hitless_merge = None
+        self.hitless_stats_timer = None
+        if self.hot_standby_settings and self.hitless_settings:
+            raise ValueError("hot_standby and hitless_merge cannot be combined")
+        # Scheduled playout switches between live inputs and files at the times in the channel's schedule
+        playout = self.channel_settings.get('scheduled_playout')
+        self.playout_settings = (playout if isinstance(playout, dict) else {}) if playout else None
+        self.playout = None
+        if self.playout_settings is not None and (self.hot_standby_settings or self.hitless_settings):
+            raise ValueError("scheduled_playout cannot be combined with hot_standby or hitless_merge")
+        redundant = self.hot_standby_settings or self.hitless_settings or self.playout_settings is not None
+
+        # Inputs marked shared are received once by shared_ingest.py and read from its socket
+        self.shared = bool(self.selected_input.get('shared')) and not redundant
+        self.shared_timer = None
+
+        # Passthrough channels cut the program out of the TS by PID instead of demuxing and remuxing it
+        self.mux_settings = self.config.get_plugin_settings(channel_name, 'mpegtsmux')
+        self.fast_passthrough = (check_full_passthrough(self.config, channel_name)
+                                 and self.mux_settings.get('fast-passthrough', True))
+        self.remuxer = None
+
+        # Queue, shm and jitter buffer sizing from the channel's latency_profile
+        self.sizing = LatencySizing(self.channel_settings, 'udp_input', self.logger)
+
+        # Local TS files are played out through the same appsrc path as our own socket readers
+        self.file_input = self.selected_input['type'] == 'filesrc' and not (redundant or self.shared)
+
         # Verify input type is UDP
-        if self.selected_input['type'] != 'udpsrc':
-            raise ValueError("Only UDP input type is supported")
+        if self.selected_input['type'] != 'udpsrc' and not (redundant or self.shared or self.file_input):
+            raise ValueError("Only UDP and file input types are supported")
         
         # Initialize Redis for stats collection
         try:
@@ -190,9 +274,9 @@ class InputPipelineHandler:
 
 
 #main indent
-    def analyze_stream(self):
+    def analyze_stream(self, probe_data):
         """
-        Analyze the input stream using ffprobe to detect codecs and PIDs.
+        Select the program, codecs and PIDs from the PSI read off the live stream.
         Handles both explicitly configured PIDs and automatic detection with fallback.
         """
         def format_pid(pid):
@@ -211,40 +295,18 @@ class InputPipelineHandler:
         # Get configuration from channel settings
         input_config = self.selected_input
         uri = input_config.get('uri')
-        program_number = input_config.get('demux', {}).get('program-number')
-        video_pid = format_pid(input_config.get('demux', {}).get('video-pid'))
-        audio_pid = format_pid(input_config.get('demux', {}).get('audio-pid'))
+        demux = input_config.get('demux', {})
+        program_number = demux.get('program-number')
+        video_pid = format_pid(demux.get('video-pid'))
+        # One audio PID per track; a single value selects the first track
+        audio_pids = demux.get('audio-pid')
+        audio_pids = [format_pid(pid) for pid in (audio_pids if isinstance(audio_pids, list) else [audio_pids]) if pid]
 
         # Log the initial configuration
-        self.logger.info(f"Analyzing stream: URI={uri}, Program={program_number}, Video PID={video_pid}, Audio PID={audio_pid}")
+        self.logger.info(f"Analyzing stream: URI={uri}, Program={program_number}, Video PID={video_pid}, "
+                         f"Audio PIDs={audio_pids}, carrying {describe_streams(self.streams)}")
 
-        try:
-            cmd = [
-                "ffprobe",
-                "-v", "quiet",
-                "-print_format", "json",
-                "-show_format",
-                "-show_streams",
-                "-show_programs",
-                "-i", uri
-            ]
-            self.logger.debug(f"Executing ffprobe command: {' '.join(cmd)}")
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=20)
-            
-            if result.returncode != 0:
-                self.logger.error(f"ffprobe command failed: {result.stderr}")
-                sys.exit(1)
-            probe_data = json.loads(result.stdout)
-            self.logger.debug(f"Probe data: {json.dumps(probe_data, indent=2)}")
-        except subprocess.TimeoutExpired:
-            self.logger.error("ffprobe command timed out")
-            sys.exit(1)
-        except json.JSONDecodeError:
-            self.logger.error("Failed to parse ffprobe output")
-            sys.exit(1)
-        except Exception as e:
-            self.logger.error(f"Error during ffprobe execution: {str(e)}")
-            sys.exit(1)
+        self.logger.debug(f"Probe data: {json.dumps(probe_data, indent=2)}")
 
         # Find the matching program
         matching_program = None
@@ -258,91 +320,85 @@ class InputPipelineHandler:
             matching_program = probe_data['programs'][0]
             self.logger.warning(f"Specified program {program_number} not found. Using program {matching_program.get('program_id')}")
             # Reset PIDs as we're using a different program
-            video_pid = audio_pid = None
+            video_pid = None
+            audio_pids = []
 
         if not matching_program:
-            self.logger.error("No valid program found in the stream")
-            sys.exit(1)
+            raise RuntimeError("No valid program found in the stream")
 
         found_program_number = matching_program.get('program_id')
         self.logger.info(f"Using program number: {found_program_number}")
 
-        # Find matching video and audio streams
-        video_codec = audio_codec = None
-        found_video_pid = found_audio_pid = None
-        first_video_pid = first_audio_pid = None
+        streams = matching_program.get('streams', [])
+        for stream in streams:
+            self.logger.info(f"Found a PID -->: {format_pid(stream.get('id'))} of type: {stream['codec_type']}")
+
+        def select(codec_type, wanted_pid, taken):
+            """The stream with the wanted PID, otherwise the first one of the type not already taken"""
+            candidates = [stream for stream in streams
+                          if stream['codec_type'] == codec_type and format_pid(stream.get('id')) not in taken]
+            if not candidates:
+                return None
+            first_pid = format_pid(candidates[0].get('id'))
+            if not wanted_pid:
+                self.logger.info(f"No specific {codec_type} PID provided. Using first found {codec_type} PID: {first_pid}")
+                return candidates[0]
+            match = next((stream for stream in candidates if format_pid(stream.get('id')) == wanted_pid), None)
+            if match:
+                self.logger.info(f"Found matching {codec_type} PID: {wanted_pid}")
+                return match
+            self.logger.warning(f"No exact match for {codec_type} PID {wanted_pid}. Using first found PID: {first_pid}")
+            return candidates[0]
+
+        # Every stream in the channel's stream set must be there; anything else is left out
+        video_codec = found_video_pid = None
+        if self.streams['video']:
+            video = select('video', video_pid, ())
+            if video is None:
+                raise RuntimeError("No video stream found; set the channel's streams to audio-only to run without video")
+            video_codec = video['codec_name']
+            found_video_pid = format_pid(video.get('id'))
+
+        audio_tracks = []
+        for track in range(self.streams['audio']):
+            audio = select('audio', audio_pids[track] if track < len(audio_pids) else None,
+                           [existing['pid'] for existing in audio_tracks])
+            if audio is None:
+                raise RuntimeError(f"Found {len(audio_tracks)} of the channel's {self.streams['audio']} audio track(s); "
+                                   f"set the channel's streams to match the input")
+            audio_tracks.append({
+                'codec': audio['codec_name'],
+                'pid': format_pid(audio.get('id')),
+                'language': audio.get('tags', {}).get('language')
+            })
 
-        for stream in matching_program.get('streams', []):
-            stream_pid = format_pid(stream.get('id'))
-            self.logger.info(f"Found a PID -->: {stream_pid} of type: {stream['codec_type']}")
-            
-            if stream['codec_type'] == 'video':
-                if not video_pid:
-                    # No PID was set, use the first video stream encountered
-                    video_codec = stream['codec_name']
-                    found_video_pid = stream_pid
-                    self.logger.info(f"No specific video PID provided. Using first found video PID: {found_video_pid}")
-                else:
-                    if first_video_pid is None:
-                        first_video_pid = stream_pid
-                    
-                    if stream_pid == video_pid:
-                        video_codec = stream['codec_name']
-                        found_video_pid = stream_pid
-                        self.logger.info(f"Found matching video PID: {found_video_pid}")
-            
-            elif stream['codec_type'] == 'audio':
-                if not audio_pid:
-                    # No PID was set, use the first audio stream encountered
-                    audio_codec = stream['codec_name']
-                    found_audio_pid = stream_pid
-                    self.logger.info(f"No specific audio PID provided. Using first found audio PID: {found_audio_pid}")
-                else:
-                    if first_audio_pid is None:
-                        first_audio_pid = stream_pid
-                    
-                    if stream_pid == audio_pid:
-                        audio_codec = stream['codec_name']
-                        found_audio_pid = stream_pid
-                        self.logger.info(f"Found matching audio PID: {found_audio_pid}")
-
-        # After the loop, check if we need to use the first found PIDs
-        if video_pid and not found_video_pid:
-            video_codec = next((s['codec_name'] for s in matching_program.get('streams', []) 
-                              if format_pid(s.get('id')) == first_video_pid), None)
-            found_video_pid = first_video_pid
-            self.logger.warning(f"No exact match for video PID {video_pid}. Using first found PID: {found_video_pid}")
-
-        if audio_pid and not found_audio_pid:
-            audio_codec = next((s['codec_name'] for s in matching_program.get('streams', []) 
-                              if format_pid(s.get('id')) == first_audio_pid), None)
-            found_audio_pid = first_audio_pid
-            self.logger.warning(f"No exact match for audio PID {audio_pid}. Using first found PID: {found_audio_pid}")
-
-        # Final check
-        if not found_video_pid and not found_audio_pid:
-            self.logger.error("No matching video or audio streams found")
-            sys.exit(1)
+        # Tracks are numbered in PMT order, which is how every demuxer downstream will see them
+        pmt_order = [format_pid(stream.get('id')) for stream in streams]
+        audio_tracks.sort(key=lambda track: pmt_order.index(track['pid']))
+
+        carried = [found_video_pid] + [track['pid'] for track in audio_tracks]
+        left_out = [format_pid(stream.get('id')) for stream in streams
+                    if stream['codec_type'] in ('video', 'audio') and format_pid(stream.get('id')) not in carried]
+        if left_out:
+            self.logger.info(f"Not carrying PIDs {', '.join(left_out)}, the channel carries {describe_streams(self.streams)}")
 
         self.logger.info(f"Detected video codec: {video_codec}, PID: {found_video_pid}")
-        self.logger.info(f"Detected audio codec: {audio_codec}, PID: {found_audio_pid}")
+        for track, info in enumerate(audio_tracks):
+            self.logger.info(f"Detected audio track {track + 1} codec: {info['codec']}, PID: {info['pid']}")
         self.logger.info(f"Detected Program: {found_program_number}")
 
         # Store the detected PIDs for use in pad-added handler
         self.video_pid = found_video_pid
-        self.audio_pid = found_audio_pid
+        self.audio_tracks = audio_tracks
 
         # Store codec info before returning
-        self._store_codec_info(video_codec, audio_codec, found_video_pid, found_audio_pid, found_program_number)
-        
-        return video_codec, audio_codec, found_video_pid, found_audio_pid, found_program_number
+        self._store_codec_info(video_codec, found_video_pid, audio_tracks, found_program_number)
+
+        return video_codec, found_video_pid, audio_tracks, found_program_number
 
 #main indent
     def create_pipeline(self):
         """Create and configure the GStreamer pipeline based on stream analysis"""
-        self.logger.info("About to check source details")
-        self.video_codec, self.audio_codec, self.video_pid, self.audio_pid, self.program_number = self.analyze_stream()
- 
         self.logger.info("Creating pipeline")
         self.pipeline = Gst.Pipeline.new("caricoder_pipeline")
 
@@ -353,38 +409,84 @@ class InputPipelineHandler:
         self._link_static_elements()
 
         # Connect pad-added signal for dynamic linking
-        self.elements['tsdemux'].connect("pad-added", self.on_pad_added)
+        if not self.fast_passthrough:
+            self.elements['tsdemux'].connect("pad-added", self.on_pad_added)
 
         self.setup_stats_collection()
 
+        # Read PAT/PMT from the first packets; parsers are added once the codecs are known
+        program_number = self.selected_input.get('demux', {}).get('program-number')
+        self.psi_discovery = PSIDiscovery(
+            self.elements['source'].get_static_pad('src'), program_number,
+            on_complete=self._on_psi_discovered, on_timeout=self._on_psi_timeout,
+            logger=self.logger
+        )
+        self.psi_discovery.start()
 
 #main indent
-    def _store_codec_info(self, video_codec, audio_codec, video_pid, audio_pid, program_number):
-        """Store codec information in JSON files for reference."""
-        # Create and store video info
-        video_info = {
-            'codec': video_codec,
-            'pid': video_pid,
-            'program_number': program_number
-        }
-        
-        # Create and store audio info
-        audio_info = {
-            'codec': audio_codec,
-            'pid': audio_pid,
+    def _on_psi_discovered(self, probe_data):
+        """Finish the pipeline from the discovered PSI; runs in the source streaming thread"""
+        try:
+            self.video_codec, self.video_pid, self.audio_tracks, self.program_number = \
+                self.analyze_stream(probe_data)
+        except RuntimeError as e:
+            self.logger.error(str(e))
+            GLib.idle_add(self._abort, 1)
+            return False
+
+        if self.remuxer:
+            pmt = self.psi_discovery.parser.pmts[self.program_number]
+            self.remuxer.select(
+                self.program_number, pmt,
+                int(self.video_pid, 16) if self.video_pid else None,
+                [int(track['pid'], 16) for track in self.audio_tracks]
+            )
+            return True
+
+        if self.program_number:
+            self.elements['tsdemux'].set_property('program-number', self.program_number)
+            self.logger.info(f"Set tsdemux to use program number: {self.program_number}")
+
+        self._create_codec_parsers()
+        names = ['video_parser'] + [f'audio_parser{track_suffix(track)}' for track in range(len(self.audio_tracks))]
+        for name in names:
+            if name in self.elements:
+                self.pipeline.add(self.elements[name])
+                self.elements[name].sync_state_with_parent()
+        return True
+
+    def _on_psi_timeout(self):
+        """No usable PSI arrived in time"""
+        self._abort(1)
+
+    def _abort(self, exit_code):
+        """Stop the main loop and exit with the given code once cleaned up"""
+        self.exit_code = exit_code
+        if self.loop:
+            self.loop.quit()
+        return False
+
+
+#main indent
+    def _store_codec_info(self, video_codec, video_pid, audio_tracks, program_number):
+        """Store codec information in JSON files for the streams the channel carries."""
+        video_info = None
+        if self.streams['video']:
+            video_info = {
+                'codec': video_codec,
+                'pid': video_pid,
+                'program_number': program_number
+            }
+
+        audio_infos = [{
+            'codec': track['codec'],
+            'pid': track['pid'],
+            'language': track['language'],
             'program_number': program_number
-        }
+        } for track in audio_tracks]
 
-        # Write info files
-        video_info_path = f"{self.socket_dir}/{self.channel_name}_video_shm_info"
-        audio_info_path = f"{self.socket_dir}/{self.channel_name}_audio_shm_info"
-        
-        with open(video_info_path, 'w') as f:
-            json.dump(video_info, f, indent=2)
-        with open(audio_info_path, 'w') as f:
-            json.dump(audio_info, f, indent=2)
-            
-        self.logger.info(f"Stored codec info to: {video_info_path} and {audio_info_path}")
+        paths = write_stream_info(self.channel_name, video_info, audio_infos, self.socket_dir)
+        self.logger.info(f"Stored codec info to: {', '.join(paths)}")
 
 #main indent
     def _create_elements(self):
@@ -396,17 +498,82 @@ class InputPipelineHandler:
         
         # Create UDP source element
         udp_settings = self.selected_input
-        udp = Gst.ElementFactory.make("udpsrc", "source")
-        
-        # Configure UDP URI and properties
         base_uri = udp_settings.get('uri', '')
-        
-        
-
         self.logger.info(f"Base UDP URI: {base_uri}")
-        udp.set_property('uri', base_uri)
-        #udp.set_property('do-timestamp', False)
-        self.elements['source'] = udp
+
+        options = dict(udp_settings.get('options') or {})
+        buffer_size = int(options.pop('buffer-size', DEFAULT_BUFFER_SIZE))
+        if not (self.hot_standby_settings or self.hitless_settings or self.playout_settings is not None
+                or self.shared or self.file_input):
+            check_receive_buffer(buffer_size, self.logger)
+
+        ingest = udp_settings.get('ingest') or {}
+        if self.hot_standby_settings:
+            self.hot_standby = HotStandbySource(
+                self.inputs, self.hot_standby_settings, active_index=self.source_index,
+                srt_latency=self.sizing.srt_latency_ms(), stats_collector=self.stats_collector, logger=self.logger
+            )
+            source = self.hot_standby.bin
+            options = {}
+        elif self.playout_settings is not None:
+            self.playout = PlayoutSource(
+                self.channel_name, self.inputs, self.playout_settings, fallback_index=self.source_index,
+                srt_latency=self.sizing.srt_latency_ms(), stats_collector=self.stats_collector, logger=self.logger
+            )
+            source = self.playout.bin
+            options = {}
+        elif self.shared:
+            source = self._create_shared_source()
+            options = {}
+        elif self.file_input:
+            source = self._create_appsrc(buffer_size, True)
+            self.file_player = TSFilePlayer(
+                base_uri, udp_settings.get('playout') or {}, self._push_batch,
+                on_end=self._on_file_end, stats_collector=self.stats_collector, logger=self.logger
+            )
+            options = {}
+        elif self.hitless_settings:
+            source = self._create_appsrc(buffer_size, True)
+            self.hitless_merge = HitlessMerge(
+                self.inputs, self.hitless_settings, self._push_batch,
+                srt_latency=self.sizing.srt_latency_ms(), stats_collector=self.stats_collector, logger=self.logger
+            )
+            options = {}
+        elif ingest.get('mode', 'udpsrc') == 'batched':
+            # Our own socket reader pushes whole recvmmsg() batches into an appsrc
+            source = self._create_appsrc(buffer_size, options.pop('do-timestamp', True))
+            self.udp_receiver = BatchedUDPReceiver(
+                base_uri, self._push_batch,
+                buffer_size=buffer_size,
+                batch_size=int(ingest.get('batch-size', DEFAULT_BATCH_SIZE)),
+                sockets=int(ingest.get('sockets', 1)),
+                multicast_iface=options.pop('multicast-iface', None),
+                logger=self.logger
+            )
+        elif ingest.get('mode') == 'rtp':
+            # RTP is reordered and repaired from SMPTE 2022-1 FEC before it reaches the pipeline
+            source = self._create_appsrc(buffer_size, options.pop('do-timestamp', True))
+            self.rtp_receiver = RTPFECReceiver(
+                base_uri, ingest, self._push_batch,
+                buffer_size=buffer_size,
+                multicast_iface=options.pop('multicast-iface', None),
+                stats_collector=self.stats_collector, logger=self.logger
+            )
+        else:
+            source = Gst.ElementFactory.make("udpsrc", "source")
+            source.set_property('uri', base_uri)
+            source.set_property('buffer-size', buffer_size)
+
+        for key, value in options.items():
+            try:
+                source.set_property(key, value)
+            except (TypeError, ValueError) as e:
+                self.logger.warning(f"Could not set {key}={value} on UDP source: {str(e)}")
+        self.elements['source'] = source
+
+        if self.fast_passthrough:
+            self._create_remux_elements()
+            return
 
         # Create common pipeline elements
         self.elements.update({
@@ -425,72 +592,18 @@ class InputPipelineHandler:
 
         
         
-        # Create queues with proper buffering for sync
-        self.elements['video_queue1'] = Gst.ElementFactory.make("queue", "video_queue1")
-        self.elements['audio_queue1'] = Gst.ElementFactory.make("queue", "audio_queue1")
-
-        self.elements['video_queue2'] = Gst.ElementFactory.make("queue", "video_queue2")
-        self.elements['audio_queue2'] = Gst.ElementFactory.make("queue", "audio_queue2")
-
-        
-        
-
-
-        # increase udp buffer-size, hopefully help with a buffer
-        self.elements['source'].set_property("buffer-size", 2097152)
- 
-        if self.program_number:
-            self.elements['tsdemux'].set_property('program-number', self.program_number)
-            self.logger.info(f"Set tsdemux to use program number: {self.program_number}")
-
+        # Create queues with proper buffering for sync, one pair per stream the channel carries
+        branch_queues = []
+        if self.streams['video']:
+            branch_queues += ['video_queue1', 'video_queue2']
+        for track in range(self.streams['audio']):
+            branch_queues += [f'audio_queue1{track_suffix(track)}', f'audio_queue2{track_suffix(track)}']
+        for name in branch_queues:
+            self.elements[name] = Gst.ElementFactory.make("queue", name)
 
         # Configure queues for better sync
-        self.elements['queue1'].set_property("leaky", 1) 
-        self.elements['queue1'].set_property("max-size-buffers", 0)
-        self.elements['queue1'].set_property("max-size-time", 3000000000)
-        self.elements['queue1'].set_property("max-size-bytes", 0) 
-
-        self.elements['jitterqueue'].set_property("leaky", 1) 
-        self.elements['jitterqueue'].set_property("max-size-buffers", 0)
-        self.elements['jitterqueue'].set_property("max-size-time", 3000000000)
-        self.elements['jitterqueue'].set_property("max-size-bytes", 0) 
-
-
-        self.elements['queue2'].set_property("leaky", 1) 
-        self.elements['queue2'].set_property("max-size-buffers", 0)
-        self.elements['queue2'].set_property("max-size-time", 3000000000)
-        self.elements['queue2'].set_property("max-size-bytes", 0) 
-
-        self.elements['final_queue1'].set_property("leaky", 1) 
-        self.elements['final_queue1'].set_property("max-size-buffers", 0)
-        self.elements['final_queue1'].set_property("max-size-time", 3000000000)
-        self.elements['final_queue1'].set_property("max-size-bytes", 0) 
-
-        self.elements['final_queue2'].set_property("leaky", 1) 
-        self.elements['final_queue2'].set_property("max-size-buffers", 0)
-        self.elements['final_queue2'].set_property("max-size-time", 3000000000)
-        self.elements['final_queue2'].set_property("max-size-bytes", 0) 
-
-
-        self.elements['video_queue1'].set_property("leaky", 1) 
-        self.elements['video_queue1'].set_property("max-size-buffers", 0)
-        self.elements['video_queue1'].set_property("max-size-time", 3000000000)
-        self.elements['video_queue1'].set_property("max-size-bytes", 0) 
-
-        self.elements['audio_queue1'].set_property("leaky", 1) 
-        self.elements['audio_queue1'].set_property("max-size-buffers", 0)
-        self.elements['audio_queue1'].set_property("max-size-time", 3000000000)
-        self.elements['audio_queue1'].set_property("max-size-bytes", 0)
-
-        self.elements['video_queue2'].set_property("leaky", 1) 
-        self.elements['video_queue2'].set_property("max-size-buffers", 0)
-        self.elements['video_queue2'].set_property("max-size-time", 3000000000)
-        self.elements['video_queue2'].set_property("max-size-bytes", 0) 
-
-        self.elements['audio_queue2'].set_property("leaky", 1) 
-        self.elements['audio_queue2'].set_property("max-size-buffers", 0)
-        self.elements['audio_queue2'].set_property("max-size-time", 3000000000)
-        self.elements['audio_queue2'].set_property("max-size-bytes", 0)
+        for name in ['queue1', 'jitterqueue', 'queue2', 'final_queue1', 'final_queue2'] + branch_queues:
+            self.sizing.configure_queue(self.elements[name])
 
 
 
@@ -502,6 +615,15 @@ class InputPipelineHandler:
             
         
 
+        self._configure_shmsink()
+
+        # Add all elements to pipeline
+        for element in self.elements.values():
+            self.pipeline.add(element)
+
+#main indent
+    def _configure_shmsink(self):
+        """Point the shmsink at this channel's muxed socket"""
         # Create shared memory path
         shm_path = f"{self.socket_dir}/{self.channel_name}_muxed_shm"
         self.socket_paths = [shm_path]
@@ -514,24 +636,77 @@ class InputPipelineHandler:
             except Exception as e:
                 self.logger.warning(f"Could not remove socket {shm_path}: {e}")
 
-       
-
-        # Create appropriate parser elements based on detected codecs
-        self._create_codec_parsers()
-
-        
         # Configure shared memory sink
         self.elements['shmsink'].set_property('socket-path', shm_path)
         self.elements['shmsink'].set_property('wait-for-connection', False)
         self.elements['shmsink'].set_property('async', True)
         self.elements['shmsink'].set_property('sync', True)
-        self.elements['shmsink'].set_property('shm-size', 2000000)  # 2MB buffer
+        self.sizing.configure_shmsink(self.elements['shmsink'])
 
         self.logger.info(f"Created shared memory socket: {shm_path}")
 
-        # Add all elements to pipeline
+#main indent
+    def _create_remux_elements(self):
+        """Elements for the passthrough fast path: source ! queue ! appsink, remux, appsrc ! shmsink"""
+        # Same decimal PIDs mpegtsmux gets as sink_<pid> pad names in the transcoder
+        self.remuxer = PIDRemuxer(
+            int(self.mux_settings.get('program-number', 1000)),
+            mux_video_pid(self.mux_settings) if self.streams['video'] else None,
+            mux_audio_pids(self.mux_settings, self.streams['audio']),
+            pmt_pid=int(str(self.mux_settings.get('pmt-pid', DEFAULT_PMT_PID))),
+            logger=self.logger
+        )
+
+        self.elements.update({
+            'queue1': Gst.ElementFactory.make("queue", "queue1"),
+            'remux_sink': Gst.ElementFactory.make("appsink", "remux_sink"),
+            'remux_src': Gst.ElementFactory.make("appsrc", "remux_src"),
+            'shmsink': Gst.ElementFactory.make("shmsink", "shmsink")
+        })
+
+        self.sizing.configure_queue(self.elements['queue1'])
+
+        self.elements['remux_sink'].set_property('emit-signals', True)
+        self.elements['remux_sink'].set_property('sync', False)
+        self.elements['remux_sink'].connect('new-sample', self._on_remux_sample)
+
+        if self.selected_input.get('jitter_buffer'):
+            # PCR-timestamped by tsparse and released on time by the appsink
+            self.elements['tsparse'] = Gst.ElementFactory.make("tsparse", "tsparse")
+            self.elements['remux_sink'].set_property('sync', True)
+
+        remux_src = self.elements['remux_src']
+        remux_src.set_property('caps', Gst.Caps.from_string("video/mpegts,systemstream=true,packetsize=188"))
+        remux_src.set_property('is-live', True)
+        remux_src.set_property('format', Gst.Format.TIME)
+        remux_src.set_property('do-timestamp', True)
+        remux_src.set_property('block', False)
+
+        self._configure_shmsink()
+
         for element in self.elements.values():
             self.pipeline.add(element)
+        self.logger.info("Using PID remux fast path for passthrough channel")
+
+#main indent
+    def _on_remux_sample(self, sink):
+        """Remux one buffer from the appsink into the appsrc; runs in the queue1 streaming thread"""
+        sample = sink.emit('pull-sample')
+        if not sample:
+            return Gst.FlowReturn.EOS
+        buffer = sample.get_buffer()
+        success, map_info = buffer.map(Gst.MapFlags.READ)
+        if not success:
+            return Gst.FlowReturn.OK
+        try:
+            output = self.remuxer.process(map_info.data)
+        finally:
+            buffer.unmap(map_info)
+        if output:
+            ret = self.elements['remux_src'].emit('push-buffer', Gst.Buffer.new_wrapped(output))
+            if ret != Gst.FlowReturn.OK:
+                self.remux_push_errors += 1
+        return Gst.FlowReturn.OK
 
     def _create_codec_parsers(self):
         """
@@ -557,26 +732,44 @@ class InputPipelineHandler:
         if self.video_codec in video_parser_map:
             parser_type = video_parser_map[self.video_codec]
             self.elements['video_parser'] = Gst.ElementFactory.make(parser_type, "video_parser")
-
-            
+            if parser_type in ('h264parse', 'h265parse') and gop_cache_settings(self.channel_settings) is not None:
+                # SPS/PPS with every IDR, so a cached GOP carries its own codec headers
+                self.elements['video_parser'].set_property('config-interval', -1)
 
             self.logger.info(f"Created video parser: {parser_type} for codec {self.video_codec}")
-        else:
+        elif self.streams['video']:
             self.logger.warning(f"Unsupported video codec: {self.video_codec}")
             
-        # Create audio parser based on detected codec
-        if self.audio_codec in audio_parser_map:
-            parser_type = audio_parser_map[self.audio_codec]
-            self.elements['audio_parser'] = Gst.ElementFactory.make(parser_type, "audio_parser")
-            self.logger.info(f"Created audio parser: {parser_type} for codec {self.audio_codec}")
-        else:
-            self.logger.warning(f"Unsupported audio codec: {self.audio_codec}")
+        # Create an audio parser for each track based on its detected codec
+        for track, info in enumerate(self.audio_tracks):
+            name = f"audio_parser{track_suffix(track)}"
+            if info['codec'] in audio_parser_map:
+                parser_type = audio_parser_map[info['codec']]
+                self.elements[name] = Gst.ElementFactory.make(parser_type, name)
+                self.logger.info(f"Created audio parser: {parser_type} for codec {info['codec']} (track {track + 1})")
+            else:
+                self.logger.warning(f"Unsupported audio codec: {info['codec']} (track {track + 1})")
 
     def _link_static_elements(self):
         """
         Link the static (non-dynamic) elements in the pipeline.
         These are elements that don't require dynamic pad linking.
         """
+        if self.fast_passthrough:
+            if not self.elements['source'].link(self.elements['queue1']):
+                raise RuntimeError("Failed to link source to queue1")
+            if 'tsparse' in self.elements:
+                if not self.elements['queue1'].link(self.elements['tsparse']):
+                    raise RuntimeError("Failed to link queue1 to tsparse")
+                if not self.elements['tsparse'].link(self.elements['remux_sink']):
+                    raise RuntimeError("Failed to link tsparse to remux_sink")
+            elif not self.elements['queue1'].link(self.elements['remux_sink']):
+                raise RuntimeError("Failed to link queue1 to remux_sink")
+            if not self.elements['remux_src'].link(self.elements['shmsink']):
+                raise RuntimeError("Failed to link remux_src to shmsink")
+            self.logger.info("Successfully linked fast path elements")
+            return
+
         # Link source elements
         if not self.elements['source'].link(self.elements['queue1']):
             raise RuntimeError("Failed to link source to queue1")
@@ -642,7 +835,8 @@ class InputPipelineHandler:
                         # Link the rest of the video chain
                         self.elements['video_queue1'].link(self.elements['video_parser'])
                         self.elements['video_parser'].link(self.elements['video_queue2'])
-                        self.elements['video_queue2'].link(self.elements['mpegtsmux'])
+                        self.elements['video_queue2'].link_pads(
+                            'src', self.elements['mpegtsmux'], f"sink_{mux_video_pid(self.mux_settings)}")
                         self.logger.info("Linked complete video chain to muxer")
                     else:
                         self.logger.error(f"Failed to link video pad with PID: {pad_pid}")
@@ -652,16 +846,21 @@ class InputPipelineHandler:
                 self.logger.info(f"Ignoring video pad with non-matching PID: {pad_pid}")
 
         elif pad_name.startswith("audio"):
-            if pad_pid == self.audio_pid:
-                sink_pad = self.elements['audio_queue1'].get_static_pad("sink")
+            track = next((i for i, info in enumerate(self.audio_tracks) if info['pid'] == pad_pid), None)
+            if track is not None:
+                suffix = track_suffix(track)
+                sink_pad = self.elements[f'audio_queue1{suffix}'].get_static_pad("sink")
                 if not sink_pad.is_linked():
                     if pad.link(sink_pad) == Gst.PadLinkReturn.OK:
-                        self.logger.info(f"Successfully linked audio pad with PID: {pad_pid}")
+                        self.logger.info(f"Successfully linked audio pad with PID: {pad_pid} (track {track + 1})")
                         # Link the rest of the audio chain
-                        self.elements['audio_queue1'].link(self.elements['audio_parser'])
-                        self.elements['audio_parser'].link(self.elements['audio_queue2'])
-                        self.elements['audio_queue2'].link(self.elements['mpegtsmux'])
-                        self.logger.info("Linked complete audio chain to muxer")
+                        self.elements[f'audio_queue1{suffix}'].link(self.elements[f'audio_parser{suffix}'])
+                        self.elements[f'audio_parser{suffix}'].link(self.elements[f'audio_queue2{suffix}'])
+                        # On the track's own PID, which is how the transcoder tells the tracks apart
+                        self.elements[f'audio_queue2{suffix}'].link_pads(
+                            'src', self.elements['mpegtsmux'],
+                            f"sink_{mux_audio_pids(self.mux_settings, self.streams['audio'])[track]}")
+                        self.logger.info(f"Linked complete audio chain for track {track + 1} to muxer")
                     else:
                         self.logger.error(f"Failed to link audio pad with PID: {pad_pid}")
                 else:
@@ -684,6 +883,8 @@ class InputPipelineHandler:
             'buffer_level_time': 0,
             'input_caps': ''
         }
+        self.push_errors = 0
+        self.remux_push_errors = 0
 
         # Add probe to UDP source
         src_pad = self.elements['source'].get_static_pad('src')
@@ -691,6 +892,52 @@ class InputPipelineHandler:
             src_pad.add_probe(Gst.PadProbeType.BUFFER, self._src_probe_cb)
             self.logger.info("Added probe to UDP source")
 
+        # TR 101 290 checks on the received transport stream
+        self.ts_analyzer = create_analyzer(self.selected_input, self.stats_collector, self.logger)
+        if self.ts_analyzer and src_pad:
+            src_pad.add_probe(Gst.PadProbeType.BUFFER | Gst.PadProbeType.BUFFER_LIST,
+                              self.ts_analyzer.probe_buffer)
+            self.ts_analysis_timer = GLib.timeout_add(1000, self.ts_analyzer.publish)
+            self.logger.info("Added TS analyser to UDP source")
+
+        # Raw input for post-mortem captures; one ring for the life of the process
+        if self.flight_recorder is None:
+            self.flight_recorder = create_flight_recorder(self.selected_input, self.channel_name,
+                                                          self.stats_collector, self.logger)
+            if self.flight_recorder:
+                self.flight_recorder_timer = GLib.timeout_add(1000, self.flight_recorder.poll)
+        if self.flight_recorder and src_pad:
+            src_pad.add_probe(Gst.PadProbeType.BUFFER | Gst.PadProbeType.BUFFER_LIST,
+                             self.flight_recorder.probe_buffer)
+
+        # PCR smoothing in tsparse sized from the jitter measured on the source
+        self.jitter_buffer = create_jitter_buffer(
+            self.selected_input, self.elements.get('tsparse'), self.pipeline,
+            queue=self.elements.get('queue2'), stats_collector=self.stats_collector,
+            defaults=self.sizing.jitter_buffer_defaults(), logger=self.logger
+        )
+        if self.jitter_buffer and src_pad:
+            src_pad.add_probe(Gst.PadProbeType.BUFFER | Gst.PadProbeType.BUFFER_LIST,
+                              self.jitter_buffer.probe_buffer)
+            self.jitter_buffer_timer = GLib.timeout_add(1000, self.jitter_buffer.update)
+            self.logger.info("Added jitter buffer probe to UDP source")
+
+        # Receive latency, and the stamps the next process matches the shm handoff against
+        self.latency_probe = LatencyProbe(self.channel_name, 'input', stats_collector=self.stats_collector,
+                                          budgets=self.sizing.hop_budgets(), logger=self.logger)
+        if src_pad:
+            self.latency_probe.add_ingress(src_pad)
+        self.latency_probe.add_egress('receive', self.elements['shmsink'].get_static_pad('sink'))
+        self.latency_timer = GLib.timeout_add(1000, self.latency_probe.update)
+
+        # Latest GOP for the transcoder and outputs to start from when they connect
+        gop_settings = gop_cache_settings(self.channel_settings)
+        if gop_settings is not None:
+            self.gop_cache = GOPCache(self.channel_name, gop_settings, self.stats_collector, self.logger)
+            self.elements['shmsink'].get_static_pad('sink').add_probe(
+                Gst.PadProbeType.BUFFER | Gst.PadProbeType.BUFFER_LIST, self.gop_cache.probe_buffer)
+            self.gop_cache_timer = GLib.timeout_add(1000, self.gop_cache.publish)
+
         # Start stats collection timer
         self.stats_timer = GLib.timeout_add(5000, self.collect_stats)
         self.logger.info("Started stats collection timer")
@@ -712,6 +959,59 @@ class InputPipelineHandler:
 
         return Gst.PadProbeReturn.OK
 
+#main indent
+    def _create_shared_source(self):
+        """Read this input from the shared ingest service instead of the network"""
+        path = register_consumer(self.channel_name, self.source_index, self.selected_input,
+                                 latency=self.sizing.srt_latency_ms())
+        self.logger.info(f"Registered with shared ingest, waiting for {path}")
+        deadline = time.time() + SHARED_SOCKET_TIMEOUT
+        while not os.path.exists(path):
+            if time.time() > deadline:
+                unregister_consumer(self.channel_name, self.source_index)
+                raise RuntimeError(f"Shared ingest did not create {path} within {SHARED_SOCKET_TIMEOUT}s")
+            time.sleep(0.5)
+
+        source = Gst.ElementFactory.make("shmsrc", "source")
+        source.set_property('socket-path', path)
+        source.set_property('is-live', True)
+        source.set_property('do-timestamp', True)
+        return source
+
+#main indent
+    def _refresh_shared(self):
+        """Keep the shared ingest registration alive"""
+        try:
+            register_consumer(self.channel_name, self.source_index, self.selected_input,
+                               latency=self.sizing.srt_latency_ms())
+        except OSError as e:
+            self.logger.error(f"Could not refresh shared ingest registration: {str(e)}")
+        return True
+
+#main indent
+    def _create_appsrc(self, buffer_size, do_timestamp):
+        """Source for TS read from sockets by our own code"""
+        source = Gst.ElementFactory.make("appsrc", "source")
+        source.set_property('caps', Gst.Caps.from_string("video/mpegts,systemstream=true,packetsize=188"))
+        source.set_property('is-live', True)
+        source.set_property('format', Gst.Format.TIME)
+        source.set_property('do-timestamp', do_timestamp)
+        source.set_property('block', False)
+        source.set_property('max-bytes', buffer_size)
+        return source
+
+#main indent
+    def _on_file_end(self):
+        """A file played without looping has ended; runs in the player thread"""
+        self.elements['source'].emit('end-of-stream')
+
+#main indent
+    def _push_batch(self, data, datagrams):
+        """Hand one batch of datagrams to the appsrc; runs in the receiver thread"""
+        ret = self.elements['source'].emit('push-buffer', Gst.Buffer.new_wrapped(data))
+        if ret != Gst.FlowReturn.OK:
+            self.push_errors += 1
+
 #main indent
     def collect_stats(self):
         """Periodic stats collection and publishing"""
@@ -731,6 +1031,29 @@ class InputPipelineHandler:
                     self.stats['buffer_level_bytes'] = queue.get_property('current-level-bytes')
                     self.stats['buffer_level_time'] = queue.get_property('current-level-time')
 
+                if self.udp_receiver:
+                    receiver_stats = self.udp_receiver.get_stats()
+                    self.stats.update({
+                        'datagrams_received': receiver_stats['datagrams'],
+                        'avg_batch_datagrams': receiver_stats['avg_batch'],
+                        'max_batch_datagrams': receiver_stats['max_batch'],
+                        'receive_errors': receiver_stats['errors'],
+                        'socket_drops': receiver_stats['socket_drops'],
+                        'push_errors': self.push_errors
+                    })
+                    self.push_errors = 0
+
+                if self.remuxer:
+                    remux_stats = self.remuxer.get_stats()
+                    self.stats.update({
+                        'remux_packets_in': remux_stats['packets_in'],
+                        'remux_packets_out': remux_stats['packets_out'],
+                        'remux_resyncs': remux_stats['resyncs'],
+                        'remux_pmt_updates': remux_stats['pmt_updates'],
+                        'remux_push_errors': self.remux_push_errors
+                    })
+                    self.remux_push_errors = 0
+
                 # Log stats
                 self.logger.debug(f"UDP Input Stats: {json.dumps(self.stats, indent=2)}")
 
@@ -784,9 +1107,13 @@ class InputPipelineHandler:
                     'element_name': message.src.get_name()
                 }
             })
+            if self.flight_recorder:
+                self.flight_recorder.dump('pipeline_error', f"{message.src.get_name()}: {err.message}")
         elif t == Gst.MessageType.WARNING:
             warn, debug = message.parse_warning()
             self.logger.warning(f"Pipeline warning: {warn.message}")
+            if self.flight_recorder:
+                self.flight_recorder.mark('warning', f"{message.src.get_name()}: {warn.message}")
             self.logger.debug(f"Warning debug info: {debug}")
         elif t == Gst.MessageType.STATE_CHANGED:
             if message.src == self.pipeline:
@@ -795,6 +1122,8 @@ class InputPipelineHandler:
                                f"to {new_state.value_nick}")
         elif t == Gst.MessageType.EOS:
             self.logger.warning("End of stream reached")
+            if self.file_player and self.loop:
+                self.loop.quit()
 
 
     def run(self):
@@ -818,12 +1147,43 @@ class InputPipelineHandler:
         # Generate DOT file after pipeline is playing
         # self.generate_dot_file("pipeline_playing")
 
+        if self.udp_receiver:
+            self.udp_receiver.start()
+
+        if self.rtp_receiver:
+            self.rtp_receiver.start()
+            self.rtp_stats_timer = GLib.timeout_add(1000, self.rtp_receiver.publish)
+
+        if self.file_player:
+            self.file_player.start()
+            self.file_stats_timer = GLib.timeout_add(1000, self.file_player.publish)
+
+        if self.hot_standby:
+            self.hot_standby.start()
+
+        if self.playout:
+            self.playout.start()
+
+        if self.shared:
+            self.shared_timer = GLib.timeout_add_seconds(5, self._refresh_shared)
+
+        if self.hitless_merge:
+            self.hitless_merge.start()
+            self.hitless_stats_timer = GLib.timeout_add(1000, self.hitless_merge.publish)
+
         
 
+        # Measure main loop lag so blocking callbacks show up in stats
+        self.lag_probe = GLibLagProbe(
+            f"{self.channel_name}_udp_input", self.logger,
+            stats_collector=self.stats_collector, stat_type="loop_lag_input"
+        )
+        self.lag_probe.start()
+        
         # Run the main loop
-        loop = GLib.MainLoop()
+        self.loop = GLib.MainLoop()
         try:
-            loop.run()
+            self.loop.run()
         except KeyboardInterrupt:
             self.logger.info("Keyboard interrupt received, stopping CariCoder")
             pass
@@ -831,6 +1191,8 @@ class InputPipelineHandler:
             self.cleanup()
 
         self.logger.info("CariCoder run method completed")
+        if self.exit_code:
+            sys.exit(self.exit_code)
 
     def cleanup(self):
         """
@@ -838,6 +1200,45 @@ class InputPipelineHandler:
         """
         self.logger.info("Starting cleanup process")
         
+        if self.lag_probe:
+            self.lag_probe.stop()
+
+        if self.psi_discovery:
+            self.psi_discovery.stop()
+
+        if self.udp_receiver:
+            self.udp_receiver.stop()
+
+        if self.rtp_receiver:
+            self.rtp_receiver.stop()
+            if self.rtp_stats_timer:
+                GLib.source_remove(self.rtp_stats_timer)
+                self.rtp_stats_timer = None
+
+        if self.file_player:
+            self.file_player.stop()
+            if self.file_stats_timer:
+                GLib.source_remove(self.file_stats_timer)
+                self.file_stats_timer = None
+
+        if self.hot_standby:
+            self.hot_standby.stop()
+
+        if self.playout:
+            self.playout.stop()
+
+        if self.shared:
+            if self.shared_timer:
+                GLib.source_remove(self.shared_timer)
+                self.shared_timer = None
+            unregister_consumer(self.channel_name, self.source_index)
+
+        if self.hitless_merge:
+            self.hitless_merge.stop()
+            if self.hitless_stats_timer:
+                GLib.source_remove(self.hitless_stats_timer)
+                self.hitless_stats_timer = None
+        
         # Generate final DOT file before cleanup
         self.generate_dot_file("pipeline_final")
         
@@ -845,6 +1246,32 @@ class InputPipelineHandler:
             GLib.source_remove(self.stats_timer)
             self.logger.debug("Removed stats collection timer")
 
+        if self.ts_analysis_timer:
+            GLib.source_remove(self.ts_analysis_timer)
+            self.ts_analysis_timer = None
+
+        if self.jitter_buffer_timer:
+            GLib.source_remove(self.jitter_buffer_timer)
+            self.jitter_buffer_timer = None
+
+        if self.latency_timer:
+            GLib.source_remove(self.latency_timer)
+            self.latency_timer = None
+        if self.latency_probe:
+            self.latency_probe.close()
+
+        if self.gop_cache_timer:
+            GLib.source_remove(self.gop_cache_timer)
+            self.gop_cache_timer = None
+        if self.gop_cache:
+            self.gop_cache.close()
+
+        if self.flight_recorder_timer:
+            GLib.source_remove(self.flight_recorder_timer)
+            self.flight_recorder_timer = None
+        if self.flight_recorder:
+            self.flight_recorder.close()
+
         # Stop pipeline
         if self.pipeline:
             self.logger.info("Stopping pipeline")
@@ -852,9 +1279,7 @@ class InputPipelineHandler:
             self.logger.info("Pipeline stopped")
 
         # Remove socket files and info files
-        paths_to_remove = self.socket_paths + [
-            f"{self.socket_dir}/{self.channel_name}_video_shm_info",
-            f"{self.socket_dir}/{self.channel_name}_audio_shm_info",
+        paths_to_remove = self.socket_paths + all_info_paths(self.channel_name, self.socket_dir) + [
             f"{self.socket_dir}/{self.channel_name}_muxed_shm_info"
         ]
         
@@ -16,6 +16,11 @@ import argparse
 from datetime import datetime
 from pathlib import Path
 from stats_collector import StatsCollector
+from loop_lag import GLibLagProbe
+from latency_probe import LatencyProbe
+from latency_profile import LatencySizing
+from gop_cache import GOPReplay, gop_cache_settings
+from stream_set import is_passthrough
 
 def setup_logging(channel_name, output_index, log_dir='logs', log_level='INFO'):
     """Configure logging with both console and file outputs"""
@@ -57,18 +62,8 @@ def setup_logging(channel_name, output_index, log_dir='logs', log_level='INFO'):
     return logging.getLogger(__name__)
 
 def check_full_passthrough(config, channel_name):
-    """Check if both audio and video are set to passthrough"""
-    transcoding = config.get_channel_settings(channel_name).get('transcoding', {})
-    
-    video_streams = transcoding.get('video', {}).get('streams', [])
-    if not video_streams:
-        video_passthrough = transcoding.get('video', {}).get('codec') == 'passthrough'
-    else:
-        video_passthrough = all(stream.get('codec') == 'passthrough' for stream in video_streams)
-    
-    audio_passthrough = transcoding.get('audio', {}).get('codec') == 'passthrough'
-    
-    return video_passthrough and audio_passthrough
+    """Check if every stream the channel carries is set to passthrough"""
+    return is_passthrough(config.get_channel_settings(channel_name))
 
 class UDPOutputWatchdog:
     """Watchdog system for UDP output pipeline monitoring"""
@@ -271,6 +266,7 @@ class UDPOutputHandler:
         """Initialize the UDP output handler"""
         self.logger = logging.getLogger(__name__)
         self.channel_name = channel_name
+        self.lag_probe = None
         self.output_index = output_index
         
         # Set up DOT file directory
@@ -299,6 +295,9 @@ class UDPOutputHandler:
         self.selected_output = self.outputs[output_index]
         if self.selected_output.get('type') != 'udpsink':
             raise ValueError(f"Output {output_index} is not UDP type")
+
+        # Queue sizing from the channel's latency_profile
+        self.sizing = LatencySizing(self.channel_settings, 'udp_output', self.logger)
         
         # Initialize GStreamer
         Gst.init(None)
@@ -307,6 +306,8 @@ class UDPOutputHandler:
         self.pipeline = None
         self.elements = {}
         self.watchdog = None
+        self.latency_probe = None
+        self.latency_timer = None
         
         # Initialize Redis for stats
         try:
@@ -411,18 +412,18 @@ class UDPOutputHandler:
             self.elements['shmsrc'].set_property('socket-path', input_path)
             self.elements['shmsrc'].set_property('is-live', True)
             self.elements['shmsrc'].set_property('do-timestamp', True)
-            
+
+            # Start from the input handler's cached GOP instead of mid-GOP
+            if self.is_passthrough and gop_cache_settings(self.channel_settings) is not None:
+                GOPReplay(self.channel_name, self.logger).attach(self.elements['shmsrc'].get_static_pad('src'))
             
             # Create queue
             self.elements['queue1'] = Gst.ElementFactory.make("queue", "queue1")
             if not self.elements['queue1']:
                 raise RuntimeError("Failed to create queue element")
             
-            # Configure queue with larger buffer
-            self.elements['queue1'].set_property("leaky", 1)
-            self.elements['queue1'].set_property("max-size-buffers", 0)
-            self.elements['queue1'].set_property("max-size-time", 3000000000)
-            self.elements['queue1'].set_property("max-size-bytes", 0)
+            # Configure queue for the latency profile
+            self.sizing.configure_queue(self.elements['queue1'])
             
             # Create UDP sink
             self.elements['udpsink'] = Gst.ElementFactory.make("udpsink", "udpsink")
@@ -449,6 +450,8 @@ class UDPOutputHandler:
                 
             if not self.elements['queue1'].link(self.elements['udpsink']):
                 raise RuntimeError("Failed to link queue1 to udpsink")
+
+            self._setup_latency_probe()
             
             self.logger.info("Pipeline created successfully")
             
@@ -456,6 +459,27 @@ class UDPOutputHandler:
             self.logger.error(f"Error creating pipeline: {str(e)}")
             raise
 
+    def _stop_latency_probe(self):
+        """Remove the timer and ring file of the previous pipeline's latency probe"""
+        if self.latency_timer:
+            GLib.source_remove(self.latency_timer)
+            self.latency_timer = None
+        if self.latency_probe:
+            self.latency_probe.close()
+            self.latency_probe = None
+
+    def _setup_latency_probe(self):
+        """Handoff from the upstream process, send latency and the channel's total"""
+        self._stop_latency_probe()
+        self.latency_probe = LatencyProbe(
+            self.channel_name, f"udp_output_{self.output_index}",
+            upstream='input' if self.is_passthrough else 'transcoder',
+            stats_collector=self.stats_collector, budgets=self.sizing.hop_budgets(), logger=self.logger
+        )
+        self.latency_probe.add_ingress(self.elements['shmsrc'].get_static_pad('src'))
+        self.latency_probe.add_egress('send', self.elements['udpsink'].get_static_pad('sink'), ts=False)
+        self.latency_timer = GLib.timeout_add(1000, self.latency_probe.update)
+
     def collect_stats(self):
         """Collect and store UDP output statistics"""
         if self.elements.get('udpsink'):
@@ -590,6 +614,13 @@ class UDPOutputHandler:
             # Start statistics collection
             self.stats_timer = GLib.timeout_add(5000, self.collect_stats)
             
+            # Measure main loop lag so blocking callbacks show up in stats
+            self.lag_probe = GLibLagProbe(
+                f"{self.channel_name}_udp_output_{self.output_index}", self.logger,
+                stats_collector=self.stats_collector, stat_type=f"loop_lag_output_{self.output_index}"
+            )
+            self.lag_probe.start()
+            
             # Run the main loop
             loop = GLib.MainLoop()
             try:
@@ -608,6 +639,11 @@ class UDPOutputHandler:
         """Cleanup resources"""
         self.logger.info("Starting cleanup")
         
+        if self.lag_probe:
+            self.lag_probe.stop()
+
+        self._stop_latency_probe()
+        
         try:
             if self.watchdog:
                 self.watchdog.cleanup()
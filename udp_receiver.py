@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+import ctypes
+import ctypes.util
+import errno
+import ipaddress
+import logging
+import os
+import select
+import socket
+import struct
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+RMEM_MAX_PATH = "/proc/sys/net/core/rmem_max"
+SO_RCVBUFFORCE = getattr(socket, 'SO_RCVBUFFORCE', 33)
+MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0x40)
+
+DEFAULT_BUFFER_SIZE = 2097152
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_MAX_PACKET_SIZE = 2048
+
+
+def read_rmem_max() -> Optional[int]:
+    """net.core.rmem_max, or None where it cannot be read"""
+    try:
+        with open(RMEM_MAX_PATH, 'r') as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def check_receive_buffer(requested: int, logger: logging.Logger) -> bool:
+    """Warn when the kernel will cap a requested receive buffer; True if it fits"""
+    rmem_max = read_rmem_max()
+    if rmem_max is None or requested <= rmem_max:
+        return True
+    logger.warning(
+        f"Requested UDP receive buffer {requested} bytes exceeds net.core.rmem_max ({rmem_max}); "
+        f"the kernel will cap it unless raised with: sysctl -w net.core.rmem_max={requested}"
+    )
+    return False
+
+
+def socket_drops(sock_fd: int) -> Optional[int]:
+    """Kernel drop counter for a UDP socket from /proc/net/udp{,6}"""
+    inode = str(os.fstat(sock_fd).st_ino)
+    for path in ("/proc/net/udp", "/proc/net/udp6"):
+        try:
+            with open(path, 'r') as f:
+                next(f)
+                for line in f:
+                    fields = line.split()
+                    if len(fields) > 12 and fields[9] == inode:
+                        return int(fields[12])
+        except OSError:
+            continue
+    return None
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(_IOVec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int)
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _MsgHdr), ('msg_len', ctypes.c_uint)]
+
+
+def _load_recvmmsg():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        recvmmsg = libc.recvmmsg
+    except (OSError, AttributeError, TypeError):
+        return None
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    recvmmsg.restype = ctypes.c_int
+    return recvmmsg
+
+
+_recvmmsg = _load_recvmmsg()
+
+
+class _BatchReader:
+    """recvmmsg() into one preallocated block; falls back to a recv_into loop"""
+
+    def __init__(self, sock: socket.socket, batch_size: int, max_packet_size: int):
+        self.sock = sock
+        self.batch_size = batch_size
+        self.max_packet_size = max_packet_size
+        self.block = ctypes.create_string_buffer(batch_size * max_packet_size)
+        self.view = memoryview(self.block).cast('B')
+
+        self.msgs = (_MMsgHdr * batch_size)()
+        self.iovecs = (_IOVec * batch_size)()
+        base = ctypes.addressof(self.block)
+        for i in range(batch_size):
+            self.iovecs[i].iov_base = base + i * max_packet_size
+            self.iovecs[i].iov_len = max_packet_size
+            self.msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.iovecs[i])
+            self.msgs[i].msg_hdr.msg_iovlen = 1
+
+    def read(self) -> List[memoryview]:
+        """Datagrams waiting on the socket, up to batch_size, without blocking"""
+        if _recvmmsg is not None:
+            count = _recvmmsg(self.sock.fileno(), self.msgs, self.batch_size, MSG_DONTWAIT, None)
+            if count < 0:
+                err = ctypes.get_errno()
+                if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    return []
+                raise OSError(err, os.strerror(err))
+            size = self.max_packet_size
+            return [self.view[i * size:i * size + self.msgs[i].msg_len] for i in range(count)]
+
+        datagrams = []
+        for i in range(self.batch_size):
+            slot = self.view[i * self.max_packet_size:(i + 1) * self.max_packet_size]
+            try:
+                length = self.sock.recv_into(slot, 0, MSG_DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                break
+            datagrams.append(slot[:length])
+        return datagrams
+
+
+class BatchedUDPReceiver:
+    """
+    Receives a UDP stream with batched reads and hands each batch to on_batch(data, datagrams)
+    as one contiguous bytes object, or as a list of datagrams with join=False. Several
+    SO_REUSEPORT sockets can share the port for unicast feeds that arrive as more than one
+    flow; batches from all of them go through one lock so the output stays in per-socket order.
+    """
+
+    def __init__(self, uri: str, on_batch: Callable[[bytes, int], None],
+                 buffer_size: int = DEFAULT_BUFFER_SIZE, batch_size: int = DEFAULT_BATCH_SIZE,
+                 max_packet_size: int = DEFAULT_MAX_PACKET_SIZE, sockets: int = 1,
+                 multicast_iface: Optional[str] = None, join: bool = True,
+                 logger: Optional[logging.Logger] = None):
+        self.logger = logger or logging.getLogger(__name__)
+        parsed = urlparse(uri)
+        self.address = parsed.hostname or '0.0.0.0'
+        self.port = parsed.port
+        if self.port is None:
+            raise ValueError(f"No port in UDP URI: {uri}")
+        self.multicast = ipaddress.ip_address(self.address).is_multicast
+        if self.multicast and sockets > 1:
+            # Every SO_REUSEPORT socket joined to a group gets its own copy of each datagram
+            self.logger.warning("Multiple receive sockets are not used for multicast, using one")
+            sockets = 1
+
+        self.on_batch = on_batch
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.max_packet_size = max_packet_size
+        self.multicast_iface = multicast_iface
+        self.socket_count = max(1, sockets)
+        self.join = join
+
+        self.sockets: List[socket.socket] = []
+        self._threads: List[threading.Thread] = []
+        self._stop_event = threading.Event()
+        self._output_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.stats = {'datagrams': 0, 'bytes': 0, 'batches': 0, 'max_batch': 0, 'errors': 0}
+
+    def _open_socket(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+        check_receive_buffer(self.buffer_size, self.logger)
+        try:
+            # Needs CAP_NET_ADMIN but is not capped by rmem_max
+            sock.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE, self.buffer_size)
+        except OSError:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.buffer_size)
+        actual = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        # Linux reports double the usable size to account for bookkeeping
+        if actual // 2 < self.buffer_size:
+            self.logger.warning(f"UDP receive buffer is {actual // 2} bytes, requested {self.buffer_size}")
+        else:
+            self.logger.info(f"UDP receive buffer set to {actual // 2} bytes")
+
+        sock.bind((self.address, self.port))
+        if self.multicast:
+            ifindex = socket.if_nametoindex(self.multicast_iface) if self.multicast_iface else 0
+            mreq = struct.pack("4s4si", socket.inet_aton(self.address), socket.inet_aton('0.0.0.0'), ifindex)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        sock.setblocking(False)
+        return sock
+
+    def start(self):
+        """Open the sockets and start one reader thread per socket"""
+        self._stop_event.clear()
+        for index in range(self.socket_count):
+            sock = self._open_socket()
+            self.sockets.append(sock)
+            thread = threading.Thread(target=self._run, args=(sock,), name=f"UDPReceiver-{index}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+        mode = "recvmmsg" if _recvmmsg is not None else "recv loop"
+        self.logger.info(
+            f"Batched UDP receiver on {self.address}:{self.port} with {self.socket_count} socket(s), "
+            f"{mode}, up to {self.batch_size} datagrams per read"
+        )
+
+    def stop(self):
+        """Stop the reader threads and close the sockets"""
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join(timeout=1)
+        for sock in self.sockets:
+            sock.close()
+        self._threads = []
+        self.sockets = []
+
+    def _run(self, sock: socket.socket):
+        reader = _BatchReader(sock, self.batch_size, self.max_packet_size)
+        poller = select.poll()
+        poller.register(sock.fileno(), select.POLLIN)
+        while not self._stop_event.is_set():
+            # Short poll so stop() is noticed; reads themselves never block
+            if not poller.poll(100):
+                continue
+            try:
+                datagrams = reader.read()
+            except OSError as e:
+                with self._stats_lock:
+                    self.stats['errors'] += 1
+                self.logger.error(f"UDP receive error: {str(e)}")
+                time.sleep(0.01)
+                continue
+            if not datagrams:
+                continue
+
+            # The read block is reused, so datagrams are copied out either way
+            data = b''.join(datagrams) if self.join else [bytes(d) for d in datagrams]
+            with self._stats_lock:
+                self.stats['datagrams'] += len(datagrams)
+                self.stats['bytes'] += sum(len(d) for d in datagrams)
+                self.stats['batches'] += 1
+                self.stats['max_batch'] = max(self.stats['max_batch'], len(datagrams))
+            with self._output_lock:
+                self.on_batch(data, len(datagrams))
+
+    def get_stats(self) -> Dict:
+        """Counters since the last call plus the kernel drop count"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+            self.stats.update({'datagrams': 0, 'bytes': 0, 'batches': 0, 'max_batch': 0, 'errors': 0})
+        stats['avg_batch'] = stats['datagrams'] / stats['batches'] if stats['batches'] else 0
+        drops = [socket_drops(sock.fileno()) for sock in self.sockets]
+        stats['socket_drops'] = sum(d for d in drops if d is not None)
+        return stats
@@ -105,37 +105,6 @@ async function fetchOutputStats(serverAddress, channelName, outputIndex) {
 }
 
 
-// Update the fetchEncoderStats function
-async function fetchEncoderStats(serverAddress, channelName) {
-    try {
-        const response = await fetch(`http://${serverAddress}:5000/stats/live/${channelName}/video_encoder_output`);
-        if (!response.ok) return null;
-        const data = await response.json();
-        if (!data || data.length === 0) return null;
-        return {
-            ...data[data.length - 1].stats,
-            timestamp: data[data.length - 1].timestamp
-        };
-    } catch (error) {
-        log(`Error fetching encoder stats: ${error.message}`);
-        return null;
-    }
-}
-
-
-// New function to fetch input format info
-async function fetchInputStats(serverAddress, channelName) {
-    try {
-        const response = await fetch(`http://${serverAddress}:5000/stats/live/${channelName}/video_encoder_input`);
-        if (!response.ok) return null;
-        const data = await response.json();
-        return data.length > 0 ? data[data.length - 1].stats : null;
-    } catch (error) {
-        log(`Error fetching input stats: ${error.message}`);
-        return null;
-    }
-}
-
 function hasConfigChanged(oldConfig, newConfig) {
     const compareSection = (oldSection, newSection, fields) => {
         if (!oldSection || !newSection) return true;
@@ -181,86 +150,25 @@ async function getServerIP() {
     }
 }
 
-async function fetchChannelList(serverAddress) {
-    try {
-        const response = await fetch(`http://${serverAddress}:8001/list`);
-        if (!response.ok) throw new Error('Failed to fetch channel list');
-        const data = await response.json();
-        log('Channel list response:', data);
-        return data.channels || {};
-    } catch (error) {
-        log(`Error fetching channel list: ${error.message}`);
-        return {};
-    }
-}
-
-async function fetchChannelStatus(serverAddress) {
-    try {
-        const response = await fetch(`http://${serverAddress}:8001/status`);
-        if (!response.ok) throw new Error('Failed to fetch channel status');
-        const data = await response.json();
-        console.log('Status response:', JSON.stringify(data, null, 2));  // <-- Modified log
-        return data.channels || {};
-    } catch (error) {
-        log(`Error fetching channel status: ${error.message}`);
-        return {};
-    }
-}
-
-async function fetchChannelConfig(serverAddress) {
-    if (!serverAddress) {
-        log('No server address provided');
-        return { channels: [] };
-    }
-
-    log(`Fetching channel config from server: ${serverAddress}`);
-    try {
-        const response = await fetch(`http://${serverAddress}:5000/api/channels`);
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        const data = await response.json();
-        return data || { channels: [] };
-    } catch (error) {
-        log(`Error fetching channel config: ${error.message}`);
-        return { channels: [] };
-    }
-}
-
-// Update fetchChannelStats to handle HLS input
-async function fetchChannelStats(serverAddress, channelName, channelConfig) {
-    try {
-        const inputType = getInputType(channelConfig);
-        if (!inputType) return null;
-
-        const response = await fetch(`http://${serverAddress}:5000/stats/live/${channelName}/${inputType}`);
-        if (!response.ok) throw new Error('Failed to fetch channel stats');
-        const data = await response.json();
-        
-        if (data && data.length > 0) {
-            const latestStats = data[data.length - 1];
-            
-            switch(inputType) {
-                case 'srt_input':
-                    return {
-                        bitrate: latestStats.stats['receive-rate-mbps'],
-                        bandwidth: latestStats.stats['bandwidth-mbps'],
-                        timestamp: latestStats.timestamp
-                    };
-                case 'udp_input':
-                case 'hls_input':
-                    return {
-                        bitrate: latestStats.stats.bitrate_mbps,
-                        buffer: latestStats.stats.buffer_level_bytes,
-                        timestamp: latestStats.timestamp
-                    };
-            }
-        }
-        return null;
-    } catch (error) {
-        log(`Error fetching channel stats: ${error.message}`);
-        return null;
+function parseInputStats(inputType, latestStats) {
+    if (!latestStats) return null;
+
+    switch(inputType) {
+        case 'srt_input':
+            return {
+                bitrate: latestStats.stats['receive-rate-mbps'],
+                bandwidth: latestStats.stats['bandwidth-mbps'],
+                timestamp: latestStats.timestamp
+            };
+        case 'udp_input':
+        case 'hls_input':
+            return {
+                bitrate: latestStats.stats.bitrate_mbps,
+                buffer: latestStats.stats.buffer_level_bytes,
+                timestamp: latestStats.timestamp
+            };
     }
+    return null;
 }
 
 // For debugging purposes, let's add a function to log detailed stats
@@ -279,62 +187,50 @@ function logDetailedStats(stats, inputType) {
     log(`Channel Stats [${inputType}]:`, JSON.stringify(details, null, 2));
 }
 
-// Modify getChannelData to properly capture process information
+// Config, run state, processes and input stats for one server, taken from the fleet view
 async function getChannelData(serverAddress) {
-    try {
-        const configResponse = await fetchChannelConfig(serverAddress);
-        const channelStatus = await fetchChannelStatus(serverAddress);
-        const channelList = await fetchChannelList(serverAddress);
-        const channelStats = {};
-
-      const runningChannels = Object.entries(channelList)
-    .filter(([name, info]) => info.running)
-    .map(([name, info]) => {
-        const status = channelStatus[name];
-        return {
-            name: name,
-            channel: name,
-            running: true,
-            processes: status?.processes || {} 
-        };
-    });
-console.log('Running channels:', runningChannels);  // Add this log
+    const empty = {
+        config: { channels: [] },
+        runningChannels: [],
+        channelStats: {}
+    };
 
-        
+    // One request to the local stats API, which fans out to every server in servers.json
+    const { fetchFleetView } = await import('./modules/api.js');
+    const fleet = await fetchFleetView(true);
+    if (!fleet) return empty;
 
-        for (const channel of runningChannels) {
-            const channelConfig = configResponse.channels.find(c => c.name === channel.channel || c.name === channel.name);
-            
-            if (channelConfig) {
-                // Get input stats
-                const stats = await fetchChannelStats(serverAddress, channel.channel || channel.name, channelConfig);
-                if (stats) {
-                    channelStats[channel.channel || channel.name] = stats;
-                }
-                
-                // Get encoder stats if transcoding
-                if (!channelConfig.transcoding?.video?.codec !== 'passthrough') {
-                    const encoderStats = await fetchEncoderStats(serverAddress, channel.channel || channel.name);
-                    if (encoderStats) {
-                        channelStats[channel.channel || channel.name].encoderStats = encoderStats;
-                    }
-                }
-            }
+    const serverName = Object.keys(fleet.servers || {}).find(name =>
+        name === serverAddress || fleet.servers[name].host === serverAddress
+    );
+    if (!serverName || !fleet.servers[serverName].reachable) {
+        log(`Server ${serverAddress} is not reachable from the fleet view`);
+        return empty;
+    }
+
+    const channels = fleet.channels.filter(channel => channel.server === serverName);
+    const runningChannels = channels
+        .filter(channel => channel.running)
+        .map(channel => ({
+            name: channel.name,
+            channel: channel.name,
+            running: true,
+            processes: channel.processes || {}
+        }));
+
+    const channelStats = {};
+    channels.forEach(channel => {
+        const stats = parseInputStats(getInputType(channel.config), channel.input_stats);
+        if (stats) {
+            channelStats[channel.name] = stats;
         }
+    });
 
-        return {
-            config: configResponse,
-            runningChannels,
-            channelStats
-        };
-    } catch (error) {
-        log(`Error getting channel data: ${error.message}`);
-        return {
-            config: { channels: [] },
-            runningChannels: [],
-            channelStats: {}
-        };
-    }
+    return {
+        config: { channels: channels.map(channel => channel.config) },
+        runningChannels,
+        channelStats
+    };
 }
 
 // Fix timestamp check in output bitrate polling
@@ -36,4 +36,16 @@ export async function fetchServerList() {
         console.error('Error fetching server list:', error);
         return [];
     }
-}
\ No newline at end of file
+}
+export async function fetchFleetView(includeStats = false) {
+    // One request to the local stats API, which fans out to every server in servers.json
+    try {
+        const query = includeStats ? '?stats=1' : '';
+        const response = await fetch(`http://${window.location.hostname}:5000/federation/fleet${query}`);
+        if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+        return await response.json();
+    } catch (error) {
+        console.error('Error fetching fleet view:', error);
+        return null;
+    }
+}
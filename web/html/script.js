@@ -76,6 +76,7 @@ async function updateCharts() {
     }
 
     await updateChannelStatus(serverAddress);
+    await updateCapacity(serverAddress);
     log('Finished updating all charts');
 }
 
@@ -502,21 +503,34 @@ function updatePopoutChart(chart, resource) {
 
 // 10. Function to fetch and display channel status
 async function updateChannelStatus(serverAddress) {
-    log('Fetching channel status');
+    log('Fetching fleet view');
     try {
-        const response = await fetch(`http://${serverAddress}:5000/metrics/latest`);
-        const data = await response.json();
+        const { fetchFleetView } = await import('./modules/api.js');
+        const fleet = await fetchFleetView();
+        if (!fleet) return;
+        const servers = fleet.servers || {};
+
+        markUnreachableServers(servers);
 
         const statusList = document.getElementById('channel-status-list');
         if (statusList) {
             statusList.innerHTML = '';
-            
-            if (data.channels) {
-                const [running, total] = data.channels.value.split('/');
+
+            const selected = Object.values(servers).find(server => server.host === serverAddress);
+            const metrics = selected && selected.metrics;
+            if (metrics && metrics.channels) {
+                const [running, total] = metrics.channels.value.split('/');
                 const listItem = document.createElement('li');
                 listItem.textContent = `Running Channels: ${running}/${total}`;
                 statusList.appendChild(listItem);
             }
+
+            if (fleet.summary) {
+                const fleetItem = document.createElement('li');
+                fleetItem.textContent = `Fleet: ${fleet.summary.channels_running}/${fleet.summary.channels_total} ` +
+                    `channels on ${fleet.summary.servers_reachable}/${fleet.summary.servers_total} servers`;
+                statusList.appendChild(fleetItem);
+            }
             log('Successfully updated channel status');
         } else {
             log('Channel status list element not found');
@@ -526,6 +540,47 @@ async function updateChannelStatus(serverAddress) {
     }
 }
 
+// Function to fetch and display capacity headroom per channel profile
+async function updateCapacity(serverAddress) {
+    log('Fetching capacity headroom');
+    try {
+        const response = await fetch(`http://${serverAddress}:5000/capacity`);
+        const data = await response.json();
+
+        const capacityList = document.getElementById('capacity-list');
+        if (!capacityList) {
+            log('Capacity list element not found');
+            return;
+        }
+        capacityList.innerHTML = '';
+
+        // Channels sharing a profile have the same headroom, so list each profile once
+        const profiles = {};
+        Object.entries(data.channels || {}).forEach(([channel, estimate]) => {
+            const key = estimate.profile.key;
+            if (!profiles[key]) {
+                profiles[key] = { estimate, channels: [] };
+            }
+            profiles[key].channels.push(channel);
+        });
+
+        Object.values(profiles).forEach(({ estimate, channels }) => {
+            const listItem = document.createElement('li');
+            const headroom = estimate.headroom !== null ? estimate.headroom : 'N/A';
+            const source = estimate.cost.source === 'observed'
+                ? `observed x${estimate.cost.samples}`
+                : 'baseline';
+            listItem.textContent = `${channels.join(', ')}: ${headroom} more ` +
+                `(${estimate.profile.mode}, ${estimate.cost.cpu_cores.toFixed(2)} cores each, ` +
+                `${source}, limited by ${estimate.limited_by})`;
+            capacityList.appendChild(listItem);
+        });
+        log('Successfully updated capacity headroom');
+    } catch (error) {
+        log(`Error updating capacity headroom: ${error.message}`);
+    }
+}
+
 // 11. Function to populate server select dropdown
 function populateServerSelect() {
     const serverSelect = document.getElementById('server-select');
@@ -547,6 +602,17 @@ function populateServerSelect() {
         .catch(error => log(`Error loading server list: ${error.message}`));
 }
 
+// Label servers the federation endpoint cannot reach so they are not selected blindly
+function markUnreachableServers(servers) {
+    const serverSelect = document.getElementById('server-select');
+    Array.from(serverSelect.options).forEach(option => {
+        const server = Object.values(servers).find(entry => entry.host === option.value);
+        if (server) {
+            option.textContent = server.reachable ? option.value : `${option.value} (unreachable)`;
+        }
+    });
+}
+
 // 12. Event listener for server select change
 document.getElementById('server-select').addEventListener('change', () => {
     updateCharts();